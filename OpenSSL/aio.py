@@ -0,0 +1,481 @@
+# Copyright (C) Jean-Paul Calderone
+# See LICENSE for details.
+
+"""
+asyncio support for pyOpenSSL.
+
+TLS is run over an ordinary asyncio transport by driving a memory BIO
+:py:class:`OpenSSL.SSL.Connection`, so everything configured on the
+:py:class:`OpenSSL.SSL.Context` (verify and server name callbacks, session
+settings, and so on) works exactly as it does with sockets.
+
+This module requires Python 3.4 or newer.
+"""
+
+import sys
+import asyncio
+from socket import SHUT_RDWR
+
+from OpenSSL.SSL import (
+    RECEIVED_SHUTDOWN, Connection, Error, SysCallError, WantReadError,
+    ZeroReturnError)
+
+__all__ = ['TLSTransport', 'TLSProtocol', 'create_connection', 'create_server']
+
+
+class TLSTransport(asyncio.Transport):
+    """
+    The transport given to the application protocol.  Application data
+    written to it is encrypted and written to the underlying transport.
+
+    Flow control counts both the underlying transport's write buffer and the
+    application data waiting to be encrypted: the application protocol's
+    ``pause_writing`` is called when they go over the high water mark, and
+    ``resume_writing`` once they have drained below the low one.
+    """
+    def __init__(self, tls_protocol):
+        asyncio.Transport.__init__(self)
+        self._tls = tls_protocol
+        self._closing = False
+
+
+    def get_extra_info(self, name, default=None):
+        """
+        In addition to everything the underlying transport provides,
+        ``'ssl_connection'`` gives the :py:class:`OpenSSL.SSL.Connection` and
+        ``'peercert'`` the peer's :py:class:`OpenSSL.crypto.X509` (or
+        :py:obj:`None`).
+        """
+        return self._tls._get_extra_info(name, default)
+
+
+    def set_protocol(self, protocol):
+        self._tls._app_protocol = protocol
+
+
+    def get_protocol(self):
+        return self._tls._app_protocol
+
+
+    def is_closing(self):
+        return self._closing
+
+
+    def close(self):
+        """
+        Send a closure alert once all buffered application data has been
+        written, then close the underlying transport.
+        """
+        if not self._closing:
+            self._closing = True
+            self._tls._start_shutdown()
+
+
+    def abort(self):
+        """
+        Close the underlying transport immediately, without a closure alert.
+        """
+        self._closing = True
+        self._tls._abort()
+
+
+    def write(self, data):
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            raise TypeError(
+                "data argument must be a bytes-like object, not %r" % (
+                    type(data).__name__,))
+        if self._closing:
+            raise RuntimeError("cannot write to a closing transport")
+        if data:
+            self._tls._write_appdata(bytes(data))
+
+
+    def can_write_eof(self):
+        return False
+
+
+    def pause_reading(self):
+        if self._tls._transport is not None:
+            self._tls._transport.pause_reading()
+
+
+    def resume_reading(self):
+        if self._tls._transport is not None:
+            self._tls._transport.resume_reading()
+
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        if high is None:
+            if low is None:
+                high = 64 * 1024
+            else:
+                high = 4 * low
+        if low is None:
+            low = high // 4
+        if not high >= low >= 0:
+            raise ValueError(
+                "high (%r) must be >= low (%r) must be >= 0" % (high, low))
+        self._tls._high_water = high
+        self._tls._low_water = low
+        if self._tls._transport is not None:
+            self._tls._transport.set_write_buffer_limits(high, low)
+        self._tls._update_writing()
+
+
+    def get_write_buffer_size(self):
+        size = self._tls._pending_size()
+        if self._tls._transport is not None:
+            size += self._tls._transport.get_write_buffer_size()
+        return size
+
+
+
+class TLSProtocol(asyncio.Protocol):
+    """
+    An asyncio protocol which runs TLS over the transport it is connected to
+    and presents the decrypted stream to *app_protocol* through a
+    :py:class:`TLSTransport`.
+
+    *app_protocol*'s ``connection_made`` is called once the handshake has
+    completed.  If *waiter* is given, it is a future which is resolved with a
+    ``(transport, app_protocol)`` tuple at that point, or with the exception
+    which made the handshake fail.
+
+    :param context: The :py:class:`OpenSSL.SSL.Context` to use.
+    :param app_protocol: The application's protocol instance.
+    :param server_side: True to act as a TLS server, false for a client.
+    :param server_hostname: (optional) For clients, the byte string to send
+        in the server name extension.
+    :param waiter: (optional) A future to resolve when the handshake ends.
+    """
+    def __init__(self, context, app_protocol, server_side,
+                 server_hostname=None, waiter=None):
+        self._context = context
+        self._app_protocol = app_protocol
+        self._server_side = server_side
+        self._server_hostname = server_hostname
+        self._waiter = waiter
+        self._transport = None
+        self._connection = None
+        self._app_transport = TLSTransport(self)
+        self._handshaking = True
+        self._app_connected = False
+        self._shutdown_requested = False
+        self._error = None
+        # Application data which OpenSSL could not accept yet, for example
+        # while a renegotiation is waiting for the peer.
+        self._pending = []
+        self._high_water = 64 * 1024
+        self._low_water = 16 * 1024
+        # Whether the underlying transport, and the application protocol,
+        # have been told to stop writing.
+        self._transport_paused = False
+        self._writing_paused = False
+
+
+    def connection_made(self, transport):
+        self._transport = transport
+        connection = Connection(self._context, None)
+        if self._server_side:
+            connection.set_accept_state()
+        else:
+            connection.set_connect_state()
+            if self._server_hostname is not None:
+                connection.set_tlsext_host_name(self._server_hostname)
+        self._connection = connection
+        self._process(bytes())
+
+
+    def data_received(self, data):
+        if self._connection is not None:
+            self._process(data)
+
+
+    def eof_received(self):
+        # An end of file without a closure alert may be an attacker cutting
+        # the stream short, so report it the way Connection.recv does.  The
+        # connection is over either way; let the transport close itself.
+        if (self._connection is not None and self._error is None and
+                not self._connection.get_shutdown() & RECEIVED_SHUTDOWN):
+            self._error = SysCallError(-1, "Unexpected EOF")
+        return False
+
+
+    def connection_lost(self, exc):
+        if exc is None:
+            exc = self._error
+        if self._waiter is not None and not self._waiter.done():
+            if exc is None:
+                exc = ConnectionResetError(
+                    "Connection lost during the TLS handshake")
+            self._waiter.set_exception(exc)
+        self._waiter = None
+        self._app_transport._closing = True
+        if self._app_connected:
+            self._app_connected = False
+            self._app_protocol.connection_lost(exc)
+        self._transport = None
+        self._connection = None
+        self._pending = []
+
+
+    def pause_writing(self):
+        self._transport_paused = True
+        self._update_writing()
+
+
+    def resume_writing(self):
+        self._transport_paused = False
+        self._update_writing()
+
+
+    def _update_writing(self):
+        """
+        Pause or resume the application protocol's writing, according to how
+        much is waiting to be written.
+        """
+        if not self._app_connected:
+            return
+        size = self._app_transport.get_write_buffer_size()
+        if not self._writing_paused:
+            if self._transport_paused or size > self._high_water:
+                self._writing_paused = True
+                self._app_protocol.pause_writing()
+        elif not self._transport_paused and size <= self._low_water:
+            self._writing_paused = False
+            self._app_protocol.resume_writing()
+
+
+    def _get_extra_info(self, name, default):
+        if name == 'ssl_connection':
+            return self._connection
+        if name == 'peercert':
+            if self._connection is None:
+                return default
+            return self._connection.get_peer_certificate()
+        if self._transport is None:
+            return default
+        return self._transport.get_extra_info(name, default)
+
+
+    def _pending_size(self):
+        return sum([len(data) for data in self._pending])
+
+
+    def _process(self, data):
+        """
+        Hand bytes received from the network to OpenSSL, send whatever it
+        wants sent and deliver any application data.
+        """
+        try:
+            plaintext, outgoing = self._connection.feed(data)
+        except ZeroReturnError:
+            self._peer_closed()
+            return
+        except Error:
+            self._fatal_error(sys.exc_info()[1])
+            return
+
+        if outgoing:
+            self._transport.write(outgoing)
+
+        if self._handshaking:
+            try:
+                # This does nothing once the handshake is over; before then,
+                # feed has already done all that can be done.
+                self._connection.do_handshake()
+            except WantReadError:
+                return
+            except Error:
+                self._fatal_error(sys.exc_info()[1])
+                return
+            self._handshake_done()
+            if self._connection is None:
+                return
+
+        if plaintext:
+            self._app_protocol.data_received(plaintext)
+            if self._connection.get_shutdown() & RECEIVED_SHUTDOWN:
+                # The closure alert arrived along with this data; feed only
+                # reports it on the next call, which may never come.
+                self._peer_closed()
+                return
+
+        if self._pending:
+            self._send_pending()
+
+
+    def _handshake_done(self):
+        self._handshaking = False
+        self._app_connected = True
+        self._app_protocol.connection_made(self._app_transport)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result((self._app_transport, self._app_protocol))
+        self._waiter = None
+
+
+    def _flush(self):
+        """
+        Write everything waiting in the outgoing memory BIO to the transport.
+        """
+        while True:
+            try:
+                data = self._connection.bio_read(65536)
+            except WantReadError:
+                return
+            self._transport.write(data)
+
+
+    def _write_appdata(self, data):
+        self._pending.append(data)
+        if len(self._pending) == 1 and not self._handshaking:
+            self._send_pending()
+        else:
+            self._update_writing()
+
+
+    def _send_pending(self):
+        while self._pending:
+            data = self._pending[0]
+            try:
+                sent = self._connection.send(data)
+            except WantReadError:
+                # Renegotiating; this is retried when the peer answers.
+                break
+            except Error:
+                self._fatal_error(sys.exc_info()[1])
+                return
+            if sent < len(data):
+                self._pending[0] = data[sent:]
+            else:
+                del self._pending[0]
+        self._flush()
+        self._update_writing()
+        if self._shutdown_requested and not self._pending:
+            self._shutdown()
+
+
+    def _start_shutdown(self):
+        if self._transport is None:
+            return
+        if self._handshaking:
+            self._abort()
+            return
+        self._shutdown_requested = True
+        if not self._pending:
+            self._shutdown()
+
+
+    def _shutdown(self):
+        self._shutdown_requested = False
+        try:
+            self._connection.shutdown(SHUT_RDWR)
+        except Error:
+            pass
+        self._flush()
+        self._transport.close()
+
+
+    def _abort(self):
+        if self._transport is not None:
+            self._transport.abort()
+
+
+    def _peer_closed(self):
+        """
+        The peer sent a closure alert.
+        """
+        keep_open = False
+        if self._app_connected:
+            keep_open = self._app_protocol.eof_received()
+        if not keep_open:
+            self._app_transport.close()
+
+
+    def _fatal_error(self, exc):
+        self._error = exc
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_exception(exc)
+        self._waiter = None
+        try:
+            # Send any alert OpenSSL generated.
+            self._flush()
+        except Error:
+            pass
+        self._transport.close()
+
+
+
+def _future(loop):
+    try:
+        return loop.create_future()
+    except AttributeError:
+        return asyncio.Future(loop=loop)
+
+
+
+def create_connection(protocol_factory, context, host=None, port=None,
+                      server_hostname=None, loop=None, **kwargs):
+    """
+    Open a TLS connection using *context*.
+
+    This accepts the same arguments as
+    :py:meth:`asyncio.AbstractEventLoop.create_connection` (the extra keyword
+    arguments are passed on to it), except that TLS is provided by *context*
+    instead of :py:mod:`ssl`.
+
+    :return: A future which resolves to a ``(transport, protocol)`` tuple once
+        the TLS handshake has completed.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    waiter = _future(loop)
+    app_protocol = protocol_factory()
+
+    def tls_protocol_factory():
+        return TLSProtocol(
+            context, app_protocol, False, server_hostname, waiter)
+
+    connecting = asyncio.ensure_future(
+        loop.create_connection(tls_protocol_factory, host, port, **kwargs),
+        loop=loop)
+
+    def connected(result):
+        if waiter.done():
+            return
+        if result.cancelled():
+            waiter.cancel()
+        elif result.exception() is not None:
+            waiter.set_exception(result.exception())
+    connecting.add_done_callback(connected)
+
+    def cancelled(result):
+        if result.cancelled() and not connecting.done():
+            connecting.cancel()
+    waiter.add_done_callback(cancelled)
+
+    return waiter
+
+
+
+def create_server(protocol_factory, context, host=None, port=None, loop=None,
+                  **kwargs):
+    """
+    Start a TLS server using *context*.
+
+    This accepts the same arguments as
+    :py:meth:`asyncio.AbstractEventLoop.create_server` (the extra keyword
+    arguments are passed on to it), except that TLS is provided by *context*
+    instead of :py:mod:`ssl`.  *protocol_factory* is called once for each
+    accepted connection, and the protocol it returns is connected once the
+    TLS handshake has completed.
+
+    :return: The coroutine returned by ``loop.create_server``.
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+
+    def tls_protocol_factory():
+        return TLSProtocol(context, protocol_factory(), True)
+
+    return loop.create_server(tls_protocol_factory, host, port, **kwargs)
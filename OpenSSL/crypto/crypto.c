@@ -868,7 +868,7 @@ PyOpenSSL_MODINIT(crypto) {
     }
 #endif
 
-    crypto_Error = PyErr_NewException("OpenSSL.crypto.Error", NULL, NULL);
+    crypto_Error = error_type_new("OpenSSL.crypto.Error");
     if (crypto_Error == NULL)
         goto error;
 
@@ -76,6 +76,34 @@ crypto_X509Store_New(X509_STORE *store, int dealloc)
     return self;
 }
 
+static char crypto_X509Store_doc[] = "\n\
+A class representing X.509 certificate stores.\n\
+\n\
+Create a new, empty X509Store object.\n\
+\n\
+:returns: The :class:`X509Store` object\n\
+";
+
+static PyObject *
+crypto_X509Store_new(PyTypeObject *subtype, PyObject *args, PyObject *kwargs)
+{
+    X509_STORE *store;
+    crypto_X509StoreObj *self;
+
+    if (!PyArg_ParseTuple(args, ":X509Store")) {
+        return NULL;
+    }
+
+    if ((store = X509_STORE_new()) == NULL) {
+        exception_from_error_queue(crypto_Error);
+        return NULL;
+    }
+    if ((self = crypto_X509Store_New(store, 1)) == NULL) {
+        X509_STORE_free(store);
+    }
+    return (PyObject *)self;
+}
+
 /*
  * Deallocate the memory used by the X509Store object
  *
@@ -114,7 +142,7 @@ PyTypeObject crypto_X509Store_Type = {
     NULL, /* setattro */
     NULL, /* as_buffer */
     Py_TPFLAGS_DEFAULT,
-    NULL, /* doc */
+    crypto_X509Store_doc, /* doc */
     NULL, /* traverse */
     NULL, /* clear */
     NULL, /* tp_richcompare */
@@ -122,6 +150,16 @@ PyTypeObject crypto_X509Store_Type = {
     NULL, /* tp_iter */
     NULL, /* tp_iternext */
     crypto_X509Store_methods, /* tp_methods */
+    NULL, /* tp_members */
+    NULL, /* tp_getset */
+    NULL, /* tp_base */
+    NULL, /* tp_dict */
+    NULL, /* tp_descr_get */
+    NULL, /* tp_descr_set */
+    0, /* tp_dictoffset */
+    NULL, /* tp_init */
+    NULL, /* tp_alloc */
+    crypto_X509Store_new, /* tp_new */
 };
 
 
@@ -140,6 +178,11 @@ init_crypto_x509store(PyObject *module)
 
     /* PyModule_AddObject steals a reference.
      */
+    Py_INCREF((PyObject *)&crypto_X509Store_Type);
+    if (PyModule_AddObject(module, "X509Store", (PyObject *)&crypto_X509Store_Type) != 0) {
+        return 0;
+    }
+
     Py_INCREF((PyObject *)&crypto_X509Store_Type);
     if (PyModule_AddObject(module, "X509StoreType", (PyObject *)&crypto_X509Store_Type) != 0) {
         return 0;
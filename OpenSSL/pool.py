@@ -0,0 +1,292 @@
+# Copyright (C) Jean-Paul Calderone
+# See LICENSE for details.
+
+"""
+A pool of client connections.
+
+Idle connections are kept per (host, port, server name) and handed out again,
+and when a new connection has to be made the session of the last one made to
+the same place is offered to the server, so that it can resume the session
+with an abbreviated handshake instead of a full one.
+"""
+
+import sys
+import socket
+from select import select
+from time import time
+from threading import Condition
+
+from OpenSSL.SSL import Connection, Error
+
+__all__ = ['ConnectionPool', 'PoolTimeoutError']
+
+
+class PoolTimeoutError(Exception):
+    """
+    No connection became available before the timeout expired.
+    """
+
+
+
+class ConnectionPool(object):
+    """
+    A thread safe pool of connected :py:class:`OpenSSL.SSL.Connection`
+    objects.
+
+    :param context: The :py:class:`OpenSSL.SSL.Context` to make connections
+        with.
+    :param max_per_key: (optional) The most connections, in use or idle, to
+        one (host, port, server name), or :py:obj:`None` for no limit.
+    :param max_idle_per_key: (optional) The most idle connections to keep
+        for one (host, port, server name).
+    :param idle_timeout: (optional) How many seconds an idle connection is
+        kept before it is closed.
+    :param connect_timeout: (optional) How many seconds to wait for a TCP
+        connection, or :py:obj:`None` to wait for as long as it takes.
+
+    :ivar hits: The number of times an idle connection was handed out.
+    :ivar misses: The number of times a new connection had to be made.
+    """
+    def __init__(self, context, max_per_key=None, max_idle_per_key=4,
+                 idle_timeout=60.0, connect_timeout=None):
+        self.context = context
+        self.max_per_key = max_per_key
+        self.max_idle_per_key = max_idle_per_key
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = Condition()
+        # key -> list of (connection, time released), oldest first
+        self._idle = {}
+        # key -> number of connections in use or being made
+        self._active = {}
+        # connection -> key, for connections which are in use
+        self._keys = {}
+        # key -> the most recent Session
+        self._sessions = {}
+        self._closed = False
+
+
+    def acquire(self, host, port, server_name=None, timeout=None):
+        """
+        Get a connection to *host* and *port* which has completed its
+        handshake, either an idle one or a new one.  Give it back with
+        :py:meth:`release` when done with it.
+
+        :param host: The host name or address to connect to.
+        :param port: The port to connect to.
+        :param server_name: (optional) The byte string to send in the server
+            name extension.
+        :param timeout: (optional) If *max_per_key* connections are already
+            in use, how many seconds to wait for one to be released, or
+            :py:obj:`None` to wait for as long as it takes.
+        :raise PoolTimeoutError: If no connection became available in time.
+        :return: The :py:class:`OpenSSL.SSL.Connection`.
+        """
+        key = (host, port, server_name)
+        stale = []
+        self._lock.acquire()
+        try:
+            connection = self._take(key, timeout, stale)
+            if connection is not None:
+                self.hits += 1
+                self._keys[connection] = key
+            else:
+                self.misses += 1
+                session = self._sessions.get(key)
+        finally:
+            self._lock.release()
+            # Closing sends a closure alert, which may block; not with the
+            # lock held.
+            for idle in stale:
+                self._close(idle)
+        if connection is not None:
+            return connection
+
+        try:
+            connection = self._connect(host, port, server_name, session)
+        except:
+            self._lock.acquire()
+            try:
+                self._active[key] -= 1
+                self._lock.notifyAll()
+            finally:
+                self._lock.release()
+            raise
+
+        self._lock.acquire()
+        try:
+            self._sessions[key] = connection.get_session()
+            self._keys[connection] = key
+        finally:
+            self._lock.release()
+        return connection
+
+
+    def release(self, connection, reusable=True):
+        """
+        Give back a connection obtained from :py:meth:`acquire`.
+
+        :param connection: The :py:class:`OpenSSL.SSL.Connection`.
+        :param reusable: (optional) False if the connection must not be used
+            again, for example because a response was not read in full.
+        """
+        self._lock.acquire()
+        try:
+            key = self._keys.pop(connection)
+            self._active[key] -= 1
+            self._lock.notifyAll()
+            if reusable and connection.get_shutdown() == 0:
+                # The server may have sent a newer session since the
+                # handshake.
+                session = connection.get_session()
+                if session is not None:
+                    self._sessions[key] = session
+                idle = self._idle.setdefault(key, [])
+                if not self._closed and len(idle) < self.max_idle_per_key:
+                    idle.append((connection, time()))
+                    return
+        finally:
+            self._lock.release()
+        self._close(connection)
+
+
+    def expire(self):
+        """
+        Close the connections which have been idle for longer than
+        *idle_timeout*.  This also happens as a side effect of
+        :py:meth:`acquire`, for the connections it looks at.
+        """
+        cutoff = time() - self.idle_timeout
+        expired = []
+        self._lock.acquire()
+        try:
+            for key, idle in list(self._idle.items()):
+                while idle and idle[0][1] < cutoff:
+                    expired.append(idle.pop(0)[0])
+                if not idle:
+                    del self._idle[key]
+        finally:
+            self._lock.release()
+        for connection in expired:
+            self._close(connection)
+
+
+    def close(self):
+        """
+        Close every idle connection.  Connections in use are closed when they
+        are released.
+        """
+        self._lock.acquire()
+        try:
+            self._closed = True
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._lock.release()
+        for connections in idle.values():
+            for connection, released in connections:
+                self._close(connection)
+
+
+    def _take(self, key, timeout, stale):
+        """
+        With the lock held, take a usable idle connection for *key*, or
+        reserve room for a new one and return :py:obj:`None`.  The idle
+        connections found to be unusable are appended to *stale* for the
+        caller to close once it has released the lock.
+        """
+        if self._closed:
+            raise ValueError("The pool is closed")
+        deadline = None
+        if timeout is not None:
+            deadline = time() + timeout
+        while True:
+            idle = self._idle.get(key, [])
+            cutoff = time() - self.idle_timeout
+            while idle:
+                connection, released = idle.pop()
+                if released >= cutoff and self._usable(connection):
+                    self._active[key] = self._active.get(key, 0) + 1
+                    return connection
+                stale.append(connection)
+
+            active = self._active.get(key, 0)
+            if self.max_per_key is None or active < self.max_per_key:
+                self._active[key] = active + 1
+                return None
+
+            if deadline is None:
+                self._lock.wait()
+            else:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        "No connection to %s:%s available" % key[:2])
+                self._lock.wait(remaining)
+
+
+    def _usable(self, connection):
+        """
+        An idle connection is usable if the server has sent nothing on it,
+        since what it would send is a closure alert or the end of the stream.
+        """
+        try:
+            readable = select([connection], [], [], 0)[0]
+        except (socket.error, ValueError):
+            return False
+        return not readable and connection.pending() == 0
+
+
+    def _connect(self, host, port, server_name, session):
+        sock = None
+        error = socket.error("getaddrinfo returned no addresses")
+        for family, socktype, proto, canonname, address in socket.getaddrinfo(
+            host, port, 0, socket.SOCK_STREAM):
+            sock = socket.socket(family, socktype, proto)
+            try:
+                sock.settimeout(self.connect_timeout)
+                sock.connect(address)
+            except socket.error:
+                error = sys.exc_info()[1]
+                sock.close()
+                sock = None
+            else:
+                break
+        if sock is None:
+            raise error
+        sock.settimeout(None)
+
+        connection = Connection(self.context, sock)
+        try:
+            if server_name is not None:
+                connection.set_tlsext_host_name(server_name)
+            if session is not None:
+                connection.set_session(session)
+            connection.set_connect_state()
+            connection.do_handshake()
+        except:
+            sock.close()
+            raise
+        return connection
+
+
+    def _close(self, connection):
+        """
+        Send a closure alert, if the connection can still take one, and close
+        the socket.
+        """
+        try:
+            if sys.version_info >= (2, 7, 0, 'alpha', 1):
+                connection.shutdown(socket.SHUT_RDWR)
+            else:
+                connection.shutdown()
+        except (Error, socket.error):
+            # The server has gone away or reset the connection; it is being
+            # closed anyway.
+            pass
+        try:
+            connection.close()
+        except socket.error:
+            pass
@@ -282,7 +282,7 @@ PyOpenSSL_MODINIT(rand) {
         PyOpenSSL_MODRETURN(NULL);
     }
 
-    rand_Error = PyErr_NewException("OpenSSL.rand.Error", NULL, NULL);
+    rand_Error = error_type_new("OpenSSL.rand.Error");
 
     if (rand_Error == NULL) {
         goto error;
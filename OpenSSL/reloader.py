@@ -0,0 +1,169 @@
+# Copyright (C) Jean-Paul Calderone
+# See LICENSE for details.
+
+"""
+A Context which follows changes to its certificate and key files.
+
+Certificates can be rotated without restarting a server: when the files
+change, a new Context is loaded from them and, if they are valid and match,
+used for the connections made from then on.  Connections made before keep the
+Context they were made with, which goes away once the last of them does.
+"""
+
+import os
+import sys
+from threading import Event, Lock, Thread
+
+from OpenSSL.SSL import SSLv23_METHOD, Context
+
+__all__ = ['ContextReloader']
+
+
+class ContextReloader(object):
+    """
+    A thread safe holder of the current :py:class:`OpenSSL.SSL.Context` for a
+    certificate chain file and a private key file, which loads a new one when
+    the files change.
+
+    :param certificate: The name of the file holding the PEM certificate
+        chain, the server's own certificate first.
+    :param key: The name of the file holding the private key.
+    :param method: (optional) The method the Contexts are made with.
+    :param configure: (optional) A callable which is called with each new
+        Context, before it is used, to set it up further.
+    :raise OpenSSL.SSL.Error: If the files cannot be loaded or do not match.
+
+    :ivar context: The Context loaded from the files most recently.
+    :ivar reloads: The number of times a new Context replaced the old one.
+    :ivar failures: The number of times the changed files could not be
+        loaded.
+    :ivar last_error: The exception raised by the last load which failed, or
+        :py:obj:`None`.
+    """
+    def __init__(self, certificate, key, method=SSLv23_METHOD, configure=None):
+        self.certificate = certificate
+        self.key = key
+        self.method = method
+        self.configure = configure
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self._lock = Lock()
+        self._stamps = self._stat()
+        self.context = self._load()
+        self._thread = None
+        self._stopped = Event()
+
+
+    def _stat(self):
+        """
+        Get what is needed to tell whether the files have changed since.  A
+        file replaced by renaming another over it may keep its modification
+        time, but not its inode.
+        """
+        stamps = []
+        for name in [self.certificate, self.key]:
+            st = os.stat(name)
+            stamps.append((st.st_mtime, st.st_size, st.st_ino))
+        return stamps
+
+
+    def _load(self):
+        context = Context(self.method)
+        context.use_certificate_chain_file(self.certificate)
+        context.use_privatekey_file(self.key)
+        context.check_privatekey()
+        if self.configure is not None:
+            self.configure(context)
+        return context
+
+
+    def check(self):
+        """
+        Load a new Context if the files have changed since they were last
+        loaded.  If they cannot be loaded or do not match, for example
+        because only one of them has been replaced so far, the old Context is
+        kept and the files are tried again when they next change.
+
+        :return: :py:obj:`True` if a new Context replaced the old one,
+            :py:obj:`False` otherwise.
+        """
+        self._lock.acquire()
+        try:
+            try:
+                stamps = self._stat()
+            except OSError:
+                # A file is being replaced; look again later.
+                return False
+            if stamps == self._stamps:
+                return False
+            self._stamps = stamps
+            try:
+                context = self._load()
+            except Exception:
+                self.failures += 1
+                self.last_error = sys.exc_info()[1]
+                return False
+            self.context = context
+            self.reloads += 1
+            return True
+        finally:
+            self._lock.release()
+
+
+    def start(self, interval=60.0):
+        """
+        Call :py:meth:`check` every *interval* seconds in a daemon thread,
+        until :py:meth:`stop` is called.
+
+        :param interval: (optional) How many seconds to wait between checks.
+        :return: None
+        """
+        if self._thread is not None:
+            raise ValueError("The reloader is already started")
+        self._stopped.clear()
+        self._thread = Thread(target=self._run, args=(interval,))
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+
+    def stop(self):
+        """
+        Stop the thread started by :py:meth:`start`, and wait for it to exit.
+
+        :return: None
+        """
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+
+    def _run(self, interval):
+        while True:
+            self._stopped.wait(interval)
+            if self._stopped.isSet():
+                return
+            self.check()
+
+
+    def servername_callback(self, connection):
+        """
+        A callback for :py:meth:`OpenSSL.SSL.Context.set_tlsext_servername_callback`
+        which switches *connection* to the current Context.
+        """
+        connection.set_context(self.context)
+
+
+    def install(self, context):
+        """
+        Make connections which use *context* switch to the current Context
+        during their handshake, so that a listening socket's Context never has
+        to be replaced.
+
+        :param context: The :py:class:`OpenSSL.SSL.Context` connections are
+            made with.
+        :return: None
+        """
+        context.set_tlsext_servername_callback(self.servername_callback)
@@ -0,0 +1,549 @@
+# Copyright (C) Jean-Paul Calderone
+# See LICENSE for details.
+
+"""
+A single threaded TLS server built on :py:mod:`selectors`.
+
+Every connection is a non-blocking :py:class:`OpenSSL.SSL.Connection` which is
+taken through its handshake, its application data and its shutdown by the
+readiness events the selector reports, so one process can hold many thousands
+of mostly idle connections.
+
+This module requires Python 3.4 or newer.
+"""
+
+import os
+import sys
+import socket
+import selectors
+from time import monotonic
+from collections import deque
+from errno import EAGAIN, EWOULDBLOCK, ECONNABORTED, EINTR, EMFILE, ENFILE
+from traceback import print_exc
+
+from OpenSSL.SSL import (
+    WANT_READ, WANT_WRITE, Connection, Error, WantReadError, WantWriteError,
+    WantX509LookupError)
+
+__all__ = ['HANDSHAKING', 'OPEN', 'SHUTTING_DOWN', 'CLOSED',
+           'ConnectionHandler', 'ServerConnection', 'TLSServer']
+
+HANDSHAKING = 'HANDSHAKING'
+OPEN = 'OPEN'
+SHUTTING_DOWN = 'SHUTTING_DOWN'
+CLOSED = 'CLOSED'
+
+_WANT = (WantReadError, WantWriteError, WantX509LookupError)
+
+# The most plaintext one record can carry.
+_READ_SIZE = 16384
+
+
+class ConnectionHandler(object):
+    """
+    The application side of one connection.  Subclass this and give the
+    subclass (or any other callable returning an instance) to
+    :py:class:`TLSServer`.
+    """
+    def connection_made(self, connection):
+        """
+        Called when the handshake has completed.
+
+        :param connection: The :py:class:`ServerConnection`.
+        """
+
+
+    def data_received(self, data):
+        """
+        Called with each chunk of application data received.
+
+        :param data: A byte string.
+        """
+
+
+    def connection_lost(self, reason):
+        """
+        Called once when a connection which completed its handshake is gone.
+
+        :param reason: :py:obj:`None` if the connection was closed with a
+            closure alert, otherwise the exception which ended it.
+        """
+
+
+
+class ServerConnection(object):
+    """
+    One accepted connection, and the state machine driving it.
+
+    :ivar connection: The :py:class:`OpenSSL.SSL.Connection`.
+    :ivar address: The peer address returned by ``accept``.
+    :ivar handler: The :py:class:`ConnectionHandler` for this connection.
+    :ivar state: One of :py:data:`HANDSHAKING`, :py:data:`OPEN`,
+        :py:data:`SHUTTING_DOWN` or :py:data:`CLOSED`.
+    :ivar deadline: The :py:func:`time.monotonic` time by which the handshake
+        must be done, or :py:obj:`None`.
+    """
+    deadline = None
+
+    def __init__(self, server, connection, address, handler):
+        self.server = server
+        self.connection = connection
+        self.address = address
+        self.handler = handler
+        self.state = HANDSHAKING
+        self.events = selectors.EVENT_READ
+        self._outgoing = []
+        self._reading = True
+
+
+    def fileno(self):
+        return self.connection.fileno()
+
+
+    def write(self, data):
+        """
+        Send *data* to the peer, buffering whatever cannot be sent yet.
+        """
+        if self.state != OPEN:
+            raise ValueError("Cannot write to a connection which is %s" % (
+                    self.state,))
+        if data:
+            self._outgoing.append(bytes(data))
+            if len(self._outgoing) == 1:
+                self._flush()
+                self._update()
+
+
+    def get_write_buffer_size(self):
+        """
+        :return: The number of bytes written but not yet accepted by OpenSSL.
+        """
+        return sum([len(data) for data in self._outgoing])
+
+
+    def pause_reading(self):
+        """
+        Stop reading from the peer until :py:meth:`resume_reading` is called.
+        """
+        self._reading = False
+        self._update()
+
+
+    def resume_reading(self):
+        """
+        Start reading from the peer again.
+        """
+        if not self._reading:
+            self._reading = True
+            self._update()
+            if self.state == OPEN and self.connection.pending():
+                self._read()
+                if self.state == OPEN and self._outgoing:
+                    # The read has replaced what the connection waited for
+                    # to write.
+                    self._flush()
+                self._update()
+
+
+    def close(self):
+        """
+        Send a closure alert once everything written has been sent, then
+        close the socket.
+        """
+        if self.state == HANDSHAKING:
+            self._lost(None)
+        elif self.state == OPEN:
+            self.state = SHUTTING_DOWN
+            if not self._outgoing:
+                self._shutdown()
+            self._update()
+
+
+    def abort(self):
+        """
+        Close the socket immediately, without a closure alert.
+        """
+        self._lost(None)
+
+
+    def _ready(self, events):
+        """
+        Advance the state machine after the selector reported *events*.
+        """
+        if self.state == HANDSHAKING:
+            self._handshake()
+        elif self.state == OPEN and self._reading:
+            self._read()
+        # After a read, what the connection waits for is what the read
+        # needs; try the writing again to find out what that needs.
+        if self.state == OPEN and self._outgoing:
+            self._flush()
+        if self.state == SHUTTING_DOWN:
+            if self._outgoing:
+                self._flush()
+            if not self._outgoing:
+                self._shutdown()
+        self._update()
+
+
+    def _update(self):
+        """
+        Register interest in whatever the last operation on the connection
+        was waiting for.
+        """
+        if self.state == CLOSED:
+            return
+        connection = self.connection
+        if self.state == OPEN:
+            if self._reading or connection.want_read():
+                events = selectors.EVENT_READ
+            else:
+                events = 0
+            if connection.want_write():
+                events |= selectors.EVENT_WRITE
+        elif connection.want_write():
+            events = selectors.EVENT_WRITE
+        else:
+            events = selectors.EVENT_READ
+        if events != self.events:
+            self.server._modify(self, events)
+            self.events = events
+
+
+    def _handshake(self):
+        try:
+            status = self.connection.do_handshake_nb()
+        except _WANT:
+            return
+        except Error:
+            self._lost(sys.exc_info()[1])
+            return
+        if status is not None:
+            return
+        self.state = OPEN
+        if not self._call('connection_made', self):
+            return
+        if self.state == OPEN:
+            # Application data may have arrived along with the last
+            # handshake message.
+            self._read()
+
+
+    def _read(self):
+        while self.state == OPEN and self._reading:
+            try:
+                data = self.connection.recv_nb(_READ_SIZE)
+            except _WANT:
+                return
+            except Error:
+                self._lost(sys.exc_info()[1])
+                return
+            if isinstance(data, int):
+                # WANT_READ or WANT_WRITE
+                return
+            if not data:
+                self._peer_closed()
+                return
+            if not self._call('data_received', data):
+                return
+
+
+    def _flush(self):
+        while self._outgoing:
+            data = self._outgoing[0]
+            try:
+                sent = self.connection.send_nb(data)
+            except _WANT:
+                return
+            except Error:
+                self._lost(sys.exc_info()[1])
+                return
+            if sent in (WANT_READ, WANT_WRITE):
+                return
+            if sent < len(data):
+                self._outgoing[0] = data[sent:]
+            else:
+                del self._outgoing[0]
+
+
+    def _shutdown(self):
+        """
+        Send the closure alert and close the socket.  The peer's alert is not
+        waited for, since the socket is not reused.
+        """
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except _WANT:
+            return
+        except Error:
+            # A shutdown which has to wait for the socket raises Error with
+            # nothing in it; it is tried again when the socket is ready.
+            if self.connection.want_write() or self.connection.want_read():
+                return
+            self._lost(sys.exc_info()[1])
+            return
+        self._lost(None)
+
+
+    def _peer_closed(self):
+        self._outgoing = []
+        self.state = SHUTTING_DOWN
+        self._shutdown()
+
+
+    def _lost(self, reason):
+        if self.state == CLOSED:
+            return
+        handshaking = self.state == HANDSHAKING
+        self.state = CLOSED
+        self._outgoing = []
+        self.server._forget(self)
+        try:
+            self.connection.close()
+        except socket.error:
+            pass
+        if not handshaking:
+            self._call('connection_lost', reason)
+
+
+    def _call(self, name, *args):
+        """
+        Call a handler method.  If it raises, report the error and abort the
+        connection.
+
+        :return: True if the call succeeded.
+        """
+        try:
+            getattr(self.handler, name)(*args)
+        except Exception:
+            self.server.handle_error(self)
+            self._lost(sys.exc_info()[1])
+            return False
+        return True
+
+
+
+class TLSServer(object):
+    """
+    Accept TLS connections on *address* and serve them all from one thread.
+
+    :param context: The :py:class:`OpenSSL.SSL.Context` for new connections.
+    :param address: The address to listen on.  Use port 0 to pick any free
+        port; :py:attr:`address` gives the one chosen.
+    :param handler_factory: Called with no arguments for each accepted
+        connection to create its :py:class:`ConnectionHandler`.
+    :param backlog: (optional) The listen backlog.
+    :param family: (optional) The address family, by default IPv4.
+    :param selector: (optional) The :py:class:`selectors.BaseSelector` to
+        use, by default the best one available on this platform.
+    :param handshake_timeout: (optional) How many seconds a connection may
+        take to complete its handshake before it is aborted, or
+        :py:obj:`None` for no limit.
+    """
+    def __init__(self, context, address, handler_factory, backlog=1024,
+                 family=socket.AF_INET, selector=None, handshake_timeout=30.0):
+        if selector is None:
+            selector = selectors.DefaultSelector()
+        self.context = context
+        self.handler_factory = handler_factory
+        self.backlog = backlog
+        self.handshake_timeout = handshake_timeout
+        self.connections = set()
+        # Connections which may still be handshaking, in the order they were
+        # accepted, and so of their deadlines.
+        self._handshaking = deque()
+        self._selector = selector
+        self._running = False
+        self._accepting = True
+        # A descriptor held back for when all the others are used up; see
+        # _shed.
+        self._reserve = self._openReserve()
+
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            self._listener.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._listener.bind(address)
+            self._listener.listen(backlog)
+            self._listener.setblocking(False)
+        except socket.error:
+            self._listener.close()
+            raise
+        self.address = self._listener.getsockname()
+        self._selector.register(self._listener, selectors.EVENT_READ, None)
+
+
+    def fileno(self):
+        return self._listener.fileno()
+
+
+    def serve_once(self, timeout=None):
+        """
+        Wait up to *timeout* seconds for readiness events and handle them.
+
+        :return: The number of events handled.
+        """
+        if self._handshaking:
+            # Wake up in time to abort the first handshake to time out.
+            wait = max(self._handshaking[0].deadline - monotonic(), 0)
+            if timeout is None or wait < timeout:
+                timeout = wait
+        try:
+            ready = self._selector.select(timeout)
+        except (OSError, socket.error):
+            if sys.exc_info()[1].args[0] == EINTR:
+                return 0
+            raise
+        for key, events in ready:
+            if key.data is None:
+                self._accept()
+            elif key.data.state != CLOSED:
+                key.data._ready(events)
+        self._expire()
+        return len(ready)
+
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Handle events until :py:meth:`shutdown` is called.
+        """
+        self._running = True
+        while self._running:
+            self.serve_once(poll_interval)
+
+
+    def shutdown(self):
+        """
+        Make :py:meth:`serve_forever` return after the events it is handling.
+        """
+        self._running = False
+
+
+    def close(self):
+        """
+        Stop listening and abort every connection.
+        """
+        for connection in list(self.connections):
+            connection.abort()
+        if self._accepting:
+            self._selector.unregister(self._listener)
+        self._listener.close()
+        self._selector.close()
+        self._handshaking.clear()
+        if self._reserve is not None:
+            os.close(self._reserve)
+            self._reserve = None
+
+
+    def handle_error(self, connection):
+        """
+        Called from within an ``except`` block when a handler method raises.
+        The connection is aborted afterwards.  By default the traceback is
+        printed to stderr.
+        """
+        print_exc()
+
+
+    def _accept(self):
+        # Accept what is waiting, but not so much that the existing
+        # connections are starved.
+        for i in range(self.backlog):
+            try:
+                sock, address = self._listener.accept()
+            except (OSError, socket.error):
+                code = sys.exc_info()[1].args[0]
+                if code in (EAGAIN, EWOULDBLOCK, ECONNABORTED, EINTR):
+                    return
+                if code in (EMFILE, ENFILE):
+                    if self._shed():
+                        continue
+                    return
+                raise
+            sock.setblocking(False)
+            connection = Connection(self.context, sock)
+            connection.set_accept_state()
+            server_connection = ServerConnection(
+                self, connection, address, self.handler_factory())
+            if self.handshake_timeout is not None:
+                server_connection.deadline = (
+                    monotonic() + self.handshake_timeout)
+                self._handshaking.append(server_connection)
+            self.connections.add(server_connection)
+            self._selector.register(
+                server_connection, selectors.EVENT_READ, server_connection)
+
+
+    def _expire(self):
+        """
+        Abort the connections which did not complete their handshake in time,
+        and forget those which did or are gone.
+        """
+        now = monotonic()
+        handshaking = self._handshaking
+        while handshaking:
+            server_connection = handshaking[0]
+            if server_connection.state == HANDSHAKING:
+                if server_connection.deadline > now:
+                    return
+                server_connection.abort()
+            handshaking.popleft()
+
+
+    def _openReserve(self):
+        try:
+            return os.open(os.devnull, os.O_RDONLY)
+        except OSError:
+            return None
+
+
+    def _shed(self):
+        """
+        Out of descriptors.  The pending connection keeps the listener
+        readable, so leaving it there would make the selector report it again
+        at once, forever.  Give up the reserve descriptor to accept the
+        connection and close it straight away.  Without a reserve, stop
+        listening until one of the connections is closed.
+
+        :return: True if a connection was shed.
+        """
+        if self._reserve is None:
+            self._reserve = self._openReserve()
+        if self._reserve is not None:
+            os.close(self._reserve)
+            self._reserve = None
+            try:
+                sock, address = self._listener.accept()
+            except (OSError, socket.error):
+                pass
+            else:
+                sock.close()
+            self._reserve = self._openReserve()
+            if self._reserve is not None:
+                return True
+        if self._accepting:
+            self._accepting = False
+            self._selector.unregister(self._listener)
+        return False
+
+
+    def _modify(self, server_connection, events):
+        if events:
+            if server_connection.events:
+                self._selector.modify(
+                    server_connection, events, server_connection)
+            else:
+                self._selector.register(
+                    server_connection, events, server_connection)
+        elif server_connection.events:
+            self._selector.unregister(server_connection)
+
+
+    def _forget(self, server_connection):
+        self.connections.discard(server_connection)
+        if server_connection.events:
+            self._selector.unregister(server_connection)
+            server_connection.events = 0
+        if not self._accepting:
+            # A descriptor is about to be freed; listen again.
+            self._accepting = True
+            self._selector.register(self._listener, selectors.EVENT_READ, None)
@@ -0,0 +1,318 @@
+# Copyright (C) Jean-Paul Calderone
+# See LICENSE for details.
+
+"""
+Contexts for the server names clients ask for.
+
+A server which answers for many names does not have to build a Context for
+every one of them before it starts.  :py:class:`ContextCache` loads the
+Context for a name the first time a client asks for it and keeps the ones
+asked for recently, up to a number of Contexts or of bytes, so that names
+which are rarely asked for do not hold on to memory.
+"""
+
+import os
+import re
+from time import time
+from collections import deque
+from threading import Lock
+
+from OpenSSL.SSL import SSLv23_METHOD, Context
+
+__all__ = ['ContextCache', 'DirectoryLoader']
+
+
+class ContextCache(object):
+    """
+    A thread safe cache of the :py:class:`OpenSSL.SSL.Context` objects for
+    server names, which are loaded when first asked for and thrown away, least
+    recently used first, when there are too many.
+
+    :param loader: A callable which is called with a server name (a byte
+        string, in lower case) and returns the Context for it, or a tuple of
+        the Context and an estimate of how many bytes it takes up, or
+        :py:obj:`None` if there is no Context for the name.  It may be called
+        from more than one thread at a time.
+    :param max_contexts: (optional) The most Contexts to keep, or
+        :py:obj:`None` for no limit.
+    :param max_bytes: (optional) The most bytes, as estimated by *loader*, the
+        Contexts kept may take up, or :py:obj:`None` for no limit.
+    :param max_missing: (optional) The most names *loader* had no Context for
+        to remember, the oldest being forgotten first.  They are kept apart
+        from the Contexts, so that clients asking for made up names cannot
+        push Contexts out of the cache.
+
+    :ivar hits: The number of times a server name was found in the cache.
+    :ivar misses: The number of times *loader* had to be called.
+    :ivar evictions: The number of Contexts thrown away to make room.
+    :ivar errors: The number of times *loader* raised an exception.
+    :ivar load_time: The total number of seconds spent in *loader*.
+    :ivar max_load_time: The most seconds one call to *loader* took.
+    """
+    def __init__(self, loader, max_contexts=1000, max_bytes=None,
+                 max_missing=1000):
+        self.loader = loader
+        self.max_contexts = max_contexts
+        self.max_bytes = max_bytes
+        self.max_missing = max_missing
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self.load_time = 0.0
+        self.max_load_time = 0.0
+        self.bytes = 0
+        self._lock = Lock()
+        # name -> [previous, next, name, context, size], in a circular list
+        # which runs from the most to the least recently used name.
+        self._entries = {}
+        self._root = root = []
+        root[:] = [root, root, None, None, 0]
+        # The names loader had no Context for, and the same oldest first.
+        self._missing = set()
+        self._missing_order = deque()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def get(self, server_name):
+        """
+        Get the Context for a server name, loading it if it is not in the
+        cache.  Names for which *loader* returned :py:obj:`None` are
+        remembered, up to *max_missing* of them, without taking the place of
+        any Context.
+
+        :param server_name: The server name, a byte string.
+        :return: The :py:class:`OpenSSL.SSL.Context`, or :py:obj:`None`.
+        """
+        server_name = server_name.lower()
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(server_name)
+            if entry is not None:
+                self.hits += 1
+                self._unlink(entry)
+                self._link(entry)
+                return entry[3]
+            if server_name in self._missing:
+                self.hits += 1
+                return None
+            self.misses += 1
+        finally:
+            self._lock.release()
+
+        start = time()
+        try:
+            try:
+                context = self.loader(server_name)
+            except:
+                self._lock.acquire()
+                self.errors += 1
+                self._lock.release()
+                raise
+        finally:
+            elapsed = time() - start
+            self._lock.acquire()
+            self.load_time += elapsed
+            self.max_load_time = max(self.max_load_time, elapsed)
+            self._lock.release()
+
+        size = 0
+        if isinstance(context, tuple):
+            context, size = context
+
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(server_name)
+            if entry is not None:
+                # Another thread loaded it at the same time; keep its Context
+                # so that every connection for the name shares one.
+                return entry[3]
+            if context is None:
+                self._add_missing(server_name)
+                return None
+            entry = [None, None, server_name, context, size]
+            self._entries[server_name] = entry
+            self._link(entry)
+            self.bytes += size
+            self._shrink()
+        finally:
+            self._lock.release()
+        return context
+
+
+    def evict(self, server_name):
+        """
+        Throw away the Context for a server name, if it is cached, so that it
+        is loaded again when it is next asked for.  If *loader* had no Context
+        for the name, forget that instead.
+
+        :param server_name: The server name, a byte string.
+        :return: :py:obj:`True` if it was cached, :py:obj:`False` otherwise.
+        """
+        server_name = server_name.lower()
+        self._lock.acquire()
+        try:
+            if server_name in self._missing:
+                self._missing.remove(server_name)
+                self._missing_order = deque([
+                        name for name in self._missing_order
+                        if name != server_name])
+                return True
+            entry = self._entries.pop(server_name, None)
+            if entry is None:
+                return False
+            self._unlink(entry)
+            self.bytes -= entry[4]
+            return True
+        finally:
+            self._lock.release()
+
+
+    def clear(self):
+        """
+        Throw away every cached Context, and forget the names *loader* had
+        no Context for.
+        """
+        self._lock.acquire()
+        try:
+            self._missing.clear()
+            self._missing_order.clear()
+            self._entries.clear()
+            self._root[:] = [self._root, self._root, None, None, 0]
+            self.bytes = 0
+        finally:
+            self._lock.release()
+
+
+    def servername_callback(self, connection):
+        """
+        A callback for :py:meth:`OpenSSL.SSL.Context.set_tlsext_servername_callback`
+        which switches *connection* to the Context for the server name its
+        client asked for.  Connections asking for no name, or for a name
+        there is no Context for, are left alone, and so are those for which
+        *loader* raised an exception.
+        """
+        server_name = connection.get_servername()
+        if server_name is None:
+            return
+        try:
+            context = self.get(server_name)
+        except Exception:
+            return
+        if context is not None:
+            connection.set_context(context)
+
+
+    def install(self, context):
+        """
+        Make connections which use *context* switch to the Context for the
+        server name their client asks for.
+
+        :param context: The :py:class:`OpenSSL.SSL.Context` connections are
+            made with.
+        :return: None
+        """
+        context.set_tlsext_servername_callback(self.servername_callback)
+
+
+    def _link(self, entry):
+        root = self._root
+        first = root[1]
+        entry[0] = root
+        entry[1] = first
+        root[1] = first[0] = entry
+
+
+    def _unlink(self, entry):
+        previous, next = entry[0], entry[1]
+        previous[1] = next
+        next[0] = previous
+
+
+    def _add_missing(self, server_name):
+        """
+        With the lock held, remember that *loader* has no Context for a name,
+        forgetting the oldest such names if there are too many.
+        """
+        if server_name in self._missing or not self.max_missing:
+            return
+        self._missing.add(server_name)
+        self._missing_order.append(server_name)
+        while len(self._missing_order) > self.max_missing:
+            self._missing.remove(self._missing_order.popleft())
+
+
+    def _shrink(self):
+        """
+        With the lock held, throw away the least recently used Contexts until
+        the cache is within its limits.  The Context just added is kept even if
+        it is larger than *max_bytes* by itself.
+        """
+        root = self._root
+        while len(self._entries) > 1 and (
+            (self.max_contexts is not None and
+             len(self._entries) > self.max_contexts) or
+            (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            entry = root[0]
+            self._unlink(entry)
+            del self._entries[entry[2]]
+            self.bytes -= entry[4]
+            self.evictions += 1
+
+
+
+class DirectoryLoader(object):
+    """
+    A loader for :py:class:`ContextCache` which reads the certificate chain
+    for a server name from ``<name>.crt`` in a directory, and its private key
+    from ``<name>.key``.  The chain file holds PEM certificates, the server's
+    own first.
+
+    :param directory: The directory the files are in.
+    :param method: (optional) The method the Contexts are made with.
+    :param configure: (optional) A callable which is called with each new
+        Context, before it is used, to set it up further.
+    """
+    _valid = re.compile(r'^[a-z0-9_-]+(\.[a-z0-9_-]+)*\Z')
+
+    def __init__(self, directory, method=SSLv23_METHOD, configure=None):
+        self.directory = directory
+        self.method = method
+        self.configure = configure
+
+
+    def __call__(self, server_name):
+        """
+        Load the Context for a server name.
+
+        :param server_name: The server name, a byte string.
+        :return: A tuple of the :py:class:`OpenSSL.SSL.Context` and the size
+            of the files it was loaded from, or :py:obj:`None` if there are no
+            files for the name.
+        """
+        try:
+            name = server_name.decode('ascii').lower()
+        except UnicodeError:
+            return None
+        # The name comes from the client; keep it from naming files outside of
+        # the directory.
+        if self._valid.match(name) is None:
+            return None
+
+        certificate = os.path.join(self.directory, name + '.crt')
+        key = os.path.join(self.directory, name + '.key')
+        try:
+            size = os.path.getsize(certificate) + os.path.getsize(key)
+        except OSError:
+            return None
+
+        context = Context(self.method)
+        context.use_certificate_chain_file(certificate)
+        context.use_privatekey_file(key)
+        context.check_privatekey()
+        if self.configure is not None:
+            self.configure(context)
+        return context, size
@@ -18,16 +18,34 @@
 #  if !(defined(__BEOS__) || defined(__CYGWIN__))
 #    include <netinet/tcp.h>
 #  endif
+#  ifdef HAVE_POLL_H
+#    include <poll.h>
+#  elif defined(HAVE_SYS_SELECT_H)
+#    include <sys/select.h>
+#  endif
+#  include <unistd.h>
+#  include <fcntl.h>
+#  include <sys/time.h>
 #else
 #  include <winsock.h>
 #  include <wincrypt.h>
+#  include <io.h>
 #endif
 
 #define SSL_MODULE
 #include <openssl/bio.h>
 #include <openssl/err.h>
+#include <openssl/x509v3.h>
 #include "ssl.h"
 
+/*
+ * OpenSSL 1.0.2 and later can check the name in the peer's certificate while
+ * verifying it.
+ */
+#ifdef X509_CHECK_FLAG_NO_PARTIAL_WILDCARDS
+#define PYOPENSSL_VERIFY_HOSTNAME
+#endif
+
 /**
  * If we are on UNIX, fine, just use PyErr_SetFromErrno. If we are on Windows,
  * apply some black winsock voodoo. This is basically just copied from Python's
@@ -244,6 +262,543 @@ handle_ssl_errors(SSL *ssl, int err, int ret)
     }
 }
 
+/*
+ * Wait for a socket to become readable or writable.  Call this without the
+ * GIL held.
+ *
+ * Arguments: fd      - The socket to wait on
+ *            writing - True to wait until the socket is writable, false to
+ *                      wait until it is readable
+ *            timeout - The longest time to wait, in seconds, or a negative
+ *                      number to wait forever
+ * Returns:   1 if the socket is ready, 0 if the timeout expired, -1 if
+ *            waiting failed (errno describes the problem)
+ */
+static int
+wait_for_socket(SOCKET_T fd, int writing, double timeout)
+{
+#if defined(HAVE_POLL) && !defined(MS_WINDOWS)
+    struct pollfd pollfd;
+    int ms;
+
+    if (timeout < 0)
+        ms = -1;
+    else if (timeout * 1000.0 >= INT_MAX)
+        ms = INT_MAX;
+    else
+        ms = (int)(timeout * 1000.0 + 0.5);
+
+    pollfd.fd = fd;
+    pollfd.events = writing ? POLLOUT : POLLIN;
+    pollfd.revents = 0;
+    return poll(&pollfd, 1, ms);
+#else
+    fd_set fds;
+    struct timeval tv, *tvp = NULL;
+
+    FD_ZERO(&fds);
+    FD_SET(fd, &fds);
+    if (timeout >= 0)
+    {
+        tv.tv_sec = (long)timeout;
+        tv.tv_usec = (long)((timeout - tv.tv_sec) * 1e6);
+        tvp = &tv;
+    }
+    return select((int)fd + 1, writing ? NULL : &fds, writing ? &fds : NULL,
+                  NULL, tvp);
+#endif
+}
+
+/*
+ * The SSL I/O operations connection_perform knows how to do.
+ */
+#define IO_READ         0
+#define IO_WRITE        1
+#define IO_HANDSHAKE    2
+#define IO_SHUTDOWN     3
+
+/*
+ * How long a thread safe connection in the middle of a handshake waits for
+ * its socket before trying the operation again anyway.  Another thread's
+ * operation may have read the records it is waiting for into OpenSSL's
+ * buffers, which happens while a handshake is renegotiated.
+ */
+#define THREAD_SAFE_POLL_INTERVAL 0.1
+
+/*
+ * What connection_timeout returns for thread safe connections: wait as long
+ * as the socket's timeout, which connection_perform only looks up if it has
+ * to wait.
+ */
+#define SOCKET_TIMEOUT (-2.0)
+
+/*
+ * Put a socket in non-blocking mode.
+ *
+ * Arguments: fd - The socket
+ * Returns:   1 if the socket was blocking, to be passed to set_blocking
+ *            afterwards, 0 if it was not or that cannot be told, -1 if it
+ *            could not be changed (errno describes the problem)
+ */
+static int
+set_nonblocking(SOCKET_T fd)
+{
+#ifdef MS_WINDOWS
+    u_long arg = 1;
+
+    /* Windows cannot tell whether a socket is blocking; it stays as it is. */
+    return ioctlsocket(fd, FIONBIO, &arg) == 0 ? 0 : -1;
+#else
+    int flags;
+
+    flags = fcntl(fd, F_GETFL, 0);
+    if (flags < 0)
+        return -1;
+    if (flags & O_NONBLOCK)
+        return 0;
+    if (fcntl(fd, F_SETFL, flags | O_NONBLOCK) < 0)
+        return -1;
+    return 1;
+#endif
+}
+
+/*
+ * Put a socket set_nonblocking found blocking back in blocking mode.
+ *
+ * Arguments: fd - The socket
+ * Returns:   None
+ */
+static void
+set_blocking(SOCKET_T fd)
+{
+#ifndef MS_WINDOWS
+    int flags;
+
+    flags = fcntl(fd, F_GETFL, 0);
+    if (flags >= 0)
+        fcntl(fd, F_SETFL, flags & ~O_NONBLOCK);
+#endif
+}
+
+/*
+ * Get the current time, to keep track of timeouts across several waits.
+ *
+ * Returns: The time in seconds
+ */
+static double
+current_time(void)
+{
+#ifdef MS_WINDOWS
+    return GetTickCount() / 1000.0;
+#else
+    struct timeval tv;
+
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + tv.tv_usec / 1e6;
+#endif
+}
+
+/*
+ * Acquire one of the locks of a thread safe connection.  Call this with the
+ * GIL held; it is released if the lock has to be waited for.
+ *
+ * Arguments: self - The Connection object
+ *            lock - The lock
+ * Returns:   None
+ */
+static void
+connection_acquire(ssl_ConnectionObj *self, PyThread_type_lock lock)
+{
+#ifdef WITH_THREAD
+    if (!PyThread_acquire_lock(lock, NOWAIT_LOCK))
+    {
+        MY_BEGIN_ALLOW_THREADS(self->tstate);
+        PyThread_acquire_lock(lock, WAIT_LOCK);
+        MY_END_ALLOW_THREADS(self->tstate);
+    }
+#endif
+}
+
+/*
+ * Take the SSL lock of a thread safe connection before using its SSL object
+ * outside of connection_perform, so that it is not read or changed while
+ * another thread is in the middle of an operation.  Callbacks OpenSSL makes
+ * during an operation run in the thread which already holds the lock, and do
+ * not take it again.  Call this with the GIL held.
+ *
+ * Arguments: self - The Connection object
+ * Returns:   True if the lock was taken, to be passed to connection_unlock
+ */
+static int
+connection_lock(ssl_ConnectionObj *self)
+{
+#ifdef WITH_THREAD
+    long me;
+
+    if (self->ssl_lock == NULL)
+        return 0;
+    me = (long)PyThread_get_thread_ident();
+    if (self->ssl_owner == me)
+        return 0;
+    connection_acquire(self, self->ssl_lock);
+    self->ssl_owner = me;
+    return 1;
+#else
+    return 0;
+#endif
+}
+
+/*
+ * Release the lock taken by connection_lock.
+ *
+ * Arguments: self   - The Connection object
+ *            locked - What connection_lock returned
+ * Returns:   None
+ */
+static void
+connection_unlock(ssl_ConnectionObj *self, int locked)
+{
+#ifdef WITH_THREAD
+    if (!locked)
+        return;
+    self->ssl_owner = 0;
+    PyThread_release_lock(self->ssl_lock);
+#endif
+}
+
+/*
+ * Before an operation on a thread safe connection, take the locks of the
+ * directions it works in: reading, writing or, for handshakes, both.  This
+ * does nothing for other connections.  Call this with the GIL held.
+ *
+ * Arguments: self - The Connection object
+ *            op   - One of the IO_ constants
+ * Returns:   None
+ */
+static void
+connection_begin(ssl_ConnectionObj *self, int op)
+{
+    if (self->ssl_lock == NULL)
+        return;
+    if (op == IO_READ || op == IO_HANDSHAKE)
+        connection_acquire(self, self->read_lock);
+    if (op != IO_READ)
+        connection_acquire(self, self->write_lock);
+}
+
+/*
+ * Once a server name map (see Context.set_servername_map) has switched the
+ * connection to another Context, which happens without the GIL, take a
+ * reference to that Context and drop the ones to the map and to the Context
+ * referred to before.  Call this with the GIL held.
+ *
+ * Arguments: self - The Connection object
+ * Returns:   None
+ */
+static void
+connection_sync_context(ssl_ConnectionObj *self)
+{
+    ssl_ContextObj *old;
+    ssl_ServernameMap *map;
+    int locked;
+
+    if (self->servername_map == NULL)
+        return;
+
+    locked = connection_lock(self);
+    old = self->routed_from;
+    if (old != NULL)
+    {
+        Py_INCREF(self->context);
+        self->routed_from = NULL;
+    }
+    map = self->servername_map;
+    self->servername_map = NULL;
+    connection_unlock(self, locked);
+
+    ssl_ServernameMap_release(map);
+    Py_XDECREF(old);
+}
+
+/*
+ * Release the locks taken by connection_begin.
+ *
+ * Arguments: self - The Connection object
+ *            op   - One of the IO_ constants
+ * Returns:   None
+ */
+static void
+connection_end(ssl_ConnectionObj *self, int op)
+{
+    connection_sync_context(self);
+#ifdef WITH_THREAD
+    if (self->ssl_lock == NULL)
+        return;
+    if (op != IO_READ)
+        PyThread_release_lock(self->write_lock);
+    if (op == IO_READ || op == IO_HANDSHAKE)
+        PyThread_release_lock(self->read_lock);
+#endif
+}
+
+/*
+ * Find out how long a connection may wait for its socket in
+ * connection_perform.
+ *
+ * Arguments: self - The Connection object
+ * Returns:   SOCKET_TIMEOUT for thread safe connections, 0 for others, which
+ *            never wait.
+ */
+static double
+connection_timeout(ssl_ConnectionObj *self)
+{
+    return self->ssl_lock == NULL ? 0.0 : SOCKET_TIMEOUT;
+}
+
+/*
+ * Get the timeout of a connection's socket, as socket.gettimeout() reports
+ * it.  Call this with the GIL held.
+ *
+ * Arguments: self - The Connection object
+ * Returns:   The timeout in seconds, or a negative number to wait forever
+ */
+static double
+socket_timeout(ssl_ConnectionObj *self)
+{
+    PyObject *result;
+    double timeout = -1.0;
+
+    result = PyObject_CallMethod(self->socket, "gettimeout", NULL);
+    if (result == NULL)
+    {
+        PyErr_Clear();
+        return timeout;
+    }
+    if (result != Py_None)
+    {
+        timeout = PyFloat_AsDouble(result);
+        if (timeout == -1.0 && PyErr_Occurred())
+            PyErr_Clear();
+    }
+    Py_DECREF(result);
+    return timeout;
+}
+
+/*
+ * Perform an SSL I/O operation.  Call this without the GIL held.
+ *
+ * On a thread safe connection OpenSSL is only called with the SSL lock held,
+ * and with the socket in non-blocking mode.  If the operation has to wait for
+ * the socket, the lock is released while waiting, so that a thread waiting to
+ * read does not stop another from writing, and then the operation is tried
+ * again, until it succeeds, fails or the timeout expires.
+ *
+ * Arguments: self    - The Connection object
+ *            op      - One of the IO_ constants
+ *            buf     - The buffer to read into or write from, for IO_READ and
+ *                      IO_WRITE
+ *            len     - The size of buf
+ *            timeout - For thread safe connections, the longest time to wait
+ *                      for the socket in seconds, a negative number to wait
+ *                      forever, or SOCKET_TIMEOUT to wait as long as the
+ *                      socket's timeout
+ *            err     - Where to store the result of SSL_get_error
+ * Returns:   The return value of the OpenSSL function, with errno as it left
+ *            it
+ */
+static int
+connection_perform(ssl_ConnectionObj *self, int op, void *buf, int len,
+                   double timeout, int *err)
+{
+    int ret, ready, saved_errno, locked = 0, restore = 0, in_init = 0;
+    double wait, now, deadline = -1.0;
+    unsigned long ops = 0;
+#ifdef WITH_THREAD
+    long me = 0;
+
+    if (self->ssl_lock != NULL)
+        me = (long)PyThread_get_thread_ident();
+#endif
+
+    for (;;)
+    {
+#ifdef WITH_THREAD
+        if (self->ssl_lock != NULL && self->ssl_owner != me)
+        {
+            PyThread_acquire_lock(self->ssl_lock, WAIT_LOCK);
+            self->ssl_owner = me;
+            locked = 1;
+            /*
+             * OpenSSL must not block with the lock held, whatever mode the
+             * socket is in.  The mode is put back afterwards, so that the
+             * socket still behaves the way its timeout says when it is used
+             * directly.
+             */
+            restore = set_nonblocking(SSL_get_fd(self->ssl)) == 1;
+        }
+#endif
+
+        switch (op)
+        {
+            case IO_READ:
+                ret = SSL_read(self->ssl, buf, len);
+                break;
+            case IO_WRITE:
+                ret = SSL_write(self->ssl, buf, len);
+                break;
+            case IO_HANDSHAKE:
+                ret = SSL_do_handshake(self->ssl);
+                break;
+            default:
+                ret = SSL_shutdown(self->ssl);
+                break;
+        }
+        saved_errno = errno;
+        *err = SSL_get_error(self->ssl, ret);
+
+        if (!locked)
+            break;
+#ifdef WITH_THREAD
+        if (restore)
+            set_blocking(SSL_get_fd(self->ssl));
+        in_init = SSL_in_init(self->ssl) || SSL_renegotiate_pending(self->ssl);
+        ops = ++self->ssl_ops;
+        self->ssl_owner = 0;
+        PyThread_release_lock(self->ssl_lock);
+        locked = 0;
+#endif
+
+        if ((*err != SSL_ERROR_WANT_READ && *err != SSL_ERROR_WANT_WRITE) ||
+            timeout == 0)
+            break;
+
+        if (timeout == SOCKET_TIMEOUT)
+        {
+            /*
+             * Looked up only now, so that operations which do not have to
+             * wait do not call into Python.
+             */
+            MY_END_ALLOW_THREADS(self->tstate);
+            timeout = socket_timeout(self);
+            MY_BEGIN_ALLOW_THREADS(self->tstate);
+            if (timeout == 0)
+                break;
+        }
+
+        /*
+         * Every record arriving on the socket wakes all the threads waiting
+         * for it, so a thread only misses one if another thread's operation
+         * reads it before this one starts to wait.  That is checked for here,
+         * and while a handshake is in progress, when operations in either
+         * direction read from the socket, the wait is kept short as well.
+         */
+        wait = in_init ? THREAD_SAFE_POLL_INTERVAL : -1.0;
+        if (timeout > 0)
+        {
+            now = current_time();
+            if (deadline < 0)
+                deadline = now + timeout;
+            else if (now >= deadline)
+                break;
+            if (wait < 0 || deadline - now < wait)
+                wait = deadline - now;
+        }
+        if (self->ssl_ops != ops)
+            continue;
+        ready = wait_for_socket(SSL_get_fd(self->ssl),
+                                *err == SSL_ERROR_WANT_WRITE, wait);
+        if (ready < 0)
+        {
+            saved_errno = errno;
+            *err = SSL_ERROR_SYSCALL;
+            ret = -1;
+            break;
+        }
+    }
+
+    errno = saved_errno;
+    return ret;
+}
+
+/*
+ * Record, on the exception currently being raised, how many bytes had been
+ * sent before it happened.
+ *
+ * Arguments: sent - The number of bytes sent
+ * Returns:   None
+ */
+static void
+set_bytes_sent(PY_LONG_LONG sent)
+{
+    PyObject *type, *value, *traceback, *count;
+
+    PyErr_Fetch(&type, &value, &traceback);
+    PyErr_NormalizeException(&type, &value, &traceback);
+    if (value != NULL && (count = PyLong_FromLongLong(sent)) != NULL)
+    {
+        if (PyObject_SetAttrString(value, "bytes_sent", count) < 0)
+            PyErr_Clear();
+        Py_DECREF(count);
+    }
+    PyErr_Restore(type, value, traceback);
+}
+
+/*
+ * Record, on the exception currently being raised, the application data read
+ * before it happened.
+ *
+ * Arguments: plaintext - The data read (a new reference, which is stolen)
+ *            used      - How many bytes of plaintext were read
+ * Returns:   None
+ */
+static void
+set_plaintext(PyObject *plaintext, Py_ssize_t used)
+{
+    PyObject *type, *value, *traceback;
+
+    PyErr_Fetch(&type, &value, &traceback);
+    PyErr_NormalizeException(&type, &value, &traceback);
+    if (value != NULL && _PyBytes_Resize(&plaintext, used) == 0)
+    {
+        if (PyObject_SetAttrString(value, "plaintext", plaintext) < 0)
+            PyErr_Clear();
+        Py_DECREF(plaintext);
+    }
+    else
+    {
+        PyErr_Clear();
+        Py_XDECREF(plaintext);
+    }
+    PyErr_Restore(type, value, traceback);
+}
+
+/*
+ * Read from a file at a given offset.  Call this without the GIL held.
+ *
+ * Arguments: fd     - The file descriptor to read from
+ *            buf    - Where to put the bytes read
+ *            len    - The maximum number of bytes to read
+ *            offset - The position in the file to read from
+ * Returns:   The number of bytes read, 0 at end of file, or -1 if reading
+ *            failed (errno describes the problem)
+ */
+static int
+read_file_at(int fd, char *buf, int len, PY_LONG_LONG offset)
+{
+#ifdef MS_WINDOWS
+    if (_lseeki64(fd, offset, SEEK_SET) < 0)
+        return -1;
+    return _read(fd, buf, len);
+#else
+    ssize_t n;
+
+    do {
+        n = pread(fd, buf, len, (off_t)offset);
+    } while (n < 0 && errno == EINTR);
+    return (int)n;
+#endif
+}
+
 /*
  * Here be member methods of the Connection "class"
  */
@@ -259,6 +814,7 @@ ssl_Connection_get_context(ssl_ConnectionObj *self, PyObject *args) {
         return NULL;
     }
 
+    connection_sync_context(self);
     Py_INCREF(self->context);
     return (PyObject *)self->context;
 }
@@ -273,6 +829,7 @@ static PyObject *
 ssl_Connection_set_context(ssl_ConnectionObj *self, PyObject *args) {
     ssl_ContextObj *ctx;
     ssl_ContextObj *old;
+    int locked;
 
     if (!PyArg_ParseTuple(args, "O!:set_context", &ssl_Context_Type, &ctx)) {
         return NULL;
@@ -286,12 +843,18 @@ ssl_Connection_set_context(ssl_ConnectionObj *self, PyObject *args) {
     /* XXX The unit tests don't actually verify that this call is made.
      * They're satisfied if self->context gets updated.
      */
+    locked = connection_lock(self);
     SSL_set_SSL_CTX(self->ssl, ctx->ctx);
+    connection_unlock(self, locked);
 
-    /* Swap the old out and the new in.
+    /* Swap the old out and the new in.  If a server name map switched the
+     * connection, the reference held is still to the Context before that.
      */
-    old = self->context;
+    old = self->routed_from != NULL ? self->routed_from : self->context;
+    self->routed_from = NULL;
     self->context = ctx;
+    ssl_ServernameMap_release(self->servername_map);
+    self->servername_map = NULL;
 
     /* XXX The unit tests don't verify that this reference is dropped.
      */
@@ -310,21 +873,25 @@ message, or None if there wasn't one.\n\
 ";
 static PyObject *
 ssl_Connection_get_servername(ssl_ConnectionObj *self, PyObject *args) {
-    int type = TLSEXT_NAMETYPE_host_name;
+    int type = TLSEXT_NAMETYPE_host_name, locked;
     const char *name;
+    PyObject *result;
 
     if (!PyArg_ParseTuple(args, ":get_servername")) {
         return NULL;
     }
 
+    locked = connection_lock(self);
     name = SSL_get_servername(self->ssl, type);
 
     if (name == NULL) {
         Py_INCREF(Py_None);
-        return Py_None;
+        result = Py_None;
     } else {
-        return PyBytes_FromString(name);
+        result = PyBytes_FromString(name);
     }
+    connection_unlock(self, locked);
+    return result;
 }
 
 
@@ -337,42 +904,168 @@ Set the value of the servername extension to send in the client hello.\n\
 static PyObject *
 ssl_Connection_set_tlsext_host_name(ssl_ConnectionObj *self, PyObject *args) {
     char *buf;
+    int locked;
 
     if (!PyArg_ParseTuple(args, BYTESTRING_FMT ":set_tlsext_host_name", &buf)) {
         return NULL;
     }
 
     /* XXX I guess this can fail sometimes? */
+    locked = connection_lock(self);
     SSL_set_tlsext_host_name(self->ssl, buf);
+    connection_unlock(self, locked);
 
     Py_INCREF(Py_None);
     return Py_None;
 }
 
 
-
-static char ssl_Connection_pending_doc[] = "\n\
-Get the number of bytes that can be safely read from the connection\n\
+#ifdef PYOPENSSL_VERIFY_HOSTNAME
+static char ssl_Connection_set_verify_hostname_doc[] = "\n\
+Check that the peer's certificate is for a host name while verifying it,\n\
+against the DNS names of its subjectAltName extension, or its common name\n\
+if there are none.  Wildcards are only matched as a whole label.  A\n\
+mismatch is an X509_V_ERR_HOSTNAME_MISMATCH verification error.\n\
 \n\
-:return: The number of bytes available in the receive buffer.\n\
+:param name: A byte string giving the host name, or None to stop checking\n\
+    it.\n\
+:return: None\n\
 ";
 static PyObject *
-ssl_Connection_pending(ssl_ConnectionObj *self, PyObject *args) {
-    int ret;
+ssl_Connection_set_verify_hostname(ssl_ConnectionObj *self, PyObject *args) {
+    PyObject *name;
+    X509_VERIFY_PARAM *param;
+    char *buf = NULL;
+    Py_ssize_t length = 0;
+    int locked, ok;
 
-    if (!PyArg_ParseTuple(args, ":pending")) {
+    if (!PyArg_ParseTuple(args, "O:set_verify_hostname", &name)) {
         return NULL;
     }
 
-    ret = SSL_pending(self->ssl);
-    return PyLong_FromLong((long)ret);
-}
-
-static char ssl_Connection_bio_write_doc[] = "\n\
-When using non-socket connections this function sends\n\
-\"dirty\" data that would have traveled in on the network.\n\
+    if (name != Py_None) {
+        if (!PyBytes_Check(name)) {
+            PyErr_SetString(PyExc_TypeError, "name must be a byte string or None");
+            return NULL;
+        }
+        buf = PyBytes_AS_STRING(name);
+        length = PyBytes_GET_SIZE(name);
+        if (length == 0 || memchr(buf, '\0', length) != NULL) {
+            PyErr_SetString(PyExc_ValueError, "name must be a non-empty host name");
+            return NULL;
+        }
+    }
+
+    locked = connection_lock(self);
+    param = SSL_get0_param(self->ssl);
+    X509_VERIFY_PARAM_set_hostflags(param, X509_CHECK_FLAG_NO_PARTIAL_WILDCARDS);
+    ok = X509_VERIFY_PARAM_set1_host(param, buf, length);
+    connection_unlock(self, locked);
+    if (!ok) {
+        exception_from_error_queue(ssl_Error);
+        return NULL;
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static char ssl_Connection_set_verify_ip_doc[] = "\n\
+Check that the peer's certificate is for an IP address while verifying it,\n\
+against the IP addresses of its subjectAltName extension.  A mismatch is an\n\
+X509_V_ERR_IP_ADDRESS_MISMATCH verification error.\n\
+\n\
+:param address: A byte string giving the IPv4 or IPv6 address in text form,\n\
+    or None to stop checking it.\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Connection_set_verify_ip(ssl_ConnectionObj *self, PyObject *args) {
+    PyObject *address;
+    X509_VERIFY_PARAM *param;
+    int locked, ok = 1;
+
+    if (!PyArg_ParseTuple(args, "O:set_verify_ip", &address)) {
+        return NULL;
+    }
+
+    if (address != Py_None) {
+        if (!PyBytes_Check(address)) {
+            PyErr_SetString(PyExc_TypeError, "address must be a byte string or None");
+            return NULL;
+        }
+        if ((size_t)PyBytes_GET_SIZE(address) != strlen(PyBytes_AS_STRING(address))) {
+            ok = 0;
+        }
+    }
+
+    locked = connection_lock(self);
+    param = SSL_get0_param(self->ssl);
+    if (address == Py_None) {
+        X509_VERIFY_PARAM_set1_ip(param, NULL, 0);
+    } else if (ok) {
+        ok = X509_VERIFY_PARAM_set1_ip_asc(param, PyBytes_AS_STRING(address));
+    }
+    connection_unlock(self, locked);
+    if (!ok) {
+        flush_error_queue();
+        PyErr_SetString(PyExc_ValueError, "address must be an IPv4 or IPv6 address");
+        return NULL;
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+#endif
+
+static char ssl_Connection_get_verify_result_doc[] = "\n\
+Retrieve the result of verifying the peer's certificate.\n\
 \n\
-:param buf: The string to put into the memory BIO.\n\
+:return: An X509_V_* verification error number (0 for success).  See\n\
+    SSL_get_verify_result(3SSL) for details.\n\
+";
+static PyObject *
+ssl_Connection_get_verify_result(ssl_ConnectionObj *self, PyObject *args) {
+    long result;
+    int locked;
+
+    if (!PyArg_ParseTuple(args, ":get_verify_result")) {
+        return NULL;
+    }
+
+    locked = connection_lock(self);
+    result = SSL_get_verify_result(self->ssl);
+    connection_unlock(self, locked);
+    return PyLong_FromLong(result);
+}
+
+
+
+static char ssl_Connection_pending_doc[] = "\n\
+Get the number of bytes that can be safely read from the connection\n\
+\n\
+:return: The number of bytes available in the receive buffer.\n\
+";
+static PyObject *
+ssl_Connection_pending(ssl_ConnectionObj *self, PyObject *args) {
+    int ret, locked;
+
+    if (!PyArg_ParseTuple(args, ":pending")) {
+        return NULL;
+    }
+
+    locked = connection_lock(self);
+    ret = SSL_pending(self->ssl);
+    connection_unlock(self, locked);
+    return PyLong_FromLong((long)ret);
+}
+
+static char ssl_Connection_bio_write_doc[] = "\n\
+When using non-socket connections this function sends\n\
+\"dirty\" data that would have traveled in on the network.\n\
+\n\
+:param buf: The string (or any object supporting the buffer protocol) to\n\
+            put into the memory BIO.\n\
 :return: The number of bytes written\n\
 ";
 static PyObject *
@@ -387,10 +1080,36 @@ ssl_Connection_bio_write(ssl_ConnectionObj *self, PyObject *args)
             return NULL;
     }
 
-    if (!PyArg_ParseTuple(args, "s#|i:bio_write", &buf, &len))
+#if PY_VERSION_HEX >= 0x02060000
+    {
+        Py_buffer pbuf;
+
+        if (!PyArg_ParseTuple(args, "s*:bio_write", &pbuf))
+            return NULL;
+
+        if (pbuf.len > INT_MAX)
+        {
+            PyBuffer_Release(&pbuf);
+            PyErr_SetString(PyExc_OverflowError, "buffer too long for bio_write");
+            return NULL;
+        }
+
+        buf = pbuf.buf;
+        len = (int)pbuf.len;
+
+        /*
+         * The memory BIO copies the data, so the buffer can be released as
+         * soon as BIO_write returns.
+         */
+        ret = BIO_write(self->into_ssl, buf, len);
+        PyBuffer_Release(&pbuf);
+    }
+#else
+    if (!PyArg_ParseTuple(args, "s#:bio_write", &buf, &len))
         return NULL;
 
     ret = BIO_write(self->into_ssl, buf, len);
+#endif
 
     if (PyErr_Occurred())
     {
@@ -409,38 +1128,63 @@ ssl_Connection_bio_write(ssl_ConnectionObj *self, PyObject *args)
     return PyLong_FromLong((long)ret);
 }
 
-static char ssl_Connection_send_doc[] = "\n\
-Send data on the connection. NOTE: If you get one of the WantRead,\n\
-WantWrite or WantX509Lookup exceptions on this, you have to call the\n\
-method again with the SAME buffer.\n\
-\n\
-:param buf: The string to send\n\
-:param flags: (optional) Included for compatibility with the socket\n\
-              API, the value is ignored\n\
-:return: The number of bytes written\n\
-";
+/*
+ * Report the failure of an SSL I/O function.  The _nb methods return
+ * WANT_READ or WANT_WRITE instead of raising WantReadError or WantWriteError,
+ * since for them that is the normal course of things rather than an error.
+ *
+ * Arguments: self - The Connection object
+ *            err  - The return code from SSL_get_error
+ *            ret  - The return code from the SSL I/O function
+ *            nb   - True for the _nb methods
+ * Returns:   The status to return, or NULL with an exception set
+ */
 static PyObject *
-ssl_Connection_send(ssl_ConnectionObj *self, PyObject *args) {
+connection_failed(ssl_ConnectionObj *self, int err, int ret, int nb)
+{
+    if (nb && err == SSL_ERROR_WANT_READ)
+        return PyLong_FromLong(ssl_WANT_READ);
+    if (nb && err == SSL_ERROR_WANT_WRITE)
+        return PyLong_FromLong(ssl_WANT_WRITE);
+    handle_ssl_errors(self->ssl, err, ret);
+    return NULL;
+}
+
+#if PY_VERSION_HEX >= 0x02060000
+#define SEND_FORMAT(name) "s*|i:" name
+#else
+#define SEND_FORMAT(name) "s#|i:" name
+#endif
+
+/*
+ * The implementation of send and send_nb.
+ */
+static PyObject *
+connection_send(ssl_ConnectionObj *self, PyObject *args, char *format, int nb) {
     int len, ret, err, flags;
+    double timeout;
     char *buf;
 
 #if PY_VERSION_HEX >= 0x02060000
     Py_buffer pbuf;
 
-    if (!PyArg_ParseTuple(args, "s*|i:send", &pbuf, &flags))
+    if (!PyArg_ParseTuple(args, format, &pbuf, &flags))
         return NULL;
 
     buf = pbuf.buf;
     len = pbuf.len;
 #else
 
-    if (!PyArg_ParseTuple(args, "s#|i:send", &buf, &len, &flags))
+    if (!PyArg_ParseTuple(args, format, &buf, &len, &flags))
         return NULL;
 #endif
 
+    timeout = nb ? 0.0 : connection_timeout(self);
+    connection_begin(self, IO_WRITE);
     MY_BEGIN_ALLOW_THREADS(self->tstate)
-    ret = SSL_write(self->ssl, buf, len);
+    ret = connection_perform(self, IO_WRITE, buf, len, timeout, &err);
     MY_END_ALLOW_THREADS(self->tstate)
+    connection_end(self, IO_WRITE);
 
 #if PY_VERSION_HEX >= 0x02060000
     PyBuffer_Release(&pbuf);
@@ -452,10 +1196,199 @@ ssl_Connection_send(ssl_ConnectionObj *self, PyObject *args) {
         return NULL;
     }
 
-    err = SSL_get_error(self->ssl, ret);
     if (err == SSL_ERROR_NONE)
-    {
         return PyLong_FromLong((long)ret);
+    return connection_failed(self, err, ret, nb);
+}
+
+static char ssl_Connection_send_doc[] = "\n\
+Send data on the connection. NOTE: If you get one of the WantRead,\n\
+WantWrite or WantX509Lookup exceptions on this, you have to call the\n\
+method again with the SAME buffer.\n\
+\n\
+:param buf: The string to send\n\
+:param flags: (optional) Included for compatibility with the socket\n\
+              API, the value is ignored\n\
+:return: The number of bytes written\n\
+";
+static PyObject *
+ssl_Connection_send(ssl_ConnectionObj *self, PyObject *args) {
+    return connection_send(self, args, SEND_FORMAT("send"), 0);
+}
+
+static char ssl_Connection_send_nb_doc[] = "\n\
+Send data on the connection without raising WantReadError or\n\
+WantWriteError.  This is meant for non-blocking sockets.  As with send, if\n\
+the data could not be sent, call the method again with the SAME buffer.\n\
+\n\
+:param buf: The string to send\n\
+:param flags: (optional) Included for compatibility with the socket\n\
+              API, the value is ignored\n\
+:return: The number of bytes written, or WANT_READ or WANT_WRITE if the\n\
+         socket has to become readable or writable first\n\
+";
+static PyObject *
+ssl_Connection_send_nb(ssl_ConnectionObj *self, PyObject *args) {
+    return connection_send(self, args, SEND_FORMAT("send_nb"), 1);
+}
+
+#if PY_VERSION_HEX >= 0x02060000
+static char ssl_Connection_writev_doc[] = "\n\
+Send the contents of several buffers on the connection.  The buffers are\n\
+packed together so that each SSL record is as full as possible, instead of\n\
+producing at least one record per buffer.\n\
+\n\
+:param buffers: A sequence of strings (or other objects supporting the\n\
+                buffer protocol) to send, in order\n\
+:return: The number of bytes written.  This may be less than the total\n\
+         length of the buffers if the transport could not accept more data\n\
+         without blocking; call writev again with the unsent data.\n\
+";
+static PyObject *
+ssl_Connection_writev(ssl_ConnectionObj *self, PyObject *args)
+{
+    PyObject *buffers, *seq;
+    Py_buffer *views;
+    Py_ssize_t nviews, i, idx, off, take, remaining, total = 0;
+    long written = 0;
+    char *staging;
+    const char *chunk;
+    int chunklen, ret = 0, err = SSL_ERROR_NONE;
+    double timeout;
+
+    if (!PyArg_ParseTuple(args, "O:writev", &buffers))
+        return NULL;
+
+    seq = PySequence_Fast(buffers, "writev() argument must be a sequence");
+    if (seq == NULL)
+        return NULL;
+
+    nviews = PySequence_Fast_GET_SIZE(seq);
+    views = PyMem_New(Py_buffer, nviews > 0 ? nviews : 1);
+    if (views == NULL)
+    {
+        Py_DECREF(seq);
+        return PyErr_NoMemory();
+    }
+
+    for (i = 0; i < nviews; i++)
+    {
+        if (PyObject_GetBuffer(PySequence_Fast_GET_ITEM(seq, i), &views[i],
+                               PyBUF_SIMPLE) < 0)
+        {
+            while (--i >= 0)
+                PyBuffer_Release(&views[i]);
+            PyMem_Free(views);
+            Py_DECREF(seq);
+            return NULL;
+        }
+        total += views[i].len;
+    }
+
+    /*
+     * Small pieces are copied into this buffer until it holds a full record.
+     * Pieces which are at least a record long are written in place.
+     */
+    staging = PyMem_Malloc(total < SSL3_RT_MAX_PLAIN_LENGTH ?
+                           (total > 0 ? total : 1) : SSL3_RT_MAX_PLAIN_LENGTH);
+    if (staging == NULL)
+    {
+        for (i = 0; i < nviews; i++)
+            PyBuffer_Release(&views[i]);
+        PyMem_Free(views);
+        Py_DECREF(seq);
+        return PyErr_NoMemory();
+    }
+
+    timeout = connection_timeout(self);
+    connection_begin(self, IO_WRITE);
+    MY_BEGIN_ALLOW_THREADS(self->tstate)
+    idx = 0;
+    off = 0;
+    for (;;)
+    {
+        /* Skip over any exhausted (or empty) buffers. */
+        while (idx < nviews && off == views[idx].len)
+        {
+            idx++;
+            off = 0;
+        }
+        if (idx == nviews)
+            break;
+
+        if (views[idx].len - off >= SSL3_RT_MAX_PLAIN_LENGTH)
+        {
+            chunk = (const char *)views[idx].buf + off;
+            chunklen = SSL3_RT_MAX_PLAIN_LENGTH;
+        }
+        else
+        {
+            Py_ssize_t j = idx, o = off;
+
+            chunklen = 0;
+            while (j < nviews && chunklen < SSL3_RT_MAX_PLAIN_LENGTH)
+            {
+                take = views[j].len - o;
+                if (take > SSL3_RT_MAX_PLAIN_LENGTH - chunklen)
+                    take = SSL3_RT_MAX_PLAIN_LENGTH - chunklen;
+                memcpy(staging + chunklen, (const char *)views[j].buf + o, take);
+                chunklen += (int)take;
+                o += take;
+                if (o == views[j].len)
+                {
+                    j++;
+                    o = 0;
+                }
+            }
+            chunk = staging;
+        }
+
+        ret = connection_perform(self, IO_WRITE, (void *)chunk, chunklen,
+                                 timeout, &err);
+        if (err != SSL_ERROR_NONE)
+            break;
+
+        written += ret;
+        remaining = ret;
+        while (remaining > 0)
+        {
+            take = views[idx].len - off;
+            if (take > remaining)
+                take = remaining;
+            off += take;
+            remaining -= take;
+            if (off == views[idx].len)
+            {
+                idx++;
+                off = 0;
+            }
+        }
+    }
+    MY_END_ALLOW_THREADS(self->tstate)
+    connection_end(self, IO_WRITE);
+
+    PyMem_Free(staging);
+    for (i = 0; i < nviews; i++)
+        PyBuffer_Release(&views[i]);
+    PyMem_Free(views);
+    Py_DECREF(seq);
+
+    if (PyErr_Occurred())
+    {
+        flush_error_queue();
+        return NULL;
+    }
+
+    if (err == SSL_ERROR_NONE ||
+        (written > 0 && (err == SSL_ERROR_WANT_READ ||
+                         err == SSL_ERROR_WANT_WRITE)))
+    {
+        /*
+         * Everything was written, or some of it was and the transport is
+         * now full.  Report the progress and let the caller try again with
+         * the rest, just like a short send().
+         */
+        return PyLong_FromLong(written);
     }
     else
     {
@@ -463,40 +1396,85 @@ ssl_Connection_send(ssl_ConnectionObj *self, PyObject *args) {
         return NULL;
     }
 }
+#endif
 
 static char ssl_Connection_sendall_doc[] = "\n\
 Send \"all\" data on the connection. This calls send() repeatedly until\n\
-all data is sent. If an error occurs, it's impossible to tell how much data\n\
-has been sent.\n\
+all data is sent.  If the underlying socket is non-blocking, sendall waits\n\
+for it to become readable or writable (as OpenSSL requires) instead of\n\
+retrying immediately.\n\
+\n\
+If an error occurs or the timeout expires, the exception raised has a\n\
+bytes_sent attribute giving the number of bytes from the start of buf\n\
+which were accepted before it happened.\n\
 \n\
 :param buf: The string to send\n\
 :param flags: (optional) Included for compatibility with the socket\n\
               API, the value is ignored\n\
-:return: The number of bytes written\n\
+:param timeout: (optional) The longest time, in seconds, to wait at any\n\
+                one point for a non-blocking socket to become ready.\n\
+                If it expires, WantReadError or WantWriteError is raised.\n\
+                The default, None, means wait for as long as it takes.\n\
+:return: None\n\
 ";
 static PyObject *
-ssl_Connection_sendall(ssl_ConnectionObj *self, PyObject *args)
+ssl_Connection_sendall(ssl_ConnectionObj *self, PyObject *args, PyObject *kwargs)
 {
     char *buf;
-    int len, ret, err, flags;
-    PyObject *pyret = Py_None;
+    int len, ret, err, flags = 0, ready, saved_errno;
+    long sent = 0;
+    double timeout = -1.0;
+    SOCKET_T fd;
+    PyObject *pyret = Py_None, *timeout_obj = Py_None;
+    static char *kwlist[] = {"buf", "flags", "timeout", NULL};
 
 #if PY_VERSION_HEX >= 0x02060000
     Py_buffer pbuf;
 
-    if (!PyArg_ParseTuple(args, "s*|i:sendall", &pbuf, &flags))
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s*|iO:sendall", kwlist,
+                                     &pbuf, &flags, &timeout_obj))
         return NULL;
 
     buf = pbuf.buf;
     len = pbuf.len;
 #else
-    if (!PyArg_ParseTuple(args, "s#|i:sendall", &buf, &len, &flags))
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s#|iO:sendall", kwlist,
+                                     &buf, &len, &flags, &timeout_obj))
         return NULL;
 #endif
 
-    do {
+    if (timeout_obj != Py_None)
+    {
+        timeout = PyFloat_AsDouble(timeout_obj);
+        if (timeout == -1.0 && PyErr_Occurred())
+        {
+            pyret = NULL;
+            goto done;
+        }
+        if (timeout < 0)
+        {
+            PyErr_SetString(PyExc_ValueError, "timeout must be non-negative");
+            pyret = NULL;
+            goto done;
+        }
+    }
+
+    /*
+     * This is -1 for memory BIO connections, which have nothing to wait on.
+     */
+    fd = SSL_get_fd(self->ssl);
+
+    /*
+     * Thread safe connections wait for the socket in connection_perform, for
+     * as long as the socket's own timeout unless a timeout is given.
+     */
+    if (self->ssl_lock != NULL && timeout_obj == Py_None)
+        timeout = connection_timeout(self);
+
+    connection_begin(self, IO_WRITE);
+    while (len > 0) {
         MY_BEGIN_ALLOW_THREADS(self->tstate)
-        ret = SSL_write(self->ssl, buf, len);
+        ret = connection_perform(self, IO_WRITE, buf, len, timeout, &err);
         MY_END_ALLOW_THREADS(self->tstate)
         if (PyErr_Occurred())
         {
@@ -504,21 +1482,50 @@ ssl_Connection_sendall(ssl_ConnectionObj *self, PyObject *args)
             pyret = NULL;
             break;
         }
-        err = SSL_get_error(self->ssl, ret);
         if (err == SSL_ERROR_NONE)
         {
             buf += ret;
             len -= ret;
+            sent += ret;
         }
-        else if (err == SSL_ERROR_SSL || err == SSL_ERROR_SYSCALL ||
-                 err == SSL_ERROR_ZERO_RETURN)
+        else if ((err == SSL_ERROR_WANT_READ || err == SSL_ERROR_WANT_WRITE) &&
+                 fd != (SOCKET_T)-1 && self->ssl_lock == NULL)
+        {
+            MY_BEGIN_ALLOW_THREADS(self->tstate)
+            ready = wait_for_socket(fd, err == SSL_ERROR_WANT_WRITE, timeout);
+            saved_errno = errno;
+            MY_END_ALLOW_THREADS(self->tstate)
+            if (ready < 0)
+            {
+                errno = saved_errno;
+                if (errno == EINTR && PyErr_CheckSignals() == 0)
+                    continue;
+                if (!PyErr_Occurred())
+                    syscall_from_errno();
+                pyret = NULL;
+                break;
+            }
+            else if (ready == 0)
+            {
+                /* Timed out.  Raise the WantReadError or WantWriteError. */
+                handle_ssl_errors(self->ssl, err, ret);
+                pyret = NULL;
+                break;
+            }
+        }
+        else
         {
             handle_ssl_errors(self->ssl, err, ret);
             pyret = NULL;
             break;
         }
-    } while (len > 0);
+    }
+    connection_end(self, IO_WRITE);
+
+    if (pyret == NULL)
+        set_bytes_sent(sent);
 
+done:
 #if PY_VERSION_HEX >= 0x02060000
     PyBuffer_Release(&pbuf);
 #endif
@@ -527,6 +1534,171 @@ ssl_Connection_sendall(ssl_ConnectionObj *self, PyObject *args)
     return pyret;
 }
 
+static char ssl_Connection_sendfile_doc[] = "\n\
+Send the contents of a file on the connection.  The file is read and\n\
+encrypted in record-sized pieces without holding the GIL, and no strings\n\
+are created for its contents.\n\
+\n\
+:param file: A file object (anything with a fileno() method) or a file\n\
+             descriptor\n\
+:param offset: (optional) The position in the file to start sending from.\n\
+               The file's own position is not used.\n\
+:param count: (optional) The maximum number of bytes to send.  The default,\n\
+              None, sends everything up to the end of the file.\n\
+:return: The number of bytes sent.  This is less than count if the end of\n\
+         the file was reached, or if the transport could not accept more\n\
+         data without blocking; in that case, call sendfile again with\n\
+         offset advanced by the return value to send the rest.\n\
+";
+static PyObject *
+ssl_Connection_sendfile(ssl_ConnectionObj *self, PyObject *args, PyObject *kwargs)
+{
+    PyObject *file, *count_obj = Py_None;
+    PY_LONG_LONG offset = 0, count = -1, sent = 0;
+    int fd, want, nread, ret = 0, err = SSL_ERROR_NONE, read_errno = 0;
+    double timeout;
+    char *chunk;
+    static char *kwlist[] = {"file", "offset", "count", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|LO:sendfile", kwlist,
+                                     &file, &offset, &count_obj))
+        return NULL;
+
+    if (offset < 0)
+    {
+        PyErr_SetString(PyExc_ValueError, "offset must be non-negative");
+        return NULL;
+    }
+
+    if (count_obj != Py_None)
+    {
+        count = PyLong_AsLongLong(count_obj);
+        if (count == -1 && PyErr_Occurred())
+            return NULL;
+        if (count < 0)
+        {
+            PyErr_SetString(PyExc_ValueError, "count must be non-negative");
+            return NULL;
+        }
+    }
+
+    fd = PyObject_AsFileDescriptor(file);
+    if (fd < 0)
+        return NULL;
+
+    chunk = PyMem_Malloc(SSL3_RT_MAX_PLAIN_LENGTH);
+    if (chunk == NULL)
+        return PyErr_NoMemory();
+
+    timeout = connection_timeout(self);
+    connection_begin(self, IO_WRITE);
+    MY_BEGIN_ALLOW_THREADS(self->tstate)
+    while (count < 0 || sent < count)
+    {
+        want = SSL3_RT_MAX_PLAIN_LENGTH;
+        if (count >= 0 && count - sent < want)
+            want = (int)(count - sent);
+
+        nread = read_file_at(fd, chunk, want, offset + sent);
+        if (nread < 0)
+        {
+            read_errno = errno;
+            break;
+        }
+        if (nread == 0)
+            break;
+
+        ret = connection_perform(self, IO_WRITE, chunk, nread, timeout, &err);
+        if (err != SSL_ERROR_NONE)
+            break;
+
+        /*
+         * Anything not accepted is read again from the file on the next
+         * iteration.
+         */
+        sent += ret;
+    }
+    MY_END_ALLOW_THREADS(self->tstate)
+    connection_end(self, IO_WRITE);
+
+    PyMem_Free(chunk);
+
+    if (PyErr_Occurred())
+    {
+        flush_error_queue();
+        set_bytes_sent(sent);
+        return NULL;
+    }
+
+    if (read_errno != 0)
+    {
+        errno = read_errno;
+        PyErr_SetFromErrno(PyExc_IOError);
+        set_bytes_sent(sent);
+        return NULL;
+    }
+
+    if (err == SSL_ERROR_NONE ||
+        (sent > 0 && (err == SSL_ERROR_WANT_READ ||
+                      err == SSL_ERROR_WANT_WRITE)))
+    {
+        return PyLong_FromLongLong(sent);
+    }
+    else
+    {
+        handle_ssl_errors(self->ssl, err, ret);
+        set_bytes_sent(sent);
+        return NULL;
+    }
+}
+
+/*
+ * The implementation of recv and recv_nb.
+ */
+static PyObject *
+connection_recv(ssl_ConnectionObj *self, PyObject *args, char *format, int nb)
+{
+    int bufsiz, ret, err, flags;
+    double timeout;
+    PyObject *buf;
+
+    if (!PyArg_ParseTuple(args, format, &bufsiz, &flags))
+        return NULL;
+
+    buf = PyBytes_FromStringAndSize(NULL, bufsiz);
+    if (buf == NULL)
+        return NULL;
+
+    timeout = nb ? 0.0 : connection_timeout(self);
+    connection_begin(self, IO_READ);
+    MY_BEGIN_ALLOW_THREADS(self->tstate)
+    ret = connection_perform(self, IO_READ, PyBytes_AsString(buf), bufsiz,
+                             timeout, &err);
+    MY_END_ALLOW_THREADS(self->tstate)
+    connection_end(self, IO_READ);
+
+    if (PyErr_Occurred())
+    {
+        Py_DECREF(buf);
+        flush_error_queue();
+        return NULL;
+    }
+
+    if (err == SSL_ERROR_NONE || (nb && err == SSL_ERROR_ZERO_RETURN))
+    {
+        if (err != SSL_ERROR_NONE)
+            ret = 0;
+        if (ret != bufsiz && _PyBytes_Resize(&buf, ret) < 0)
+            return NULL;
+        return buf;
+    }
+    else
+    {
+        Py_DECREF(buf);
+        return connection_failed(self, err, ret, nb);
+    }
+}
+
 static char ssl_Connection_recv_doc[] = "\n\
 Receive data on the connection. NOTE: If you get one of the WantRead,\n\
 WantWrite or WantX509Lookup exceptions on this, you have to call the\n\
@@ -538,43 +1710,119 @@ method again with the SAME buffer.\n\
 :return: The string read from the Connection\n\
 ";
 static PyObject *
-ssl_Connection_recv(ssl_ConnectionObj *self, PyObject *args)
+ssl_Connection_recv(ssl_ConnectionObj *self, PyObject *args)
+{
+    return connection_recv(self, args, "i|i:recv", 0);
+}
+
+static char ssl_Connection_recv_nb_doc[] = "\n\
+Receive data on the connection without raising WantReadError,\n\
+WantWriteError or ZeroReturnError.  This is meant for non-blocking sockets.\n\
+\n\
+:param bufsiz: The maximum number of bytes to read\n\
+:param flags: (optional) Included for compatibility with the socket\n\
+              API, the value is ignored\n\
+:return: The string read from the Connection, an empty string if the\n\
+         connection was closed cleanly, or WANT_READ or WANT_WRITE if the\n\
+         socket has to become readable or writable first\n\
+";
+static PyObject *
+ssl_Connection_recv_nb(ssl_ConnectionObj *self, PyObject *args)
+{
+    return connection_recv(self, args, "i|i:recv_nb", 1);
+}
+
+#if PY_VERSION_HEX >= 0x02060000
+/*
+ * The implementation of recv_into and recv_into_nb.
+ */
+static PyObject *
+connection_recv_into(ssl_ConnectionObj *self, PyObject *args, char *format, int nb)
 {
-    int bufsiz, ret, err, flags;
-    PyObject *buf;
+    int nbytes = 0, ret, err, flags = 0;
+    double timeout;
+    Py_buffer pbuf;
 
-    if (!PyArg_ParseTuple(args, "i|i:recv", &bufsiz, &flags))
+    if (!PyArg_ParseTuple(args, format, &pbuf, &nbytes, &flags))
         return NULL;
 
-    buf = PyBytes_FromStringAndSize(NULL, bufsiz);
-    if (buf == NULL)
+    if (nbytes < 0)
+    {
+        PyBuffer_Release(&pbuf);
+        PyErr_SetString(PyExc_ValueError, "negative buffersize in recv_into");
         return NULL;
+    }
+
+    /*
+     * SSL_read takes an int, so never ask for more than that even if the
+     * buffer is bigger.
+     */
+    if (nbytes == 0 || nbytes > pbuf.len)
+    {
+        nbytes = pbuf.len > INT_MAX ? INT_MAX : (int)pbuf.len;
+    }
 
+    timeout = nb ? 0.0 : connection_timeout(self);
+    connection_begin(self, IO_READ);
     MY_BEGIN_ALLOW_THREADS(self->tstate)
-    ret = SSL_read(self->ssl, PyBytes_AsString(buf), bufsiz);
+    ret = connection_perform(self, IO_READ, pbuf.buf, nbytes, timeout, &err);
     MY_END_ALLOW_THREADS(self->tstate)
+    connection_end(self, IO_READ);
+
+    PyBuffer_Release(&pbuf);
 
     if (PyErr_Occurred())
     {
-        Py_DECREF(buf);
         flush_error_queue();
         return NULL;
     }
 
-    err = SSL_get_error(self->ssl, ret);
     if (err == SSL_ERROR_NONE)
-    {
-        if (ret != bufsiz && _PyBytes_Resize(&buf, ret) < 0)
-            return NULL;
-        return buf;
-    }
-    else
-    {
-        handle_ssl_errors(self->ssl, err, ret);
-        Py_DECREF(buf);
-        return NULL;
-    }
+        return PyLong_FromLong((long)ret);
+    if (nb && err == SSL_ERROR_ZERO_RETURN)
+        return PyLong_FromLong(0);
+    return connection_failed(self, err, ret, nb);
+}
+
+static char ssl_Connection_recv_into_doc[] = "\n\
+Receive data on the connection and store the data into a buffer rather than\n\
+creating a new string.\n\
+\n\
+:param buffer: A writable buffer (for example a bytearray) to read into\n\
+:param nbytes: (optional) The maximum number of bytes to read into the\n\
+               buffer.  If not present or 0, defaults to the size of the\n\
+               buffer.  If larger than the size of the buffer, it is\n\
+               reduced to the size of the buffer.\n\
+:param flags: (optional) Included for compatibility with the socket\n\
+              API, the value is ignored\n\
+:return: The number of bytes read into the buffer\n\
+";
+static PyObject *
+ssl_Connection_recv_into(ssl_ConnectionObj *self, PyObject *args)
+{
+    return connection_recv_into(self, args, "w*|ii:recv_into", 0);
+}
+
+static char ssl_Connection_recv_into_nb_doc[] = "\n\
+Receive data on the connection into a buffer without raising\n\
+WantReadError, WantWriteError or ZeroReturnError.  This is meant for\n\
+non-blocking sockets.\n\
+\n\
+:param buffer: A writable buffer (for example a bytearray) to read into\n\
+:param nbytes: (optional) The maximum number of bytes to read into the\n\
+               buffer, as for recv_into\n\
+:param flags: (optional) Included for compatibility with the socket\n\
+              API, the value is ignored\n\
+:return: The number of bytes read into the buffer, 0 if the connection was\n\
+         closed cleanly, or WANT_READ or WANT_WRITE if the socket has to\n\
+         become readable or writable first\n\
+";
+static PyObject *
+ssl_Connection_recv_into_nb(ssl_ConnectionObj *self, PyObject *args)
+{
+    return connection_recv_into(self, args, "w*|ii:recv_into_nb", 1);
 }
+#endif
 
 static char ssl_Connection_bio_read_doc[] = "\n\
 When using non-socket connections this function reads\n\
@@ -631,6 +1879,227 @@ ssl_Connection_bio_read(ssl_ConnectionObj *self, PyObject *args)
     return buf;
 }
 
+#if PY_VERSION_HEX >= 0x02060000
+static char ssl_Connection_bio_read_into_doc[] = "\n\
+When using non-socket connections this function reads the \"dirty\" data\n\
+that would have traveled away on the network directly into a buffer rather\n\
+than creating a new string.\n\
+\n\
+:param buffer: A writable buffer (for example a bytearray) to read into\n\
+:param nbytes: (optional) The maximum number of bytes to read into the\n\
+               buffer.  If not present or 0, defaults to the size of the\n\
+               buffer.  If larger than the size of the buffer, it is\n\
+               reduced to the size of the buffer.\n\
+:return: The number of bytes read into the buffer\n\
+";
+static PyObject *
+ssl_Connection_bio_read_into(ssl_ConnectionObj *self, PyObject *args)
+{
+    int nbytes = 0, ret;
+    Py_buffer pbuf;
+
+    if (self->from_ssl == NULL)
+    {
+            PyErr_SetString(PyExc_TypeError, "Connection sock was not None");
+            return NULL;
+    }
+
+    if (!PyArg_ParseTuple(args, "w*|i:bio_read_into", &pbuf, &nbytes))
+        return NULL;
+
+    if (nbytes < 0)
+    {
+        PyBuffer_Release(&pbuf);
+        PyErr_SetString(PyExc_ValueError, "negative buffersize in bio_read_into");
+        return NULL;
+    }
+
+    if (nbytes == 0 || nbytes > pbuf.len)
+    {
+        nbytes = pbuf.len > INT_MAX ? INT_MAX : (int)pbuf.len;
+    }
+
+    ret = BIO_read(self->from_ssl, pbuf.buf, nbytes);
+    PyBuffer_Release(&pbuf);
+
+    if (PyErr_Occurred())
+    {
+        flush_error_queue();
+        return NULL;
+    }
+
+    if (ret <= 0) {
+        /*
+         * There was a problem with the BIO_read of some sort.
+         */
+        handle_bio_errors(self->from_ssl, ret);
+        return NULL;
+    }
+
+    return PyLong_FromLong((long)ret);
+}
+#endif
+
+static char ssl_Connection_feed_doc[] = "\n\
+When using non-socket connections this function performs a complete round\n\
+of memory BIO pumping in one call: it puts \"dirty\" data that traveled in\n\
+on the network into the memory BIO, reads all of the application data that\n\
+is then available (advancing the handshake as needed), and collects all of\n\
+the \"dirty\" data waiting to travel away on the network.\n\
+\n\
+:param buf: (optional) The string (or any object supporting the buffer\n\
+            protocol) received from the network.  It may be empty, for\n\
+            example to collect the bytes which start a client handshake.\n\
+:return: A two-tuple of the application data read and the bytes to send\n\
+         to the peer; either may be empty.  ZeroReturnError is only raised\n\
+         once there is no more application data to return; other errors\n\
+         are raised as from recv, with the application data read before\n\
+         the error as their plaintext attribute.  Any bytes to send to the\n\
+         peer (such as an alert) can then still be retrieved with bio_read.\n\
+";
+static PyObject *
+ssl_Connection_feed(ssl_ConnectionObj *self, PyObject *args)
+{
+    char *buf = NULL;
+    int len = 0, ret, err = SSL_ERROR_NONE;
+    Py_ssize_t used = 0, capacity;
+    size_t pending;
+    PyObject *plaintext, *ciphertext, *result;
+#if PY_VERSION_HEX >= 0x02060000
+    Py_buffer pbuf;
+#endif
+
+    if (self->into_ssl == NULL)
+    {
+            PyErr_SetString(PyExc_TypeError, "Connection sock was not None");
+            return NULL;
+    }
+
+#if PY_VERSION_HEX >= 0x02060000
+    pbuf.buf = NULL;
+    pbuf.len = 0;
+    pbuf.obj = NULL;
+    if (!PyArg_ParseTuple(args, "|s*:feed", &pbuf))
+        return NULL;
+
+    if (pbuf.len > INT_MAX)
+    {
+        PyBuffer_Release(&pbuf);
+        PyErr_SetString(PyExc_OverflowError, "buffer too long for feed");
+        return NULL;
+    }
+    buf = pbuf.buf;
+    len = (int)pbuf.len;
+#else
+    if (!PyArg_ParseTuple(args, "|s#:feed", &buf, &len))
+        return NULL;
+#endif
+
+    if (len > 0)
+    {
+        ret = BIO_write(self->into_ssl, buf, len);
+        if (ret <= 0)
+        {
+#if PY_VERSION_HEX >= 0x02060000
+            PyBuffer_Release(&pbuf);
+#endif
+            handle_bio_errors(self->into_ssl, ret);
+            return NULL;
+        }
+    }
+#if PY_VERSION_HEX >= 0x02060000
+    if (pbuf.obj != NULL)
+        PyBuffer_Release(&pbuf);
+#endif
+
+    /*
+     * There can't be more application data than there is ciphertext, plus
+     * whatever was already buffered inside the SSL object, so this is
+     * usually big enough to read everything without growing the string.
+     */
+    capacity = len + SSL_pending(self->ssl);
+    if (capacity < SSL3_RT_MAX_PLAIN_LENGTH)
+        capacity = SSL3_RT_MAX_PLAIN_LENGTH;
+
+    plaintext = PyBytes_FromStringAndSize(NULL, capacity);
+    if (plaintext == NULL)
+        return NULL;
+
+    for (;;)
+    {
+        if (used == capacity)
+        {
+            capacity *= 2;
+            if (_PyBytes_Resize(&plaintext, capacity) < 0)
+                return NULL;
+        }
+
+        MY_BEGIN_ALLOW_THREADS(self->tstate)
+        ret = SSL_read(self->ssl, PyBytes_AsString(plaintext) + used,
+                       capacity - used > INT_MAX ? INT_MAX : (int)(capacity - used));
+        MY_END_ALLOW_THREADS(self->tstate)
+        connection_sync_context(self);
+
+        if (PyErr_Occurred())
+        {
+            flush_error_queue();
+            set_plaintext(plaintext, used);
+            return NULL;
+        }
+
+        err = SSL_get_error(self->ssl, ret);
+        if (err != SSL_ERROR_NONE)
+            break;
+        used += ret;
+    }
+
+    if (err != SSL_ERROR_WANT_READ &&
+        !(err == SSL_ERROR_ZERO_RETURN && used > 0))
+    {
+        /*
+         * Running out of ciphertext is the normal way for this to end.  A
+         * clean shutdown is reported as soon as no application data comes
+         * with it; OpenSSL will keep reporting it on later calls.
+         */
+        handle_ssl_errors(self->ssl, err, ret);
+        set_plaintext(plaintext, used);
+        return NULL;
+    }
+
+    if (used != capacity && _PyBytes_Resize(&plaintext, used) < 0)
+        return NULL;
+
+    pending = BIO_ctrl_pending(self->from_ssl);
+    ciphertext = PyBytes_FromStringAndSize(NULL, pending);
+    if (ciphertext == NULL)
+    {
+        Py_DECREF(plaintext);
+        return NULL;
+    }
+    if (pending > 0)
+    {
+        ret = BIO_read(self->from_ssl, PyBytes_AsString(ciphertext), (int)pending);
+        if (ret <= 0)
+        {
+            Py_DECREF(plaintext);
+            Py_DECREF(ciphertext);
+            handle_bio_errors(self->from_ssl, ret);
+            return NULL;
+        }
+    }
+
+    result = PyTuple_New(2);
+    if (result == NULL)
+    {
+        Py_DECREF(plaintext);
+        Py_DECREF(ciphertext);
+        return NULL;
+    }
+    PyTuple_SET_ITEM(result, 0, plaintext);
+    PyTuple_SET_ITEM(result, 1, ciphertext);
+    return result;
+}
+
 static char ssl_Connection_renegotiate_doc[] = "\n\
 Renegotiate the session\n\
 \n\
@@ -638,15 +2107,17 @@ Renegotiate the session\n\
 ";
 static PyObject *
 ssl_Connection_renegotiate(ssl_ConnectionObj *self, PyObject *args) {
-    int ret;
+    int ret, locked;
 
     if (!PyArg_ParseTuple(args, ":renegotiate")) {
         return NULL;
     }
 
+    locked = connection_lock(self);
     MY_BEGIN_ALLOW_THREADS(self->tstate);
     ret = SSL_renegotiate(self->ssl);
     MY_END_ALLOW_THREADS(self->tstate);
+    connection_unlock(self, locked);
 
     if (PyErr_Occurred()) {
         flush_error_queue();
@@ -656,23 +2127,24 @@ ssl_Connection_renegotiate(ssl_ConnectionObj *self, PyObject *args) {
     return PyLong_FromLong((long)ret);
 }
 
-static char ssl_Connection_do_handshake_doc[] = "\n\
-Perform an SSL handshake (usually called after renegotiate() or one of\n\
-set_*_state()). This can raise the same exceptions as send and recv.\n\
-\n\
-:return: None.\n\
-";
+/*
+ * The implementation of do_handshake and do_handshake_nb.
+ */
 static PyObject *
-ssl_Connection_do_handshake(ssl_ConnectionObj *self, PyObject *args)
+connection_do_handshake(ssl_ConnectionObj *self, PyObject *args, char *format, int nb)
 {
     int ret, err;
+    double timeout;
 
-    if (!PyArg_ParseTuple(args, ":do_handshake"))
+    if (!PyArg_ParseTuple(args, format))
         return NULL;
 
+    timeout = nb ? 0.0 : connection_timeout(self);
+    connection_begin(self, IO_HANDSHAKE);
     MY_BEGIN_ALLOW_THREADS(self->tstate);
-    ret = SSL_do_handshake(self->ssl);
+    ret = connection_perform(self, IO_HANDSHAKE, NULL, 0, timeout, &err);
     MY_END_ALLOW_THREADS(self->tstate);
+    connection_end(self, IO_HANDSHAKE);
 
     if (PyErr_Occurred())
     {
@@ -680,17 +2152,37 @@ ssl_Connection_do_handshake(ssl_ConnectionObj *self, PyObject *args)
         return NULL;
     }
 
-    err = SSL_get_error(self->ssl, ret);
     if (err == SSL_ERROR_NONE)
     {
         Py_INCREF(Py_None);
         return Py_None;
     }
-    else
-    {
-        handle_ssl_errors(self->ssl, err, ret);
-        return NULL;
-    }
+    return connection_failed(self, err, ret, nb);
+}
+
+static char ssl_Connection_do_handshake_doc[] = "\n\
+Perform an SSL handshake (usually called after renegotiate() or one of\n\
+set_*_state()). This can raise the same exceptions as send and recv.\n\
+\n\
+:return: None.\n\
+";
+static PyObject *
+ssl_Connection_do_handshake(ssl_ConnectionObj *self, PyObject *args)
+{
+    return connection_do_handshake(self, args, ":do_handshake", 0);
+}
+
+static char ssl_Connection_do_handshake_nb_doc[] = "\n\
+Perform an SSL handshake without raising WantReadError or WantWriteError.\n\
+This is meant for non-blocking sockets.\n\
+\n\
+:return: None once the handshake is complete, or WANT_READ or WANT_WRITE\n\
+         if the socket has to become readable or writable first\n\
+";
+static PyObject *
+ssl_Connection_do_handshake_nb(ssl_ConnectionObj *self, PyObject *args)
+{
+    return connection_do_handshake(self, args, ":do_handshake_nb", 1);
 }
 
 #if defined(OPENSSL_VERSION_NUMBER) && OPENSSL_VERSION_NUMBER >= 0x00907000L
@@ -703,10 +2195,16 @@ a renegotiation is finished.\n\
 static PyObject *
 ssl_Connection_renegotiate_pending(ssl_ConnectionObj *self, PyObject *args)
 {
+    long result;
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":renegotiate_pending"))
         return NULL;
 
-    return PyLong_FromLong((long)SSL_renegotiate_pending(self->ssl));
+    locked = connection_lock(self);
+    result = SSL_renegotiate_pending(self->ssl);
+    connection_unlock(self, locked);
+    return PyLong_FromLong((long)result);
 }
 #endif
 
@@ -718,10 +2216,16 @@ Find out the total number of renegotiations.\n\
 static PyObject *
 ssl_Connection_total_renegotiations(ssl_ConnectionObj *self, PyObject *args)
 {
+    long result;
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":total_renegotiations"))
         return NULL;
 
-    return PyLong_FromLong(SSL_total_renegotiations(self->ssl));
+    locked = connection_lock(self);
+    result = SSL_total_renegotiations(self->ssl);
+    connection_unlock(self, locked);
+    return PyLong_FromLong(result);
 }
 
 static char ssl_Connection_set_accept_state_doc[] = "\n\
@@ -733,10 +2237,14 @@ automatically by read/write.\n\
 static PyObject *
 ssl_Connection_set_accept_state(ssl_ConnectionObj *self, PyObject *args)
 {
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":set_accept_state"))
         return NULL;
 
+    locked = connection_lock(self);
     SSL_set_accept_state(self->ssl);
+    connection_unlock(self, locked);
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -751,10 +2259,14 @@ automatically by read/write.\n\
 static PyObject *
 ssl_Connection_set_connect_state(ssl_ConnectionObj *self, PyObject *args)
 {
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":set_connect_state"))
         return NULL;
 
+    locked = connection_lock(self);
     SSL_set_connect_state(self->ssl);
+    connection_unlock(self, locked);
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -770,11 +2282,14 @@ static PyObject *
 ssl_Connection_connect(ssl_ConnectionObj *self, PyObject *args)
 {
     PyObject *meth, *ret;
+    int locked;
 
     if ((meth = PyObject_GetAttrString(self->socket, "connect")) == NULL)
         return NULL;
 
+    locked = connection_lock(self);
     SSL_set_connect_state(self->ssl);
+    connection_unlock(self, locked);
 
     ret = PyEval_CallObject(meth, args);
     Py_DECREF(meth);
@@ -795,11 +2310,14 @@ static PyObject *
 ssl_Connection_connect_ex(ssl_ConnectionObj *self, PyObject *args)
 {
     PyObject *meth, *ret;
+    int locked;
 
     if ((meth = PyObject_GetAttrString(self->socket, "connect_ex")) == NULL)
         return NULL;
 
+    locked = connection_lock(self);
     SSL_set_connect_state(self->ssl);
+    connection_unlock(self, locked);
 
     ret = PyEval_CallObject(meth, args);
     Py_DECREF(meth);
@@ -896,7 +2414,8 @@ Send closure alert\n\
 static PyObject *
 ssl_Connection_shutdown(ssl_ConnectionObj *self, PyObject *args)
 {
-    int ret;
+    int ret, err;
+    double timeout;
 #if PY_VERSION_HEX >= 0x020700A1
     int how;
 
@@ -907,9 +2426,12 @@ ssl_Connection_shutdown(ssl_ConnectionObj *self, PyObject *args)
         return NULL;
 #endif
 
+    timeout = connection_timeout(self);
+    connection_begin(self, IO_SHUTDOWN);
     MY_BEGIN_ALLOW_THREADS(self->tstate)
-    ret = SSL_shutdown(self->ssl);
+    ret = connection_perform(self, IO_SHUTDOWN, NULL, 0, timeout, &err);
     MY_END_ALLOW_THREADS(self->tstate)
+    connection_end(self, IO_SHUTDOWN);
 
     if (PyErr_Occurred())
     {
@@ -942,7 +2464,7 @@ Get the session cipher list\n\
 static PyObject *
 ssl_Connection_get_cipher_list(ssl_ConnectionObj *self, PyObject *args)
 {
-    int idx = 0;
+    int idx = 0, locked;
     const char *ret;
     PyObject *lst, *item;
 
@@ -950,6 +2472,7 @@ ssl_Connection_get_cipher_list(ssl_ConnectionObj *self, PyObject *args)
         return NULL;
 
     lst = PyList_New(0);
+    locked = connection_lock(self);
     while ((ret = SSL_get_cipher_list(self->ssl, idx)) != NULL)
     {
         item = PyText_FromString(ret);
@@ -957,6 +2480,7 @@ ssl_Connection_get_cipher_list(ssl_ConnectionObj *self, PyObject *args)
         Py_DECREF(item);
         idx++;
     }
+    connection_unlock(self, locked);
     return lst;
 }
 
@@ -974,18 +2498,21 @@ static PyObject *
 ssl_Connection_get_client_ca_list(ssl_ConnectionObj *self, PyObject *args) {
     STACK_OF(X509_NAME) *CANames;
     PyObject *CAList;
-    int i, n;
+    int i, n, locked;
 
     if (!PyArg_ParseTuple(args, ":get_client_ca_list")) {
         return NULL;
     }
+    locked = connection_lock(self);
     CANames = SSL_get_client_CA_list(self->ssl);
     if (CANames == NULL) {
+        connection_unlock(self, locked);
         return PyList_New(0);
     }
     n = sk_X509_NAME_num(CANames);
     CAList = PyList_New(n);
     if (CAList == NULL) {
+        connection_unlock(self, locked);
         return NULL;
     }
     for (i = 0; i < n; i++) {
@@ -994,22 +2521,26 @@ ssl_Connection_get_client_ca_list(ssl_ConnectionObj *self, PyObject *args) {
 
         CAName = X509_NAME_dup(sk_X509_NAME_value(CANames, i));
         if (CAName == NULL) {
+            connection_unlock(self, locked);
             Py_DECREF(CAList);
             exception_from_error_queue(ssl_Error);
             return NULL;
         }
         CA = (PyObject *)new_x509name(CAName, 1);
         if (CA == NULL) {
+            connection_unlock(self, locked);
             X509_NAME_free(CAName);
             Py_DECREF(CAList);
             return NULL;
         }
         if (PyList_SetItem(CAList, i, CA)) {
+            connection_unlock(self, locked);
             Py_DECREF(CA);
             Py_DECREF(CAList);
             return NULL;
         }
     }
+    connection_unlock(self, locked);
     return CAList;
 }
 
@@ -1071,10 +2602,16 @@ Get shutdown state\n\
 static PyObject *
 ssl_Connection_get_shutdown(ssl_ConnectionObj *self, PyObject *args)
 {
+    int result;
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":get_shutdown"))
         return NULL;
 
-    return PyLong_FromLong((long)SSL_get_shutdown(self->ssl));
+    locked = connection_lock(self);
+    result = SSL_get_shutdown(self->ssl);
+    connection_unlock(self, locked);
+    return PyLong_FromLong((long)result);
 }
 
 static char ssl_Connection_set_shutdown_doc[] = "\n\
@@ -1086,12 +2623,14 @@ Set shutdown state\n\
 static PyObject *
 ssl_Connection_set_shutdown(ssl_ConnectionObj *self, PyObject *args)
 {
-    int shutdown;
+    int shutdown, locked;
 
     if (!PyArg_ParseTuple(args, "i:set_shutdown", &shutdown))
         return NULL;
 
+    locked = connection_lock(self);
     SSL_set_shutdown(self->ssl, shutdown);
+    connection_unlock(self, locked);
     Py_INCREF(Py_None);
     return Py_None;
 }
@@ -1104,10 +2643,16 @@ Get a verbose state description\n\
 static PyObject *
 ssl_Connection_state_string(ssl_ConnectionObj *self, PyObject *args)
 {
+    const char *result;
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":state_string"))
         return NULL;
 
-    return PyText_FromString(SSL_state_string_long(self->ssl));
+    locked = connection_lock(self);
+    result = SSL_state_string_long(self->ssl);
+    connection_unlock(self, locked);
+    return PyText_FromString(result);
 }
 
 static char ssl_Connection_client_random_doc[] = "\n\
@@ -1118,14 +2663,21 @@ Get a copy of the client hello nonce.\n\
 static PyObject *
 ssl_Connection_client_random(ssl_ConnectionObj *self, PyObject *args)
 {
+    PyObject *result;
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":client_random"))
         return NULL;
 
+    locked = connection_lock(self);
     if (self->ssl->session == NULL) {
         Py_INCREF(Py_None);
-        return Py_None;
+        result = Py_None;
+    } else {
+        result = PyBytes_FromStringAndSize( (const char *) self->ssl->s3->client_random, SSL3_RANDOM_SIZE);
     }
-    return PyBytes_FromStringAndSize( (const char *) self->ssl->s3->client_random, SSL3_RANDOM_SIZE);
+    connection_unlock(self, locked);
+    return result;
 }
 
 static char ssl_Connection_server_random_doc[] = "\n\
@@ -1136,14 +2688,21 @@ Get a copy of the server hello nonce.\n\
 static PyObject *
 ssl_Connection_server_random(ssl_ConnectionObj *self, PyObject *args)
 {
+    PyObject *result;
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":server_random"))
         return NULL;
 
+    locked = connection_lock(self);
     if (self->ssl->session == NULL) {
         Py_INCREF(Py_None);
-        return Py_None;
+        result = Py_None;
+    } else {
+        result = PyBytes_FromStringAndSize( (const char *) self->ssl->s3->server_random, SSL3_RANDOM_SIZE);
     }
-    return PyBytes_FromStringAndSize( (const char *) self->ssl->s3->server_random, SSL3_RANDOM_SIZE);
+    connection_unlock(self, locked);
+    return result;
 }
 
 static char ssl_Connection_master_key_doc[] = "\n\
@@ -1154,14 +2713,21 @@ Get a copy of the master key.\n\
 static PyObject *
 ssl_Connection_master_key(ssl_ConnectionObj *self, PyObject *args)
 {
+    PyObject *result;
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":master_key"))
         return NULL;
 
+    locked = connection_lock(self);
     if (self->ssl->session == NULL) {
         Py_INCREF(Py_None);
-        return Py_None;
+        result = Py_None;
+    } else {
+        result = PyBytes_FromStringAndSize( (const char *) self->ssl->session->master_key, self->ssl->session->master_key_length);
     }
-    return PyBytes_FromStringAndSize( (const char *) self->ssl->session->master_key, self->ssl->session->master_key_length);
+    connection_unlock(self, locked);
+    return result;
 }
 
 static char ssl_Connection_sock_shutdown_doc[] = "\n\
@@ -1190,11 +2756,14 @@ static PyObject *
 ssl_Connection_get_peer_certificate(ssl_ConnectionObj *self, PyObject *args)
 {
     X509 *cert;
+    int locked;
 
     if (!PyArg_ParseTuple(args, ":get_peer_certificate"))
         return NULL;
 
+    locked = connection_lock(self);
     cert = SSL_get_peer_certificate(self->ssl);
+    connection_unlock(self, locked);
     if (cert != NULL)
     {
         return (PyObject *)new_x509(cert, 1);
@@ -1218,11 +2787,13 @@ ssl_Connection_get_peer_cert_chain(ssl_ConnectionObj *self, PyObject *args) {
     PyObject *chain;
     crypto_X509Obj *cert;
     Py_ssize_t i;
+    int locked;
 
     if (!PyArg_ParseTuple(args, ":get_peer_cert_chain")) {
         return NULL;
     }
 
+    locked = connection_lock(self);
     sk = SSL_get_peer_cert_chain(self->ssl);
     if (sk != NULL) {
         chain = PyList_New(sk_X509_num(sk));
@@ -1230,14 +2801,17 @@ ssl_Connection_get_peer_cert_chain(ssl_ConnectionObj *self, PyObject *args) {
             cert = new_x509(sk_X509_value(sk, i), 1);
             if (!cert) {
                 /* XXX Untested */
+                connection_unlock(self, locked);
                 Py_DECREF(chain);
                 return NULL;
             }
             CRYPTO_add(&cert->x509->references, 1, CRYPTO_LOCK_X509);
             PyList_SET_ITEM(chain, i, (PyObject *)cert);
         }
+        connection_unlock(self, locked);
         return chain;
     } else {
+        connection_unlock(self, locked);
         Py_INCREF(Py_None);
         return Py_None;
     }
@@ -1253,10 +2827,16 @@ operation.\n\
 static PyObject *
 ssl_Connection_want_read(ssl_ConnectionObj *self, PyObject *args)
 {
+    int result;
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":want_read"))
         return NULL;
 
-    return PyLong_FromLong((long)SSL_want_read(self->ssl));
+    locked = connection_lock(self);
+    result = SSL_want_read(self->ssl);
+    connection_unlock(self, locked);
+    return PyLong_FromLong((long)result);
 }
 
 static char ssl_Connection_want_write_doc[] = "\n\
@@ -1268,10 +2848,16 @@ operation.\n\
 static PyObject *
 ssl_Connection_want_write(ssl_ConnectionObj *self, PyObject *args)
 {
+    int result;
+    int locked;
+
     if (!PyArg_ParseTuple(args, ":want_write"))
         return NULL;
 
-    return PyLong_FromLong((long)SSL_want_write(self->ssl));
+    locked = connection_lock(self);
+    result = SSL_want_write(self->ssl);
+    connection_unlock(self, locked);
+    return PyLong_FromLong((long)result);
 }
 
 static char ssl_Connection_get_session_doc[] = "\n\
@@ -1284,12 +2870,15 @@ static PyObject *
 ssl_Connection_get_session(ssl_ConnectionObj *self, PyObject *args) {
     ssl_SessionObj *session;
     SSL_SESSION *native_session;
+    int locked;
 
     if (!PyArg_ParseTuple(args, ":get_session")) {
         return NULL;
     }
 
+    locked = connection_lock(self);
     native_session = SSL_get1_session(self->ssl);
+    connection_unlock(self, locked);
 
     if (native_session == NULL) {
         Py_INCREF(Py_None);
@@ -1314,12 +2903,16 @@ Set the session to be used when the TLS/SSL connection is established.\n\
 static PyObject *
 ssl_Connection_set_session(ssl_ConnectionObj *self, PyObject *args) {
     ssl_SessionObj *session;
+    int locked, ok;
 
     if (!PyArg_ParseTuple(args, "O!:set_session", &ssl_Session_Type, &session)) {
         return NULL;
     }
 
-    if (SSL_set_session(self->ssl, session->session) == 0) {
+    locked = connection_lock(self);
+    ok = SSL_set_session(self->ssl, session->session);
+    connection_unlock(self, locked);
+    if (ok == 0) {
         /* The only case which leads to this seems to be a mismatch, between
          * this connection and the session, of the SSL method.
          */
@@ -1331,6 +2924,27 @@ ssl_Connection_set_session(ssl_ConnectionObj *self, PyObject *args) {
     return Py_None;
 }
 
+static char ssl_Connection_session_reused_doc[] = "\n\
+Check whether the session of this connection was resumed rather than\n\
+established with a full handshake.\n\
+\n\
+:return: True if the session was resumed, False otherwise\n\
+";
+static PyObject *
+ssl_Connection_session_reused(ssl_ConnectionObj *self, PyObject *args) {
+    long reused;
+    int locked;
+
+    if (!PyArg_ParseTuple(args, ":session_reused")) {
+        return NULL;
+    }
+
+    locked = connection_lock(self);
+    reused = SSL_session_reused(self->ssl);
+    connection_unlock(self, locked);
+    return PyBool_FromLong(reused);
+}
+
 /*
  * Member methods in the Connection object
  * ADD_METHOD(name) expands to a correct PyMethodDef declaration
@@ -1338,27 +2952,51 @@ ssl_Connection_set_session(ssl_ConnectionObj *self, PyObject *args) {
  * for convenience
  * ADD_ALIAS(name,real) creates an "alias" of the ssl_Connection_real
  * function with the name 'name'
+ * ADD_KW_METHOD(name) is like ADD_METHOD but for methods which also accept
+ * keyword arguments
  */
 #define ADD_METHOD(name)        \
     { #name, (PyCFunction)ssl_Connection_##name, METH_VARARGS, ssl_Connection_##name##_doc }
 #define ADD_ALIAS(name,real)    \
     { #name, (PyCFunction)ssl_Connection_##real, METH_VARARGS, ssl_Connection_##real##_doc }
+#define ADD_KW_METHOD(name)     \
+    { #name, (PyCFunction)ssl_Connection_##name, METH_VARARGS | METH_KEYWORDS, ssl_Connection_##name##_doc }
 static PyMethodDef ssl_Connection_methods[] =
 {
     ADD_METHOD(get_context),
     ADD_METHOD(set_context),
     ADD_METHOD(get_servername),
     ADD_METHOD(set_tlsext_host_name),
+#ifdef PYOPENSSL_VERIFY_HOSTNAME
+    ADD_METHOD(set_verify_hostname),
+    ADD_METHOD(set_verify_ip),
+#endif
+    ADD_METHOD(get_verify_result),
     ADD_METHOD(pending),
     ADD_METHOD(send),
     ADD_ALIAS (write, send),
-    ADD_METHOD(sendall),
+    ADD_METHOD(send_nb),
+    ADD_KW_METHOD(sendall),
+    ADD_KW_METHOD(sendfile),
+#if PY_VERSION_HEX >= 0x02060000
+    ADD_METHOD(writev),
+#endif
     ADD_METHOD(recv),
     ADD_ALIAS (read, recv),
+    ADD_METHOD(recv_nb),
+#if PY_VERSION_HEX >= 0x02060000
+    ADD_METHOD(recv_into),
+    ADD_METHOD(recv_into_nb),
+#endif
     ADD_METHOD(bio_read),
+#if PY_VERSION_HEX >= 0x02060000
+    ADD_METHOD(bio_read_into),
+#endif
     ADD_METHOD(bio_write),
+    ADD_METHOD(feed),
     ADD_METHOD(renegotiate),
     ADD_METHOD(do_handshake),
+    ADD_METHOD(do_handshake_nb),
 #if defined(OPENSSL_VERSION_NUMBER) && OPENSSL_VERSION_NUMBER >= 0x00907000L
     ADD_METHOD(renegotiate_pending),
 #endif
@@ -1388,19 +3026,25 @@ static PyMethodDef ssl_Connection_methods[] =
     ADD_METHOD(set_connect_state),
     ADD_METHOD(get_session),
     ADD_METHOD(set_session),
+    ADD_METHOD(session_reused),
     { NULL, NULL }
 };
+#undef ADD_KW_METHOD
 #undef ADD_ALIAS
 #undef ADD_METHOD
 
 static char ssl_Connection_doc[] = "\n\
-Connection(context, socket) -> Connection instance\n\
+Connection(context, socket[, thread_safe]) -> Connection instance\n\
 \n\
 Create a new Connection object, using the given OpenSSL.SSL.Context instance\n\
 and socket.\n\
 \n\
 :param context: An SSL Context to use for this connection\n\
 :param socket: The socket to use for transport layer\n\
+:param thread_safe: (optional) If true, the connection may be used by\n\
+                    several threads at once: one may receive while another\n\
+                    sends.  The socket is made non-blocking during each\n\
+                    operation and waited on according to its timeout.\n\
 ";
 
 /*
@@ -1414,6 +3058,8 @@ ssl_Connection_init(ssl_ConnectionObj *self, ssl_ContextObj *ctx, PyObject *sock
 
     Py_INCREF(ctx);
     self->context = ctx;
+    Py_INCREF(ctx);
+    self->initial_context = ctx;
 
     Py_INCREF(sock);
     self->socket = sock;
@@ -1427,6 +3073,14 @@ ssl_Connection_init(ssl_ConnectionObj *self, ssl_ContextObj *ctx, PyObject *sock
 
     self->tstate = NULL;
 
+    self->read_lock = NULL;
+    self->write_lock = NULL;
+    self->ssl_lock = NULL;
+    self->ssl_owner = 0;
+    self->ssl_ops = 0;
+    self->servername_map = NULL;
+    self->routed_from = NULL;
+
     self->ssl = SSL_new(self->context->ctx);
     SSL_set_app_data(self->ssl, self);
 
@@ -1485,15 +3139,48 @@ ssl_Connection_New(ssl_ContextObj *ctx, PyObject *sock) {
     return self;
 }
 
+/*
+ * Make a Connection thread safe by giving it its locks.
+ *
+ * Arguments: self - The Connection object
+ * Returns:   0 for success, -1 with an exception set otherwise
+ */
+static int
+ssl_Connection_make_thread_safe(ssl_ConnectionObj *self) {
+#ifdef WITH_THREAD
+    if (self->socket == Py_None) {
+        PyErr_SetString(PyExc_ValueError,
+                        "thread safe connections need a socket");
+        return -1;
+    }
+
+    self->read_lock = PyThread_allocate_lock();
+    self->write_lock = PyThread_allocate_lock();
+    self->ssl_lock = PyThread_allocate_lock();
+    if (self->read_lock == NULL || self->write_lock == NULL ||
+        self->ssl_lock == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    return 0;
+#else
+    PyErr_SetString(PyExc_ValueError,
+                    "thread safe connections need thread support");
+    return -1;
+#endif
+}
+
 static PyObject*
 ssl_Connection_new(PyTypeObject *subtype, PyObject *args, PyObject *kwargs) {
     ssl_ConnectionObj *self;
     ssl_ContextObj *ctx;
     PyObject *sock;
-    static char *kwlist[] = {"context", "socket", NULL};
+    int thread_safe = 0;
+    static char *kwlist[] = {"context", "socket", "thread_safe", NULL};
 
-    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O!O:Connection", kwlist,
-                                     &ssl_Context_Type, &ctx, &sock)) {
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O!O|i:Connection", kwlist,
+                                     &ssl_Context_Type, &ctx, &sock,
+                                     &thread_safe)) {
         return NULL;
     }
 
@@ -1502,7 +3189,12 @@ ssl_Connection_new(PyTypeObject *subtype, PyObject *args, PyObject *kwargs) {
         return NULL;
     }
 
-    return (PyObject *)ssl_Connection_init(self, ctx, sock);
+    self = ssl_Connection_init(self, ctx, sock);
+    if (self != NULL && thread_safe && ssl_Connection_make_thread_safe(self) < 0) {
+        Py_DECREF(self);
+        return NULL;
+    }
+    return (PyObject *)self;
 }
 
 /*
@@ -1541,8 +3233,12 @@ ssl_Connection_traverse(ssl_ConnectionObj *self, visitproc visit, void *arg)
 {
     int ret = 0;
 
-    if (ret == 0 && self->context != NULL)
+    if (ret == 0 && self->routed_from != NULL)
+        ret = visit((PyObject *)self->routed_from, arg);
+    else if (ret == 0 && self->context != NULL)
         ret = visit((PyObject *)self->context, arg);
+    if (ret == 0 && self->initial_context != NULL)
+        ret = visit((PyObject *)self->initial_context, arg);
     if (ret == 0 && self->socket != NULL)
         ret = visit(self->socket, arg);
     if (ret == 0 && self->app_data != NULL)
@@ -1559,12 +3255,23 @@ ssl_Connection_traverse(ssl_ConnectionObj *self, visitproc visit, void *arg)
 static int
 ssl_Connection_clear(ssl_ConnectionObj *self)
 {
-    Py_XDECREF(self->context);
+    if (self->routed_from != NULL)
+    {
+        /* self->context is kept alive by the server name map. */
+        Py_DECREF(self->routed_from);
+        self->routed_from = NULL;
+    }
+    else
+        Py_XDECREF(self->context);
     self->context = NULL;
+    Py_XDECREF(self->initial_context);
+    self->initial_context = NULL;
     Py_XDECREF(self->socket);
     self->socket = NULL;
     Py_XDECREF(self->app_data);
     self->app_data = NULL;
+    ssl_ServernameMap_release(self->servername_map);
+    self->servername_map = NULL;
     self->into_ssl = NULL; /* was cleaned up by SSL_free() */
     self->from_ssl = NULL; /* was cleaned up by SSL_free() */
     return 0;
@@ -1583,6 +3290,14 @@ ssl_Connection_dealloc(ssl_ConnectionObj *self)
     if (self->ssl != NULL)
         SSL_free(self->ssl);
     ssl_Connection_clear(self);
+#ifdef WITH_THREAD
+    if (self->read_lock != NULL)
+        PyThread_free_lock(self->read_lock);
+    if (self->write_lock != NULL)
+        PyThread_free_lock(self->write_lock);
+    if (self->ssl_lock != NULL)
+        PyThread_free_lock(self->ssl_lock);
+#endif
     PyObject_GC_Del(self);
 }
 
@@ -1606,7 +3321,7 @@ PyTypeObject ssl_Connection_Type = {
     (getattrofunc)ssl_Connection_getattro, /* getattro */
     NULL, /* setattro */
     NULL, /* as_buffer */
-    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC | Py_TPFLAGS_BASETYPE,
     ssl_Connection_doc, /* doc */
     (traverseproc)ssl_Connection_traverse,
     (inquiry)ssl_Connection_clear,
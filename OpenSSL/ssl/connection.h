@@ -14,6 +14,7 @@
 #define PyOpenSSL_SSL_CONNECTION_H_
 
 #include <Python.h>
+#include <pythread.h>
 #include <openssl/ssl.h>
 
 /* shamelessly stolen from socketmodule.c */
@@ -37,14 +38,27 @@ extern  PyTypeObject      ssl_Connection_Type;
 
 #define ssl_Connection_Check(v) ((v)->ob_type == &ssl_Connection_Type)
 
+/*
+ * What the _nb methods return when the socket has to become readable or
+ * writable.  These are negative so they can not be mistaken for counts.
+ */
+#define ssl_WANT_READ       (-1)
+#define ssl_WANT_WRITE      (-2)
+
 typedef struct {
     PyObject_HEAD
     SSL                 *ssl;
     ssl_ContextObj      *context;
+    ssl_ContextObj      *initial_context; /* the context it was made with, whose session settings OpenSSL keeps using */
     PyObject            *socket;
     PyThreadState       *tstate; /* This field is no longer used. */
     PyObject            *app_data;
     BIO                 *into_ssl, *from_ssl;  /* for connections without file descriptors */
+    PyThread_type_lock  read_lock, write_lock, ssl_lock; /* for thread safe connections */
+    long                ssl_owner; /* the thread holding ssl_lock, or 0 */
+    unsigned long       ssl_ops; /* how many operations were done with ssl_lock held */
+    ssl_ServernameMap   *servername_map; /* the map which switched the connection to another context */
+    ssl_ContextObj      *routed_from; /* the context referred to before that switch, until it is made final */
 } ssl_ConnectionObj;
 
 
@@ -31,9 +31,53 @@
 #  include <wincrypt.h>
 #endif
 
+#include <string.h>
+#include <time.h>
+
 #define SSL_MODULE
 #include "ssl.h"
 
+#include <openssl/hmac.h>
+#include <openssl/rand.h>
+#include <openssl/sha.h>
+
+#ifdef SSL_CTRL_SET_TLSEXT_TICKET_KEY_CB
+#define PYOPENSSL_TICKET_KEYS
+#endif
+
+#ifdef WITH_THREAD
+#define LOCK_TICKET_KEYS(self) PyThread_acquire_lock((self)->ticket_keys_lock, WAIT_LOCK)
+#define UNLOCK_TICKET_KEYS(self) PyThread_release_lock((self)->ticket_keys_lock)
+#define LOCK_VERIFY_CACHE(self) PyThread_acquire_lock((self)->verify_cache_lock, WAIT_LOCK)
+#define UNLOCK_VERIFY_CACHE(self) PyThread_release_lock((self)->verify_cache_lock)
+#define LOCK_SERVERNAME_MAPS() PyThread_acquire_lock(servername_map_lock, WAIT_LOCK)
+#define UNLOCK_SERVERNAME_MAPS() PyThread_release_lock(servername_map_lock)
+
+/*
+ * Protects the reference counts of all server name maps, and the map pointers
+ * of all Contexts.
+ */
+static PyThread_type_lock servername_map_lock = NULL;
+#else
+#define LOCK_TICKET_KEYS(self)
+#define UNLOCK_TICKET_KEYS(self)
+#define LOCK_VERIFY_CACHE(self)
+#define UNLOCK_VERIFY_CACHE(self)
+#define LOCK_SERVERNAME_MAPS()
+#define UNLOCK_SERVERNAME_MAPS()
+#endif
+
+/*
+ * How many verify callback decisions with keys that map to the same place in
+ * the verify cache can be remembered at once.
+ */
+#define VERIFY_CACHE_WAYS 4
+
+/*
+ * The longest secret set_tlsext_ticket_key_rotation accepts.
+ */
+#define TICKET_SECRET_MAX 128
+
 /*
  * CALLBACKS
  *
@@ -148,6 +192,128 @@ global_passphrase_callback(char *buf, int maxlen, int verify, void *arg)
     return len;
 }
 
+/*
+ * Compute the key a verify callback decision is remembered under: a digest of
+ * the digests of the certificates in the chain being verified, along with the
+ * error, the depth and the preverification result.
+ *
+ * Arguments: ok       - The preverification result
+ *            x509_ctx - The verification in progress
+ *            key      - Where to write the key
+ * Returns:   1 for success, 0 otherwise
+ */
+static int
+verify_cache_key(int ok, X509_STORE_CTX *x509_ctx, unsigned char *key) {
+    STACK_OF(X509) *chain;
+    unsigned char digest[EVP_MAX_MD_SIZE];
+    unsigned int length;
+    int values[3], i;
+    SHA256_CTX sha;
+
+    chain = X509_STORE_CTX_get_chain(x509_ctx);
+    if (chain == NULL || sk_X509_num(chain) == 0) {
+        return 0;
+    }
+
+    SHA256_Init(&sha);
+    for (i = 0; i < sk_X509_num(chain); i++) {
+        if (!X509_digest(sk_X509_value(chain, i), EVP_sha256(), digest, &length)) {
+            ERR_clear_error();
+            return 0;
+        }
+        SHA256_Update(&sha, digest, length);
+    }
+    values[0] = ok;
+    values[1] = X509_STORE_CTX_get_error(x509_ctx);
+    values[2] = X509_STORE_CTX_get_error_depth(x509_ctx);
+    SHA256_Update(&sha, values, sizeof(values));
+    SHA256_Final(key, &sha);
+    return 1;
+}
+
+/*
+ * Find the set of entries of a verify cache a key can be stored in.
+ */
+static ssl_VerifyCacheEntry *
+verify_cache_set(ssl_VerifyCache *cache, const unsigned char *key) {
+    unsigned long hash;
+
+    hash = ((unsigned long)key[0] << 24) | ((unsigned long)key[1] << 16) |
+           ((unsigned long)key[2] << 8) | (unsigned long)key[3];
+    return cache->entries + (hash % cache->sets) * VERIFY_CACHE_WAYS;
+}
+
+/*
+ * Look up a remembered verify callback decision.  This does not need the GIL.
+ *
+ * Arguments: context - The Context which may remember the decision
+ *            key     - The key computed by verify_cache_key
+ * Returns:   The decision, or -1 if none is remembered
+ */
+static int
+verify_cache_lookup(ssl_ContextObj *context, const unsigned char *key) {
+    ssl_VerifyCache *cache;
+    ssl_VerifyCacheEntry *set;
+    time_t now = time(NULL);
+    int result = -1, i;
+
+    LOCK_VERIFY_CACHE(context);
+    cache = context->verify_cache;
+    if (cache != NULL) {
+        set = verify_cache_set(cache, key);
+        for (i = 0; i < VERIFY_CACHE_WAYS; i++) {
+            if (set[i].expires > now && memcmp(set[i].key, key, sizeof(set[i].key)) == 0) {
+                result = set[i].ok;
+                break;
+            }
+        }
+        if (result == -1) {
+            cache->misses++;
+        } else {
+            cache->hits++;
+        }
+    }
+    UNLOCK_VERIFY_CACHE(context);
+    return result;
+}
+
+/*
+ * Remember a verify callback decision, in place of the one in its set which
+ * expires first.  This does not need the GIL.
+ *
+ * Arguments: context - The Context to remember the decision
+ *            key     - The key computed by verify_cache_key
+ *            ok      - The decision
+ * Returns:   None
+ */
+static void
+verify_cache_store(ssl_ContextObj *context, const unsigned char *key, int ok) {
+    ssl_VerifyCache *cache;
+    ssl_VerifyCacheEntry *set, *entry;
+    time_t now = time(NULL);
+    int i;
+
+    LOCK_VERIFY_CACHE(context);
+    cache = context->verify_cache;
+    if (cache != NULL) {
+        set = verify_cache_set(cache, key);
+        entry = set;
+        for (i = 0; i < VERIFY_CACHE_WAYS; i++) {
+            if (memcmp(set[i].key, key, sizeof(set[i].key)) == 0) {
+                entry = set + i;
+                break;
+            }
+            if (set[i].expires < entry->expires) {
+                entry = set + i;
+            }
+        }
+        memcpy(entry->key, key, sizeof(entry->key));
+        entry->expires = now + cache->ttl;
+        entry->ok = ok;
+    }
+    UNLOCK_VERIFY_CACHE(context);
+}
+
 /*
  * Globally defined verify callback
  *
@@ -164,12 +330,34 @@ global_verify_callback(int ok, X509_STORE_CTX *x509_ctx)
     SSL *ssl;
     ssl_ConnectionObj *conn;
     crypto_X509Obj *cert;
-    int errnum, errdepth, c_ret;
+    int errnum, errdepth, c_ret, cached = 0;
+    unsigned char key[32];
 
     // Get Connection object to check thread state
     ssl = (SSL *)X509_STORE_CTX_get_app_data(x509_ctx);
     conn = (ssl_ConnectionObj *)SSL_get_app_data(ssl);
 
+    /*
+     * Connections created before the callback was removed still call this.
+     */
+    if (conn->context->verify_callback == Py_None) {
+        return ok;
+    }
+
+    /*
+     * A remembered decision is used without going back into Python at all.
+     */
+    if (conn->context->verify_cache != NULL && verify_cache_key(ok, x509_ctx, key)) {
+        cached = 1;
+        c_ret = verify_cache_lookup(conn->context, key);
+        if (c_ret == 1) {
+            X509_STORE_CTX_set_error(x509_ctx, X509_V_OK);
+            return 1;
+        } else if (c_ret == 0) {
+            return 0;
+        }
+    }
+
     MY_END_ALLOW_THREADS(conn->tstate);
 
     cert = new_x509(X509_STORE_CTX_get_current_cert(x509_ctx), 0);
@@ -182,15 +370,27 @@ global_verify_callback(int ok, X509_STORE_CTX *x509_ctx)
     ret = PyEval_CallObject(conn->context->verify_callback, argv);
     Py_DECREF(argv);
 
-    if (ret != NULL && PyObject_IsTrue(ret)) {
-        X509_STORE_CTX_set_error(x509_ctx, X509_V_OK);
-        Py_DECREF(ret);
-        c_ret = 1;
-    } else {
+    if (ret == NULL) {
+        /*
+         * A callback which raised an exception made no decision to remember.
+         */
+        cached = 0;
         c_ret = 0;
+    } else {
+        if (PyObject_IsTrue(ret)) {
+            X509_STORE_CTX_set_error(x509_ctx, X509_V_OK);
+            c_ret = 1;
+        } else {
+            c_ret = 0;
+        }
+        Py_DECREF(ret);
     }
 
     MY_BEGIN_ALLOW_THREADS(conn->tstate);
+
+    if (cached) {
+        verify_cache_store(conn->context, key, c_ret);
+    }
     return c_ret;
 }
 
@@ -210,6 +410,14 @@ global_info_callback(const SSL *ssl, int where, int _ret)
     ssl_ConnectionObj *conn = (ssl_ConnectionObj *)SSL_get_app_data(ssl);
     PyObject *argv, *ret;
 
+    /*
+     * Events the callback is not interested in are dropped without going near
+     * Python.
+     */
+    if (!(where & conn->context->info_mask)) {
+        return;
+    }
+
     /*
      * GIL isn't held yet.  First things first - acquire it, or any Python API
      * we invoke might segfault or blow up the sun.  The reverse will be done
@@ -237,6 +445,215 @@ global_info_callback(const SSL *ssl, int where, int _ret)
     return;
 }
 
+/*
+ * The longest server name a server name map looks up.
+ */
+#define SERVERNAME_MAX 255
+
+/*
+ * Hash a server name for a server name map (FNV-1a).
+ */
+static unsigned long
+servername_hash(const char *name, Py_ssize_t length) {
+    unsigned long hash = 2166136261UL;
+    Py_ssize_t i;
+
+    for (i = 0; i < length; i++) {
+        hash = ((hash ^ (unsigned char)name[i]) * 16777619UL) & 0xffffffffUL;
+    }
+    return hash;
+}
+
+/*
+ * Copy a server name, lower case and without a trailing dot, the way server
+ * name maps store and look them up.  Only ASCII letters are lowered, whatever
+ * the locale.
+ *
+ * Arguments: name   - The server name
+ *            length - Its length
+ *            buf    - Where to write it, with room for SERVERNAME_MAX bytes
+ * Returns:   The length of the copy, or -1 if the name is empty or too long
+ */
+static Py_ssize_t
+servername_normalize(const char *name, Py_ssize_t length, char *buf) {
+    Py_ssize_t i;
+
+    if (length > 0 && name[length - 1] == '.') {
+        length--;
+    }
+    if (length == 0 || length > SERVERNAME_MAX) {
+        return -1;
+    }
+    for (i = 0; i < length; i++) {
+        buf[i] = (name[i] >= 'A' && name[i] <= 'Z') ? name[i] - 'A' + 'a' : name[i];
+    }
+    return length;
+}
+
+/*
+ * Find the entry of a server name map for a normalized name, or the empty
+ * entry it belongs in.
+ */
+static ssl_ServernameEntry *
+servername_map_entry(ssl_ServernameMap *map, const char *name, Py_ssize_t length,
+                     unsigned long hash) {
+    ssl_ServernameEntry *entry;
+    Py_ssize_t i = hash & map->mask;
+
+    for (;;) {
+        entry = &map->entries[i];
+        if (entry->name == NULL ||
+            (entry->hash == hash && entry->length == length &&
+             memcmp(entry->name, name, length) == 0)) {
+            return entry;
+        }
+        i = (i + 1) & map->mask;
+    }
+}
+
+/*
+ * Find the Context a server name map switches connections asking for a server
+ * name to: the one for the name itself, or else for the wildcard matching its
+ * first label, or else the default.  This does not need the GIL.
+ *
+ * Arguments: map        - The server name map
+ *            servername - The server name, or NULL if the client sent none
+ * Returns:   The Context (borrowed reference), or NULL
+ */
+static ssl_ContextObj *
+servername_map_lookup(ssl_ServernameMap *map, const char *servername) {
+    char name[SERVERNAME_MAX];
+    ssl_ServernameEntry *entry;
+    Py_ssize_t length;
+    char *dot;
+
+    if (servername == NULL) {
+        return (ssl_ContextObj *)map->default_context;
+    }
+    length = servername_normalize(servername, strlen(servername), name);
+    if (length < 0) {
+        return (ssl_ContextObj *)map->default_context;
+    }
+
+    entry = servername_map_entry(map, name, length, servername_hash(name, length));
+    if (entry->name != NULL) {
+        return (ssl_ContextObj *)entry->context;
+    }
+
+    /*
+     * Turn a.example.com into *.example.com in place.
+     */
+    dot = memchr(name, '.', length);
+    if (dot != NULL && dot != name) {
+        dot[-1] = '*';
+        length -= dot - 1 - name;
+        entry = servername_map_entry(map, dot - 1, length, servername_hash(dot - 1, length));
+        if (entry->name != NULL) {
+            return (ssl_ContextObj *)entry->context;
+        }
+    }
+
+    return (ssl_ContextObj *)map->default_context;
+}
+
+/*
+ * Free a server name map.  Call this with the GIL held.
+ */
+static void
+ssl_ServernameMap_free(ssl_ServernameMap *map) {
+    Py_ssize_t i;
+
+    if (map->entries != NULL) {
+        for (i = 0; i <= map->mask; i++) {
+            if (map->entries[i].name != NULL) {
+                PyMem_Free(map->entries[i].name);
+                Py_DECREF(map->entries[i].context);
+            }
+        }
+        PyMem_Free(map->entries);
+    }
+    Py_XDECREF(map->default_context);
+    PyMem_Free(map);
+}
+
+/*
+ * Drop a reference to a server name map.  This does not need the GIL.
+ *
+ * Returns: True if that was the last reference, and the map must be freed
+ *          (with the GIL held)
+ */
+static int
+servername_map_decref(ssl_ServernameMap *map) {
+    int last;
+
+    LOCK_SERVERNAME_MAPS();
+    last = --map->refcount == 0;
+    UNLOCK_SERVERNAME_MAPS();
+    return last;
+}
+
+/*
+ * Drop a reference to a server name map, freeing it if that was the last one.
+ * Call this with the GIL held.
+ */
+void
+ssl_ServernameMap_release(ssl_ServernameMap *map) {
+    if (map != NULL && servername_map_decref(map)) {
+        ssl_ServernameMap_free(map);
+    }
+}
+
+/*
+ * Switch a connection to the Context its Context's server name map has for
+ * the server name it is asked for.  This does not need the GIL, but takes it
+ * if it has to free a map.
+ *
+ * Returns: True if the connection was switched
+ */
+static int
+servername_map_route(ssl_ConnectionObj *conn, const SSL *ssl) {
+    ssl_ServernameMap *map, *old;
+    ssl_ContextObj *target = NULL;
+
+    LOCK_SERVERNAME_MAPS();
+    map = conn->context->servername_map;
+    if (map != NULL) {
+        map->refcount++;
+    }
+    UNLOCK_SERVERNAME_MAPS();
+    if (map == NULL) {
+        return 0;
+    }
+
+    target = servername_map_lookup(map, SSL_get_servername(ssl, TLSEXT_NAMETYPE_host_name));
+    if (target != NULL) {
+        if (target->ctx != SSL_get_SSL_CTX(ssl)) {
+            SSL_set_SSL_CTX((SSL *)ssl, target->ctx);
+        }
+        /*
+         * Refer to the target at once, so that the rest of the handshake uses
+         * its callbacks and settings.  Without the GIL no reference can be
+         * taken to it, so the Connection keeps the map, and with it the
+         * target, alive, and the reference to the Context it referred to
+         * before aside, until connection_sync_context swaps them.
+         */
+        if (conn->routed_from == NULL) {
+            conn->routed_from = conn->context;
+        }
+        conn->context = target;
+        old = conn->servername_map;
+        conn->servername_map = map;
+        map = old;
+    }
+
+    if (map != NULL && servername_map_decref(map)) {
+        MY_END_ALLOW_THREADS(conn->tstate);
+        ssl_ServernameMap_free(map);
+        MY_BEGIN_ALLOW_THREADS(conn->tstate);
+    }
+    return target != NULL;
+}
+
 /*
  * Globally defined TLS extension server name callback.  This is called from
  * OpenSSL internally.  The GIL will not be held when this function is invoked.
@@ -257,6 +674,14 @@ global_tlsext_servername_callback(const SSL *ssl, int *alert, void *arg) {
     PyObject *argv, *ret;
     ssl_ConnectionObj *conn = (ssl_ConnectionObj *)SSL_get_app_data(ssl);
 
+    /*
+     * Names in the server name map are routed without going near Python.
+     */
+    if (servername_map_route(conn, ssl) ||
+        conn->context->tlsext_servername_callback == Py_None) {
+        return result;
+    }
+
     /*
      * GIL isn't held yet.  First things first - acquire it, or any Python API
      * we invoke might segfault or blow up the sun.  The reverse will be done
@@ -276,6 +701,335 @@ global_tlsext_servername_callback(const SSL *ssl, int *alert, void *arg) {
     return result;
 }
 
+#if OPENSSL_VERSION_NUMBER >= 0x10100000L
+#define SESSION_ID_CONST const
+#else
+#define SESSION_ID_CONST
+#endif
+
+/*
+ * Globally defined new session callback.  This is called from OpenSSL
+ * internally when a session is established.  The GIL will not be held when
+ * this function is invoked.  It must not be held when the function returns.
+ *
+ * The session is added to the external session cache of the Context the
+ * connection was made with, whose callback OpenSSL calls even after the
+ * connection has been switched to another one.  A cache which fails must
+ * not fail the handshake, so errors are discarded and the session just goes
+ * uncached.
+ *
+ * Returns 0, since no reference to the session is kept.
+ */
+static int
+global_new_session_callback(SSL *ssl, SSL_SESSION *session) {
+    ssl_ConnectionObj *conn = (ssl_ConnectionObj *)SSL_get_app_data(ssl);
+    PyObject *cache = conn->initial_context->session_cache;
+    PyObject *key, *value;
+    const unsigned char *id;
+    unsigned int id_length;
+    unsigned char *p;
+
+#ifdef PYOPENSSL_SHARED_SESSION_CACHE
+    if (ssl_SharedSessionCache_Check(cache)) {
+        ssl_SharedSessionCache_add((ssl_SharedSessionCacheObj *)cache, session);
+        return 0;
+    }
+#endif
+
+    id = SSL_SESSION_get_id(session, &id_length);
+    if (cache == Py_None || id_length == 0) {
+        return 0;
+    }
+
+    MY_END_ALLOW_THREADS(conn->tstate);
+
+    key = PyBytes_FromStringAndSize((const char *)id, id_length);
+    value = PyBytes_FromStringAndSize(NULL, i2d_SSL_SESSION(session, NULL));
+    if (key != NULL && value != NULL) {
+        p = (unsigned char *)PyBytes_AsString(value);
+        i2d_SSL_SESSION(session, &p);
+        PyObject_SetItem(cache, key, value);
+    }
+    Py_XDECREF(key);
+    Py_XDECREF(value);
+    PyErr_Clear();
+
+    MY_BEGIN_ALLOW_THREADS(conn->tstate);
+    return 0;
+}
+
+/*
+ * Globally defined get session callback.  This is called from OpenSSL
+ * internally when a client asks to resume a session which is not in the
+ * internal session cache.  The GIL will not be held when this function is
+ * invoked.  It must not be held when the function returns.
+ *
+ * Returns a new reference to the session from the Context's external session
+ * cache, or NULL if it is not there.
+ */
+static SSL_SESSION *
+global_get_session_callback(SSL *ssl, SESSION_ID_CONST unsigned char *id,
+                            int id_length, int *copy) {
+    ssl_ConnectionObj *conn = (ssl_ConnectionObj *)SSL_get_app_data(ssl);
+    PyObject *cache = conn->initial_context->session_cache;
+    SSL_SESSION *session = NULL;
+    PyObject *key, *value = NULL;
+    const unsigned char *p;
+
+    *copy = 0;
+
+#ifdef PYOPENSSL_SHARED_SESSION_CACHE
+    if (ssl_SharedSessionCache_Check(cache)) {
+        return ssl_SharedSessionCache_get(
+            (ssl_SharedSessionCacheObj *)cache, id, id_length);
+    }
+#endif
+
+    if (cache == Py_None) {
+        return NULL;
+    }
+
+    MY_END_ALLOW_THREADS(conn->tstate);
+
+    key = PyBytes_FromStringAndSize((const char *)id, id_length);
+    if (key != NULL) {
+        value = PyObject_GetItem(cache, key);
+        Py_DECREF(key);
+    }
+    if (value != NULL && PyBytes_Check(value)) {
+        p = (const unsigned char *)PyBytes_AsString(value);
+        session = d2i_SSL_SESSION(NULL, &p, (long)PyBytes_Size(value));
+        if (session == NULL) {
+            flush_error_queue();
+        }
+    }
+    Py_XDECREF(value);
+    /*
+     * A KeyError is the usual way to miss.
+     */
+    PyErr_Clear();
+
+    MY_BEGIN_ALLOW_THREADS(conn->tstate);
+    return session;
+}
+
+/*
+ * Globally defined remove session callback.  This is called from OpenSSL
+ * internally when a session becomes invalid, for example because it timed
+ * out.  Unlike the other callbacks, this one may be invoked with or without
+ * the GIL held (for example from SSL_CTX_flush_sessions), so it uses the
+ * PyGILState API, and leaves any pending exception alone.
+ */
+static void
+global_remove_session_callback(SSL_CTX *ctx, SSL_SESSION *session) {
+    ssl_ContextObj *context = (ssl_ContextObj *)SSL_CTX_get_app_data(ctx);
+    PyObject *cache = context->session_cache;
+    PyObject *key, *type, *value, *traceback;
+    const unsigned char *id;
+    unsigned int id_length;
+#ifdef WITH_THREAD
+    PyGILState_STATE gil;
+#endif
+
+    id = SSL_SESSION_get_id(session, &id_length);
+    if (cache == NULL || cache == Py_None || id_length == 0) {
+        return;
+    }
+
+#ifdef PYOPENSSL_SHARED_SESSION_CACHE
+    if (ssl_SharedSessionCache_Check(cache)) {
+        ssl_SharedSessionCache_remove(
+            (ssl_SharedSessionCacheObj *)cache, id, id_length);
+        return;
+    }
+#endif
+
+#ifdef WITH_THREAD
+    gil = PyGILState_Ensure();
+#endif
+    PyErr_Fetch(&type, &value, &traceback);
+
+    key = PyBytes_FromStringAndSize((const char *)id, id_length);
+    if (key != NULL) {
+        PyObject_DelItem(cache, key);
+        Py_DECREF(key);
+    }
+    PyErr_Clear();
+
+    PyErr_Restore(type, value, traceback);
+#ifdef WITH_THREAD
+    PyGILState_Release(gil);
+#endif
+}
+
+#ifdef PYOPENSSL_TICKET_KEYS
+/*
+ * Derive the session ticket key for an interval of time from a secret.  The
+ * name of the key starts with the number of the interval, so the key a
+ * ticket was protected with can be found again without trying every one.
+ *
+ * Returns: 1 for success, 0 otherwise
+ */
+static int
+derive_ticket_key(const unsigned char *secret, int secret_length,
+                  unsigned long interval, ssl_TicketKey *key) {
+    unsigned char message[8], digest[EVP_MAX_MD_SIZE];
+    unsigned int length;
+    int i;
+
+    for (i = 7; i >= 0; i--) {
+        message[i] = (unsigned char)(interval & 0xff);
+        interval >>= 8;
+    }
+    if (HMAC(EVP_sha384(), secret, secret_length, message, sizeof(message),
+             digest, &length) == NULL) {
+        return 0;
+    }
+    memcpy(key->name, message, 8);
+    memcpy(key->name + 8, digest, 8);
+    memcpy(key->hmac_key, digest + 8, 16);
+    memcpy(key->aes_key, digest + 24, 16);
+    OPENSSL_cleanse(digest, sizeof(digest));
+    return 1;
+}
+
+/*
+ * Globally defined session ticket key callback.  This is called from OpenSSL
+ * internally when it issues or receives a session ticket.  The GIL will not
+ * be held when this function is invoked, and it does not need it: the keys
+ * are protected by their own lock.
+ *
+ * Arguments: ssl    - The connection
+ *            name   - The name of the key; written when encrypting
+ *            iv     - The IV; written when encrypting
+ *            cipher - To be initialized with the encryption key
+ *            hmac   - To be initialized with the HMAC key
+ *            enc    - True to protect a new ticket, false to open one
+ * Returns:   When encrypting, 1 for success and -1 for failure.  When
+ *            decrypting, 0 if the key is unknown, 1 if the key is current and
+ *            2 if the ticket should be replaced by one using the current key.
+ */
+static int
+global_tlsext_ticket_key_callback(SSL *ssl, unsigned char *name, unsigned char *iv,
+                                  EVP_CIPHER_CTX *cipher, HMAC_CTX *hmac, int enc) {
+    /*
+     * OpenSSL calls the callback of the context the connection was made with
+     * even after a server name callback has switched it to another one, so
+     * the keys are that context's too.
+     */
+    ssl_ContextObj *context = ((ssl_ConnectionObj *)SSL_get_app_data(ssl))->initial_context;
+    unsigned char secret[TICKET_SECRET_MAX];
+    int secret_length = 0, previous = 0, result = 0, i;
+    unsigned long now = 0, wanted = 0;
+    ssl_TicketKeys *keys;
+    ssl_TicketKey key;
+
+    LOCK_TICKET_KEYS(context);
+    keys = context->ticket_keys;
+    if (keys == NULL) {
+        result = 0;
+    } else if (keys->secret != NULL) {
+        secret_length = keys->secret_length;
+        memcpy(secret, keys->secret, secret_length);
+        now = (unsigned long)time(NULL) / keys->interval;
+        previous = keys->previous;
+    } else if (enc) {
+        key = keys->keys[0];
+        result = 1;
+    } else {
+        for (i = 0; i < keys->count; i++) {
+            if (memcmp(keys->keys[i].name, name, sizeof(key.name)) == 0) {
+                key = keys->keys[i];
+                result = i == 0 ? 1 : 2;
+                break;
+            }
+        }
+    }
+    UNLOCK_TICKET_KEYS(context);
+
+    if (secret_length > 0) {
+        if (enc) {
+            wanted = now;
+            result = 1;
+        } else {
+            for (i = 0; i < 8; i++) {
+                wanted = (wanted << 8) | name[i];
+            }
+            /*
+             * Accept the next interval too, in case the host which issued
+             * the ticket has a clock which is a little ahead.
+             */
+            if (wanted == now) {
+                result = 1;
+            } else if (wanted == now + 1 ||
+                       (wanted < now && now - wanted <= (unsigned long)previous)) {
+                result = 2;
+            }
+        }
+        if (result && !derive_ticket_key(secret, secret_length, wanted, &key)) {
+            result = 0;
+        }
+        if (result && !enc && memcmp(key.name, name, sizeof(key.name)) != 0) {
+            result = 0;
+        }
+        OPENSSL_cleanse(secret, sizeof(secret));
+    }
+
+    if (result == 0) {
+        return enc ? -1 : 0;
+    }
+
+    if (enc) {
+        if (RAND_bytes(iv, 16) <= 0) {
+            result = -1;
+        } else {
+            memcpy(name, key.name, sizeof(key.name));
+            if (!EVP_EncryptInit_ex(cipher, EVP_aes_128_cbc(), NULL, key.aes_key, iv)) {
+                result = -1;
+            }
+        }
+    } else if (!EVP_DecryptInit_ex(cipher, EVP_aes_128_cbc(), NULL, key.aes_key, iv)) {
+        result = 0;
+    }
+    if (result > 0) {
+        HMAC_Init_ex(hmac, key.hmac_key, sizeof(key.hmac_key), EVP_sha256(), NULL);
+    }
+    OPENSSL_cleanse(&key, sizeof(key));
+    return result;
+}
+#endif /* PYOPENSSL_TICKET_KEYS */
+
+/*
+ * Free a set of session ticket keys, wiping them first.
+ */
+static void
+ssl_TicketKeys_free(ssl_TicketKeys *keys) {
+    if (keys == NULL) {
+        return;
+    }
+    if (keys->keys != NULL) {
+        OPENSSL_cleanse(keys->keys, keys->count * sizeof(ssl_TicketKey));
+        PyMem_Free(keys->keys);
+    }
+    if (keys->secret != NULL) {
+        OPENSSL_cleanse(keys->secret, keys->secret_length);
+        PyMem_Free(keys->secret);
+    }
+    PyMem_Free(keys);
+}
+
+/*
+ * Free a verify cache.
+ */
+static void
+ssl_VerifyCache_free(ssl_VerifyCache *cache) {
+    if (cache == NULL) {
+        return;
+    }
+    PyMem_Free(cache->entries);
+    PyMem_Free(cache);
+}
+
 /*
  * More recent builds of OpenSSL may have SSLv2 completely disabled.
  */
@@ -327,6 +1081,111 @@ ssl_Context_load_verify_locations(ssl_ContextObj *self, PyObject *args) {
     }
 }
 
+/*
+ * Check whether the last error on OpenSSL's error queue says that a
+ * certificate or CRL added to a store was there already, and if it does, clear
+ * the queue.  Newer versions of OpenSSL do not treat this as an error.
+ *
+ * Arguments: None
+ * Returns:   1 if the error was cleared, 0 otherwise
+ */
+static int
+clear_already_in_store_error(void) {
+    unsigned long err = ERR_peek_last_error();
+
+    if (ERR_GET_LIB(err) == ERR_LIB_X509 &&
+        ERR_GET_REASON(err) == X509_R_CERT_ALREADY_IN_HASH_TABLE) {
+        ERR_clear_error();
+        return 1;
+    }
+    return 0;
+}
+
+/*
+ * Parse the single byte string argument of a method which reads it without
+ * holding the GIL.  Only immutable strings are accepted, so no other thread
+ * can change the buffer meanwhile; the argument tuple keeps it alive.
+ */
+static int
+parse_buffer(PyObject *args, const char *format, char **buffer, int *len) {
+    PyObject *bytes;
+
+    if (!PyArg_ParseTuple(args, format, &bytes)) {
+        return 0;
+    }
+    if (PyBytes_GET_SIZE(bytes) > INT_MAX) {
+        PyErr_SetString(PyExc_ValueError, "buffer is too long");
+        return 0;
+    }
+    *buffer = PyBytes_AS_STRING(bytes);
+    *len = (int)PyBytes_GET_SIZE(bytes);
+    return 1;
+}
+
+static char ssl_Context_load_verify_buffer_doc[] = "\n\
+Let SSL trust the certificates, and use the CRLs, in a buffer, like\n\
+load_verify_locations does for a file.  The buffer is parsed without\n\
+holding the GIL.\n\
+\n\
+:param buffer: The PEM encoded certificates and CRLs\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Context_load_verify_buffer(ssl_ContextObj *self, PyObject *args) {
+    char *buffer;
+    int len, i, count = 0, ok = 1;
+    BIO *bio;
+    STACK_OF(X509_INFO) *infos;
+    X509_INFO *info;
+    X509_STORE *store;
+
+    if (!parse_buffer(args, "S:load_verify_buffer", &buffer, &len)) {
+        return NULL;
+    }
+
+    MY_BEGIN_ALLOW_THREADS(self->tstate);
+    infos = NULL;
+    bio = BIO_new_mem_buf(buffer, len);
+    if (bio != NULL) {
+        infos = PEM_X509_INFO_read_bio(bio, NULL, NULL, NULL);
+        BIO_free(bio);
+    }
+    MY_END_ALLOW_THREADS(self->tstate);
+
+    if (infos == NULL) {
+        exception_from_error_queue(ssl_Error);
+        return NULL;
+    }
+
+    store = SSL_CTX_get_cert_store(self->ctx);
+    for (i = 0; ok && i < sk_X509_INFO_num(infos); i++) {
+        info = sk_X509_INFO_value(infos, i);
+        if (info->x509 != NULL) {
+            ok = X509_STORE_add_cert(store, info->x509) ||
+                clear_already_in_store_error();
+            count++;
+        }
+        if (ok && info->crl != NULL) {
+            ok = X509_STORE_add_crl(store, info->crl) ||
+                clear_already_in_store_error();
+            count++;
+        }
+    }
+    sk_X509_INFO_pop_free(infos, X509_INFO_free);
+
+    if (!ok) {
+        exception_from_error_queue(ssl_Error);
+        return NULL;
+    }
+    if (count == 0) {
+        flush_error_queue();
+        PyErr_SetString(ssl_Error, "no certificates or CRLs found in buffer");
+        return NULL;
+    }
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 static char ssl_Context_set_default_verify_paths_doc[] = "\n\
 Use the platform-specific CA certificate locations\n\
 \n\
@@ -519,6 +1378,116 @@ ssl_Context_use_certificate_chain_file(ssl_ContextObj *self, PyObject *args)
     }
 }
 
+/*
+ * Parse the PEM encoded certificates in a buffer.  The first one may carry
+ * trust settings, like the first one of a certificate chain file.  This does
+ * not need the GIL.
+ *
+ * Arguments: buffer - The PEM data
+ *            len    - The length of the data
+ * Returns:   A stack of at least one certificate, or NULL with the reason on
+ *            OpenSSL's error queue
+ */
+static STACK_OF(X509) *
+pem_read_certificates(char *buffer, int len) {
+    BIO *bio;
+    STACK_OF(X509) *chain;
+    X509 *cert;
+    unsigned long err;
+
+    if ((bio = BIO_new_mem_buf(buffer, len)) == NULL) {
+        return NULL;
+    }
+    if ((chain = sk_X509_new_null()) == NULL) {
+        BIO_free(bio);
+        return NULL;
+    }
+
+    cert = PEM_read_bio_X509_AUX(bio, NULL, NULL, NULL);
+    while (cert != NULL) {
+        if (!sk_X509_push(chain, cert)) {
+            X509_free(cert);
+            goto error;
+        }
+        cert = PEM_read_bio_X509(bio, NULL, NULL, NULL);
+    }
+
+    /*
+     * Running out of certificates is reported as a missing start line;
+     * anything else means the data is broken.
+     */
+    err = ERR_peek_last_error();
+    if (sk_X509_num(chain) == 0 ||
+        ERR_GET_LIB(err) != ERR_LIB_PEM ||
+        ERR_GET_REASON(err) != PEM_R_NO_START_LINE) {
+        goto error;
+    }
+    ERR_clear_error();
+    BIO_free(bio);
+    return chain;
+
+  error:
+    sk_X509_pop_free(chain, X509_free);
+    BIO_free(bio);
+    return NULL;
+}
+
+static char ssl_Context_use_certificate_chain_buffer_doc[] = "\n\
+Load a certificate chain from a buffer, like use_certificate_chain_file\n\
+does from a file.  The buffer is parsed without holding the GIL.\n\
+\n\
+:param buffer: The PEM encoded certificates, the one to use first and the\n\
+               certificates of the CAs which issued it after it\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Context_use_certificate_chain_buffer(ssl_ContextObj *self, PyObject *args)
+{
+    char *buffer;
+    int len, i, ok;
+    STACK_OF(X509) *chain;
+
+    if (!parse_buffer(args, "S:use_certificate_chain_buffer", &buffer, &len))
+        return NULL;
+
+    MY_BEGIN_ALLOW_THREADS(self->tstate);
+    chain = pem_read_certificates(buffer, len);
+    MY_END_ALLOW_THREADS(self->tstate);
+
+    if (chain == NULL)
+    {
+        exception_from_error_queue(ssl_Error);
+        return NULL;
+    }
+
+    ok = SSL_CTX_use_certificate(self->ctx, sk_X509_value(chain, 0));
+#ifdef SSL_CTRL_CLEAR_EXTRA_CHAIN_CERTS
+    if (ok)
+        SSL_CTX_clear_extra_chain_certs(self->ctx);
+#endif
+    for (i = 1; ok && i < sk_X509_num(chain); i++)
+    {
+        ok = SSL_CTX_add_extra_chain_cert(self->ctx, sk_X509_value(chain, i));
+        if (ok)
+        {
+            /* The Context owns it now. */
+            sk_X509_set(chain, i, NULL);
+        }
+    }
+    sk_X509_pop_free(chain, X509_free);
+
+    if (!ok)
+    {
+        exception_from_error_queue(ssl_Error);
+        return NULL;
+    }
+    else
+    {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+}
+
 
 static char ssl_Context_use_certificate_file_doc[] = "\n\
 Load a certificate from a file\n\
@@ -750,12 +1719,73 @@ ssl_Context_get_session_cache_mode(ssl_ContextObj *self, PyObject *args) {
     return PyLong_FromLong(result);
 }
 
+static char ssl_Context_set_session_cache_doc[] = "\n\
+Keep sessions in an external session cache as well as in OpenSSL's\n\
+internal one, so that other Contexts using the same cache (for example in\n\
+other processes) can resume them.  Those Contexts must use the same session\n\
+id context (see :py:meth:`set_session_id`).\n\
+\n\
+:param cache: A mapping from session ids to serialized sessions (see\n\
+    :py:meth:`Session.to_bytes`) such as a :py:class:`SharedSessionCache`,\n\
+    or None to stop using an external cache.\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Context_set_session_cache(ssl_ContextObj *self, PyObject *args) {
+    PyObject *cache;
+    PyObject *old;
+
+    if (!PyArg_ParseTuple(args, "O:set_session_cache", &cache)) {
+        return NULL;
+    }
+
+    if (cache != Py_None && !PyMapping_Check(cache)) {
+        PyErr_SetString(PyExc_TypeError, "cache must be a mapping or None");
+        return NULL;
+    }
+
+    Py_INCREF(cache);
+    old = self->session_cache;
+    self->session_cache = cache;
+    Py_DECREF(old);
+
+    if (cache == Py_None) {
+        SSL_CTX_sess_set_new_cb(self->ctx, NULL);
+        SSL_CTX_sess_set_get_cb(self->ctx, NULL);
+        SSL_CTX_sess_set_remove_cb(self->ctx, NULL);
+    } else {
+        SSL_CTX_sess_set_new_cb(self->ctx, global_new_session_callback);
+        SSL_CTX_sess_set_get_cb(self->ctx, global_get_session_callback);
+        SSL_CTX_sess_set_remove_cb(self->ctx, global_remove_session_callback);
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static char ssl_Context_get_session_cache_doc[] = "\n\
+Get the external session cache.\n\
+\n\
+:return: The cache given to :py:meth:`set_session_cache`, or None.\n\
+";
+static PyObject *
+ssl_Context_get_session_cache(ssl_ContextObj *self, PyObject *args) {
+    if (!PyArg_ParseTuple(args, ":get_session_cache")) {
+        return NULL;
+    }
+
+    Py_INCREF(self->session_cache);
+    return self->session_cache;
+}
+
 static char ssl_Context_set_verify_doc[] = "\n\
 Set the verify mode and verify callback\n\
 \n\
 :param mode: The verify mode, this is either VERIFY_NONE or\n\
              VERIFY_PEER combined with possible other flags\n\
-:param callback: The Python callback to use\n\
+:param callback: (optional) The Python callback to use, or None (the\n\
+                 default) to go by OpenSSL's own verification alone,\n\
+                 without calling into Python\n\
 :return: None\n\
 \n\
 See SSL_CTX_set_verify(3SSL) for further details.\n\
@@ -764,12 +1794,12 @@ static PyObject *
 ssl_Context_set_verify(ssl_ContextObj *self, PyObject *args)
 {
     int mode;
-    PyObject *callback = NULL;
+    PyObject *callback = Py_None;
 
-    if (!PyArg_ParseTuple(args, "iO:set_verify", &mode, &callback))
+    if (!PyArg_ParseTuple(args, "i|O:set_verify", &mode, &callback))
         return NULL;
 
-    if (!PyCallable_Check(callback))
+    if (callback != Py_None && !PyCallable_Check(callback))
     {
         PyErr_SetString(PyExc_TypeError, "expected PyCallable");
         return NULL;
@@ -778,12 +1808,130 @@ ssl_Context_set_verify(ssl_ContextObj *self, PyObject *args)
     Py_DECREF(self->verify_callback);
     Py_INCREF(callback);
     self->verify_callback = callback;
-    SSL_CTX_set_verify(self->ctx, mode, global_verify_callback);
+    SSL_CTX_set_verify(self->ctx, mode,
+                       callback == Py_None ? NULL : global_verify_callback);
+
+    /*
+     * The decisions of the old callback are no good for the new one.
+     */
+    LOCK_VERIFY_CACHE(self);
+    if (self->verify_cache != NULL) {
+        memset(self->verify_cache->entries, 0,
+               (size_t)self->verify_cache->sets * VERIFY_CACHE_WAYS *
+               sizeof(ssl_VerifyCacheEntry));
+    }
+    UNLOCK_VERIFY_CACHE(self);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static char ssl_Context_set_verify_cache_doc[] = "\n\
+Remember the decisions of the verify callback, so that when a peer presents\n\
+a certificate chain it has been called for recently, it is not called\n\
+again.  Decisions are remembered for each chain (identified by the digests\n\
+of its certificates) together with the error number, error depth and\n\
+preverification result the callback is given, so the callback must not\n\
+depend on anything else, such as the Connection.  Changing the callback\n\
+with :py:meth:`set_verify` forgets all decisions.\n\
+\n\
+:param size: About how many decisions to remember at most (each\n\
+    certificate of a chain needs at least one), or 0 to stop remembering\n\
+    them.  Setting the size forgets all decisions.\n\
+:param ttl: (optional) For how many seconds a decision is remembered.\n\
+    The default is 300.\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Context_set_verify_cache(ssl_ContextObj *self, PyObject *args) {
+    ssl_VerifyCache *cache = NULL, *old;
+    int size;
+    long ttl = 300;
+
+    if (!PyArg_ParseTuple(args, "i|l:set_verify_cache", &size, &ttl)) {
+        return NULL;
+    }
+
+    if (size < 0) {
+        PyErr_SetString(PyExc_ValueError, "size must not be negative");
+        return NULL;
+    }
+    if (ttl < 1) {
+        PyErr_SetString(PyExc_ValueError, "ttl must be positive");
+        return NULL;
+    }
+
+    if (size > 0) {
+        cache = PyMem_Malloc(sizeof(ssl_VerifyCache));
+        if (cache == NULL) {
+            return PyErr_NoMemory();
+        }
+        cache->sets = size / VERIFY_CACHE_WAYS + (size % VERIFY_CACHE_WAYS != 0);
+        cache->ttl = ttl;
+        cache->hits = cache->misses = 0;
+        cache->entries = PyMem_New(ssl_VerifyCacheEntry,
+                                   (size_t)cache->sets * VERIFY_CACHE_WAYS);
+        if (cache->entries == NULL) {
+            PyMem_Free(cache);
+            return PyErr_NoMemory();
+        }
+        memset(cache->entries, 0,
+               (size_t)cache->sets * VERIFY_CACHE_WAYS * sizeof(ssl_VerifyCacheEntry));
+    }
+
+    LOCK_VERIFY_CACHE(self);
+    old = self->verify_cache;
+    self->verify_cache = cache;
+    UNLOCK_VERIFY_CACHE(self);
+
+    ssl_VerifyCache_free(old);
 
     Py_INCREF(Py_None);
     return Py_None;
 }
 
+static char ssl_Context_get_verify_cache_stats_doc[] = "\n\
+Get statistics about the decisions of the verify callback remembered since\n\
+:py:meth:`set_verify_cache` was last called.\n\
+\n\
+:return: A dict with the keys size (how many decisions can be remembered),\n\
+    entries (how many are remembered and have not expired yet), hits (how\n\
+    often the callback was not called because of one) and misses (how often\n\
+    the callback had to be called), or None if no decisions are remembered.\n\
+";
+static PyObject *
+ssl_Context_get_verify_cache_stats(ssl_ContextObj *self, PyObject *args) {
+    ssl_VerifyCache *cache;
+    unsigned long hits = 0, misses = 0;
+    long size = 0, entries = 0, i;
+    time_t now = time(NULL);
+
+    if (!PyArg_ParseTuple(args, ":get_verify_cache_stats")) {
+        return NULL;
+    }
+
+    LOCK_VERIFY_CACHE(self);
+    cache = self->verify_cache;
+    if (cache != NULL) {
+        size = (long)cache->sets * VERIFY_CACHE_WAYS;
+        for (i = 0; i < size; i++) {
+            if (cache->entries[i].expires > now) {
+                entries++;
+            }
+        }
+        hits = cache->hits;
+        misses = cache->misses;
+    }
+    UNLOCK_VERIFY_CACHE(self);
+
+    if (cache == NULL) {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    return Py_BuildValue("{s:l,s:l,s:k,s:k}", "size", size, "entries", entries,
+                         "hits", hits, "misses", misses);
+}
+
 static char ssl_Context_set_verify_depth_doc[] = "\n\
 Set the verify depth\n\
 \n\
@@ -833,36 +1981,79 @@ ssl_Context_get_verify_depth(ssl_ContextObj *self, PyObject *args)
     if (!PyArg_ParseTuple(args, ":get_verify_depth"))
         return NULL;
 
-    depth = SSL_CTX_get_verify_depth(self->ctx);
-    return PyLong_FromLong((long)depth);
+    depth = SSL_CTX_get_verify_depth(self->ctx);
+    return PyLong_FromLong((long)depth);
+}
+
+static char ssl_Context_load_tmp_dh_doc[] = "\n\
+Load parameters for Ephemeral Diffie-Hellman\n\
+\n\
+:param dhfile: The file to load EDH parameters from\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Context_load_tmp_dh(ssl_ContextObj *self, PyObject *args)
+{
+    char *dhfile;
+    BIO *bio;
+    DH *dh;
+
+    if (!PyArg_ParseTuple(args, "s:load_tmp_dh", &dhfile))
+        return NULL;
+
+    bio = BIO_new_file(dhfile, "r");
+    if (bio == NULL) {
+        exception_from_error_queue(ssl_Error);
+        return NULL;
+    }
+
+    dh = PEM_read_bio_DHparams(bio, NULL, NULL, NULL);
+    SSL_CTX_set_tmp_dh(self->ctx, dh);
+    DH_free(dh);
+    BIO_free(bio);
+
+    Py_INCREF(Py_None);
+    return Py_None;
 }
 
-static char ssl_Context_load_tmp_dh_doc[] = "\n\
-Load parameters for Ephemeral Diffie-Hellman\n\
+static char ssl_Context_load_tmp_dh_buffer_doc[] = "\n\
+Load parameters for Ephemeral Diffie-Hellman from a buffer.  The buffer is\n\
+parsed without holding the GIL.\n\
 \n\
-:param dhfile: The file to load EDH parameters from\n\
+:param buffer: The PEM encoded EDH parameters\n\
 :return: None\n\
 ";
 static PyObject *
-ssl_Context_load_tmp_dh(ssl_ContextObj *self, PyObject *args)
+ssl_Context_load_tmp_dh_buffer(ssl_ContextObj *self, PyObject *args)
 {
-    char *dhfile;
+    char *buffer;
+    int len, ok;
     BIO *bio;
     DH *dh;
 
-    if (!PyArg_ParseTuple(args, "s:load_tmp_dh", &dhfile))
+    if (!parse_buffer(args, "S:load_tmp_dh_buffer", &buffer, &len))
         return NULL;
 
-    bio = BIO_new_file(dhfile, "r");
-    if (bio == NULL) {
+    MY_BEGIN_ALLOW_THREADS(self->tstate);
+    dh = NULL;
+    bio = BIO_new_mem_buf(buffer, len);
+    if (bio != NULL) {
+        dh = PEM_read_bio_DHparams(bio, NULL, NULL, NULL);
+        BIO_free(bio);
+    }
+    MY_END_ALLOW_THREADS(self->tstate);
+
+    if (dh == NULL) {
         exception_from_error_queue(ssl_Error);
         return NULL;
     }
 
-    dh = PEM_read_bio_DHparams(bio, NULL, NULL, NULL);
-    SSL_CTX_set_tmp_dh(self->ctx, dh);
+    ok = SSL_CTX_set_tmp_dh(self->ctx, dh);
     DH_free(dh);
-    BIO_free(bio);
+    if (!ok) {
+        exception_from_error_queue(ssl_Error);
+        return NULL;
+    }
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -1034,18 +2225,156 @@ ssl_Context_get_timeout(ssl_ContextObj *self, PyObject *args)
     return PyLong_FromLong(ret);
 }
 
+static char ssl_Context_set_session_cache_size_doc[] = "\n\
+Set the most sessions the internal session cache of this Context holds.\n\
+When it is full, sessions which have expired are removed to make room,\n\
+and if there are none new sessions are not added.\n\
+\n\
+:param size: The number of sessions, or 0 for no limit\n\
+:return: The previous size\n\
+";
+static PyObject *
+ssl_Context_set_session_cache_size(ssl_ContextObj *self, PyObject *args)
+{
+    long size, ret;
+
+    if (!PyArg_ParseTuple(args, "l:set_session_cache_size", &size))
+        return NULL;
+
+    if (size < 0) {
+        PyErr_SetString(PyExc_ValueError, "size must not be negative");
+        return NULL;
+    }
+
+    ret = SSL_CTX_sess_set_cache_size(self->ctx, size);
+    return PyLong_FromLong(ret);
+}
+
+static char ssl_Context_get_session_cache_size_doc[] = "\n\
+Get the most sessions the internal session cache of this Context holds\n\
+\n\
+:return: The number of sessions, or 0 for no limit\n\
+";
+static PyObject *
+ssl_Context_get_session_cache_size(ssl_ContextObj *self, PyObject *args)
+{
+    long ret;
+
+    if (!PyArg_ParseTuple(args, ":get_session_cache_size"))
+        return NULL;
+
+    ret = SSL_CTX_sess_get_cache_size(self->ctx);
+    return PyLong_FromLong(ret);
+}
+
+static char ssl_Context_get_session_cache_stats_doc[] = "\n\
+Get the statistics OpenSSL keeps about the sessions of this Context.\n\
+\n\
+:return: A dict of these counters:\n\
+    number - sessions in the internal session cache\n\
+    connect, connect_good, connect_renegotiate - handshakes started,\n\
+        handshakes completed and renegotiations started in client mode\n\
+    accept, accept_good, accept_renegotiate - the same, in server mode\n\
+    hits - sessions resumed in server mode\n\
+    cb_hits - sessions found in the session cache set with\n\
+        set_session_cache\n\
+    misses - sessions asked for by clients but not found\n\
+    timeouts - sessions asked for by clients but expired\n\
+    cache_full - sessions removed because the cache was full\n\
+";
+static PyObject *
+ssl_Context_get_session_cache_stats(ssl_ContextObj *self, PyObject *args)
+{
+    struct {
+        const char *name;
+        long value;
+    } counters[12];
+    PyObject *stats, *value;
+    int i;
+
+    if (!PyArg_ParseTuple(args, ":get_session_cache_stats"))
+        return NULL;
+
+#define COUNTER(index, name_) \
+    counters[index].name = #name_; \
+    counters[index].value = SSL_CTX_sess_##name_(self->ctx)
+    COUNTER(0, number);
+    COUNTER(1, connect);
+    COUNTER(2, connect_good);
+    COUNTER(3, connect_renegotiate);
+    COUNTER(4, accept);
+    COUNTER(5, accept_good);
+    COUNTER(6, accept_renegotiate);
+    COUNTER(7, hits);
+    COUNTER(8, cb_hits);
+    COUNTER(9, misses);
+    COUNTER(10, timeouts);
+    COUNTER(11, cache_full);
+#undef COUNTER
+
+    stats = PyDict_New();
+    if (stats == NULL) {
+        return NULL;
+    }
+    for (i = 0; i < 12; i++) {
+        value = PyLong_FromLong(counters[i].value);
+        if (value == NULL ||
+            PyDict_SetItemString(stats, counters[i].name, value) < 0) {
+            Py_XDECREF(value);
+            Py_DECREF(stats);
+            return NULL;
+        }
+        Py_DECREF(value);
+    }
+    return stats;
+}
+
+static char ssl_Context_flush_sessions_doc[] = "\n\
+Remove the sessions which have expired from the internal session cache of\n\
+this Context, and from the session cache set with set_session_cache, if\n\
+any.\n\
+\n\
+:param now: (optional) The time, in seconds since the epoch, to check\n\
+    expiry against.  The default is the current time.\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Context_flush_sessions(ssl_ContextObj *self, PyObject *args)
+{
+    long now = -1;
+
+    if (!PyArg_ParseTuple(args, "|l:flush_sessions", &now))
+        return NULL;
+
+    if (now == -1) {
+        now = (long)time(NULL);
+    }
+
+    MY_BEGIN_ALLOW_THREADS(self->tstate);
+    SSL_CTX_flush_sessions(self->ctx, now);
+    MY_END_ALLOW_THREADS(self->tstate);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 static char ssl_Context_set_info_callback_doc[] = "\n\
 Set the info callback\n\
 \n\
 :param callback: The Python callback to use\n\
+:param where_mask: (optional) A bitmask of SSL_CB_* constants.  The callback\n\
+                   is only called for events which have at least one of\n\
+                   these bits set; the others are dropped without calling\n\
+                   into Python.  By default it is called for all events.\n\
 :return: None\n\
 ";
 static PyObject *
 ssl_Context_set_info_callback(ssl_ContextObj *self, PyObject *args)
 {
     PyObject *callback;
+    int where_mask = -1;
 
-    if (!PyArg_ParseTuple(args, "O:set_info_callback", &callback))
+    if (!PyArg_ParseTuple(args, "O|i:set_info_callback", &callback, &where_mask))
         return NULL;
 
     if (!PyCallable_Check(callback))
@@ -1057,6 +2386,7 @@ ssl_Context_set_info_callback(ssl_ContextObj *self, PyObject *args)
     Py_DECREF(self->info_callback);
     Py_INCREF(callback);
     self->info_callback = callback;
+    self->info_mask = where_mask;
     SSL_CTX_set_info_callback(self->ctx, global_info_callback);
 
     Py_INCREF(Py_None);
@@ -1100,8 +2430,25 @@ ssl_Context_set_app_data(ssl_ContextObj *self, PyObject *args)
     return Py_None;
 }
 
+/*
+ * Take a reference to a certificate store, to be given up with
+ * X509_STORE_free.
+ *
+ * Arguments: store - The store
+ * Returns:   None
+ */
+static void
+x509_store_up_ref(X509_STORE *store) {
+#if OPENSSL_VERSION_NUMBER >= 0x10100000L
+    X509_STORE_up_ref(store);
+#else
+    CRYPTO_add(&store->references, 1, CRYPTO_LOCK_X509_STORE);
+#endif
+}
+
 static char ssl_Context_get_cert_store_doc[] = "\n\
-Get the certificate store for the context\n\
+Get the certificate store for the context.  The store stays valid after\n\
+the context is gone.\n\
 \n\
 :return: A X509Store object\n\
 ";
@@ -1109,6 +2456,7 @@ static PyObject *
 ssl_Context_get_cert_store(ssl_ContextObj *self, PyObject *args)
 {
     X509_STORE *store;
+    crypto_X509StoreObj *obj;
 
     if (!PyArg_ParseTuple(args, ":get_cert_store"))
         return NULL;
@@ -1118,10 +2466,58 @@ ssl_Context_get_cert_store(ssl_ContextObj *self, PyObject *args)
         Py_INCREF(Py_None);
         return Py_None;
     }
-    else
-    {
-        return (PyObject *)new_x509store(store, 0);
+
+    x509_store_up_ref(store);
+    if ((obj = new_x509store(store, 1)) == NULL)
+        X509_STORE_free(store);
+    return (PyObject *)obj;
+}
+
+static char ssl_Context_set_cert_store_doc[] = "\n\
+Use a certificate store to verify peers with, instead of the context's own\n\
+one.  The store is shared, not copied: one store can be used by many\n\
+contexts, certificates added to it later are trusted by all of them, and it\n\
+is freed when the last of them and the X509Store objects for it are.\n\
+\n\
+:param store: The X509Store object\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Context_set_cert_store(ssl_ContextObj *self, PyObject *args)
+{
+    static PyTypeObject *X509StoreType;
+    crypto_X509StoreObj *store;
+
+    if (X509StoreType == NULL) {
+        X509StoreType = import_crypto_type("X509Store", sizeof(crypto_X509StoreObj));
+        if (X509StoreType == NULL) {
+            return NULL;
+        }
+    }
+    if (!PyArg_ParseTuple(args, "O!:set_cert_store", X509StoreType, &store)) {
+        return NULL;
+    }
+
+    /*
+     * SSL_CTX_set_cert_store takes over a reference and gives up the one to
+     * the old store, which may be the same one.
+     */
+    x509_store_up_ref(store->x509_store);
+    SSL_CTX_set_cert_store(self->ctx, store->x509_store);
+
+    /*
+     * The remembered verify callback decisions were made with the old store.
+     */
+    LOCK_VERIFY_CACHE(self);
+    if (self->verify_cache != NULL) {
+        memset(self->verify_cache->entries, 0,
+               (size_t)self->verify_cache->sets * VERIFY_CACHE_WAYS *
+               sizeof(ssl_VerifyCacheEntry));
     }
+    UNLOCK_VERIFY_CACHE(self);
+
+    Py_INCREF(Py_None);
+    return Py_None;
 }
 
 static char ssl_Context_set_options_doc[] = "\n\
@@ -1186,6 +2582,340 @@ ssl_Context_set_tlsext_servername_callback(ssl_ContextObj *self, PyObject *args)
     return Py_None;
 }
 
+/*
+ * Start using a new server name map (or none), and drop the old one.
+ */
+static void
+ssl_Context_swap_servername_map(ssl_ContextObj *self, ssl_ServernameMap *map) {
+    ssl_ServernameMap *old;
+
+    LOCK_SERVERNAME_MAPS();
+    old = self->servername_map;
+    self->servername_map = map;
+    UNLOCK_SERVERNAME_MAPS();
+
+    ssl_ServernameMap_release(old);
+}
+
+static char ssl_Context_set_servername_map_doc[] = "\n\
+Switch connections to other Contexts according to the server name clients\n\
+ask for, without calling into Python.  The callback given to\n\
+set_tlsext_servername_callback is only called for names which are not in\n\
+the map, when there is no default.\n\
+\n\
+:param mapping: A mapping from server names (byte strings) to Contexts, or\n\
+    None to stop switching.  Names are matched ignoring case and a trailing\n\
+    dot.  A name starting with \"*.\" matches any one label in its place.\n\
+:param default: (optional) The Context for names which are not in the\n\
+    mapping, and clients which send none, or None to leave them alone.\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Context_set_servername_map(ssl_ContextObj *self, PyObject *args, PyObject *keywds) {
+    static char *kwlist[] = {"mapping", "default", NULL};
+    PyObject *mapping, *dflt = Py_None, *items, *item, *key, *value;
+    ssl_ServernameMap *map;
+    ssl_ServernameEntry *entry;
+    Py_ssize_t i, count, size, length;
+    char name[SERVERNAME_MAX];
+    unsigned long hash;
+
+    if (!PyArg_ParseTupleAndKeywords(args, keywds, "O|O:set_servername_map",
+                                     kwlist, &mapping, &dflt)) {
+        return NULL;
+    }
+
+    if (dflt != Py_None && !ssl_Context_Check(dflt)) {
+        PyErr_SetString(PyExc_TypeError, "default must be a Context or None");
+        return NULL;
+    }
+
+    if (mapping == Py_None) {
+        if (dflt != Py_None) {
+            PyErr_SetString(PyExc_ValueError, "a default needs a mapping");
+            return NULL;
+        }
+        ssl_Context_swap_servername_map(self, NULL);
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+
+    if (!PyDict_Check(mapping) &&
+        !(PyMapping_Check(mapping) && PyObject_HasAttrString(mapping, "items"))) {
+        PyErr_SetString(PyExc_TypeError, "mapping must be a mapping or None");
+        return NULL;
+    }
+
+    items = PyMapping_Items(mapping);
+    if (items == NULL) {
+        return NULL;
+    }
+    if (!PyList_Check(items)) {
+        /* A mapping's items() need not return a list. */
+        item = PySequence_List(items);
+        Py_DECREF(items);
+        if ((items = item) == NULL) {
+            return NULL;
+        }
+    }
+    count = PyList_GET_SIZE(items);
+
+    /*
+     * Keep the table at most half full, so probes stay short.
+     */
+    size = 8;
+    while (size < count * 2) {
+        size *= 2;
+    }
+
+    map = PyMem_Malloc(sizeof(ssl_ServernameMap));
+    if (map == NULL) {
+        Py_DECREF(items);
+        return PyErr_NoMemory();
+    }
+    map->refcount = 1;
+    map->mask = size - 1;
+    map->default_context = NULL;
+    map->entries = PyMem_New(ssl_ServernameEntry, size);
+    if (map->entries == NULL) {
+        PyMem_Free(map);
+        Py_DECREF(items);
+        return PyErr_NoMemory();
+    }
+    memset(map->entries, 0, size * sizeof(ssl_ServernameEntry));
+
+    for (i = 0; i < count; i++) {
+        item = PyList_GET_ITEM(items, i);
+        if (!PyTuple_Check(item) || PyTuple_GET_SIZE(item) != 2) {
+            PyErr_SetString(PyExc_TypeError, "mapping items must be pairs");
+            goto error;
+        }
+        key = PyTuple_GET_ITEM(item, 0);
+        value = PyTuple_GET_ITEM(item, 1);
+        if (!PyBytes_Check(key)) {
+            PyErr_SetString(PyExc_TypeError, "server names must be byte strings");
+            goto error;
+        }
+        if (!ssl_Context_Check(value)) {
+            PyErr_SetString(PyExc_TypeError, "mapping values must be Contexts");
+            goto error;
+        }
+        length = servername_normalize(PyBytes_AS_STRING(key), PyBytes_GET_SIZE(key), name);
+        if (length < 0 || memchr(name, '\0', length) != NULL ||
+            (memchr(name, '*', length) != NULL &&
+             (length < 3 || name[0] != '*' || name[1] != '.' ||
+              memchr(name + 1, '*', length - 1) != NULL))) {
+            PyErr_Format(PyExc_ValueError, "invalid server name: %s",
+                         PyBytes_AS_STRING(key));
+            goto error;
+        }
+
+        hash = servername_hash(name, length);
+        entry = servername_map_entry(map, name, length, hash);
+        if (entry->name == NULL) {
+            entry->name = PyMem_Malloc(length);
+            if (entry->name == NULL) {
+                PyErr_NoMemory();
+                goto error;
+            }
+            memcpy(entry->name, name, length);
+            entry->length = length;
+            entry->hash = hash;
+        } else {
+            Py_DECREF(entry->context);
+        }
+        Py_INCREF(value);
+        entry->context = value;
+    }
+    Py_DECREF(items);
+
+    if (dflt != Py_None) {
+        Py_INCREF(dflt);
+        map->default_context = dflt;
+    }
+
+    ssl_Context_swap_servername_map(self, map);
+    SSL_CTX_set_tlsext_servername_callback(self->ctx, global_tlsext_servername_callback);
+    SSL_CTX_set_tlsext_servername_arg(self->ctx, NULL);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+
+  error:
+    Py_DECREF(items);
+    ssl_ServernameMap_free(map);
+    return NULL;
+}
+
+
+#ifdef PYOPENSSL_TICKET_KEYS
+/*
+ * Start using a new set of session ticket keys (or none), and free the old
+ * ones.
+ */
+static void
+ssl_Context_swap_ticket_keys(ssl_ContextObj *self, ssl_TicketKeys *keys) {
+    ssl_TicketKeys *old;
+
+    if (keys == NULL) {
+        SSL_CTX_set_tlsext_ticket_key_cb(self->ctx, NULL);
+    }
+
+    LOCK_TICKET_KEYS(self);
+    old = self->ticket_keys;
+    self->ticket_keys = keys;
+    UNLOCK_TICKET_KEYS(self);
+
+    ssl_TicketKeys_free(old);
+
+    if (keys != NULL) {
+        SSL_CTX_set_tlsext_ticket_key_cb(self->ctx, global_tlsext_ticket_key_callback);
+    }
+}
+
+static char ssl_Context_set_tlsext_ticket_keys_doc[] = "\n\
+Set the keys session tickets are protected with.  Contexts with the same\n\
+keys (for example in other processes, or on other hosts) resume each\n\
+other's sessions from their tickets.\n\
+\n\
+:param keys: A sequence of 48 byte strings, each made up of a 16 byte key\n\
+    name, a 16 byte HMAC key and a 16 byte AES key.  New tickets are\n\
+    protected with the first key.  Tickets protected with any of the keys\n\
+    are accepted, and those not protected with the first are replaced.  None\n\
+    to go back to keys OpenSSL picks at random.\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Context_set_tlsext_ticket_keys(ssl_ContextObj *self, PyObject *args) {
+    PyObject *keys, *sequence, *item;
+    ssl_TicketKeys *ticket_keys;
+    Py_ssize_t i, count;
+
+    if (!PyArg_ParseTuple(args, "O:set_tlsext_ticket_keys", &keys)) {
+        return NULL;
+    }
+
+    if (keys == Py_None) {
+        ssl_Context_swap_ticket_keys(self, NULL);
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+
+    sequence = PySequence_Fast(keys, "keys must be a sequence of byte strings");
+    if (sequence == NULL) {
+        return NULL;
+    }
+
+    count = PySequence_Fast_GET_SIZE(sequence);
+    if (count == 0) {
+        Py_DECREF(sequence);
+        PyErr_SetString(PyExc_ValueError, "at least one key is required");
+        return NULL;
+    }
+
+    for (i = 0; i < count; i++) {
+        item = PySequence_Fast_GET_ITEM(sequence, i);
+        if (!PyBytes_Check(item)) {
+            Py_DECREF(sequence);
+            PyErr_SetString(PyExc_TypeError, "keys must be byte strings");
+            return NULL;
+        }
+        if (PyBytes_Size(item) != sizeof(ssl_TicketKey)) {
+            Py_DECREF(sequence);
+            PyErr_Format(PyExc_ValueError, "keys must be %d bytes long",
+                         (int)sizeof(ssl_TicketKey));
+            return NULL;
+        }
+    }
+
+    ticket_keys = PyMem_Malloc(sizeof(ssl_TicketKeys));
+    if (ticket_keys == NULL) {
+        Py_DECREF(sequence);
+        return PyErr_NoMemory();
+    }
+    memset(ticket_keys, 0, sizeof(ssl_TicketKeys));
+    ticket_keys->keys = PyMem_Malloc(count * sizeof(ssl_TicketKey));
+    if (ticket_keys->keys == NULL) {
+        PyMem_Free(ticket_keys);
+        Py_DECREF(sequence);
+        return PyErr_NoMemory();
+    }
+    ticket_keys->count = (int)count;
+    for (i = 0; i < count; i++) {
+        memcpy(&ticket_keys->keys[i],
+               PyBytes_AsString(PySequence_Fast_GET_ITEM(sequence, i)),
+               sizeof(ssl_TicketKey));
+    }
+    Py_DECREF(sequence);
+
+    ssl_Context_swap_ticket_keys(self, ticket_keys);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static char ssl_Context_set_tlsext_ticket_key_rotation_doc[] = "\n\
+Protect session tickets with keys derived from a secret, changing to a new\n\
+key every *interval* seconds.  Contexts with the same secret and interval\n\
+(for example in other processes, or on other hosts with synchronized\n\
+clocks) resume each other's sessions from their tickets, without having to\n\
+exchange keys.\n\
+\n\
+:param secret: A byte string of up to 128 bytes, which should be random.\n\
+:param interval: How many seconds each key is used for.\n\
+:param previous: (optional) How many of the previous keys are still\n\
+    accepted.  Tickets protected with them are replaced.  The key for the\n\
+    next interval is accepted too, in case of small clock differences.\n\
+:return: None\n\
+";
+static PyObject *
+ssl_Context_set_tlsext_ticket_key_rotation(ssl_ContextObj *self, PyObject *args) {
+    ssl_TicketKeys *ticket_keys;
+    char *secret;
+    int secret_length, previous = 1;
+    long interval;
+
+    if (!PyArg_ParseTuple(args, BYTESTRING_FMT "#l|i:set_tlsext_ticket_key_rotation",
+                          &secret, &secret_length, &interval, &previous)) {
+        return NULL;
+    }
+
+    if (secret_length < 1 || secret_length > TICKET_SECRET_MAX) {
+        PyErr_Format(PyExc_ValueError, "secret must be 1 to %d bytes long",
+                     TICKET_SECRET_MAX);
+        return NULL;
+    }
+    if (interval < 1) {
+        PyErr_SetString(PyExc_ValueError, "interval must be positive");
+        return NULL;
+    }
+    if (previous < 0) {
+        PyErr_SetString(PyExc_ValueError, "previous must not be negative");
+        return NULL;
+    }
+
+    ticket_keys = PyMem_Malloc(sizeof(ssl_TicketKeys));
+    if (ticket_keys == NULL) {
+        return PyErr_NoMemory();
+    }
+    memset(ticket_keys, 0, sizeof(ssl_TicketKeys));
+    ticket_keys->secret = PyMem_Malloc(secret_length);
+    if (ticket_keys->secret == NULL) {
+        PyMem_Free(ticket_keys);
+        return PyErr_NoMemory();
+    }
+    memcpy(ticket_keys->secret, secret, secret_length);
+    ticket_keys->secret_length = secret_length;
+    ticket_keys->interval = interval;
+    ticket_keys->previous = previous;
+
+    ssl_Context_swap_ticket_keys(self, ticket_keys);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+#endif /* PYOPENSSL_TICKET_KEYS */
+
 
 /*
  * Member methods in the Context object
@@ -1198,9 +2928,11 @@ ssl_Context_set_tlsext_servername_callback(ssl_ContextObj *self, PyObject *args)
 #define ADD_METHOD(name) { #name, (PyCFunction)ssl_Context_##name, METH_VARARGS, ssl_Context_##name##_doc }
 static PyMethodDef ssl_Context_methods[] = {
     ADD_METHOD(load_verify_locations),
+    ADD_METHOD(load_verify_buffer),
     ADD_METHOD(set_passwd_cb),
     ADD_METHOD(set_default_verify_paths),
     ADD_METHOD(use_certificate_chain_file),
+    ADD_METHOD(use_certificate_chain_buffer),
     ADD_METHOD(use_certificate_file),
     ADD_METHOD(use_certificate),
     ADD_METHOD(add_extra_chain_cert),
@@ -1211,23 +2943,39 @@ static PyMethodDef ssl_Context_methods[] = {
     ADD_METHOD(set_session_id),
     ADD_METHOD(set_session_cache_mode),
     ADD_METHOD(get_session_cache_mode),
+    ADD_METHOD(set_session_cache),
+    ADD_METHOD(get_session_cache),
     ADD_METHOD(set_verify),
+    ADD_METHOD(set_verify_cache),
+    ADD_METHOD(get_verify_cache_stats),
     ADD_METHOD(set_verify_depth),
     ADD_METHOD(get_verify_mode),
     ADD_METHOD(get_verify_depth),
     ADD_METHOD(load_tmp_dh),
+    ADD_METHOD(load_tmp_dh_buffer),
     ADD_METHOD(set_cipher_list),
     ADD_METHOD(set_client_ca_list),
     ADD_METHOD(add_client_ca),
     ADD_METHOD(set_timeout),
     ADD_METHOD(get_timeout),
+    ADD_METHOD(set_session_cache_size),
+    ADD_METHOD(get_session_cache_size),
+    ADD_METHOD(get_session_cache_stats),
+    ADD_METHOD(flush_sessions),
     ADD_METHOD(set_info_callback),
     ADD_METHOD(get_app_data),
     ADD_METHOD(set_app_data),
     ADD_METHOD(get_cert_store),
+    ADD_METHOD(set_cert_store),
     ADD_METHOD(set_options),
     ADD_METHOD(set_mode),
     ADD_METHOD(set_tlsext_servername_callback),
+    { "set_servername_map", (PyCFunction)ssl_Context_set_servername_map,
+      METH_VARARGS | METH_KEYWORDS, ssl_Context_set_servername_map_doc },
+#ifdef PYOPENSSL_TICKET_KEYS
+    ADD_METHOD(set_tlsext_ticket_keys),
+    ADD_METHOD(set_tlsext_ticket_key_rotation),
+#endif
     { NULL, NULL }
 };
 #undef ADD_METHOD
@@ -1267,6 +3015,23 @@ ssl_Context_init(ssl_ContextObj *self, int i_method) {
             return NULL;
     }
 
+#ifdef WITH_THREAD
+    self->ticket_keys_lock = PyThread_allocate_lock();
+    if (self->ticket_keys_lock == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    self->verify_cache_lock = PyThread_allocate_lock();
+    if (self->verify_cache_lock == NULL) {
+        PyThread_free_lock(self->ticket_keys_lock);
+        PyErr_NoMemory();
+        return NULL;
+    }
+#endif
+    self->ticket_keys = NULL;
+    self->verify_cache = NULL;
+    self->servername_map = NULL;
+
     self->ctx = SSL_CTX_new(method);
     Py_INCREF(Py_None);
     self->passphrase_callback = Py_None;
@@ -1278,6 +3043,9 @@ ssl_Context_init(ssl_ContextObj *self, int i_method) {
     Py_INCREF(Py_None);
     self->tlsext_servername_callback = Py_None;
 
+    Py_INCREF(Py_None);
+    self->session_cache = Py_None;
+
     Py_INCREF(Py_None);
     self->passphrase_userdata = Py_None;
 
@@ -1291,6 +3059,7 @@ ssl_Context_init(ssl_ContextObj *self, int i_method) {
                                 SSL_MODE_AUTO_RETRY);
 
     self->tstate = NULL;
+    self->info_mask = -1;
 
     return self;
 }
@@ -1355,8 +3124,24 @@ ssl_Context_traverse(ssl_ContextObj *self, visitproc visit, void *arg)
         ret = visit((PyObject *)self->verify_callback, arg);
     if (ret == 0 && self->info_callback != NULL)
         ret = visit((PyObject *)self->info_callback, arg);
+    if (ret == 0 && self->session_cache != NULL)
+        ret = visit(self->session_cache, arg);
     if (ret == 0 && self->app_data != NULL)
         ret = visit(self->app_data, arg);
+    /*
+     * A map shared with Connections is not only this Context's to report.
+     */
+    if (self->servername_map != NULL && self->servername_map->refcount == 1) {
+        ssl_ServernameMap *map = self->servername_map;
+        Py_ssize_t i;
+
+        for (i = 0; ret == 0 && i <= map->mask; i++) {
+            if (map->entries[i].name != NULL)
+                ret = visit(map->entries[i].context, arg);
+        }
+        if (ret == 0 && map->default_context != NULL)
+            ret = visit(map->default_context, arg);
+    }
     return ret;
 }
 
@@ -1377,8 +3162,11 @@ ssl_Context_clear(ssl_ContextObj *self)
     self->verify_callback = NULL;
     Py_XDECREF(self->info_callback);
     self->info_callback = NULL;
+    Py_XDECREF(self->session_cache);
+    self->session_cache = NULL;
     Py_XDECREF(self->app_data);
     self->app_data = NULL;
+    ssl_Context_swap_servername_map(self, NULL);
     return 0;
 }
 
@@ -1392,8 +3180,21 @@ static void
 ssl_Context_dealloc(ssl_ContextObj *self)
 {
     PyObject_GC_UnTrack((PyObject *)self);
+    /*
+     * Sessions freed along with the context are still good for the other
+     * users of an external session cache.
+     */
+    SSL_CTX_sess_set_remove_cb(self->ctx, NULL);
     SSL_CTX_free(self->ctx);
     ssl_Context_clear(self);
+    ssl_TicketKeys_free(self->ticket_keys);
+    self->ticket_keys = NULL;
+    ssl_VerifyCache_free(self->verify_cache);
+    self->verify_cache = NULL;
+#ifdef WITH_THREAD
+    PyThread_free_lock(self->ticket_keys_lock);
+    PyThread_free_lock(self->verify_cache_lock);
+#endif
     PyObject_GC_Del(self);
 }
 
@@ -1453,6 +3254,16 @@ init_ssl_context(PyObject *module) {
         return 0;
     }
 
+#ifdef WITH_THREAD
+    if (servername_map_lock == NULL) {
+        servername_map_lock = PyThread_allocate_lock();
+        if (servername_map_lock == NULL) {
+            PyErr_NoMemory();
+            return 0;
+        }
+    }
+#endif
+
     /* PyModule_AddObject steals a reference.
      */
     Py_INCREF((PyObject *)&ssl_Context_Type);
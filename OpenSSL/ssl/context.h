@@ -14,6 +14,8 @@
 #define PyOpenSSL_SSL_CONTEXT_H_
 
 #include <Python.h>
+#include <pythread.h>
+#include <time.h>
 #include <openssl/ssl.h>
 
 extern  int                   init_ssl_context      (PyObject *);
@@ -22,6 +24,77 @@ extern  PyTypeObject      ssl_Context_Type;
 
 #define ssl_Context_Check(v) ((v)->ob_type == &ssl_Context_Type)
 
+/*
+ * A session ticket key, laid out like the keys SSL_CTX_set_tlsext_ticket_keys
+ * takes.
+ */
+typedef struct {
+    unsigned char name[16];
+    unsigned char hmac_key[16];
+    unsigned char aes_key[16];
+} ssl_TicketKey;
+
+/*
+ * The keys a Context protects session tickets with: either a fixed list of
+ * keys, the first of which encrypts new tickets, or a secret from which a
+ * key for every interval of time is derived.
+ */
+typedef struct {
+    int count;
+    ssl_TicketKey *keys;
+    unsigned char *secret;
+    int secret_length;
+    long interval;
+    int previous;
+} ssl_TicketKeys;
+
+/*
+ * A verify callback decision remembered by a Context, for the chain, error,
+ * depth and preverification result the key is a digest of.
+ */
+typedef struct {
+    unsigned char key[32];
+    time_t expires;
+    int ok;
+} ssl_VerifyCacheEntry;
+
+/*
+ * The verify callback decisions a Context remembers.  The entries are split
+ * into sets of VERIFY_CACHE_WAYS; a key can only be stored in one set.
+ */
+typedef struct {
+    int sets;
+    long ttl;
+    ssl_VerifyCacheEntry *entries;
+    unsigned long hits, misses;
+} ssl_VerifyCache;
+
+/*
+ * A server name and the Context connections asking for it are switched to.
+ * Wildcard names start with "*.".
+ */
+typedef struct {
+    char *name;
+    Py_ssize_t length;
+    unsigned long hash;
+    PyObject *context;
+} ssl_ServernameEntry;
+
+/*
+ * The server names a Context switches connections to other Contexts for, as
+ * a hash table.  Connections switched by a map keep a reference to it until
+ * they hold one to their new Context; the reference count is protected by a
+ * lock, so it can be changed without the GIL.
+ */
+typedef struct {
+    int refcount;
+    Py_ssize_t mask;
+    ssl_ServernameEntry *entries;
+    PyObject *default_context;
+} ssl_ServernameMap;
+
+extern  void                  ssl_ServernameMap_release (ssl_ServernameMap *);
+
 typedef struct {
     PyObject_HEAD
     SSL_CTX             *ctx;
@@ -30,8 +103,17 @@ typedef struct {
                         *verify_callback,
                         *info_callback,
                         *tlsext_servername_callback,
+                        *session_cache,
                         *app_data;
     PyThreadState       *tstate;
+    int                 info_mask;
+    ssl_TicketKeys      *ticket_keys;
+    ssl_VerifyCache     *verify_cache;
+    ssl_ServernameMap   *servername_map;
+#ifdef WITH_THREAD
+    PyThread_type_lock  ticket_keys_lock,
+                        verify_cache_lock;
+#endif
 } ssl_ContextObj;
 
 #define ssl_SSLv2_METHOD      (1)
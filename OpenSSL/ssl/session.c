@@ -76,6 +76,179 @@ ssl_Session_dealloc(ssl_SessionObj *self) {
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
+/*
+ * Raise ValueError and return 0 if the Session does not wrap an OpenSSL
+ * session structure, as is the case for one created by calling Session().
+ */
+static int
+ssl_Session_check(ssl_SessionObj *self) {
+    if (self->session == NULL) {
+        PyErr_SetString(PyExc_ValueError, "Session is empty");
+        return 0;
+    }
+    return 1;
+}
+
+static char ssl_Session_to_bytes_doc[] = "\n\
+Serialize the session, so that it can be stored or passed to another\n\
+process and given to :py:meth:`Session.from_bytes`.\n\
+\n\
+:return: The DER encoding of the session, as a byte string.\n\
+";
+static PyObject *
+ssl_Session_to_bytes(ssl_SessionObj *self, PyObject *args) {
+    PyObject *result;
+    unsigned char *p;
+    int len;
+
+    if (!PyArg_ParseTuple(args, ":to_bytes")) {
+        return NULL;
+    }
+
+    if (!ssl_Session_check(self)) {
+        return NULL;
+    }
+
+    len = i2d_SSL_SESSION(self->session, NULL);
+    if (len <= 0) {
+        exception_from_error_queue(ssl_Error);
+        return NULL;
+    }
+
+    result = PyBytes_FromStringAndSize(NULL, len);
+    if (result == NULL) {
+        return NULL;
+    }
+
+    p = (unsigned char *)PyBytes_AsString(result);
+    i2d_SSL_SESSION(self->session, &p);
+    return result;
+}
+
+static char ssl_Session_from_bytes_doc[] = "\n\
+Load a session serialized by :py:meth:`Session.to_bytes`.\n\
+\n\
+:param data: The DER encoding of the session.\n\
+:return: A new :py:class:`Session`.\n\
+";
+static PyObject *
+ssl_Session_from_bytes(PyObject *ignored, PyObject *args) {
+    SSL_SESSION *native_session;
+    ssl_SessionObj *session;
+    const unsigned char *p;
+    char *data;
+    int len;
+
+    if (!PyArg_ParseTuple(args, BYTESTRING_FMT "#:from_bytes", &data, &len)) {
+        return NULL;
+    }
+
+    p = (const unsigned char *)data;
+    native_session = d2i_SSL_SESSION(NULL, &p, len);
+    if (native_session == NULL) {
+        exception_from_error_queue(ssl_Error);
+        return NULL;
+    }
+
+    session = ssl_Session_from_SSL_SESSION(native_session);
+    if (session == NULL) {
+        SSL_SESSION_free(native_session);
+        return NULL;
+    }
+    return (PyObject *)session;
+}
+
+static char ssl_Session_get_id_doc[] = "\n\
+Get the session id.\n\
+\n\
+:return: The session id, as a byte string.  It is empty for a session\n\
+    which a server identified by a ticket alone.\n\
+";
+static PyObject *
+ssl_Session_get_id(ssl_SessionObj *self, PyObject *args) {
+    const unsigned char *id;
+    unsigned int len;
+
+    if (!PyArg_ParseTuple(args, ":get_id")) {
+        return NULL;
+    }
+
+    if (!ssl_Session_check(self)) {
+        return NULL;
+    }
+
+    id = SSL_SESSION_get_id(self->session, &len);
+    return PyBytes_FromStringAndSize((const char *)id, len);
+}
+
+static char ssl_Session_get_time_doc[] = "\n\
+Get the time the session was established.\n\
+\n\
+:return: The time, in seconds since the epoch.\n\
+";
+static PyObject *
+ssl_Session_get_time(ssl_SessionObj *self, PyObject *args) {
+    if (!PyArg_ParseTuple(args, ":get_time")) {
+        return NULL;
+    }
+
+    if (!ssl_Session_check(self)) {
+        return NULL;
+    }
+
+    return PyLong_FromLong(SSL_SESSION_get_time(self->session));
+}
+
+static char ssl_Session_get_timeout_doc[] = "\n\
+Get how long the session may be resumed for.\n\
+\n\
+:return: The lifetime of the session, in seconds from :py:meth:`get_time`.\n\
+";
+static PyObject *
+ssl_Session_get_timeout(ssl_SessionObj *self, PyObject *args) {
+    if (!PyArg_ParseTuple(args, ":get_timeout")) {
+        return NULL;
+    }
+
+    if (!ssl_Session_check(self)) {
+        return NULL;
+    }
+
+    return PyLong_FromLong(SSL_SESSION_get_timeout(self->session));
+}
+
+static char ssl_Session_is_resumable_doc[] = "\n\
+Find out whether the session can be used to resume a connection.\n\
+\n\
+:return: True if it can, otherwise False.  This does not consider whether\n\
+    the session has expired; see :py:meth:`get_time` and\n\
+    :py:meth:`get_timeout`.\n\
+";
+static PyObject *
+ssl_Session_is_resumable(ssl_SessionObj *self, PyObject *args) {
+    int resumable;
+
+    if (!PyArg_ParseTuple(args, ":is_resumable")) {
+        return NULL;
+    }
+
+    if (!ssl_Session_check(self)) {
+        return NULL;
+    }
+
+#if OPENSSL_VERSION_NUMBER >= 0x10101000L
+    resumable = SSL_SESSION_is_resumable(self->session);
+#else
+    resumable = !self->session->not_resumable &&
+        (self->session->session_id_length > 0
+#ifndef OPENSSL_NO_TLSEXT
+         || self->session->tlsext_ticklen > 0
+#endif
+            );
+#endif
+    return PyBool_FromLong(resumable);
+}
+
 /*
  * Member methods in the Session object
  * ADD_METHOD(name) expands to a correct PyMethodDef declaration
@@ -85,9 +258,17 @@ ssl_Session_dealloc(ssl_SessionObj *self) {
  * function with the name 'name'
  */
 #define ADD_METHOD(name) { #name, (PyCFunction)ssl_Session_##name, METH_VARARGS, ssl_Session_##name##_doc }
+#define ADD_STATIC_METHOD(name) { #name, (PyCFunction)ssl_Session_##name, METH_VARARGS | METH_STATIC, ssl_Session_##name##_doc }
 static PyMethodDef ssl_Session_methods[] = {
+    ADD_METHOD(to_bytes),
+    ADD_STATIC_METHOD(from_bytes),
+    ADD_METHOD(get_id),
+    ADD_METHOD(get_time),
+    ADD_METHOD(get_timeout),
+    ADD_METHOD(is_resumable),
     { NULL, NULL }
 };
+#undef ADD_STATIC_METHOD
 #undef ADD_METHOD
 
 /*
@@ -0,0 +1,525 @@
+/*
+ * sessioncache.c
+ *
+ * Copyright (C) Jean-Paul Calderone
+ * See LICENSE for details.
+ *
+ * A fixed size session cache in anonymous shared memory.  A cache created
+ * before a server forks its workers is shared by all of them, so a session
+ * established by one worker can be resumed by any other.
+ *
+ * The cache is set associative: the hash of a session id picks a set of
+ * CACHE_WAYS entries, and within a set the least recently used entry is
+ * replaced.  A process shared mutex in the mapping protects it.
+ *
+ */
+#include <Python.h>
+#define SSL_MODULE
+#include "ssl.h"
+
+#ifdef PYOPENSSL_SHARED_SESSION_CACHE
+
+#include <stddef.h>
+#include <string.h>
+#include <time.h>
+#include <errno.h>
+#include <pthread.h>
+#include <sys/mman.h>
+
+#if !defined(MAP_ANONYMOUS) && defined(MAP_ANON)
+#define MAP_ANONYMOUS MAP_ANON
+#endif
+
+#if PY_VERSION_HEX < 0x02050000
+typedef inquiry lenfunc;
+#endif
+
+#define CACHE_WAYS 8
+
+struct ssl_SharedSessionCacheHeader {
+    pthread_mutex_t lock;
+    unsigned long clock;        /* Stamp given to the last entry used */
+    unsigned long sets;
+    unsigned long entry_size;   /* The most DER one entry can hold */
+    unsigned long stride;       /* Bytes from one entry to the next */
+};
+
+typedef struct {
+    unsigned long used;         /* LRU stamp, or 0 for an empty entry */
+    long expires;
+    unsigned int id_length;
+    unsigned int data_length;
+    unsigned char id[SSL_MAX_SSL_SESSION_ID_LENGTH];
+    unsigned char data[1];
+} cache_entry;
+
+#define ALIGN(n, to) (((n) + (to) - 1) / (to) * (to))
+#define HEADER_SIZE ALIGN(sizeof(struct ssl_SharedSessionCacheHeader), 64)
+
+static cache_entry *
+cache_entry_at(struct ssl_SharedSessionCacheHeader *header, unsigned long index) {
+    return (cache_entry *)((char *)header + HEADER_SIZE + index * header->stride);
+}
+
+static int
+cache_lock(struct ssl_SharedSessionCacheHeader *header) {
+    int ret = pthread_mutex_lock(&header->lock);
+#ifdef __linux__
+    if (ret == EOWNERDEAD) {
+        /*
+         * A process died holding the lock.  An entry is only marked used once
+         * it has been written completely, so the cache is still consistent.
+         */
+        pthread_mutex_consistent(&header->lock);
+        ret = 0;
+    }
+#endif
+    return ret;
+}
+
+static void
+cache_unlock(struct ssl_SharedSessionCacheHeader *header) {
+    pthread_mutex_unlock(&header->lock);
+}
+
+/*
+ * Find the entry for a session id.  The lock must be held.
+ *
+ * Arguments: header    - The cache
+ *            id        - The session id
+ *            id_length - The length of the session id
+ *            victim    - If not NULL, set to the entry to replace if the id
+ *                        is not in the cache
+ * Returns:   The entry, or NULL if the id is not in the cache
+ */
+static cache_entry *
+cache_find(struct ssl_SharedSessionCacheHeader *header, const unsigned char *id,
+           unsigned int id_length, cache_entry **victim) {
+    unsigned long hash = 2166136261UL, base, i;
+    long now = (long)time(NULL);
+    cache_entry *entry, *oldest = NULL;
+
+    for (i = 0; i < id_length; i++) {
+        hash = (hash ^ id[i]) * 16777619UL;
+    }
+    base = (hash % header->sets) * CACHE_WAYS;
+
+    for (i = 0; i < CACHE_WAYS; i++) {
+        entry = cache_entry_at(header, base + i);
+        if (entry->used && entry->expires < now) {
+            entry->used = 0;
+        }
+        if (entry->used && entry->id_length == id_length &&
+            memcmp(entry->id, id, id_length) == 0) {
+            return entry;
+        }
+        if (oldest == NULL || entry->used < oldest->used) {
+            oldest = entry;
+        }
+    }
+    if (victim != NULL) {
+        *victim = oldest;
+    }
+    return NULL;
+}
+
+/*
+ * Store a session in the cache, replacing the least recently used entry of
+ * its set.  This does not need the GIL.
+ *
+ * Returns: 1 if the session was stored, 0 if it has no id or is too large
+ */
+int
+ssl_SharedSessionCache_add(ssl_SharedSessionCacheObj *self, SSL_SESSION *session) {
+    struct ssl_SharedSessionCacheHeader *header = self->header;
+    const unsigned char *id;
+    unsigned int id_length;
+    unsigned char *p;
+    cache_entry *entry, *victim;
+    int length;
+
+    id = SSL_SESSION_get_id(session, &id_length);
+    if (id_length == 0 || id_length > SSL_MAX_SSL_SESSION_ID_LENGTH) {
+        return 0;
+    }
+
+    length = i2d_SSL_SESSION(session, NULL);
+    if (length <= 0 || (unsigned long)length > header->entry_size) {
+        return 0;
+    }
+
+    if (cache_lock(header) != 0) {
+        return 0;
+    }
+    entry = cache_find(header, id, id_length, &victim);
+    if (entry == NULL) {
+        entry = victim;
+    }
+    entry->used = 0;
+    entry->id_length = id_length;
+    memcpy(entry->id, id, id_length);
+    p = entry->data;
+    entry->data_length = i2d_SSL_SESSION(session, &p);
+    entry->expires = SSL_SESSION_get_time(session) + SSL_SESSION_get_timeout(session);
+    entry->used = ++header->clock;
+    cache_unlock(header);
+    return 1;
+}
+
+/*
+ * Look a session up in the cache.  This does not need the GIL.
+ *
+ * Returns: A new reference to the session, or NULL if it is not in the cache
+ */
+SSL_SESSION *
+ssl_SharedSessionCache_get(ssl_SharedSessionCacheObj *self, const unsigned char *id,
+                           unsigned int id_length) {
+    struct ssl_SharedSessionCacheHeader *header = self->header;
+    SSL_SESSION *session = NULL;
+    const unsigned char *p;
+    cache_entry *entry;
+
+    if (cache_lock(header) != 0) {
+        return NULL;
+    }
+    entry = cache_find(header, id, id_length, NULL);
+    if (entry != NULL) {
+        p = entry->data;
+        session = d2i_SSL_SESSION(NULL, &p, entry->data_length);
+        entry->used = ++header->clock;
+    }
+    cache_unlock(header);
+    return session;
+}
+
+/*
+ * Remove a session from the cache, if it is there.  This does not need the
+ * GIL.
+ */
+void
+ssl_SharedSessionCache_remove(ssl_SharedSessionCacheObj *self, const unsigned char *id,
+                              unsigned int id_length) {
+    struct ssl_SharedSessionCacheHeader *header = self->header;
+    cache_entry *entry;
+
+    if (cache_lock(header) != 0) {
+        return;
+    }
+    entry = cache_find(header, id, id_length, NULL);
+    if (entry != NULL) {
+        entry->used = 0;
+    }
+    cache_unlock(header);
+}
+
+static char ssl_SharedSessionCache_doc[] = "\n\
+SharedSessionCache(size=1024, entry_size=2048) -> SharedSessionCache instance\n\
+\n\
+A fixed size session cache in shared memory, for use with\n\
+:py:meth:`Context.set_session_cache`.  Create it before forking, and the\n\
+sessions stored by any process are available to all of them.  When the\n\
+cache is full, the least recently used sessions are replaced.\n\
+\n\
+It is also a mapping from session ids to serialized sessions.\n\
+\n\
+:param size: (optional) The number of sessions the cache can hold.\n\
+:param entry_size: (optional) The size of the largest serialized session\n\
+    the cache can hold.\n\
+";
+
+static PyObject *
+ssl_SharedSessionCache_new(PyTypeObject *subtype, PyObject *args, PyObject *kwargs) {
+    ssl_SharedSessionCacheObj *self;
+    struct ssl_SharedSessionCacheHeader *header;
+    pthread_mutexattr_t attr;
+    unsigned long sets, stride;
+    size_t length;
+    void *mapping;
+    int size = 1024, entry_size = 2048, err;
+    static char *kwlist[] = {"size", "entry_size", NULL};
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|ii:SharedSessionCache",
+                                     kwlist, &size, &entry_size)) {
+        return NULL;
+    }
+
+    if (size < 1 || entry_size < 1) {
+        PyErr_SetString(PyExc_ValueError, "size and entry_size must be positive");
+        return NULL;
+    }
+
+    sets = ((unsigned long)size + CACHE_WAYS - 1) / CACHE_WAYS;
+    stride = ALIGN(offsetof(cache_entry, data) + (unsigned long)entry_size, 8);
+    length = HEADER_SIZE + sets * CACHE_WAYS * stride;
+
+    mapping = mmap(NULL, length, PROT_READ | PROT_WRITE,
+                   MAP_SHARED | MAP_ANONYMOUS, -1, 0);
+    if (mapping == MAP_FAILED) {
+        PyErr_SetFromErrno(PyExc_OSError);
+        return NULL;
+    }
+
+    header = (struct ssl_SharedSessionCacheHeader *)mapping;
+    header->sets = sets;
+    header->entry_size = entry_size;
+    header->stride = stride;
+
+    err = pthread_mutexattr_init(&attr);
+    if (err == 0) {
+        err = pthread_mutexattr_setpshared(&attr, PTHREAD_PROCESS_SHARED);
+#ifdef __linux__
+        if (err == 0) {
+            err = pthread_mutexattr_setrobust(&attr, PTHREAD_MUTEX_ROBUST);
+        }
+#endif
+        if (err == 0) {
+            err = pthread_mutex_init(&header->lock, &attr);
+        }
+        pthread_mutexattr_destroy(&attr);
+    }
+    if (err != 0) {
+        munmap(mapping, length);
+        errno = err;
+        PyErr_SetFromErrno(PyExc_OSError);
+        return NULL;
+    }
+
+    self = (ssl_SharedSessionCacheObj *)subtype->tp_alloc(subtype, 0);
+    if (self == NULL) {
+        pthread_mutex_destroy(&header->lock);
+        munmap(mapping, length);
+        return NULL;
+    }
+    self->header = header;
+    self->length = length;
+    return (PyObject *)self;
+}
+
+static void
+ssl_SharedSessionCache_dealloc(ssl_SharedSessionCacheObj *self) {
+    /*
+     * Other processes may still be using the lock, so it is not destroyed.
+     */
+    if (self->header != NULL) {
+        munmap(self->header, self->length);
+        self->header = NULL;
+    }
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+/*
+ * Get the session id a mapping key stands for, raising TypeError if it is
+ * not a byte string.
+ *
+ * Returns: 1 for success, 0 otherwise
+ */
+static int
+ssl_SharedSessionCache_key(PyObject *key, const unsigned char **id,
+                           unsigned int *id_length) {
+    if (!PyBytes_Check(key)) {
+        PyErr_SetString(PyExc_TypeError, "session id must be a byte string");
+        return 0;
+    }
+    *id = (const unsigned char *)PyBytes_AsString(key);
+    *id_length = (unsigned int)PyBytes_Size(key);
+    return 1;
+}
+
+static Py_ssize_t
+ssl_SharedSessionCache_length(ssl_SharedSessionCacheObj *self) {
+    struct ssl_SharedSessionCacheHeader *header = self->header;
+    unsigned long i, count = 0;
+    long now = (long)time(NULL);
+    cache_entry *entry;
+
+    if (cache_lock(header) != 0) {
+        PyErr_SetString(PyExc_RuntimeError, "cannot lock the session cache");
+        return -1;
+    }
+    for (i = 0; i < header->sets * CACHE_WAYS; i++) {
+        entry = cache_entry_at(header, i);
+        if (entry->used && entry->expires >= now) {
+            count++;
+        }
+    }
+    cache_unlock(header);
+    return (Py_ssize_t)count;
+}
+
+static PyObject *
+ssl_SharedSessionCache_subscript(ssl_SharedSessionCacheObj *self, PyObject *key) {
+    const unsigned char *id;
+    unsigned int id_length;
+    SSL_SESSION *session;
+    PyObject *result;
+    unsigned char *p;
+    int length;
+
+    if (!ssl_SharedSessionCache_key(key, &id, &id_length)) {
+        return NULL;
+    }
+
+    session = ssl_SharedSessionCache_get(self, id, id_length);
+    if (session == NULL) {
+        PyErr_SetObject(PyExc_KeyError, key);
+        return NULL;
+    }
+
+    length = i2d_SSL_SESSION(session, NULL);
+    result = PyBytes_FromStringAndSize(NULL, length);
+    if (result != NULL) {
+        p = (unsigned char *)PyBytes_AsString(result);
+        i2d_SSL_SESSION(session, &p);
+    }
+    SSL_SESSION_free(session);
+    return result;
+}
+
+static int
+ssl_SharedSessionCache_ass_subscript(ssl_SharedSessionCacheObj *self, PyObject *key,
+                                     PyObject *value) {
+    const unsigned char *id, *p, *session_id;
+    unsigned int id_length, session_id_length;
+    SSL_SESSION *session;
+    int stored;
+
+    if (!ssl_SharedSessionCache_key(key, &id, &id_length)) {
+        return -1;
+    }
+
+    if (value == NULL) {
+        ssl_SharedSessionCache_remove(self, id, id_length);
+        return 0;
+    }
+
+    if (!PyBytes_Check(value)) {
+        PyErr_SetString(PyExc_TypeError, "session must be a byte string");
+        return -1;
+    }
+
+    p = (const unsigned char *)PyBytes_AsString(value);
+    session = d2i_SSL_SESSION(NULL, &p, (long)PyBytes_Size(value));
+    if (session == NULL) {
+        exception_from_error_queue(ssl_Error);
+        return -1;
+    }
+
+    session_id = SSL_SESSION_get_id(session, &session_id_length);
+    if (session_id_length != id_length || memcmp(session_id, id, id_length) != 0) {
+        SSL_SESSION_free(session);
+        PyErr_SetString(PyExc_ValueError, "key is not the id of the session");
+        return -1;
+    }
+
+    stored = ssl_SharedSessionCache_add(self, session);
+    SSL_SESSION_free(session);
+    if (!stored) {
+        PyErr_SetString(PyExc_ValueError, "session is too large for the cache");
+        return -1;
+    }
+    return 0;
+}
+
+static PyMappingMethods ssl_SharedSessionCache_as_mapping = {
+    (lenfunc)ssl_SharedSessionCache_length,
+    (binaryfunc)ssl_SharedSessionCache_subscript,
+    (objobjargproc)ssl_SharedSessionCache_ass_subscript,
+};
+
+static char ssl_SharedSessionCache_get_doc[] = "\n\
+Look up a serialized session.\n\
+\n\
+:param id: The session id.\n\
+:param default: (optional) What to return if the session is not cached.\n\
+:return: The serialized session, or *default*.\n\
+";
+static PyObject *
+ssl_SharedSessionCache_get_method(ssl_SharedSessionCacheObj *self, PyObject *args) {
+    PyObject *key, *result, *default_ = Py_None;
+
+    if (!PyArg_ParseTuple(args, "O|O:get", &key, &default_)) {
+        return NULL;
+    }
+
+    result = ssl_SharedSessionCache_subscript(self, key);
+    if (result == NULL && PyErr_ExceptionMatches(PyExc_KeyError)) {
+        PyErr_Clear();
+        Py_INCREF(default_);
+        result = default_;
+    }
+    return result;
+}
+
+static PyMethodDef ssl_SharedSessionCache_methods[] = {
+    { "get", (PyCFunction)ssl_SharedSessionCache_get_method, METH_VARARGS,
+      ssl_SharedSessionCache_get_doc },
+    { NULL, NULL }
+};
+
+PyTypeObject ssl_SharedSessionCache_Type = {
+    PyOpenSSL_HEAD_INIT(&PyType_Type, 0)
+    "OpenSSL.SSL.SharedSessionCache",
+    sizeof(ssl_SharedSessionCacheObj),
+    0,
+    (destructor)ssl_SharedSessionCache_dealloc, /* tp_dealloc */
+    NULL, /* print */
+    NULL, /* tp_getattr */
+    NULL, /* setattr */
+    NULL, /* compare */
+    NULL, /* repr */
+    NULL, /* as_number */
+    NULL, /* as_sequence */
+    &ssl_SharedSessionCache_as_mapping, /* as_mapping */
+    NULL, /* hash */
+    NULL, /* call */
+    NULL, /* str */
+    NULL, /* getattro */
+    NULL, /* setattro */
+    NULL, /* as_buffer */
+    Py_TPFLAGS_DEFAULT, /* tp_flags */
+    ssl_SharedSessionCache_doc, /* tp_doc */
+    NULL, /* tp_traverse */
+    NULL, /* tp_clear */
+    NULL, /* tp_richcompare */
+    0, /* tp_weaklistoffset */
+    NULL, /* tp_iter */
+    NULL, /* tp_iternext */
+    ssl_SharedSessionCache_methods, /* tp_methods */
+    NULL, /* tp_members */
+    NULL, /* tp_getset */
+    NULL, /* tp_base */
+    NULL, /* tp_dict */
+    NULL, /* tp_descr_get */
+    NULL, /* tp_descr_set */
+    0, /* tp_dictoffset */
+    NULL, /* tp_init */
+    NULL, /* tp_alloc */
+    ssl_SharedSessionCache_new, /* tp_new */
+};
+
+#endif /* PYOPENSSL_SHARED_SESSION_CACHE */
+
+/*
+ * Initialize the SharedSessionCache part of the SSL sub module.  Where
+ * shared memory caches are not supported, the type is not defined.
+ *
+ * Arguments: module - The OpenSSL.SSL module
+ * Returns:   1 for success, 0 otherwise
+ */
+int
+init_ssl_sessioncache(PyObject *module) {
+#ifdef PYOPENSSL_SHARED_SESSION_CACHE
+    if (PyType_Ready(&ssl_SharedSessionCache_Type) < 0) {
+        return 0;
+    }
+
+    /* PyModule_AddObject steals a reference.
+     */
+    Py_INCREF((PyObject *)&ssl_SharedSessionCache_Type);
+    if (PyModule_AddObject(module, "SharedSessionCache",
+                           (PyObject *)&ssl_SharedSessionCache_Type) < 0) {
+        return 0;
+    }
+#endif
+    return 1;
+}
@@ -0,0 +1,47 @@
+/*
+ * sessioncache.h
+ * Copyright (C) Jean-Paul Calderone
+ * See LICENSE for details.
+ *
+ * Defined here is a fixed size session cache kept in shared memory, which
+ * a Context can use as its external session cache without calling into
+ * Python.
+ *
+ */
+
+#ifndef PyOpenSSL_SSL_SESSIONCACHE_H_
+#define PyOpenSSL_SSL_SESSIONCACHE_H_
+
+#include <Python.h>
+#include <openssl/ssl.h>
+
+#ifndef _WIN32
+#define PYOPENSSL_SHARED_SESSION_CACHE
+#endif
+
+#ifdef PYOPENSSL_SHARED_SESSION_CACHE
+
+struct ssl_SharedSessionCacheHeader;
+
+typedef struct {
+    PyObject_HEAD
+    struct ssl_SharedSessionCacheHeader *header;
+    size_t length;
+} ssl_SharedSessionCacheObj;
+
+extern PyTypeObject ssl_SharedSessionCache_Type;
+
+#define ssl_SharedSessionCache_Check(v) (Py_TYPE(v) == &ssl_SharedSessionCache_Type)
+
+/*
+ * These may be called without the GIL.
+ */
+extern int ssl_SharedSessionCache_add(ssl_SharedSessionCacheObj *self, SSL_SESSION *session);
+extern SSL_SESSION *ssl_SharedSessionCache_get(ssl_SharedSessionCacheObj *self, const unsigned char *id, unsigned int id_length);
+extern void ssl_SharedSessionCache_remove(ssl_SharedSessionCacheObj *self, const unsigned char *id, unsigned int id_length);
+
+#endif /* PYOPENSSL_SHARED_SESSION_CACHE */
+
+extern int init_ssl_sessioncache(PyObject *);
+
+#endif
@@ -163,7 +163,7 @@ do {                                                                    \
         goto error;                                                     \
 } while (0)
 
-    ssl_Error = PyErr_NewException("OpenSSL.SSL.Error", NULL, NULL);
+    ssl_Error = error_type_new("OpenSSL.SSL.Error");
     if (ssl_Error == NULL) {
         goto error;
     }
@@ -245,6 +245,10 @@ do {                                                                    \
     PyModule_AddIntConstant(module, "SENT_SHUTDOWN", SSL_SENT_SHUTDOWN);
     PyModule_AddIntConstant(module, "RECEIVED_SHUTDOWN", SSL_RECEIVED_SHUTDOWN);
 
+    /* Statuses returned by the _nb Connection methods */
+    PyModule_AddIntConstant(module, "WANT_READ", ssl_WANT_READ);
+    PyModule_AddIntConstant(module, "WANT_WRITE", ssl_WANT_WRITE);
+
     /* For set_info_callback */
     PyModule_AddIntConstant(module, "SSL_ST_CONNECT", SSL_ST_CONNECT);
     PyModule_AddIntConstant(module, "SSL_ST_ACCEPT", SSL_ST_ACCEPT);
@@ -300,6 +304,8 @@ do {                                                                    \
         goto error;
     if (!init_ssl_session(module))
         goto error;
+    if (!init_ssl_sessioncache(module))
+        goto error;
     if (!init_ssl_connection(module))
         goto error;
 
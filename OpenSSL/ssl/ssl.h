@@ -17,6 +17,7 @@
 #include <pythread.h>
 #include "context.h"
 #include "session.h"
+#include "sessioncache.h"
 #include "connection.h"
 #include "../util.h"
 #include "../crypto/crypto.h"
@@ -0,0 +1,353 @@
+# Copyright (C) Jean-Paul Calderone
+# See LICENSE for details.
+
+"""
+Unit tests for :py:obj:`OpenSSL.aio`.
+"""
+
+from unittest import main
+
+from OpenSSL.crypto import FILETYPE_PEM, X509
+from OpenSSL.crypto import load_certificate, load_privatekey
+from OpenSSL.SSL import TLSv1_METHOD, VERIFY_PEER
+from OpenSSL.SSL import Context, Connection, Error, SysCallError
+
+from OpenSSL.test.util import TestCase, b
+from OpenSSL.test.test_crypto import server_cert_pem, server_key_pem
+
+try:
+    import asyncio
+    from OpenSSL.aio import create_connection, create_server
+except ImportError:
+    asyncio = None
+
+
+
+class _RecordingProtocol(object):
+    """
+    An application protocol which records what happens to it and optionally
+    echoes back whatever it receives.
+    """
+    def __init__(self, loop, echo=False):
+        self.echo = echo
+        self.transport = None
+        self.received = []
+        self.events = []
+        self.made = loop.create_future()
+        self.lost = loop.create_future()
+        self.paused = loop.create_future()
+        self.resumed = loop.create_future()
+
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.made.set_result(None)
+
+
+    def data_received(self, data):
+        self.received.append(data)
+        if self.echo:
+            self.transport.write(data)
+
+
+    def eof_received(self):
+        self.events.append('eof')
+
+
+    def connection_lost(self, exc):
+        self.lost.set_result(exc)
+
+
+    def pause_writing(self):
+        if not self.paused.done():
+            self.paused.set_result(None)
+
+
+    def resume_writing(self):
+        if not self.resumed.done():
+            self.resumed.set_result(None)
+
+
+
+class TLSTransportTests(TestCase):
+    """
+    Tests for :py:obj:`OpenSSL.aio.create_connection` and
+    :py:obj:`OpenSSL.aio.create_server`.
+    """
+    def setUp(self):
+        if asyncio is None:
+            return
+        self.loop = asyncio.new_event_loop()
+        self.servers = []
+
+
+    def tearDown(self):
+        if asyncio is not None:
+            for server in self.servers:
+                server.close()
+            self.loop.close()
+        TestCase.tearDown(self)
+
+
+    def _serverContext(self):
+        ctx = Context(TLSv1_METHOD)
+        ctx.use_privatekey(load_privatekey(FILETYPE_PEM, server_key_pem))
+        ctx.use_certificate(load_certificate(FILETYPE_PEM, server_cert_pem))
+        return ctx
+
+
+    def _wait(self, future):
+        return self.loop.run_until_complete(
+            asyncio.wait_for(future, 10))
+
+
+    def _serve(self, protocol_factory, context=None):
+        """
+        Start a server on an ephemeral loopback port and return the port.
+        """
+        if context is None:
+            context = self._serverContext()
+        server = self._wait(create_server(
+                protocol_factory, context, '127.0.0.1', 0, loop=self.loop))
+        self.servers.append(server)
+        return server.sockets[0].getsockname()[1]
+
+
+    def _connect(self, port, context=None, **kwargs):
+        if context is None:
+            context = Context(TLSv1_METHOD)
+        protocol = _RecordingProtocol(self.loop)
+        transport, result = self._wait(create_connection(
+                lambda: protocol, context, '127.0.0.1', port,
+                loop=self.loop, **kwargs))
+        self.assertIdentical(result, protocol)
+        return transport, protocol
+
+
+    def _until(self, predicate):
+        for i in range(1000):
+            if predicate():
+                return
+            self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.fail("Condition never became true")
+
+
+    if asyncio is not None:
+        def test_echo(self):
+            """
+            Application data written to the transport of either side is
+            delivered to the protocol on the other side.
+            """
+            servers = []
+            def factory():
+                servers.append(_RecordingProtocol(self.loop, echo=True))
+                return servers[-1]
+            port = self._serve(factory)
+
+            transport, protocol = self._connect(port)
+            transport.write(b("hello, "))
+            transport.write(bytearray(b("world")))
+            self._until(
+                lambda: b("").join(protocol.received) == b("hello, world"))
+            self.assertEqual(
+                b("").join(servers[0].received), b("hello, world"))
+
+
+        def test_close(self):
+            """
+            Closing the transport sends a closure alert, which the peer's
+            protocol sees as an end of file followed by the end of the
+            connection.
+            """
+            servers = []
+            def factory():
+                servers.append(_RecordingProtocol(self.loop))
+                return servers[-1]
+            port = self._serve(factory)
+
+            transport, protocol = self._connect(port)
+            self._wait(servers[0].made)
+            transport.write(b("bye"))
+            transport.close()
+            self.assertTrue(transport.is_closing())
+            self.assertIdentical(self._wait(servers[0].lost), None)
+            self.assertEqual(servers[0].events, ['eof'])
+            self.assertEqual(b("").join(servers[0].received), b("bye"))
+            self.assertIdentical(self._wait(protocol.lost), None)
+
+
+        def test_truncated(self):
+            """
+            If the peer closes the connection without sending a closure
+            alert, the protocol's ``connection_lost`` is called with
+            :py:obj:`SysCallError` and ``eof_received`` is not called.
+            """
+            servers = []
+            def factory():
+                servers.append(_RecordingProtocol(self.loop))
+                return servers[-1]
+            port = self._serve(factory)
+
+            transport, protocol = self._connect(port)
+            self._wait(servers[0].made)
+            transport.write(b("cut"))
+            self._until(lambda: servers[0].received)
+            transport.abort()
+            exc = self._wait(servers[0].lost)
+            self.assertTrue(isinstance(exc, SysCallError))
+            self.assertEqual(servers[0].events, [])
+            self._wait(protocol.lost)
+
+
+        def test_write_wrong_args(self):
+            """
+            :py:obj:`TLSTransport.write` raises :py:obj:`TypeError` if called
+            with something other than bytes.
+            """
+            port = self._serve(lambda: _RecordingProtocol(self.loop))
+            transport, protocol = self._connect(port)
+            self.assertRaises(TypeError, transport.write, object())
+            transport.close()
+            self._wait(protocol.lost)
+
+
+        def test_extra_info(self):
+            """
+            The transport makes the :py:obj:`Connection` and the peer
+            certificate available as extra information, along with whatever
+            the underlying transport provides.
+            """
+            port = self._serve(lambda: _RecordingProtocol(self.loop))
+            transport, protocol = self._connect(port)
+            connection = transport.get_extra_info('ssl_connection')
+            self.assertTrue(isinstance(connection, Connection))
+            cert = transport.get_extra_info('peercert')
+            self.assertTrue(isinstance(cert, X509))
+            self.assertEqual(
+                cert.get_subject(),
+                load_certificate(FILETYPE_PEM, server_cert_pem).get_subject())
+            self.assertEqual(
+                transport.get_extra_info('peername')[1], port)
+            self.assertIdentical(transport.get_extra_info('missing'), None)
+            transport.close()
+            self._wait(protocol.lost)
+
+
+        def test_server_name(self):
+            """
+            The *server_hostname* given to :py:obj:`create_connection` is sent
+            in the server name extension and is seen by the server's
+            servername callback.
+            """
+            names = []
+            context = self._serverContext()
+            context.set_tlsext_servername_callback(
+                lambda conn: names.append(conn.get_servername()))
+            port = self._serve(lambda: _RecordingProtocol(self.loop), context)
+            transport, protocol = self._connect(
+                port, server_hostname=b("example.invalid"))
+            self.assertEqual(names, [b("example.invalid")])
+            transport.close()
+            self._wait(protocol.lost)
+
+
+        def test_handshake_failure(self):
+            """
+            If the handshake fails, the future returned by
+            :py:obj:`create_connection` fails with the error and the
+            application protocol is never connected.
+            """
+            port = self._serve(lambda: _RecordingProtocol(self.loop))
+            context = Context(TLSv1_METHOD)
+            context.set_verify(VERIFY_PEER, lambda *args: False)
+            protocol = _RecordingProtocol(self.loop)
+            self.assertRaises(
+                Error, self._wait, create_connection(
+                    lambda: protocol, context, '127.0.0.1', port,
+                    loop=self.loop))
+            self.assertFalse(protocol.made.done())
+
+
+        def test_flow_control(self):
+            """
+            When the underlying transport's write buffer goes over its high
+            water mark the application protocol's ``pause_writing`` is called,
+            and ``resume_writing`` once it has drained below the low one.
+            """
+            servers = []
+            def factory():
+                servers.append(_RecordingProtocol(self.loop))
+                return servers[-1]
+            port = self._serve(factory)
+
+            transport, protocol = self._connect(port)
+            self._wait(servers[0].made)
+            servers[0].transport.pause_reading()
+            transport.set_write_buffer_limits(high=2 ** 16, low=2 ** 14)
+            chunk = b("x") * 2 ** 16
+            while not protocol.paused.done():
+                transport.write(chunk)
+            self.assertTrue(transport.get_write_buffer_size() > 2 ** 16)
+            self.assertFalse(protocol.resumed.done())
+
+            servers[0].transport.resume_reading()
+            self._wait(protocol.resumed)
+            transport.close()
+            self._wait(protocol.lost)
+
+
+        def test_flow_control_pending(self):
+            """
+            Application data waiting to be encrypted, here while a
+            renegotiation waits for the peer, counts towards the high water
+            mark.
+            """
+            servers = []
+            def factory():
+                servers.append(_RecordingProtocol(self.loop, echo=True))
+                return servers[-1]
+            port = self._serve(factory)
+
+            transport, protocol = self._connect(port)
+            self._wait(servers[0].made)
+            servers[0].transport.pause_reading()
+            transport.set_write_buffer_limits(high=2 ** 10)
+            transport.get_extra_info('ssl_connection').renegotiate()
+            transport.write(b("x") * 2 ** 12)
+            self.assertTrue(protocol.paused.done())
+            self.assertTrue(transport.get_write_buffer_size() >= 2 ** 12)
+
+            servers[0].transport.resume_reading()
+            self._wait(protocol.resumed)
+            self._until(lambda: len(b("").join(protocol.received)) == 2 ** 12)
+            transport.close()
+            self._wait(protocol.lost)
+
+
+        def test_lost(self):
+            """
+            Once the connection is lost, the transport is closing, writing to
+            it raises :py:obj:`RuntimeError`, and its other methods do
+            nothing.
+            """
+            servers = []
+            def factory():
+                servers.append(_RecordingProtocol(self.loop))
+                return servers[-1]
+            port = self._serve(factory)
+
+            transport, protocol = self._connect(port)
+            self._wait(servers[0].made)
+            servers[0].transport.close()
+            self._wait(protocol.lost)
+            self.assertTrue(transport.is_closing())
+            self.assertRaises(RuntimeError, transport.write, b("x"))
+            transport.pause_reading()
+            transport.resume_reading()
+            transport.set_write_buffer_limits(high=10)
+            self.assertEqual(transport.get_write_buffer_size(), 0)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -10,10 +10,12 @@ from unittest import main
 import os, re, sys
 from subprocess import PIPE, Popen
 from datetime import datetime, timedelta
+from pickle import dumps, loads
 
 from OpenSSL.crypto import TYPE_RSA, TYPE_DSA, Error, PKey, PKeyType
 from OpenSSL.crypto import X509, X509Type, X509Name, X509NameType
 from OpenSSL.crypto import X509Req, X509ReqType
+from OpenSSL.crypto import X509Store, X509StoreType
 from OpenSSL.crypto import X509Extension, X509ExtensionType
 from OpenSSL.crypto import load_certificate, load_privatekey
 from OpenSSL.crypto import FILETYPE_PEM, FILETYPE_ASN1, FILETYPE_TEXT
@@ -2747,6 +2749,119 @@ class CRLTests(TestCase):
         self.assertRaises(Error, load_crl, FILETYPE_PEM, "hello, world")
 
 
+
+class X509StoreTests(TestCase):
+    """
+    Tests for :py:obj:`OpenSSL.crypto.X509Store`.
+    """
+    def test_type(self):
+        """
+        :py:obj:`X509Store` and :py:obj:`X509StoreType` refer to the same type
+        object and can be used to create instances of that type.
+        """
+        self.assertIdentical(X509Store, X509StoreType)
+        self.assertConsistentType(X509Store, 'X509Store')
+
+
+    def test_construction_wrong_args(self):
+        """
+        :py:obj:`X509Store` raises :py:obj:`TypeError` if called with any
+        arguments.
+        """
+        self.assertRaises(TypeError, X509Store, None)
+
+
+    def test_add_cert(self):
+        """
+        :py:obj:`X509Store.add_cert` adds a certificate to a new store.
+        """
+        store = X509Store()
+        store.add_cert(load_certificate(FILETYPE_PEM, root_cert_pem))
+        self.assertRaises(TypeError, store.add_cert, object())
+
+
+
+class ErrorTests(TestCase):
+    """
+    Tests for :py:obj:`OpenSSL.crypto.Error`.
+    """
+    def _error(self):
+        return self.assertRaises(
+            Error, load_certificate, FILETYPE_PEM, b("-----BEGIN CERTIFICATE-----"))
+
+
+    def test_codes(self):
+        """
+        An :py:obj:`Error` raised for the OpenSSL error queue has a ``codes``
+        attribute giving the packed code of each error in it, one for each
+        error described by its args.
+        """
+        e = self._error()
+        self.assertTrue(isinstance(e.codes, tuple))
+        self.assertNotEqual(e.codes, ())
+        for code in e.codes:
+            self.assertEqual(code, int(code))
+        self.assertEqual(len(e.codes), len(e.args[0]))
+
+
+    def test_args(self):
+        """
+        The args of an :py:obj:`Error` raised for the OpenSSL error queue are a
+        list of *(lib, function, reason)* string tuples, and its string form
+        includes them.
+        """
+        e = self._error()
+        [errors] = e.args
+        self.assertTrue(isinstance(errors, list))
+        for error in errors:
+            self.assertEqual(len(error), 3)
+        self.assertEqual(e.args, e.args)
+        self.assertEqual(str(e), str(errors))
+
+
+    def test_str_first(self):
+        """
+        The string form of an :py:obj:`Error` raised for the OpenSSL error
+        queue describes its errors even if its args were not used first.
+        """
+        e = self._error()
+        errors = str(e)
+        self.assertEqual(errors, str(e.args[0]))
+
+
+    def test_set_args(self):
+        """
+        The args of an :py:obj:`Error` raised for the OpenSSL error queue can be
+        replaced before they have been used.
+        """
+        e = self._error()
+        e.args = ("replaced",)
+        self.assertEqual(e.args, ("replaced",))
+        self.assertEqual(str(e), "replaced")
+
+
+    def test_without_queue(self):
+        """
+        An :py:obj:`Error` created directly has the arguments it was created
+        with and no codes.
+        """
+        e = Error("hello")
+        self.assertEqual(e.args, ("hello",))
+        self.assertEqual(e.codes, ())
+
+
+    def test_pickle(self):
+        """
+        An :py:obj:`Error` raised for the OpenSSL error queue can be pickled,
+        keeping its codes and the description of its errors.
+        """
+        e = self._error()
+        copy = loads(dumps(e))
+        self.assertEqual(copy.codes, e.codes)
+        self.assertEqual(copy.args, e.args)
+
+
+
 class SignVerifyTests(TestCase):
     """
     Tests for :py:obj:`OpenSSL.crypto.sign` and :py:obj:`OpenSSL.crypto.verify`.
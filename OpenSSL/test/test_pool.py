@@ -0,0 +1,258 @@
+# Copyright (C) Jean-Paul Calderone
+# See LICENSE for details.
+
+"""
+Unit tests for :py:obj:`OpenSSL.pool`.
+"""
+
+from unittest import main
+from socket import socket, timeout
+from threading import Thread
+from time import sleep
+
+from OpenSSL.crypto import FILETYPE_PEM, load_certificate, load_privatekey
+from OpenSSL.SSL import TLSv1_METHOD, Context, Connection, Error
+from OpenSSL.pool import ConnectionPool, PoolTimeoutError
+
+from OpenSSL.test.util import TestCase, b
+from OpenSSL.test.test_crypto import server_cert_pem, server_key_pem
+
+
+class _Server(object):
+    """
+    A blocking TLS server, run in threads, which echoes whatever it receives
+    and records the server names its clients ask for.
+    """
+    def __init__(self):
+        self.context = Context(TLSv1_METHOD)
+        self.context.use_privatekey(
+            load_privatekey(FILETYPE_PEM, server_key_pem))
+        self.context.use_certificate(
+            load_certificate(FILETYPE_PEM, server_cert_pem))
+        self.context.set_session_id(b("pool-test"))
+        self.names = []
+        self.context.set_tlsext_servername_callback(
+            lambda conn: self.names.append(conn.get_servername()))
+        self.connections = []
+        self._listener = socket()
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(5)
+        self._listener.settimeout(0.05)
+        self.port = self._listener.getsockname()[1]
+        self._running = True
+        self._threads = [Thread(target=self._accept)]
+        self._threads[0].start()
+
+
+    def _accept(self):
+        while self._running:
+            try:
+                sock, address = self._listener.accept()
+            except timeout:
+                continue
+            sock.settimeout(None)
+            connection = Connection(self.context, sock)
+            connection.set_accept_state()
+            self.connections.append(connection)
+            thread = Thread(target=self._echo, args=(connection,))
+            thread.start()
+            self._threads.append(thread)
+
+
+    def _echo(self, connection):
+        try:
+            while True:
+                connection.sendall(connection.recv(1024))
+        except Error:
+            pass
+
+
+    def stop(self):
+        self._running = False
+        for connection in self.connections:
+            try:
+                connection.sock_shutdown(2)
+            except Exception:
+                pass
+        for thread in self._threads:
+            thread.join(10)
+        self._listener.close()
+
+
+
+class ConnectionPoolTests(TestCase):
+    """
+    Tests for :py:obj:`OpenSSL.pool.ConnectionPool`.
+    """
+    def setUp(self):
+        self.server = _Server()
+        self.pool = ConnectionPool(Context(TLSv1_METHOD))
+
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+        TestCase.tearDown(self)
+
+
+    def _acquire(self, **kwargs):
+        return self.pool.acquire('127.0.0.1', self.server.port, **kwargs)
+
+
+    def _echo(self, connection, data=b("hello")):
+        connection.sendall(data)
+        self.assertEqual(connection.recv(1024), data)
+
+
+    def test_reuse(self):
+        """
+        A released connection is handed out again by the next
+        :py:obj:`ConnectionPool.acquire` for the same place.
+        """
+        first = self._acquire()
+        self._echo(first)
+        self.pool.release(first)
+        second = self._acquire()
+        self.assertIdentical(first, second)
+        self._echo(second)
+        self.pool.release(second)
+        self.assertEqual((self.pool.hits, self.pool.misses), (1, 1))
+
+
+    def test_busy(self):
+        """
+        A connection in use is not handed out again; a new one is made.
+        """
+        first = self._acquire()
+        second = self._acquire()
+        self.assertNotEqual(first, second)
+        self._echo(first)
+        self._echo(second)
+        self.pool.release(first)
+        self.pool.release(second)
+        self.assertEqual((self.pool.hits, self.pool.misses), (0, 2))
+
+
+    def test_server_name(self):
+        """
+        Connections for different server names are kept apart, and the name
+        is sent in the server name extension.
+        """
+        first = self._acquire(server_name=b("one.example"))
+        self.pool.release(first)
+        second = self._acquire(server_name=b("two.example"))
+        self.assertNotEqual(first, second)
+        self.pool.release(second)
+        self.assertEqual(
+            self.server.names, [b("one.example"), b("two.example")])
+
+
+    def test_not_reusable(self):
+        """
+        A connection released as not reusable is closed and a later
+        :py:obj:`ConnectionPool.acquire` makes a new one.
+        """
+        first = self._acquire()
+        self.pool.release(first, reusable=False)
+        self.assertRaises(Error, first.send, b("x"))
+        second = self._acquire()
+        self.assertNotEqual(first, second)
+        self.pool.release(second)
+        self.assertEqual((self.pool.hits, self.pool.misses), (0, 2))
+
+
+    def test_max_idle(self):
+        """
+        No more than *max_idle_per_key* connections are kept idle.
+        """
+        self.pool.max_idle_per_key = 1
+        first = self._acquire()
+        second = self._acquire()
+        self.pool.release(first)
+        self.pool.release(second)
+        self.assertIdentical(self._acquire(), first)
+        self.assertNotEqual(self._acquire(), second)
+
+
+    def test_idle_timeout(self):
+        """
+        Connections idle for longer than *idle_timeout* are not handed out.
+        """
+        self.pool.idle_timeout = 0.01
+        first = self._acquire()
+        self.pool.release(first)
+        sleep(0.05)
+        second = self._acquire()
+        self.assertNotEqual(first, second)
+        self.pool.release(second)
+        self.assertEqual((self.pool.hits, self.pool.misses), (0, 2))
+
+
+    def test_expire(self):
+        """
+        :py:obj:`ConnectionPool.expire` closes connections idle for longer
+        than *idle_timeout*.
+        """
+        first = self._acquire()
+        self.pool.release(first)
+        self.pool.expire()
+        self.assertIdentical(self._acquire(), first)
+        self.pool.release(first)
+        self.pool.idle_timeout = 0
+        sleep(0.01)
+        self.pool.expire()
+        self.assertRaises(Error, first.send, b("x"))
+
+
+    def test_closed_by_server(self):
+        """
+        An idle connection the server has closed is not handed out.
+        """
+        first = self._acquire()
+        self.pool.release(first)
+        self.server.connections[0].sock_shutdown(1)
+        sleep(0.05)
+        second = self._acquire()
+        self.assertNotEqual(first, second)
+        self._echo(second)
+        self.pool.release(second)
+
+
+    def test_stale_closed_without_lock(self):
+        """
+        The idle connections :py:obj:`ConnectionPool.acquire` finds unusable
+        are closed after the pool's lock is released.
+        """
+        closed = []
+        close = self.pool._close
+        def recordingClose(connection):
+            closed.append((connection, self.pool._lock._is_owned()))
+            close(connection)
+        self.pool._close = recordingClose
+
+        first = self._acquire()
+        self.pool.release(first)
+        self.server.connections[0].sock_shutdown(1)
+        sleep(0.05)
+        second = self._acquire()
+        self.assertEqual(closed, [(first, False)])
+        self.pool.release(second)
+
+
+    def test_max_per_key(self):
+        """
+        :py:obj:`ConnectionPool.acquire` raises :py:obj:`PoolTimeoutError` if
+        *max_per_key* connections are in use and none is released before the
+        timeout.
+        """
+        self.pool.max_per_key = 1
+        first = self._acquire()
+        self.assertRaises(PoolTimeoutError, self._acquire, timeout=0.01)
+        self.pool.release(first)
+        self.assertIdentical(self._acquire(timeout=0.01), first)
+        self.pool.release(first)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# Copyright (C) Jean-Paul Calderone
+# See LICENSE for details.
+
+"""
+Unit tests for :py:obj:`OpenSSL.reloader`.
+"""
+
+import os
+from unittest import main
+from time import time, sleep
+
+from OpenSSL.SSL import TLSv1_METHOD, Context, Connection, Error
+from OpenSSL.reloader import ContextReloader
+
+from OpenSSL.test.util import TestCase
+from OpenSSL.test.test_crypto import (
+    root_cert_pem, server_cert_pem, server_key_pem,
+    client_cert_pem, client_key_pem)
+from OpenSSL.test.test_ssl import _LoopbackMixin
+
+
+class ContextReloaderTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`OpenSSL.reloader.ContextReloader`.
+    """
+    def setUp(self):
+        self.certificate = self.mktemp()
+        self.key = self.mktemp()
+        self._stamp = time()
+        self._write(server_cert_pem + root_cert_pem, server_key_pem)
+        self.reloader = ContextReloader(
+            self.certificate, self.key, TLSv1_METHOD)
+
+
+    def tearDown(self):
+        self.reloader.stop()
+        TestCase.tearDown(self)
+
+
+    def _write(self, certificate=None, key=None):
+        """
+        Replace the files, and make sure they look changed even if the clock
+        has not moved on since they were last written.
+        """
+        self._stamp += 10
+        for name, data in [(self.certificate, certificate), (self.key, key)]:
+            if data is not None:
+                fObj = open(name, 'wb')
+                fObj.write(data)
+                fObj.close()
+                os.utime(name, (self._stamp, self._stamp))
+
+
+    def _subject(self, context):
+        server = Connection(context, None)
+        server.set_accept_state()
+        client = Connection(Context(TLSv1_METHOD), None)
+        client.set_connect_state()
+        self._interactInMemory(server, client)
+        return client.get_peer_certificate().get_subject().CN
+
+
+    def test_loaded(self):
+        """
+        :py:obj:`ContextReloader` loads a Context from the files, and
+        :py:obj:`ContextReloader.check` keeps it while they do not change.
+        """
+        context = self.reloader.context
+        self.assertEqual(self._subject(context), "lovely server")
+        self.assertFalse(self.reloader.check())
+        self.assertIdentical(self.reloader.context, context)
+        self.assertEqual(self.reloader.reloads, 0)
+
+
+    def test_invalid(self):
+        """
+        :py:obj:`ContextReloader` raises :py:obj:`OpenSSL.SSL.Error` if the
+        key does not match the certificate.
+        """
+        self._write(client_cert_pem)
+        self.assertRaises(Error, ContextReloader, self.certificate, self.key)
+
+
+    def test_reload(self):
+        """
+        When the files change, :py:obj:`ContextReloader.check` loads a new
+        Context from them.  Connections made with the old Context keep it.
+        """
+        old = self.reloader.context
+        before = Connection(old, None)
+        self._write(client_cert_pem, client_key_pem)
+        self.assertTrue(self.reloader.check())
+        self.assertNotIdentical(self.reloader.context, old)
+        self.assertEqual(self.reloader.reloads, 1)
+        self.assertEqual(self._subject(self.reloader.context), "ugly client")
+        self.assertIdentical(before.get_context(), old)
+        self.assertFalse(self.reloader.check())
+
+
+    def test_mismatch(self):
+        """
+        If only one of the files has been replaced, so that they do not match,
+        :py:obj:`ContextReloader.check` keeps the old Context and records the
+        error, and loads a new one once the other file is replaced too.
+        """
+        old = self.reloader.context
+        self._write(client_cert_pem)
+        self.assertFalse(self.reloader.check())
+        self.assertIdentical(self.reloader.context, old)
+        self.assertEqual(self.reloader.failures, 1)
+        self.assertTrue(isinstance(self.reloader.last_error, Error))
+        self.assertFalse(self.reloader.check())
+        self.assertEqual(self.reloader.failures, 1)
+
+        self._write(key=client_key_pem)
+        self.assertTrue(self.reloader.check())
+        self.assertEqual(self._subject(self.reloader.context), "ugly client")
+
+
+    def test_install(self):
+        """
+        Connections made with a Context a :py:obj:`ContextReloader` is
+        installed on use the current Context for their handshake.
+        """
+        front = Context(TLSv1_METHOD)
+        self.reloader.install(front)
+        self.assertEqual(self._subject(front), "lovely server")
+        self._write(client_cert_pem, client_key_pem)
+        self.reloader.check()
+        self.assertEqual(self._subject(front), "ugly client")
+
+
+    def test_start(self):
+        """
+        :py:obj:`ContextReloader.start` checks the files in a thread until
+        :py:obj:`ContextReloader.stop` is called.
+        """
+        old = self.reloader.context
+        self.reloader.start(0.01)
+        self.assertRaises(ValueError, self.reloader.start)
+        self._write(client_cert_pem, client_key_pem)
+        for i in range(500):
+            if self.reloader.context is not old:
+                break
+            sleep(0.01)
+        self.assertEqual(self.reloader.reloads, 1)
+        self.reloader.stop()
+        self._write(server_cert_pem, server_key_pem)
+        sleep(0.05)
+        self.assertEqual(self.reloader.reloads, 1)
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+# Copyright (C) Jean-Paul Calderone
+# See LICENSE for details.
+
+"""
+Unit tests for :py:obj:`OpenSSL.server`.
+"""
+
+import os
+import sys
+from errno import EMFILE
+from unittest import main
+from socket import socket, SHUT_RDWR
+from threading import Thread
+from time import time
+
+from OpenSSL.crypto import FILETYPE_PEM, load_certificate, load_privatekey
+from OpenSSL.SSL import TLSv1_METHOD, Context, Connection
+from OpenSSL.SSL import ZeroReturnError
+
+from OpenSSL.test.util import TestCase, b
+from OpenSSL.test.test_crypto import server_cert_pem, server_key_pem
+
+try:
+    import selectors
+    from OpenSSL.server import (
+        HANDSHAKING, OPEN, SHUTTING_DOWN, CLOSED, ConnectionHandler,
+        TLSServer)
+except ImportError:
+    selectors = None
+
+
+
+if selectors is not None:
+    class _RecordingHandler(ConnectionHandler):
+        """
+        A handler which records what happens to it and echoes back whatever
+        it receives, closing the connection when it receives ``b"close"``.
+        """
+        def __init__(self):
+            self.connection = None
+            self.received = []
+            self.lost = []
+
+
+        def connection_made(self, connection):
+            self.connection = connection
+
+
+        def data_received(self, data):
+            self.received.append(data)
+            if data == b("close"):
+                self.connection.close()
+            else:
+                self.connection.write(data)
+
+
+        def connection_lost(self, reason):
+            self.lost.append(reason)
+
+
+
+class TLSServerTests(TestCase):
+    """
+    Tests for :py:obj:`OpenSSL.server.TLSServer`.
+    """
+    def setUp(self):
+        self.server = None
+        self.handlers = []
+        self.threads = []
+
+
+    def tearDown(self):
+        for thread in self.threads:
+            thread.join(10)
+        if self.server is not None:
+            self.server.close()
+        TestCase.tearDown(self)
+
+
+    def _serverContext(self):
+        ctx = Context(TLSv1_METHOD)
+        ctx.use_privatekey(load_privatekey(FILETYPE_PEM, server_key_pem))
+        ctx.use_certificate(load_certificate(FILETYPE_PEM, server_cert_pem))
+        return ctx
+
+
+    def _serve(self, handler=None, **kwargs):
+        if handler is None:
+            handler = _RecordingHandler
+        def factory():
+            self.handlers.append(handler())
+            return self.handlers[-1]
+        self.server = TLSServer(
+            self._serverContext(), ('127.0.0.1', 0), factory, **kwargs)
+        return self.server
+
+
+    def _client(self):
+        client = Connection(Context(TLSv1_METHOD), socket())
+        client.connect(self.server.address)
+        client.set_connect_state()
+        return client
+
+
+    def _inThread(self, function, *args):
+        """
+        Call *function* in a new thread and return a list which will contain
+        its result, or the exception it raised, when it is done.
+        """
+        result = []
+        def run():
+            try:
+                result.append(function(*args))
+            except Exception:
+                result.append(sys.exc_info()[1])
+        thread = Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+        return result
+
+
+    def _until(self, predicate):
+        for i in range(1000):
+            if predicate():
+                return
+            self.server.serve_once(0.01)
+        self.fail("Condition never became true")
+
+
+    if selectors is not None:
+        def test_echo(self):
+            """
+            Data sent by a client is delivered to its handler, and data the
+            handler writes is received by the client.
+            """
+            self._serve()
+            def echo(message):
+                client = self._client()
+                client.sendall(message)
+                received = client.recv(1024)
+                client.close()
+                return received
+            result = self._inThread(echo, b("hello, world"))
+            self._until(lambda: result)
+            self.assertEqual(result, [b("hello, world")])
+            self.assertEqual(self.handlers[0].received, [b("hello, world")])
+
+
+        def test_many_connections(self):
+            """
+            Connections are served concurrently by the one thread.
+            """
+            self._serve()
+            clients = []
+            for i in range(20):
+                clients.append(self._client())
+
+            def talk():
+                for i, client in enumerate(clients):
+                    client.sendall(b("message %d" % (i,)))
+                received = [client.recv(1024) for client in clients]
+                for client in clients:
+                    client.close()
+                return received
+            result = self._inThread(talk)
+            self._until(lambda: result)
+            self.assertEqual(
+                result[0], [b("message %d" % (i,)) for i in range(20)])
+
+
+        def test_states(self):
+            """
+            A connection starts out :py:data:`HANDSHAKING`, waiting to read,
+            becomes :py:data:`OPEN` once the handshake is done and is
+            :py:data:`CLOSED` and forgotten once it is over.
+            """
+            server = self._serve()
+            client = self._client()
+            self._until(lambda: server.connections)
+            [connection] = server.connections
+            self.assertEqual(connection.state, HANDSHAKING)
+            self.assertEqual(connection.events, selectors.EVENT_READ)
+
+            result = self._inThread(client.do_handshake)
+            self._until(lambda: connection.state == OPEN)
+            self._until(lambda: result)
+            self.assertEqual(result, [None])
+
+            client.shutdown(SHUT_RDWR)
+            self._until(lambda: connection.state == CLOSED)
+            self.assertEqual(server.connections, set())
+            self.assertEqual(self.handlers[0].lost, [None])
+            client.close()
+
+
+        def test_handler_closes(self):
+            """
+            When the handler closes the connection, the client receives a
+            closure alert.
+            """
+            self._serve()
+            def closed():
+                client = self._client()
+                client.sendall(b("close"))
+                try:
+                    client.recv(1024)
+                finally:
+                    client.close()
+            result = self._inThread(closed)
+            self._until(lambda: result)
+            self.assertTrue(isinstance(result[0], ZeroReturnError))
+            self.assertEqual(self.handlers[0].lost, [None])
+
+
+        def test_shutdown_waits(self):
+            """
+            If the socket is full when the connection is closed, the
+            connection waits for it to become writable, sends what is left and
+            the closure alert, and then closes cleanly.
+            """
+            server = self._serve()
+            client = self._client()
+            self._until(lambda: server.connections)
+            [connection] = server.connections
+            result = self._inThread(client.do_handshake)
+            self._until(lambda: result)
+            while not connection.get_write_buffer_size():
+                connection.write(b("x") * 16384)
+            connection.close()
+            self.assertEqual(connection.state, SHUTTING_DOWN)
+            self.assertEqual(connection.events, selectors.EVENT_WRITE)
+            self.assertEqual(self.handlers[0].lost, [])
+
+            def drain():
+                try:
+                    while True:
+                        client.recv(16384)
+                except ZeroReturnError:
+                    return True
+            drained = self._inThread(drain)
+            self._until(lambda: connection.state == CLOSED)
+            self.assertEqual(self.handlers[0].lost, [None])
+            self._until(lambda: drained)
+            self.assertEqual(drained, [True])
+            client.close()
+
+
+        def test_handshake_failure(self):
+            """
+            A connection whose handshake fails is closed without its handler
+            being connected.
+            """
+            server = self._serve()
+            client = socket()
+            client.connect(server.address)
+            client.sendall(b("this is not a TLS handshake\r\n") * 10)
+            self._until(lambda: self.handlers and not server.connections)
+            self.assertIdentical(self.handlers[0].connection, None)
+            self.assertEqual(self.handlers[0].lost, [])
+            client.close()
+
+
+        def test_write_on_connect(self):
+            """
+            More data than the socket takes, written as soon as the connection
+            is made, is all sent without the client sending anything.
+            """
+            size = 2 ** 22
+            class Greeter(_RecordingHandler):
+                def connection_made(self, connection):
+                    _RecordingHandler.connection_made(self, connection)
+                    connection.write(b("x") * size)
+            self._serve(Greeter)
+            def receive():
+                client = self._client()
+                received = 0
+                try:
+                    while received < size:
+                        received += len(client.recv(65536))
+                finally:
+                    client.close()
+                return received
+            result = self._inThread(receive)
+            self._until(lambda: result)
+            self.assertEqual(result, [size])
+
+
+        def test_handshake_timeout(self):
+            """
+            A connection which does not complete its handshake within
+            *handshake_timeout* seconds is aborted, even if nothing else
+            happens.
+            """
+            server = self._serve(handshake_timeout=0.2)
+            client = socket()
+            client.connect(server.address)
+            self._until(lambda: server.connections)
+            start = time()
+            while server.connections:
+                server.serve_once(5)
+            self.assertTrue(0.1 < time() - start < 4)
+            self.assertEqual(self.handlers[0].lost, [])
+            self.assertEqual(client.recv(1024), b(""))
+            client.close()
+
+
+        def test_write_closed(self):
+            """
+            :py:obj:`ServerConnection.write` raises :py:obj:`ValueError` if
+            the connection is not open.
+            """
+            server = self._serve()
+            client = self._client()
+            self._until(lambda: server.connections)
+            [connection] = server.connections
+            self.assertRaises(ValueError, connection.write, b("x"))
+            client.close()
+
+
+        def _exhaust(self, server):
+            """
+            Make the listener's next ``accept`` fail with :py:obj:`EMFILE`,
+            as if the process had run out of descriptors.
+            """
+            listener = server._listener
+            class Exhausted(object):
+                def accept(self):
+                    server._listener = listener
+                    raise OSError(EMFILE, "Too many open files")
+                def __getattr__(self, name):
+                    return getattr(listener, name)
+            server._listener = Exhausted()
+
+
+        def test_out_of_descriptors(self):
+            """
+            When ``accept`` fails because there are no descriptors left, the
+            server closes the pending connection using its reserve descriptor
+            instead of having the listener reported ready again at once.
+            """
+            server = self._serve()
+            self._exhaust(server)
+            client = socket()
+            client.connect(server.address)
+            self.assertEqual(server.serve_once(1), 1)
+            self.assertEqual(server.connections, set())
+            self.assertEqual(client.recv(1024), b(""))
+            self.assertEqual(server.serve_once(0), 0)
+            client.close()
+
+
+        def test_out_of_descriptors_no_reserve(self):
+            """
+            Without a reserve descriptor, the server stops listening when it
+            runs out of descriptors, and starts again once a connection is
+            closed.
+            """
+            server = self._serve()
+            first = self._client()
+            self._until(lambda: server.connections)
+            [connection] = server.connections
+            self._exhaust(server)
+            server._openReserve = lambda: None
+            os.close(server._reserve)
+            server._reserve = None
+            second = socket()
+            second.connect(server.address)
+            self.assertEqual(server.serve_once(1), 1)
+            self.assertEqual(server.serve_once(0), 0)
+            self.assertEqual(len(server.connections), 1)
+
+            connection.abort()
+            self._until(lambda: server.connections)
+            self.assertFalse(connection in server.connections)
+            first.close()
+            second.close()
+
+
+        def test_serve_forever(self):
+            """
+            :py:obj:`TLSServer.serve_forever` handles events until
+            :py:obj:`TLSServer.shutdown` is called.
+            """
+            server = self._serve()
+            class Stopper(ConnectionHandler):
+                def data_received(self, data):
+                    server.shutdown()
+            server.handler_factory = Stopper
+            client = self._client()
+            result = self._inThread(client.sendall, b("stop"))
+            server.serve_forever(0.01)
+            self.threads[-1].join(10)
+            self.assertEqual(result, [None])
+            client.close()
+
+
+
+if __name__ == '__main__':
+    main()
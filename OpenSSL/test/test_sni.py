@@ -0,0 +1,293 @@
+# Copyright (C) Jean-Paul Calderone
+# See LICENSE for details.
+
+"""
+Unit tests for :py:obj:`OpenSSL.sni`.
+"""
+
+import os
+from sys import platform
+from unittest import main
+from time import sleep
+
+from OpenSSL.crypto import FILETYPE_PEM, load_certificate, load_privatekey
+from OpenSSL.SSL import TLSv1_METHOD, Context, Connection, Error
+from OpenSSL.sni import ContextCache, DirectoryLoader
+
+from OpenSSL.test.util import TestCase, b
+from OpenSSL.test.test_crypto import (
+    root_cert_pem, server_cert_pem, server_key_pem)
+from OpenSSL.test.test_ssl import _LoopbackMixin
+
+
+class ContextCacheTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`OpenSSL.sni.ContextCache`.
+    """
+    def setUp(self):
+        self.loaded = []
+        self.sizes = {}
+
+
+    def _loader(self, server_name):
+        self.loaded.append(server_name)
+        if server_name.startswith(b("missing")):
+            return None
+        if server_name.startswith(b("broken")):
+            raise ValueError(server_name)
+        context = Context(TLSv1_METHOD)
+        context.use_privatekey(load_privatekey(FILETYPE_PEM, server_key_pem))
+        context.use_certificate(load_certificate(FILETYPE_PEM, server_cert_pem))
+        if server_name in self.sizes:
+            return context, self.sizes[server_name]
+        return context
+
+
+    def test_cached(self):
+        """
+        :py:obj:`ContextCache.get` calls the loader only the first time a name
+        is asked for, and returns the same Context every time.
+        """
+        cache = ContextCache(self._loader)
+        first = cache.get(b("one.example"))
+        self.assertTrue(isinstance(first, Context))
+        self.assertIdentical(cache.get(b("one.example")), first)
+        self.assertIdentical(cache.get(b("ONE.example")), first)
+        self.assertEqual(self.loaded, [b("one.example")])
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(len(cache), 1)
+
+
+    def test_missing(self):
+        """
+        Names the loader has no Context for are remembered apart from the
+        Contexts, up to *max_missing* of them, and do not push Contexts out.
+        """
+        cache = ContextCache(self._loader, max_contexts=1, max_missing=2)
+        context = cache.get(b("one.example"))
+        self.assertIdentical(cache.get(b("missing.example")), None)
+        self.assertIdentical(cache.get(b("MISSING.example")), None)
+        self.assertEqual(self.loaded, [b("one.example"), b("missing.example")])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        for name in [b("missing1.example"), b("missing2.example")]:
+            self.assertIdentical(cache.get(name), None)
+        self.assertEqual((len(cache), cache.evictions), (1, 0))
+        self.assertIdentical(cache.get(b("one.example")), context)
+
+        # Only the two most recent are remembered.
+        del self.loaded[:]
+        cache.get(b("missing2.example"))
+        cache.get(b("missing.example"))
+        self.assertEqual(self.loaded, [b("missing.example")])
+
+        self.assertTrue(cache.evict(b("missing.example")))
+        cache.get(b("missing.example"))
+        cache.clear()
+        cache.get(b("missing.example"))
+        self.assertEqual(self.loaded, [b("missing.example")] * 3)
+
+
+    def test_missing_not_remembered(self):
+        """
+        With *max_missing* 0, the loader is called every time for names it has
+        no Context for.
+        """
+        cache = ContextCache(self._loader, max_missing=0)
+        cache.get(b("missing.example"))
+        cache.get(b("missing.example"))
+        self.assertEqual(self.loaded, [b("missing.example")] * 2)
+
+
+    def test_loader_error(self):
+        """
+        An exception raised by the loader is raised by
+        :py:obj:`ContextCache.get`, counted, and not cached.
+        """
+        cache = ContextCache(self._loader)
+        self.assertRaises(ValueError, cache.get, b("broken.example"))
+        self.assertRaises(ValueError, cache.get, b("broken.example"))
+        self.assertEqual(cache.errors, 2)
+        self.assertEqual(len(cache), 0)
+
+
+    def test_max_contexts(self):
+        """
+        When there are more than *max_contexts* Contexts, the least recently
+        used one is thrown away.
+        """
+        cache = ContextCache(self._loader, max_contexts=2)
+        cache.get(b("one.example"))
+        cache.get(b("two.example"))
+        cache.get(b("one.example"))
+        cache.get(b("three.example"))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        del self.loaded[:]
+        cache.get(b("one.example"))
+        cache.get(b("three.example"))
+        self.assertEqual(self.loaded, [])
+        cache.get(b("two.example"))
+        self.assertEqual(self.loaded, [b("two.example")])
+
+
+    def test_max_bytes(self):
+        """
+        When the sizes the loader gives add up to more than *max_bytes*, the
+        least recently used Contexts are thrown away, but the newest one is
+        always kept.
+        """
+        self.sizes = {
+            b("one.example"): 40, b("two.example"): 40,
+            b("three.example"): 50, b("huge.example"): 500}
+        cache = ContextCache(self._loader, max_bytes=100)
+        cache.get(b("one.example"))
+        cache.get(b("two.example"))
+        self.assertEqual(cache.bytes, 80)
+        cache.get(b("three.example"))
+        self.assertEqual(cache.bytes, 90)
+        self.assertEqual(len(cache), 2)
+        cache.get(b("huge.example"))
+        self.assertEqual(cache.bytes, 500)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.evictions, 3)
+
+
+    def test_evict(self):
+        """
+        :py:obj:`ContextCache.evict` throws away the Context for a name, so
+        that it is loaded again, and :py:obj:`ContextCache.clear` throws away
+        all of them.
+        """
+        self.sizes = {b("one.example"): 10}
+        cache = ContextCache(self._loader)
+        cache.get(b("one.example"))
+        cache.get(b("two.example"))
+        self.assertTrue(cache.evict(b("one.example")))
+        self.assertFalse(cache.evict(b("one.example")))
+        self.assertEqual(cache.bytes, 0)
+        cache.get(b("one.example"))
+        self.assertEqual(self.loaded, [
+                b("one.example"), b("two.example"), b("one.example")])
+        cache.clear()
+        self.assertEqual((len(cache), cache.bytes), (0, 0))
+        cache.get(b("two.example"))
+        self.assertEqual(len(self.loaded), 4)
+
+
+    def test_load_time(self):
+        """
+        The time spent in the loader is added up.
+        """
+        def loader(server_name):
+            sleep(0.05)
+            return self._loader(server_name)
+        cache = ContextCache(loader)
+        cache.get(b("one.example"))
+        cache.get(b("two.example"))
+        self.assertTrue(cache.load_time >= 0.1)
+        self.assertTrue(0.05 <= cache.max_load_time < cache.load_time)
+
+
+    def _handshake(self, cache, server_name):
+        context = Context(TLSv1_METHOD)
+        context.use_privatekey(load_privatekey(FILETYPE_PEM, server_key_pem))
+        context.use_certificate(load_certificate(FILETYPE_PEM, server_cert_pem))
+        cache.install(context)
+        server = Connection(context, None)
+        server.set_accept_state()
+        client = Connection(Context(TLSv1_METHOD), None)
+        client.set_connect_state()
+        if server_name is not None:
+            client.set_tlsext_host_name(server_name)
+        self._interactInMemory(server, client)
+        return context, server
+
+
+    def test_install(self):
+        """
+        Connections made with a Context a :py:obj:`ContextCache` is installed
+        on are switched to the Context for the server name they ask for.
+        """
+        cache = ContextCache(self._loader)
+        context, server = self._handshake(cache, b("one.example"))
+        self.assertIdentical(server.get_context(), cache.get(b("one.example")))
+
+
+    def test_install_no_context(self):
+        """
+        Connections asking for no server name, for a name there is no Context
+        for, or for a name the loader fails for, keep their Context.
+        """
+        cache = ContextCache(self._loader)
+        for server_name in [None, b("missing.example"), b("broken.example")]:
+            context, server = self._handshake(cache, server_name)
+            self.assertIdentical(server.get_context(), context)
+        self.assertEqual(cache.errors, 1)
+
+
+
+class DirectoryLoaderTests(TestCase):
+    """
+    Tests for :py:obj:`OpenSSL.sni.DirectoryLoader`.
+    """
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.mkdir(self.directory)
+        self._write("one.example.crt", server_cert_pem + root_cert_pem)
+        self._write("one.example.key", server_key_pem)
+
+
+    def _write(self, name, data):
+        fObj = open(os.path.join(self.directory, name), 'wb')
+        fObj.write(data)
+        fObj.close()
+
+
+    def test_load(self):
+        """
+        :py:obj:`DirectoryLoader` loads the chain and key for a name into a
+        new Context, and gives the size of the files as its size.
+        """
+        configured = []
+        loader = DirectoryLoader(self.directory, configure=configured.append)
+        context, size = loader(b("One.Example"))
+        self.assertTrue(isinstance(context, Context))
+        self.assertEqual(configured, [context])
+        self.assertEqual(
+            size, len(server_cert_pem + root_cert_pem + server_key_pem))
+
+
+    def test_missing(self):
+        """
+        :py:obj:`DirectoryLoader` returns :py:obj:`None` for names it has no
+        files for, and for names which are not valid host names.
+        """
+        loader = DirectoryLoader(self.directory)
+        self.assertIdentical(loader(b("two.example")), None)
+        self._write("bad.crt", server_cert_pem)
+        self._write("bad.key", server_key_pem)
+        invalid = [b("/bad"), b(".bad"), b("bad."), b("\xff")]
+        name = os.path.basename(self.directory)
+        invalid.append(b("../") + name.encode('ascii') + b("/bad"))
+        if platform != "win32":
+            self._write("bad\n.crt", server_cert_pem)
+            self._write("bad\n.key", server_key_pem)
+            invalid.append(b("bad\n"))
+        for server_name in invalid:
+            self.assertIdentical(loader(server_name), None)
+
+
+    def test_wrong_key(self):
+        """
+        :py:obj:`DirectoryLoader` raises :py:obj:`OpenSSL.SSL.Error` if the
+        key does not belong to the certificate.
+        """
+        self._write("one.example.crt", root_cert_pem)
+        loader = DirectoryLoader(self.directory)
+        self.assertRaises(Error, loader, b("one.example"))
+
+
+
+if __name__ == '__main__':
+    main()
@@ -6,14 +6,18 @@ Unit tests for :py:obj:`OpenSSL.SSL`.
 """
 
 from gc import collect
+from time import sleep, time
 from errno import ECONNREFUSED, EINPROGRESS, EWOULDBLOCK
-from sys import platform, version_info
-from socket import error, socket
+from sys import exc_info, platform, version_info
+from socket import error, socket, SOL_SOCKET, SO_SNDBUF, SO_RCVBUF
+from threading import Thread
 
 if version_info >= (2, 7, 0, 'alpha', 1):
-    from socket import SHUT_WR
+    from socket import SHUT_WR, SHUT_RDWR
 
+import os
 from os import makedirs
+from select import select
 from os.path import join, dirname
 from unittest import main
 from weakref import ref
@@ -22,10 +26,12 @@ from OpenSSL.crypto import TYPE_RSA, FILETYPE_PEM
 from OpenSSL.crypto import PKey, X509, X509Extension
 from OpenSSL.crypto import dump_privatekey, load_privatekey
 from OpenSSL.crypto import dump_certificate, load_certificate
+from OpenSSL.crypto import X509Store
 
 from OpenSSL.SSL import OPENSSL_VERSION_NUMBER, SSLEAY_VERSION, SSLEAY_CFLAGS
 from OpenSSL.SSL import SSLEAY_PLATFORM, SSLEAY_DIR, SSLEAY_BUILT_ON
 from OpenSSL.SSL import SENT_SHUTDOWN, RECEIVED_SHUTDOWN
+from OpenSSL.SSL import WANT_READ, WANT_WRITE
 from OpenSSL.SSL import SSLv2_METHOD, SSLv3_METHOD, SSLv23_METHOD, TLSv1_METHOD
 from OpenSSL.SSL import OP_NO_SSLv2, OP_NO_SSLv3, OP_SINGLE_DH_USE
 from OpenSSL.SSL import (
@@ -37,7 +43,8 @@ from OpenSSL.SSL import (
     SESS_CACHE_NO_INTERNAL_STORE, SESS_CACHE_NO_INTERNAL)
 
 from OpenSSL.SSL import (
-    Error, SysCallError, WantReadError, ZeroReturnError, SSLeay_version)
+    Error, SysCallError, WantReadError, WantWriteError, ZeroReturnError,
+    SSLeay_version)
 from OpenSSL.SSL import (
     Context, ContextType, Session, Connection, ConnectionType)
 
@@ -61,6 +68,11 @@ try:
 except ImportError:
     OP_NO_TICKET = None
 
+try:
+    from OpenSSL.SSL import SharedSessionCache
+except ImportError:
+    SharedSessionCache = None
+
 try:
     from OpenSSL.SSL import OP_NO_COMPRESSION
 except ImportError:
@@ -612,6 +624,69 @@ class ContextTests(TestCase, _LoopbackMixin):
         self.assertTrue(called)
 
 
+    def test_set_info_callback_mask(self):
+        """
+        :py:obj:`Context.set_info_callback` accepts a bitmask as a second
+        argument, and the callback is only invoked for events which have one of
+        its bits set.
+        """
+        called = []
+        def info(conn, where, ret):
+            called.append(where)
+        context = Context(TLSv1_METHOD)
+        context.set_info_callback(info, SSL_CB_HANDSHAKE_DONE | SSL_CB_ALERT)
+        context.use_certificate(
+            load_certificate(FILETYPE_PEM, cleartextCertificatePEM))
+        context.use_privatekey(
+            load_privatekey(FILETYPE_PEM, cleartextPrivateKeyPEM))
+
+        def makeServer(socket):
+            server = Connection(context, socket)
+            server.set_accept_state()
+            return server
+        server, client = self._loopback(serverFactory=makeServer)
+
+        self.assertTrue(called)
+        for where in called:
+            self.assertTrue(where & (SSL_CB_HANDSHAKE_DONE | SSL_CB_ALERT))
+        self.assertTrue(
+            [where for where in called if where & SSL_CB_HANDSHAKE_DONE])
+
+
+    def test_set_info_callback_empty_mask(self):
+        """
+        The callback given to :py:obj:`Context.set_info_callback` with a mask of
+        0 is never invoked.
+        """
+        called = []
+        context = Context(TLSv1_METHOD)
+        context.set_info_callback(lambda *args: called.append(args), 0)
+        context.use_certificate(
+            load_certificate(FILETYPE_PEM, cleartextCertificatePEM))
+        context.use_privatekey(
+            load_privatekey(FILETYPE_PEM, cleartextPrivateKeyPEM))
+
+        def makeServer(socket):
+            server = Connection(context, socket)
+            server.set_accept_state()
+            return server
+        self._loopback(serverFactory=makeServer)
+        self.assertEqual(called, [])
+
+
+    def test_set_info_callback_wrong_args(self):
+        """
+        :py:obj:`Context.set_info_callback` raises :py:obj:`TypeError` if given
+        a callback which is not callable or a mask which is not an integer.
+        """
+        context = Context(TLSv1_METHOD)
+        self.assertRaises(TypeError, context.set_info_callback)
+        self.assertRaises(TypeError, context.set_info_callback, object())
+        self.assertRaises(TypeError, context.set_info_callback, lambda *a: None, "1")
+        self.assertRaises(
+            TypeError, context.set_info_callback, lambda *a: None, 1, 2)
+
+
     def _load_verify_locations_test(self, *args):
         """
         Create a client context which will verify the peer certificate and call
@@ -704,6 +779,146 @@ class ContextTests(TestCase, _LoopbackMixin):
         self.assertRaises(TypeError, context.load_verify_locations, None, None, None)
 
 
+    def _verify_server_certificate(self, clientContext):
+        """
+        Check that a client using *clientContext* accepts the certificate of
+        a server using :py:obj:`cleartextCertificatePEM`.
+        """
+        clientContext.set_verify(
+            VERIFY_PEER,
+            lambda conn, cert, errno, depth, preverify_ok: preverify_ok)
+
+        serverContext = Context(TLSv1_METHOD)
+        serverContext.use_certificate(
+            load_certificate(FILETYPE_PEM, cleartextCertificatePEM))
+        serverContext.use_privatekey(
+            load_privatekey(FILETYPE_PEM, cleartextPrivateKeyPEM))
+
+        (server, client) = socket_pair()
+        clientSSL = Connection(clientContext, client)
+        clientSSL.set_connect_state()
+        serverSSL = Connection(serverContext, server)
+        serverSSL.set_accept_state()
+        handshake(clientSSL, serverSSL)
+
+        cert = clientSSL.get_peer_certificate()
+        self.assertEqual(cert.get_subject().CN, 'Testing Root CA')
+
+
+    def test_set_cert_store_wrong_args(self):
+        """
+        :py:obj:`Context.set_cert_store` raises :py:obj:`TypeError` if called
+        with anything other than one :py:obj:`X509Store`.
+        """
+        context = Context(TLSv1_METHOD)
+        self.assertRaises(TypeError, context.set_cert_store)
+        self.assertRaises(TypeError, context.set_cert_store, object())
+        self.assertRaises(
+            TypeError, context.set_cert_store, X509Store(), None)
+
+
+    def test_set_cert_store(self):
+        """
+        :py:obj:`Context.set_cert_store` makes a Context verify peers with a
+        store shared with other Contexts, including certificates added to the
+        store afterwards.
+        """
+        store = X509Store()
+        contexts = [Context(TLSv1_METHOD), Context(TLSv1_METHOD)]
+        for context in contexts:
+            context.set_cert_store(store)
+        store.add_cert(load_certificate(FILETYPE_PEM, cleartextCertificatePEM))
+        del store
+        collect()
+        for context in contexts:
+            self._verify_server_certificate(context)
+
+
+    def test_set_cert_store_from_context(self):
+        """
+        The store of one Context can be given to another with
+        :py:obj:`Context.set_cert_store`, and stays valid when the first
+        Context is gone.  Giving a Context the store it already has changes
+        nothing.
+        """
+        first = Context(TLSv1_METHOD)
+        first.load_verify_buffer(cleartextCertificatePEM)
+        second = Context(TLSv1_METHOD)
+        second.set_cert_store(first.get_cert_store())
+        second.set_cert_store(second.get_cert_store())
+        del first
+        collect()
+        self._verify_server_certificate(second)
+
+
+    def test_get_cert_store_outlives_context(self):
+        """
+        The :py:obj:`X509Store` returned by :py:obj:`Context.get_cert_store`
+        can still be used after the Context is gone.
+        """
+        context = Context(TLSv1_METHOD)
+        store = context.get_cert_store()
+        del context
+        collect()
+        store.add_cert(load_certificate(FILETYPE_PEM, cleartextCertificatePEM))
+
+
+    def test_load_verify_buffer(self):
+        """
+        :py:obj:`Context.load_verify_buffer` accepts a buffer of PEM
+        certificates and uses them for verification purposes.  Loading a
+        certificate a second time is not an error.
+        """
+        clientContext = Context(TLSv1_METHOD)
+        clientContext.load_verify_buffer(cleartextCertificatePEM)
+        clientContext.load_verify_buffer(cleartextCertificatePEM)
+        clientContext.set_verify(
+            VERIFY_PEER,
+            lambda conn, cert, errno, depth, preverify_ok: preverify_ok)
+
+        serverContext = Context(TLSv1_METHOD)
+        serverContext.use_certificate(
+            load_certificate(FILETYPE_PEM, cleartextCertificatePEM))
+        serverContext.use_privatekey(
+            load_privatekey(FILETYPE_PEM, cleartextPrivateKeyPEM))
+
+        (server, client) = socket_pair()
+        clientSSL = Connection(clientContext, client)
+        clientSSL.set_connect_state()
+        serverSSL = Connection(serverContext, server)
+        serverSSL.set_accept_state()
+        handshake(clientSSL, serverSSL)
+
+        cert = clientSSL.get_peer_certificate()
+        self.assertEqual(cert.get_subject().CN, 'Testing Root CA')
+
+
+    def test_load_verify_buffer_invalid(self):
+        """
+        :py:obj:`Context.load_verify_buffer` raises :py:obj:`Error` if the
+        buffer holds no certificates, and :py:obj:`TypeError` if called with
+        the wrong arguments, including a mutable buffer.
+        """
+        context = Context(TLSv1_METHOD)
+        for buffer in [b(""), b("hello")]:
+            try:
+                context.load_verify_buffer(buffer)
+            except Error:
+                self.assertEqual(
+                    exc_info()[1].args,
+                    ("no certificates or CRLs found in buffer",))
+            else:
+                self.fail("load_verify_buffer did not fail")
+        self.assertRaises(TypeError, context.load_verify_buffer)
+        self.assertRaises(TypeError, context.load_verify_buffer, object())
+        self.assertRaises(
+            TypeError, context.load_verify_buffer,
+            bytearray(cleartextCertificatePEM))
+        self.assertRaises(
+            TypeError, context.load_verify_buffer, cleartextCertificatePEM,
+            None)
+
+
     if platform == "win32":
         "set_default_verify_paths appears not to work on Windows.  "
         "See LP#404343 and LP#404344."
@@ -863,6 +1078,61 @@ class ContextTests(TestCase, _LoopbackMixin):
 
         self._handshake_test(serverContext, clientContext)
 
+
+    def test_use_certificate_chain_buffer(self):
+        """
+        :py:obj:`Context.use_certificate_chain_buffer` reads a certificate
+        chain from a buffer, and the server sends all of it.
+        """
+        chain = _create_certificate_chain()
+        [(cakey, cacert), (ikey, icert), (skey, scert)] = chain
+
+        serverContext = Context(TLSv1_METHOD)
+        serverContext.use_certificate_chain_buffer(
+            dump_certificate(FILETYPE_PEM, scert) +
+            dump_certificate(FILETYPE_PEM, icert) +
+            dump_certificate(FILETYPE_PEM, cacert))
+        serverContext.use_privatekey(skey)
+
+        clientContext = Context(TLSv1_METHOD)
+        clientContext.set_verify(
+            VERIFY_PEER | VERIFY_FAIL_IF_NO_PEER_CERT, verify_cb)
+        clientContext.load_verify_buffer(dump_certificate(FILETYPE_PEM, cacert))
+
+        (server, client) = socket_pair()
+        serverSSL = Connection(serverContext, server)
+        serverSSL.set_accept_state()
+        clientSSL = Connection(clientContext, client)
+        clientSSL.set_connect_state()
+        handshake(clientSSL, serverSSL)
+
+        self.assertEqual(
+            [cert.get_subject().CN for cert in clientSSL.get_peer_cert_chain()],
+            ["Server Certificate", "Intermediate Certificate",
+             "Authority Certificate"])
+
+
+    def test_use_certificate_chain_buffer_invalid(self):
+        """
+        :py:obj:`Context.use_certificate_chain_buffer` raises :py:obj:`Error`
+        if the buffer holds no certificates or a broken one, and
+        :py:obj:`TypeError` if called with the wrong arguments.
+        """
+        context = Context(TLSv1_METHOD)
+        broken = b("-----BEGIN CERTIFICATE-----\nAAAA\n-----END CERTIFICATE-----\n")
+        self.assertRaises(Error, context.use_certificate_chain_buffer, b(""))
+        self.assertRaises(
+            Error, context.use_certificate_chain_buffer, b("hello"))
+        self.assertRaises(
+            Error, context.use_certificate_chain_buffer,
+            cleartextCertificatePEM + broken)
+        self.assertRaises(TypeError, context.use_certificate_chain_buffer)
+        self.assertRaises(
+            TypeError, context.use_certificate_chain_buffer, object())
+        self.assertRaises(
+            TypeError, context.use_certificate_chain_buffer,
+            bytearray(cleartextCertificatePEM))
+
     # XXX load_client_ca
     # XXX set_session_id
 
@@ -922,6 +1192,20 @@ class ContextTests(TestCase, _LoopbackMixin):
         # XXX What should I assert here? -exarkun
 
 
+    def test_load_tmp_dh_buffer(self):
+        """
+        :py:obj:`Context.load_tmp_dh_buffer` loads Diffie-Hellman parameters
+        from a buffer, and raises :py:obj:`Error` if there are none in it.
+        """
+        context = Context(TLSv1_METHOD)
+        context.load_tmp_dh_buffer(b(dhparam))
+        self.assertRaises(Error, context.load_tmp_dh_buffer, b("hello"))
+        self.assertRaises(TypeError, context.load_tmp_dh_buffer)
+        self.assertRaises(TypeError, context.load_tmp_dh_buffer, object())
+        self.assertRaises(
+            TypeError, context.load_tmp_dh_buffer, bytearray(b(dhparam)))
+
+
     def test_set_cipher_list(self):
         """
         :py:obj:`Context.set_cipher_list` accepts a :py:obj:`str` naming the ciphers which
@@ -1065,116 +1349,1321 @@ class ServerNameCallbackTests(TestCase, _LoopbackMixin):
 
 
 
-class SessionTests(TestCase):
+class ServernameMapTests(TestCase, _LoopbackMixin):
     """
-    Unit tests for :py:obj:`OpenSSL.SSL.Session`.
+    Tests for :py:obj:`Context.set_servername_map`.
     """
-    def test_construction(self):
+    def _context(self):
+        context = Context(TLSv1_METHOD)
+        context.use_privatekey(load_privatekey(FILETYPE_PEM, server_key_pem))
+        context.use_certificate(load_certificate(FILETYPE_PEM, server_cert_pem))
+        return context
+
+
+    def _connect(self, context, name):
         """
-        :py:class:`Session` can be constructed with no arguments, creating a new
-        instance of that type.
+        Connect a client asking for the server name *name*, or none if it is
+        :py:obj:`None`, to a server using *context*, and return the Context the
+        server ends up using.
         """
-        new_session = Session()
-        self.assertTrue(isinstance(new_session, Session))
+        server = Connection(context, None)
+        server.set_accept_state()
 
+        client = Connection(Context(TLSv1_METHOD), None)
+        client.set_connect_state()
+        if name is not None:
+            client.set_tlsext_host_name(name)
 
-    def test_construction_wrong_args(self):
+        self._interactInMemory(server, client)
+        return server.get_context()
+
+
+    def test_wrong_args(self):
         """
-        If any arguments are passed to :py:class:`Session`, :py:obj:`TypeError`
-        is raised.
+        :py:obj:`Context.set_servername_map` raises :py:obj:`TypeError` if
+        called with the wrong number of arguments, a mapping with keys which
+        are not byte strings or values which are not :py:obj:`Context`
+        instances, or a default which is not a :py:obj:`Context`, and
+        :py:obj:`ValueError` for invalid server names.
         """
-        self.assertRaises(TypeError, Session, 123)
-        self.assertRaises(TypeError, Session, "hello")
-        self.assertRaises(TypeError, Session, object())
+        context = Context(TLSv1_METHOD)
+        self.assertRaises(TypeError, context.set_servername_map)
+        self.assertRaises(TypeError, context.set_servername_map, {}, None, None)
+        self.assertRaises(TypeError, context.set_servername_map, object())
+        self.assertRaises(
+            TypeError, context.set_servername_map, {1: context})
+        self.assertRaises(
+            TypeError, context.set_servername_map, {b("a.example.com"): 1})
+        self.assertRaises(
+            TypeError, context.set_servername_map, {}, object())
+        for name in [b(""), b("."), b("a") * 256, b("a*.example.com"),
+                     b("*.*.example.com"), b("a.*.example.com"), b("*"),
+                     b("a\0b")]:
+            self.assertRaises(
+                ValueError, context.set_servername_map, {name: context})
+        self.assertRaises(ValueError, context.set_servername_map, None, context)
 
 
+    def test_exact(self):
+        """
+        A connection asking for a server name in the mapping is switched to its
+        :py:obj:`Context`, whatever the case of the name and with or without a
+        trailing dot, without the servername callback being called.
+        """
+        called = []
+        front = self._context()
+        front.set_tlsext_servername_callback(called.append)
+        target = self._context()
+        front.set_servername_map({b("a.example.com"): target})
+        for name in [b("a.example.com"), b("A.Example.COM"), b("a.example.com.")]:
+            self.assertIdentical(target, self._connect(front, name))
+        self.assertEqual(called, [])
 
-class ConnectionTests(TestCase, _LoopbackMixin):
-    """
-    Unit tests for :py:obj:`OpenSSL.SSL.Connection`.
-    """
-    # XXX want_write
-    # XXX want_read
-    # XXX get_peer_certificate -> None
-    # XXX sock_shutdown
-    # XXX master_key -> TypeError
-    # XXX server_random -> TypeError
-    # XXX state_string
-    # XXX connect -> TypeError
-    # XXX connect_ex -> TypeError
-    # XXX set_connect_state -> TypeError
-    # XXX set_accept_state -> TypeError
-    # XXX renegotiate_pending
-    # XXX do_handshake -> TypeError
-    # XXX bio_read -> TypeError
-    # XXX recv -> TypeError
-    # XXX send -> TypeError
-    # XXX bio_write -> TypeError
 
-    def test_type(self):
+    def test_target_callbacks(self):
         """
-        :py:obj:`Connection` and :py:obj:`ConnectionType` refer to the same type object and
-        can be used to create instances of that type.
+        The rest of the handshake of a connection switched by the mapping uses
+        the callbacks of the :py:obj:`Context` it is switched to.
         """
-        self.assertIdentical(Connection, ConnectionType)
-        ctx = Context(TLSv1_METHOD)
-        self.assertConsistentType(Connection, 'Connection', ctx, None)
+        called = []
+        front = self._context()
+        target = self._context()
+        target.set_info_callback(
+            lambda conn, where, ret: called.append(where))
+        front.set_servername_map({b("a.example.com"): target})
+        self.assertIdentical(target, self._connect(front, b("a.example.com")))
+        self.assertTrue(
+            [where for where in called if where & SSL_CB_HANDSHAKE_DONE])
 
 
-    def test_get_context(self):
+    def test_wildcard(self):
         """
-        :py:obj:`Connection.get_context` returns the :py:obj:`Context` instance used to
-        construct the :py:obj:`Connection` instance.
+        A name starting with ``*.`` in the mapping matches names with any one
+        label in its place, and an exact name takes precedence over it.
         """
-        context = Context(TLSv1_METHOD)
-        connection = Connection(context, None)
-        self.assertIdentical(connection.get_context(), context)
+        front = self._context()
+        wildcard = self._context()
+        exact = self._context()
+        front.set_servername_map({
+                b("*.example.com"): wildcard, b("www.example.com"): exact})
+        self.assertIdentical(wildcard, self._connect(front, b("a.example.com")))
+        self.assertIdentical(exact, self._connect(front, b("www.example.com")))
+        self.assertIdentical(front, self._connect(front, b("example.com")))
+        self.assertIdentical(front, self._connect(front, b("a.b.example.com")))
 
 
-    def test_get_context_wrong_args(self):
+    def test_miss(self):
         """
-        :py:obj:`Connection.get_context` raises :py:obj:`TypeError` if called with any
-        arguments.
+        The servername callback is called for a name which is not in the
+        mapping, when there is no default.
         """
-        connection = Connection(Context(TLSv1_METHOD), None)
-        self.assertRaises(TypeError, connection.get_context, None)
+        called = []
+        front = self._context()
+        front.set_tlsext_servername_callback(
+            lambda conn: called.append(conn.get_servername()))
+        front.set_servername_map({b("a.example.com"): self._context()})
+        self.assertIdentical(front, self._connect(front, b("b.example.com")))
+        self.assertEqual(called, [b("b.example.com")])
 
 
-    def test_set_context_wrong_args(self):
+    def test_default(self):
         """
-        :py:obj:`Connection.set_context` raises :py:obj:`TypeError` if called with a
-        non-:py:obj:`Context` instance argument or with any number of arguments other
-        than 1.
+        A connection asking for a server name which is not in the mapping, or
+        for none, is switched to the default, without the servername callback
+        being called.
         """
-        ctx = Context(TLSv1_METHOD)
-        connection = Connection(ctx, None)
-        self.assertRaises(TypeError, connection.set_context)
-        self.assertRaises(TypeError, connection.set_context, object())
-        self.assertRaises(TypeError, connection.set_context, "hello")
-        self.assertRaises(TypeError, connection.set_context, 1)
-        self.assertRaises(TypeError, connection.set_context, 1, 2)
-        self.assertRaises(
-            TypeError, connection.set_context, Context(TLSv1_METHOD), 2)
-        self.assertIdentical(ctx, connection.get_context())
+        called = []
+        front = self._context()
+        front.set_tlsext_servername_callback(called.append)
+        dflt = self._context()
+        front.set_servername_map({b("a.example.com"): self._context()}, dflt)
+        self.assertIdentical(dflt, self._connect(front, b("b.example.com")))
+        self.assertIdentical(dflt, self._connect(front, None))
+        self.assertEqual(called, [])
 
 
-    def test_set_context(self):
+    def test_removed(self):
         """
-        :py:obj:`Connection.set_context` specifies a new :py:obj:`Context` instance to be used
-        for the connection.
+        After :py:obj:`Context.set_servername_map` is called with
+        :py:obj:`None`, connections are not switched any more.
         """
-        original = Context(SSLv23_METHOD)
-        replacement = Context(TLSv1_METHOD)
-        connection = Connection(original, None)
-        connection.set_context(replacement)
-        self.assertIdentical(replacement, connection.get_context())
-        # Lose our references to the contexts, just in case the Connection isn't
-        # properly managing its own contributions to their reference counts.
-        del original, replacement
-        collect()
+        front = self._context()
+        front.set_servername_map({b("a.example.com"): self._context()})
+        front.set_servername_map(None)
+        self.assertIdentical(front, self._connect(front, b("a.example.com")))
 
 
-    def test_set_tlsext_host_name_wrong_args(self):
+    def test_replaced(self):
+        """
+        A connection switched by a mapping which has since been replaced keeps
+        the :py:obj:`Context` it was switched to.
+        """
+        front = self._context()
+        front.set_servername_map({b("a.example.com"): self._context()})
+
+        server = Connection(front, None)
+        server.set_accept_state()
+        client = Connection(Context(TLSv1_METHOD), None)
+        client.set_connect_state()
+        client.set_tlsext_host_name(b("a.example.com"))
+        self._interactInMemory(server, client)
+
+        front.set_servername_map({})
+        collect()
+        context = server.get_context()
+        self.assertNotIdentical(context, front)
+        server.write(b("x"))
+        self.assertEqual(self._interactInMemory(server, client), (client, b("x")))
+
+
+class SessionTests(TestCase, _LoopbackMixin):
+    """
+    Unit tests for :py:obj:`OpenSSL.SSL.Session`.
+    """
+    def _serverContext(self):
+        ctx = Context(TLSv1_METHOD)
+        ctx.use_privatekey(load_privatekey(FILETYPE_PEM, server_key_pem))
+        ctx.use_certificate(load_certificate(FILETYPE_PEM, server_cert_pem))
+        ctx.set_session_id(b("unity-test"))
+        return ctx
+
+
+    def _handshake(self, ctx, session=None):
+        """
+        Connect a client to a server using *ctx*, offering *session* if it is
+        not :py:obj:`None`, and return the (server, client) pair.
+        """
+        def makeServer(socket):
+            server = Connection(ctx, socket)
+            server.set_accept_state()
+            return server
+
+        def makeClient(socket):
+            client = self._loopbackClientFactory(socket)
+            if session is not None:
+                client.set_session(session)
+            return client
+
+        return self._loopback(serverFactory=makeServer, clientFactory=makeClient)
+
+    def test_construction(self):
+        """
+        :py:class:`Session` can be constructed with no arguments, creating a new
+        instance of that type.
+        """
+        new_session = Session()
+        self.assertTrue(isinstance(new_session, Session))
+
+
+    def test_construction_wrong_args(self):
+        """
+        If any arguments are passed to :py:class:`Session`, :py:obj:`TypeError`
+        is raised.
+        """
+        self.assertRaises(TypeError, Session, 123)
+        self.assertRaises(TypeError, Session, "hello")
+        self.assertRaises(TypeError, Session, object())
+
+
+    def test_empty(self):
+        """
+        The methods of a :py:class:`Session` created by calling
+        :py:class:`Session` raise :py:obj:`ValueError`, since it has no
+        session data.
+        """
+        session = Session()
+        self.assertRaises(ValueError, session.to_bytes)
+        self.assertRaises(ValueError, session.get_id)
+        self.assertRaises(ValueError, session.get_time)
+        self.assertRaises(ValueError, session.get_timeout)
+        self.assertRaises(ValueError, session.is_resumable)
+
+
+    def test_wrong_args(self):
+        """
+        The :py:class:`Session` methods raise :py:obj:`TypeError` if called
+        with the wrong arguments.
+        """
+        server, client = self._handshake(self._serverContext())
+        session = client.get_session()
+        self.assertRaises(TypeError, session.to_bytes, None)
+        self.assertRaises(TypeError, session.get_id, None)
+        self.assertRaises(TypeError, session.get_time, None)
+        self.assertRaises(TypeError, session.get_timeout, None)
+        self.assertRaises(TypeError, session.is_resumable, None)
+        self.assertRaises(TypeError, Session.from_bytes)
+        self.assertRaises(TypeError, Session.from_bytes, object())
+        self.assertRaises(TypeError, Session.from_bytes, b("a"), b("b"))
+
+
+    def test_from_bytes_invalid(self):
+        """
+        :py:obj:`Session.from_bytes` raises :py:obj:`OpenSSL.SSL.Error` if
+        the bytes are not a serialized session.
+        """
+        self.assertRaises(Error, Session.from_bytes, b("not a session"))
+
+
+    def test_attributes(self):
+        """
+        A :py:class:`Session` from a completed handshake has an id, the time
+        it was established, a timeout and can be resumed.
+        """
+        before = int(time())
+        server, client = self._handshake(self._serverContext())
+        session = client.get_session()
+        self.assertTrue(isinstance(session.get_id(), bytes))
+        self.assertTrue(len(session.get_id()) > 0)
+        self.assertTrue(before <= session.get_time() <= int(time()))
+        self.assertTrue(session.get_timeout() > 0)
+        self.assertIdentical(session.is_resumable(), True)
+
+
+    def test_round_trip(self):
+        """
+        A :py:class:`Session` loaded by :py:obj:`Session.from_bytes` from
+        the result of :py:obj:`Session.to_bytes` is the same session, and can
+        be used to resume a connection.
+        """
+        ctx = self._serverContext()
+        originalServer, originalClient = self._handshake(ctx)
+        original = originalClient.get_session()
+        data = original.to_bytes()
+        self.assertTrue(isinstance(data, bytes))
+
+        loaded = Session.from_bytes(data)
+        self.assertTrue(isinstance(loaded, Session))
+        self.assertEqual(loaded.to_bytes(), data)
+        self.assertEqual(loaded.get_id(), original.get_id())
+        self.assertEqual(loaded.get_time(), original.get_time())
+        self.assertEqual(loaded.get_timeout(), original.get_timeout())
+
+        resumedServer, resumedClient = self._handshake(ctx, loaded)
+        self.assertEqual(
+            originalServer.master_key(), resumedServer.master_key())
+
+
+
+class SessionCacheTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`Context.set_session_cache` and
+    :py:obj:`OpenSSL.SSL.SharedSessionCache`.
+    """
+    def _serverContext(self, cache=None):
+        ctx = Context(TLSv1_METHOD)
+        ctx.use_privatekey(load_privatekey(FILETYPE_PEM, server_key_pem))
+        ctx.use_certificate(load_certificate(FILETYPE_PEM, server_cert_pem))
+        ctx.set_session_id(b("unity-test"))
+        if OP_NO_TICKET is not None:
+            # A ticket the server cannot decrypt stops it from looking in the
+            # session cache.
+            ctx.set_options(OP_NO_TICKET)
+        if cache is not None:
+            ctx.set_session_cache(cache)
+        return ctx
+
+
+    def _handshake(self, ctx, session=None):
+        """
+        Connect a client to a server using *ctx*, offering *session* if it is
+        not :py:obj:`None`, and return the (server, client) pair.
+        """
+        def makeServer(socket):
+            server = Connection(ctx, socket)
+            server.set_accept_state()
+            return server
+
+        def makeClient(socket):
+            client = self._loopbackClientFactory(socket)
+            if session is not None:
+                client.set_session(session)
+            return client
+
+        return self._loopback(serverFactory=makeServer, clientFactory=makeClient)
+
+
+    def _assertResumes(self, cache):
+        """
+        A session established with one Context using *cache* is resumed by a
+        different Context using it too.
+        """
+        originalServer, originalClient = self._handshake(
+            self._serverContext(cache))
+        session = originalClient.get_session()
+        resumedServer, resumedClient = self._handshake(
+            self._serverContext(cache), session)
+        self.assertEqual(
+            originalServer.master_key(), resumedServer.master_key())
+
+
+    def test_servername_switch(self):
+        """
+        Connections which a servername callback switches to another Context
+        keep using the session cache of the Context they were made with.
+        """
+        cache = {}
+        switched = self._serverContext()
+        def serverContext():
+            ctx = self._serverContext(cache)
+            ctx.set_tlsext_servername_callback(
+                lambda connection: connection.set_context(switched))
+            return ctx
+        originalServer, originalClient = self._handshake(serverContext())
+        self.assertEqual(len(cache), 1)
+        resumedServer, resumedClient = self._handshake(
+            serverContext(), originalClient.get_session())
+        self.assertEqual(
+            originalServer.master_key(), resumedServer.master_key())
+
+
+    def test_set_session_cache_wrong_args(self):
+        """
+        :py:obj:`Context.set_session_cache` raises :py:obj:`TypeError` if
+        called with the wrong number of arguments or something other than a
+        mapping or :py:obj:`None`.
+        """
+        context = Context(TLSv1_METHOD)
+        self.assertRaises(TypeError, context.set_session_cache)
+        self.assertRaises(TypeError, context.set_session_cache, {}, None)
+        self.assertRaises(TypeError, context.set_session_cache, object())
+        self.assertRaises(TypeError, context.set_session_cache, 3)
+
+
+    def test_get_session_cache(self):
+        """
+        :py:obj:`Context.get_session_cache` returns the cache last given to
+        :py:obj:`Context.set_session_cache`, or :py:obj:`None`.
+        """
+        context = Context(TLSv1_METHOD)
+        self.assertIdentical(context.get_session_cache(), None)
+        cache = {}
+        context.set_session_cache(cache)
+        self.assertIdentical(context.get_session_cache(), cache)
+        context.set_session_cache(None)
+        self.assertIdentical(context.get_session_cache(), None)
+        self.assertRaises(TypeError, context.get_session_cache, None)
+
+
+    def test_new_sessions_stored(self):
+        """
+        A new session is stored in the cache under its id.
+        """
+        cache = {}
+        server, client = self._handshake(self._serverContext(cache))
+        session_id = client.get_session().get_id()
+        self.assertEqual(list(cache.keys()), [session_id])
+        self.assertEqual(Session.from_bytes(cache[session_id]).get_id(), session_id)
+
+
+    def test_resume(self):
+        """
+        Two Contexts using the same cache resume each other's sessions.
+        """
+        self._assertResumes({})
+
+
+    def test_broken_cache(self):
+        """
+        Errors raised by the cache do not stop connections from being made.
+        """
+        class Broken(dict):
+            def __getitem__(self, key):
+                raise RuntimeError()
+
+            def __setitem__(self, key, value):
+                raise RuntimeError()
+
+        ctx = self._serverContext(Broken())
+        server, client = self._handshake(ctx)
+        server, client = self._handshake(ctx, client.get_session())
+
+
+    def test_session_reused(self):
+        """
+        :py:obj:`Connection.session_reused` returns :py:obj:`False` for a
+        connection which made a new session and :py:obj:`True` for one which
+        resumed a session.
+        """
+        ctx = self._serverContext()
+        server, client = self._handshake(ctx)
+        self.assertIdentical(server.session_reused(), False)
+        self.assertIdentical(client.session_reused(), False)
+        server, client = self._handshake(ctx, client.get_session())
+        self.assertIdentical(server.session_reused(), True)
+        self.assertIdentical(client.session_reused(), True)
+        self.assertRaises(TypeError, server.session_reused, None)
+
+
+    def test_session_cache_stats(self):
+        """
+        :py:obj:`Context.get_session_cache_stats` returns a dict of the
+        counters OpenSSL keeps about the sessions of the Context.
+        """
+        ctx = self._serverContext()
+        stats = ctx.get_session_cache_stats()
+        self.assertEqual(
+            sorted(stats.keys()),
+            ["accept", "accept_good", "accept_renegotiate", "cache_full",
+             "cb_hits", "connect", "connect_good", "connect_renegotiate",
+             "hits", "misses", "number", "timeouts"])
+        self.assertEqual(set(stats.values()), set([0]))
+
+        # Keep the first pair: a connection freed without a clean shutdown
+        # takes its session out of the cache.
+        firstServer, firstClient = self._handshake(ctx)
+        server, client = self._handshake(ctx, firstClient.get_session())
+        stats = ctx.get_session_cache_stats()
+        self.assertEqual(stats["number"], 1)
+        self.assertEqual(stats["accept"], 2)
+        self.assertEqual(stats["accept_good"], 2)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["connect"], 0)
+        self.assertRaises(TypeError, ctx.get_session_cache_stats, None)
+
+
+    def test_session_cache_size(self):
+        """
+        :py:obj:`Context.set_session_cache_size` sets the most sessions the
+        internal session cache holds and returns the previous limit, which
+        :py:obj:`Context.get_session_cache_size` returns.
+        """
+        ctx = self._serverContext()
+        default = ctx.get_session_cache_size()
+        self.assertEqual(ctx.set_session_cache_size(1), default)
+        self.assertEqual(ctx.get_session_cache_size(), 1)
+        self.assertRaises(ValueError, ctx.set_session_cache_size, -1)
+        self.assertRaises(TypeError, ctx.set_session_cache_size)
+        self.assertRaises(TypeError, ctx.set_session_cache_size, "1")
+        self.assertRaises(TypeError, ctx.get_session_cache_size, None)
+
+
+    def test_flush_sessions(self):
+        """
+        :py:obj:`Context.flush_sessions` removes the sessions which have
+        expired by the given time, or by now, from the internal session cache
+        and from the session cache set with :py:obj:`Context.set_session_cache`.
+        """
+        cache = {}
+        ctx = self._serverContext(cache)
+        server, client = self._handshake(ctx)
+        ctx.flush_sessions()
+        self.assertEqual(ctx.get_session_cache_stats()["number"], 1)
+        self.assertEqual(len(cache), 1)
+        ctx.flush_sessions(int(time()) + ctx.get_timeout() + 1)
+        self.assertEqual(ctx.get_session_cache_stats()["number"], 0)
+        self.assertEqual(cache, {})
+        self.assertRaises(TypeError, ctx.flush_sessions, "now")
+        self.assertRaises(TypeError, ctx.flush_sessions, 1, 2)
+
+
+    if SharedSessionCache is not None:
+        def test_shared_wrong_args(self):
+            """
+            :py:obj:`SharedSessionCache` raises :py:obj:`TypeError` if called
+            with arguments of the wrong type and :py:obj:`ValueError` if
+            called with sizes which are not positive.
+            """
+            self.assertRaises(TypeError, SharedSessionCache, "a")
+            self.assertRaises(TypeError, SharedSessionCache, 1, 2, 3)
+            self.assertRaises(ValueError, SharedSessionCache, 0)
+            self.assertRaises(ValueError, SharedSessionCache, entry_size=-1)
+
+
+        def test_shared_mapping(self):
+            """
+            :py:obj:`SharedSessionCache` is a mapping from session ids to
+            serialized sessions.
+            """
+            server, client = self._handshake(self._serverContext())
+            session = client.get_session()
+            cache = SharedSessionCache()
+            self.assertEqual(len(cache), 0)
+            self.assertRaises(KeyError, lambda: cache[session.get_id()])
+            self.assertIdentical(cache.get(session.get_id()), None)
+
+            cache[session.get_id()] = session.to_bytes()
+            self.assertEqual(len(cache), 1)
+            self.assertEqual(cache[session.get_id()], session.to_bytes())
+            self.assertEqual(cache.get(session.get_id()), session.to_bytes())
+
+            del cache[session.get_id()]
+            self.assertEqual(len(cache), 0)
+            self.assertEqual(cache.get(session.get_id(), 3), 3)
+
+
+        def test_shared_mapping_wrong_values(self):
+            """
+            Storing something other than a serialized session, a session under
+            a different id or a session larger than *entry_size* fails.
+            """
+            server, client = self._handshake(self._serverContext())
+            session = client.get_session()
+            cache = SharedSessionCache()
+            def store(key, value):
+                cache[key] = value
+            self.assertRaises(TypeError, store, object(), session.to_bytes())
+            self.assertRaises(TypeError, store, session.get_id(), object())
+            self.assertRaises(Error, store, session.get_id(), b("junk"))
+            self.assertRaises(
+                ValueError, store, b("wrong id"), session.to_bytes())
+            small = SharedSessionCache(entry_size=16)
+            def storeSmall(key, value):
+                small[key] = value
+            self.assertRaises(
+                ValueError, storeSmall, session.get_id(), session.to_bytes())
+
+
+        def test_shared_resume(self):
+            """
+            Two Contexts using the same :py:obj:`SharedSessionCache` resume
+            each other's sessions.
+            """
+            self._assertResumes(SharedSessionCache())
+
+
+        def test_shared_lru(self):
+            """
+            When the cache is full, the least recently used session is
+            replaced.
+            """
+            ctx = self._serverContext()
+            sessions = []
+            for i in range(9):
+                server, client = self._handshake(ctx)
+                sessions.append(client.get_session())
+
+            cache = SharedSessionCache(size=8)
+            for session in sessions[:8]:
+                cache[session.get_id()] = session.to_bytes()
+            cache[sessions[0].get_id()]
+            cache[sessions[8].get_id()] = sessions[8].to_bytes()
+
+            self.assertEqual(len(cache), 8)
+            self.assertRaises(KeyError, lambda: cache[sessions[1].get_id()])
+            for session in sessions[:1] + sessions[2:]:
+                self.assertEqual(cache[session.get_id()], session.to_bytes())
+
+
+        if hasattr(os, "fork"):
+            def test_shared_across_fork(self):
+                """
+                Sessions stored by a child process are found by its parent.
+                """
+                server, client = self._handshake(self._serverContext())
+                session = client.get_session()
+                cache = SharedSessionCache()
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        cache[session.get_id()] = session.to_bytes()
+                    finally:
+                        os._exit(0)
+                os.waitpid(pid, 0)
+                self.assertEqual(cache[session.get_id()], session.to_bytes())
+
+
+
+class TicketKeyTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`Context.set_tlsext_ticket_keys` and
+    :py:obj:`Context.set_tlsext_ticket_key_rotation`.
+    """
+    first = b("a") * 48
+    second = b("b") * 48
+
+    def _serverContext(self):
+        ctx = Context(TLSv1_METHOD)
+        ctx.use_privatekey(load_privatekey(FILETYPE_PEM, server_key_pem))
+        ctx.use_certificate(load_certificate(FILETYPE_PEM, server_cert_pem))
+        ctx.set_session_id(b("unity-test"))
+        return ctx
+
+
+    def _handshake(self, ctx, session=None, server_name=None):
+        """
+        Connect a client to a server using *ctx*, offering *session* if it is
+        not :py:obj:`None` and asking for *server_name* if it is not
+        :py:obj:`None`, and return the (server, client) pair.
+        """
+        def makeServer(socket):
+            server = Connection(ctx, socket)
+            server.set_accept_state()
+            return server
+
+        def makeClient(socket):
+            client = self._loopbackClientFactory(socket)
+            if session is not None:
+                client.set_session(session)
+            if server_name is not None:
+                client.set_tlsext_host_name(server_name)
+            return client
+
+        return self._loopback(serverFactory=makeServer, clientFactory=makeClient)
+
+
+    def _resumes(self, original, resuming, server_name=None):
+        """
+        Return whether a session established with the server Context
+        *original* is resumed with the server Context *resuming*.
+        """
+        originalServer, originalClient = self._handshake(
+            original, server_name=server_name)
+        resumedServer, resumedClient = self._handshake(
+            resuming, originalClient.get_session(), server_name)
+        return originalServer.master_key() == resumedServer.master_key()
+
+
+    if getattr(Context, "set_tlsext_ticket_keys", None) is not None:
+        def test_set_tlsext_ticket_keys_wrong_args(self):
+            """
+            :py:obj:`Context.set_tlsext_ticket_keys` raises
+            :py:obj:`TypeError` if called with the wrong number of arguments
+            or keys which are not byte strings, and :py:obj:`ValueError` if
+            called with no keys or keys of the wrong length.
+            """
+            context = Context(TLSv1_METHOD)
+            self.assertRaises(TypeError, context.set_tlsext_ticket_keys)
+            self.assertRaises(
+                TypeError, context.set_tlsext_ticket_keys, [self.first], None)
+            self.assertRaises(TypeError, context.set_tlsext_ticket_keys, 3)
+            self.assertRaises(TypeError, context.set_tlsext_ticket_keys, [3])
+            self.assertRaises(ValueError, context.set_tlsext_ticket_keys, [])
+            self.assertRaises(
+                ValueError, context.set_tlsext_ticket_keys, [self.first[:47]])
+            self.assertRaises(
+                ValueError, context.set_tlsext_ticket_keys,
+                [self.first, self.second + b("b")])
+
+
+        def test_shared_keys(self):
+            """
+            Contexts with the same ticket keys resume each other's sessions.
+            """
+            original = self._serverContext()
+            original.set_tlsext_ticket_keys([self.first])
+            resuming = self._serverContext()
+            resuming.set_tlsext_ticket_keys([self.first])
+            self.assertTrue(self._resumes(original, resuming))
+
+
+        def test_different_keys(self):
+            """
+            A Context does not resume a session from a ticket protected with
+            a key it does not have.
+            """
+            original = self._serverContext()
+            original.set_tlsext_ticket_keys([self.first])
+            resuming = self._serverContext()
+            resuming.set_tlsext_ticket_keys([self.second])
+            self.assertFalse(self._resumes(original, resuming))
+
+
+        def test_previous_key(self):
+            """
+            A Context resumes a session from a ticket protected with one of
+            its keys which is not the first.
+            """
+            original = self._serverContext()
+            original.set_tlsext_ticket_keys([self.first])
+            resuming = self._serverContext()
+            resuming.set_tlsext_ticket_keys([self.second, self.first])
+            self.assertTrue(self._resumes(original, resuming))
+
+
+        def test_remove_keys(self):
+            """
+            After :py:obj:`Context.set_tlsext_ticket_keys` is called with
+            :py:obj:`None`, tickets protected with the keys it had are not
+            accepted.
+            """
+            original = self._serverContext()
+            original.set_tlsext_ticket_keys([self.first])
+            resuming = self._serverContext()
+            resuming.set_tlsext_ticket_keys([self.first])
+            resuming.set_tlsext_ticket_keys(None)
+            self.assertFalse(self._resumes(original, resuming))
+
+
+        def test_servername_callback_switch(self):
+            """
+            Connections which a servername callback switches to a Context
+            without ticket keys still use the keys of the Context they were
+            made with, to issue tickets and to resume sessions from them.
+            """
+            switched = self._serverContext()
+            def switch(connection):
+                connection.set_context(switched)
+            original = self._serverContext()
+            original.set_tlsext_ticket_keys([self.first])
+            original.set_tlsext_servername_callback(switch)
+            resuming = self._serverContext()
+            resuming.set_tlsext_ticket_keys([self.first])
+            resuming.set_tlsext_servername_callback(switch)
+            self.assertTrue(
+                self._resumes(original, resuming, b("example.invalid")))
+
+
+        if getattr(Context, "set_servername_map", None) is not None:
+            def test_servername_map_switch(self):
+                """
+                Connections which a server name map switches to a Context
+                without ticket keys still use the keys of the Context they
+                were made with.
+                """
+                switched = self._serverContext()
+                original = self._serverContext()
+                original.set_tlsext_ticket_keys([self.first])
+                original.set_servername_map({b("example.invalid"): switched})
+                resuming = self._serverContext()
+                resuming.set_tlsext_ticket_keys([self.first])
+                resuming.set_servername_map({b("example.invalid"): switched})
+                self.assertTrue(
+                    self._resumes(original, resuming, b("example.invalid")))
+
+
+        def test_set_tlsext_ticket_key_rotation_wrong_args(self):
+            """
+            :py:obj:`Context.set_tlsext_ticket_key_rotation` raises
+            :py:obj:`TypeError` if called with the wrong number or types of
+            arguments and :py:obj:`ValueError` if called with an empty or too
+            long secret, an interval which is not positive, or a negative
+            number of previous keys.
+            """
+            context = Context(TLSv1_METHOD)
+            rotate = context.set_tlsext_ticket_key_rotation
+            self.assertRaises(TypeError, rotate)
+            self.assertRaises(TypeError, rotate, self.first)
+            self.assertRaises(TypeError, rotate, self.first, 60, 1, None)
+            self.assertRaises(TypeError, rotate, object(), 60)
+            self.assertRaises(TypeError, rotate, self.first, object())
+            self.assertRaises(ValueError, rotate, b(""), 60)
+            self.assertRaises(ValueError, rotate, b("a") * 129, 60)
+            self.assertRaises(ValueError, rotate, self.first, 0)
+            self.assertRaises(ValueError, rotate, self.first, 60, -1)
+
+
+        def test_rotation_shared_secret(self):
+            """
+            Contexts with the same ticket key secret and interval resume each
+            other's sessions.
+            """
+            original = self._serverContext()
+            original.set_tlsext_ticket_key_rotation(self.first, 3600)
+            resuming = self._serverContext()
+            resuming.set_tlsext_ticket_key_rotation(self.first, 3600)
+            self.assertTrue(self._resumes(original, resuming))
+
+
+        def test_rotation_different_secret(self):
+            """
+            Contexts with different ticket key secrets do not resume each
+            other's sessions.
+            """
+            original = self._serverContext()
+            original.set_tlsext_ticket_key_rotation(self.first, 3600)
+            resuming = self._serverContext()
+            resuming.set_tlsext_ticket_key_rotation(self.second, 3600)
+            self.assertFalse(self._resumes(original, resuming))
+
+
+
+class VerifyCacheTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`Context.set_verify_cache` and
+    :py:obj:`Context.get_verify_cache_stats`.
+    """
+    def _clientContext(self, result=True):
+        """
+        Create a client Context which verifies the server with a callback that
+        returns *result*, recording its calls in ``self.calls``.
+        """
+        self.calls = []
+        def verify(*args):
+            self.calls.append(args[1:])
+            return result
+        ctx = Context(TLSv1_METHOD)
+        ctx.set_verify(VERIFY_PEER, verify)
+        return ctx
+
+
+    def _handshake(self, ctx):
+        """
+        Connect a client using *ctx* to a server.
+        """
+        def makeClient(socket):
+            client = Connection(ctx, socket)
+            client.set_connect_state()
+            return client
+        return self._loopback(clientFactory=makeClient)
+
+
+    def test_wrong_args(self):
+        """
+        :py:obj:`Context.set_verify_cache` raises :py:obj:`TypeError` if called
+        with the wrong arguments, and :py:obj:`ValueError` if called with a
+        negative size or a ttl which is not positive.
+        """
+        context = Context(TLSv1_METHOD)
+        self.assertRaises(TypeError, context.set_verify_cache)
+        self.assertRaises(TypeError, context.set_verify_cache, "10")
+        self.assertRaises(TypeError, context.set_verify_cache, 10, 10, 10)
+        self.assertRaises(ValueError, context.set_verify_cache, -1)
+        self.assertRaises(ValueError, context.set_verify_cache, 10, 0)
+        self.assertRaises(TypeError, context.get_verify_cache_stats, None)
+
+
+    def test_stats(self):
+        """
+        :py:obj:`Context.get_verify_cache_stats` returns :py:obj:`None` unless
+        decisions are remembered, and otherwise a dict with the size of the
+        cache, which is at least the size asked for.
+        """
+        context = Context(TLSv1_METHOD)
+        self.assertIdentical(context.get_verify_cache_stats(), None)
+        context.set_verify_cache(10)
+        stats = context.get_verify_cache_stats()
+        self.assertTrue(stats["size"] >= 10)
+        self.assertEqual(stats["entries"], 0)
+        self.assertEqual(stats["hits"], 0)
+        self.assertEqual(stats["misses"], 0)
+        context.set_verify_cache(0)
+        self.assertIdentical(context.get_verify_cache_stats(), None)
+
+
+    def test_remembered(self):
+        """
+        After :py:obj:`Context.set_verify_cache`, the verify callback is not
+        called again for a certificate chain it has already accepted.
+        """
+        ctx = self._clientContext()
+        ctx.set_verify_cache(100)
+        self._handshake(ctx)
+        calls = len(self.calls)
+        self.assertTrue(calls > 0)
+        self._handshake(ctx)
+        self.assertEqual(len(self.calls), calls)
+        stats = ctx.get_verify_cache_stats()
+        self.assertEqual(stats["hits"], calls)
+        self.assertEqual(stats["misses"], calls)
+        self.assertEqual(stats["entries"], calls)
+
+
+    def test_rejection_remembered(self):
+        """
+        A chain the verify callback rejected is rejected again without calling
+        it.
+        """
+        ctx = self._clientContext(False)
+        ctx.set_verify_cache(100)
+        self.assertRaises(Error, self._handshake, ctx)
+        calls = len(self.calls)
+        self.assertTrue(calls > 0)
+        self.assertRaises(Error, self._handshake, ctx)
+        self.assertEqual(len(self.calls), calls)
+
+
+    def test_not_remembered(self):
+        """
+        Without :py:obj:`Context.set_verify_cache`, the verify callback is
+        called for every handshake.
+        """
+        ctx = self._clientContext()
+        self._handshake(ctx)
+        calls = len(self.calls)
+        self._handshake(ctx)
+        self.assertEqual(len(self.calls), calls * 2)
+
+
+    def test_set_verify_forgets(self):
+        """
+        :py:obj:`Context.set_verify` forgets the decisions of the previous
+        callback.
+        """
+        ctx = self._clientContext(False)
+        ctx.set_verify_cache(100)
+        self.assertRaises(Error, self._handshake, ctx)
+        accepted = []
+        ctx.set_verify(VERIFY_PEER, lambda *args: accepted.append(args) or True)
+        self._handshake(ctx)
+        self.assertNotEqual(accepted, [])
+
+
+class VerifyHostnameTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`Connection.set_verify_hostname` and
+    :py:obj:`Connection.set_verify_ip`.
+    """
+    # X509_V_ERR_HOSTNAME_MISMATCH and X509_V_ERR_IP_ADDRESS_MISMATCH
+    HOSTNAME_MISMATCH = 62
+    IP_ADDRESS_MISMATCH = 64
+
+    def _certificate(self):
+        """
+        Create a self-signed certificate for any name in example.com and for
+        127.0.0.1, with a common name which is not among them.
+        """
+        key = PKey()
+        key.generate_key(TYPE_RSA, 512)
+        cert = X509()
+        cert.get_subject().commonName = "common.example.org"
+        cert.set_issuer(cert.get_subject())
+        cert.set_pubkey(key)
+        cert.set_notBefore(b("20000101000000Z"))
+        cert.set_notAfter(b("20500101000000Z"))
+        cert.add_extensions([
+                X509Extension(b('subjectAltName'), False,
+                              b('DNS:*.example.com, IP:127.0.0.1'))])
+        cert.set_serial_number(0)
+        cert.sign(key, "sha1")
+        return key, cert
+
+
+    def _errors(self, check):
+        """
+        Connect a client to a server using the certificate from
+        :py:obj:`_certificate`, calling *check* with the client
+        :py:obj:`Connection` first, and return the verification errors the
+        client ran into.
+        """
+        key, cert = self._certificate()
+        errors = []
+        def verify(conn, cert, errnum, depth, ok):
+            errors.append(errnum)
+            return True
+
+        def makeServer(socket):
+            ctx = Context(TLSv1_METHOD)
+            ctx.use_privatekey(key)
+            ctx.use_certificate(cert)
+            server = Connection(ctx, socket)
+            server.set_accept_state()
+            return server
+
+        def makeClient(socket):
+            ctx = Context(TLSv1_METHOD)
+            ctx.set_verify(VERIFY_PEER, verify)
+            client = Connection(ctx, socket)
+            check(client)
+            client.set_connect_state()
+            return client
+
+        self._loopback(serverFactory=makeServer, clientFactory=makeClient)
+        return errors
+
+
+    if getattr(Connection, "set_verify_hostname", None) is not None:
+        def test_wrong_args(self):
+            """
+            :py:obj:`Connection.set_verify_hostname` and
+            :py:obj:`Connection.set_verify_ip` raise :py:obj:`TypeError` if called
+            with other than one byte string or :py:obj:`None`, and
+            :py:obj:`ValueError` if called with an empty name or an invalid
+            address.
+            """
+            connection = Connection(Context(TLSv1_METHOD), None)
+            for method in [connection.set_verify_hostname, connection.set_verify_ip]:
+                self.assertRaises(TypeError, method)
+                self.assertRaises(TypeError, method, object())
+                self.assertRaises(TypeError, method, b("a"), b("b"))
+            self.assertRaises(ValueError, connection.set_verify_hostname, b(""))
+            self.assertRaises(ValueError, connection.set_verify_hostname, b("a\0b"))
+            self.assertRaises(ValueError, connection.set_verify_ip, b("1.2.3"))
+            self.assertRaises(ValueError, connection.set_verify_ip, b("example.com"))
+
+
+        def test_hostname(self):
+            """
+            A host name matching a DNS name of the peer's certificate passes the
+            check.
+            """
+            errors = self._errors(
+                lambda client: client.set_verify_hostname(b("www.example.com")))
+            self.assertFalse(self.HOSTNAME_MISMATCH in errors)
+
+
+        def test_hostname_mismatch(self):
+            """
+            A host name which does not match any DNS name of the peer's
+            certificate fails the check, even if it is the common name.
+            """
+            for name in [b("www.example.org"), b("a.b.example.com"),
+                         b("common.example.org")]:
+                errors = self._errors(
+                    lambda client: client.set_verify_hostname(name))
+                self.assertTrue(self.HOSTNAME_MISMATCH in errors)
+
+
+        def test_hostname_none(self):
+            """
+            Passing :py:obj:`None` to :py:obj:`Connection.set_verify_hostname`
+            stops the host name from being checked.
+            """
+            def check(client):
+                client.set_verify_hostname(b("www.example.org"))
+                client.set_verify_hostname(None)
+            self.assertFalse(self.HOSTNAME_MISMATCH in self._errors(check))
+
+
+        def test_ip(self):
+            """
+            An IP address of the peer's certificate passes the check, and any other
+            address fails it.
+            """
+            errors = self._errors(lambda client: client.set_verify_ip(b("127.0.0.1")))
+            self.assertFalse(self.IP_ADDRESS_MISMATCH in errors)
+            errors = self._errors(lambda client: client.set_verify_ip(b("127.0.0.2")))
+            self.assertTrue(self.IP_ADDRESS_MISMATCH in errors)
+            errors = self._errors(lambda client: client.set_verify_ip(b("::1")))
+            self.assertTrue(self.IP_ADDRESS_MISMATCH in errors)
+
+
+    def test_verify_result(self):
+        """
+        :py:obj:`Connection.get_verify_result` returns the verification error
+        of a peer certificate no verify callback accepted.
+        """
+        key, cert = self._certificate()
+        def makeServer(socket):
+            ctx = Context(TLSv1_METHOD)
+            ctx.use_privatekey(key)
+            ctx.use_certificate(cert)
+            server = Connection(ctx, socket)
+            server.set_accept_state()
+            return server
+
+        server, client = self._loopback(serverFactory=makeServer)
+        self.assertNotEqual(client.get_verify_result(), 0)
+        self.assertRaises(TypeError, client.get_verify_result, None)
+
+
+class NativeVerifyTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`Context.set_verify` without a callback.
+    """
+    def _chain(self):
+        """
+        Create a certificate authority and a certificate for www.example.com
+        signed by it, and return the authority's certificate and the server's
+        key and certificate.
+        """
+        cakey = PKey()
+        cakey.generate_key(TYPE_RSA, 512)
+        cacert = X509()
+        cacert.get_subject().commonName = "Authority Certificate"
+        cacert.set_issuer(cacert.get_subject())
+        cacert.set_pubkey(cakey)
+        cacert.set_notBefore(b("20000101000000Z"))
+        cacert.set_notAfter(b("20500101000000Z"))
+        cacert.add_extensions([
+                X509Extension(b('basicConstraints'), False, b('CA:true'))])
+        cacert.set_serial_number(0)
+        cacert.sign(cakey, "sha1")
+
+        skey = PKey()
+        skey.generate_key(TYPE_RSA, 512)
+        scert = X509()
+        scert.get_subject().commonName = "www.example.com"
+        scert.set_issuer(cacert.get_subject())
+        scert.set_pubkey(skey)
+        scert.set_notBefore(b("20000101000000Z"))
+        scert.set_notAfter(b("20500101000000Z"))
+        scert.set_serial_number(1)
+        scert.sign(cakey, "sha1")
+        return cacert, skey, scert
+
+
+    def _handshake(self, trusted, hostname=None, callback=None):
+        """
+        Connect a client which verifies the server natively to a server using
+        the certificate from :py:obj:`_chain`, trusting the authority if
+        *trusted* is true and checking *hostname* if it is given.  If
+        *callback* is given, it is set as the verify callback of the client
+        Context first, and then removed.
+        """
+        cacert, skey, scert = self._chain()
+        cafile = self.mktemp()
+        fObj = open(cafile, 'w')
+        fObj.write(dump_certificate(FILETYPE_PEM, cacert).decode('ascii'))
+        fObj.close()
+
+        def makeServer(socket):
+            ctx = Context(TLSv1_METHOD)
+            ctx.use_privatekey(skey)
+            ctx.use_certificate(scert)
+            server = Connection(ctx, socket)
+            server.set_accept_state()
+            return server
+
+        def makeClient(socket):
+            ctx = Context(TLSv1_METHOD)
+            if callback is not None:
+                ctx.set_verify(VERIFY_PEER, callback)
+            else:
+                ctx.set_verify(VERIFY_PEER, None)
+            if trusted:
+                ctx.load_verify_locations(cafile)
+            client = Connection(ctx, socket)
+            if callback is not None:
+                ctx.set_verify(VERIFY_PEER)
+            if hostname is not None:
+                client.set_verify_hostname(hostname)
+            client.set_connect_state()
+            return client
+
+        return self._loopback(serverFactory=makeServer, clientFactory=makeClient)
+
+
+    def test_mode(self):
+        """
+        :py:obj:`Context.set_verify` sets the verify mode when it is not given a
+        callback, or given :py:obj:`None` for it.
+        """
+        context = Context(TLSv1_METHOD)
+        context.set_verify(VERIFY_PEER | VERIFY_CLIENT_ONCE, None)
+        self.assertEquals(
+            context.get_verify_mode(), VERIFY_PEER | VERIFY_CLIENT_ONCE)
+        context.set_verify(VERIFY_PEER)
+        self.assertEquals(context.get_verify_mode(), VERIFY_PEER)
+
+
+    def test_wrong_args(self):
+        """
+        :py:obj:`Context.set_verify` raises :py:obj:`TypeError` if given a
+        callback which is neither callable nor :py:obj:`None`.
+        """
+        context = Context(TLSv1_METHOD)
+        self.assertRaises(TypeError, context.set_verify)
+        self.assertRaises(TypeError, context.set_verify, VERIFY_PEER, object())
+        self.assertRaises(TypeError, context.set_verify, VERIFY_PEER, None, None)
+
+
+    def test_trusted(self):
+        """
+        Without a callback, a peer with a certificate signed by a trusted
+        authority is accepted.
+        """
+        server, client = self._handshake(True)
+        self.assertEqual(client.get_verify_result(), 0)
+
+
+    def test_untrusted(self):
+        """
+        Without a callback, a peer with a certificate signed by an authority
+        which is not trusted is rejected.
+        """
+        self.assertRaises(Error, self._handshake, False)
+
+
+    def test_callback_removed(self):
+        """
+        After the callback is removed, connections created while it was set go
+        by OpenSSL's own verification, without calling it.
+        """
+        calls = []
+        def verify(*args):
+            calls.append(args)
+            return True
+        self.assertRaises(Error, self._handshake, False, callback=verify)
+        self.assertEqual(calls, [])
+
+
+    if getattr(Connection, "set_verify_hostname", None) is not None:
+        def test_hostname(self):
+            """
+            Without a callback, a peer with a certificate for a host name other
+            than the one given to :py:obj:`Connection.set_verify_hostname` is
+            rejected.
+            """
+            self._handshake(True, b("www.example.com"))
+            self.assertRaises(Error, self._handshake, True, b("www.example.org"))
+
+
+class ConnectionTests(TestCase, _LoopbackMixin):
+    """
+    Unit tests for :py:obj:`OpenSSL.SSL.Connection`.
+    """
+    # XXX want_write
+    # XXX want_read
+    # XXX get_peer_certificate -> None
+    # XXX sock_shutdown
+    # XXX master_key -> TypeError
+    # XXX server_random -> TypeError
+    # XXX state_string
+    # XXX connect -> TypeError
+    # XXX connect_ex -> TypeError
+    # XXX set_connect_state -> TypeError
+    # XXX set_accept_state -> TypeError
+    # XXX renegotiate_pending
+    # XXX do_handshake -> TypeError
+    # XXX bio_read -> TypeError
+    # XXX recv -> TypeError
+    # XXX send -> TypeError
+    # XXX bio_write -> TypeError
+
+    def test_type(self):
+        """
+        :py:obj:`Connection` and :py:obj:`ConnectionType` refer to the same type object and
+        can be used to create instances of that type.
+        """
+        self.assertIdentical(Connection, ConnectionType)
+        ctx = Context(TLSv1_METHOD)
+        self.assertConsistentType(Connection, 'Connection', ctx, None)
+
+
+    def test_get_context(self):
+        """
+        :py:obj:`Connection.get_context` returns the :py:obj:`Context` instance used to
+        construct the :py:obj:`Connection` instance.
+        """
+        context = Context(TLSv1_METHOD)
+        connection = Connection(context, None)
+        self.assertIdentical(connection.get_context(), context)
+
+
+    def test_get_context_wrong_args(self):
+        """
+        :py:obj:`Connection.get_context` raises :py:obj:`TypeError` if called with any
+        arguments.
+        """
+        connection = Connection(Context(TLSv1_METHOD), None)
+        self.assertRaises(TypeError, connection.get_context, None)
+
+
+    def test_set_context_wrong_args(self):
+        """
+        :py:obj:`Connection.set_context` raises :py:obj:`TypeError` if called with a
+        non-:py:obj:`Context` instance argument or with any number of arguments other
+        than 1.
+        """
+        ctx = Context(TLSv1_METHOD)
+        connection = Connection(ctx, None)
+        self.assertRaises(TypeError, connection.set_context)
+        self.assertRaises(TypeError, connection.set_context, object())
+        self.assertRaises(TypeError, connection.set_context, "hello")
+        self.assertRaises(TypeError, connection.set_context, 1)
+        self.assertRaises(TypeError, connection.set_context, 1, 2)
+        self.assertRaises(
+            TypeError, connection.set_context, Context(TLSv1_METHOD), 2)
+        self.assertIdentical(ctx, connection.get_context())
+
+
+    def test_set_context(self):
+        """
+        :py:obj:`Connection.set_context` specifies a new :py:obj:`Context` instance to be used
+        for the connection.
+        """
+        original = Context(SSLv23_METHOD)
+        replacement = Context(TLSv1_METHOD)
+        connection = Connection(original, None)
+        connection.set_context(replacement)
+        self.assertIdentical(replacement, connection.get_context())
+        # Lose our references to the contexts, just in case the Connection isn't
+        # properly managing its own contributions to their reference counts.
+        del original, replacement
+        collect()
+
+
+    def test_set_tlsext_host_name_wrong_args(self):
         """
         If :py:obj:`Connection.set_tlsext_host_name` is called with a non-byte string
         argument or a byte string with an embedded NUL or other than one
@@ -1573,89 +3062,498 @@ class ConnectionTests(TestCase, _LoopbackMixin):
             server.set_accept_state()
             return server
 
-        originalServer, originalClient = self._loopback(
-            serverFactory=makeServer)
-        originalSession = originalClient.get_session()
+        originalServer, originalClient = self._loopback(
+            serverFactory=makeServer)
+        originalSession = originalClient.get_session()
+
+        def makeClient(socket):
+            # Intentionally use a different, incompatible method here.
+            client = Connection(Context(SSLv3_METHOD), socket)
+            client.set_connect_state()
+            client.set_session(originalSession)
+            return client
+
+        self.assertRaises(
+            Error,
+            self._loopback, clientFactory=makeClient, serverFactory=makeServer)
+
+
+
+class ConnectionGetCipherListTests(TestCase):
+    """
+    Tests for :py:obj:`Connection.get_cipher_list`.
+    """
+    def test_wrong_args(self):
+        """
+        :py:obj:`Connection.get_cipher_list` raises :py:obj:`TypeError` if called with any
+        arguments.
+        """
+        connection = Connection(Context(TLSv1_METHOD), None)
+        self.assertRaises(TypeError, connection.get_cipher_list, None)
+
+
+    def test_result(self):
+        """
+        :py:obj:`Connection.get_cipher_list` returns a :py:obj:`list` of :py:obj:`str` giving the
+        names of the ciphers which might be used.
+        """
+        connection = Connection(Context(TLSv1_METHOD), None)
+        ciphers = connection.get_cipher_list()
+        self.assertTrue(isinstance(ciphers, list))
+        for cipher in ciphers:
+            self.assertTrue(isinstance(cipher, str))
+
+
+
+class ConnectionSendTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`Connection.send`
+    """
+    def test_wrong_args(self):
+        """
+        When called with arguments other than a single string,
+        :py:obj:`Connection.send` raises :py:obj:`TypeError`.
+        """
+        connection = Connection(Context(TLSv1_METHOD), None)
+        self.assertRaises(TypeError, connection.send)
+        self.assertRaises(TypeError, connection.send, object())
+        self.assertRaises(TypeError, connection.send, "foo", "bar")
+
+
+    def test_short_bytes(self):
+        """
+        When passed a short byte string, :py:obj:`Connection.send` transmits all of it
+        and returns the number of bytes sent.
+        """
+        server, client = self._loopback()
+        count = server.send(b('xy'))
+        self.assertEquals(count, 2)
+        self.assertEquals(client.recv(2), b('xy'))
+
+    try:
+        memoryview
+    except NameError:
+        "cannot test sending memoryview without memoryview"
+    else:
+        def test_short_memoryview(self):
+            """
+            When passed a memoryview onto a small number of bytes,
+            :py:obj:`Connection.send` transmits all of them and returns the number of
+            bytes sent.
+            """
+            server, client = self._loopback()
+            count = server.send(memoryview(b('xy')))
+            self.assertEquals(count, 2)
+            self.assertEquals(client.recv(2), b('xy'))
+
+
+
+class ConnectionRecvIntoTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`Connection.recv_into`
+    """
+    try:
+        bytearray
+    except NameError:
+        "cannot test recv_into without bytearray"
+    else:
+        def test_wrong_args(self):
+            """
+            When called with arguments other than a writable buffer and
+            optional integers, :py:obj:`Connection.recv_into` raises
+            :py:obj:`TypeError`.
+            """
+            connection = Connection(Context(TLSv1_METHOD), None)
+            self.assertRaises(TypeError, connection.recv_into)
+            self.assertRaises(TypeError, connection.recv_into, object())
+            self.assertRaises(TypeError, connection.recv_into, b("foo"))
+            self.assertRaises(
+                TypeError, connection.recv_into, bytearray(3), "bar")
+
+
+        def test_negative_nbytes(self):
+            """
+            :py:obj:`Connection.recv_into` raises :py:obj:`ValueError` if
+            passed a negative number of bytes to read.
+            """
+            connection = Connection(Context(TLSv1_METHOD), None)
+            self.assertRaises(
+                ValueError, connection.recv_into, bytearray(3), -1)
+
+
+        def test_bytearray_no_length(self):
+            """
+            :py:obj:`Connection.recv_into` can be passed a :py:obj:`bytearray`
+            instance and data in the receive buffer is written to it.
+            """
+            server, client = self._loopback()
+            server.send(b('xy'))
+            output_buffer = bytearray(5)
+            self.assertEquals(client.recv_into(output_buffer), 2)
+            self.assertEquals(output_buffer, bytearray(b('xy\x00\x00\x00')))
+
+
+        def test_bytearray_respects_length(self):
+            """
+            When called with a :py:obj:`bytearray` instance,
+            :py:obj:`Connection.recv_into` respects the :py:obj:`nbytes`
+            parameter and doesn't copy in more than that number of bytes.
+            """
+            server, client = self._loopback()
+            server.send(b('abcdefghij'))
+            output_buffer = bytearray(10)
+            self.assertEquals(client.recv_into(output_buffer, 5), 5)
+            self.assertEquals(
+                output_buffer, bytearray(b('abcde\x00\x00\x00\x00\x00')))
+
+
+        def test_bytearray_doesnt_overfill(self):
+            """
+            When called with a :py:obj:`bytearray` instance and an
+            :py:obj:`nbytes` larger than the buffer,
+            :py:obj:`Connection.recv_into` only fills up to the size of the
+            buffer.
+            """
+            server, client = self._loopback()
+            server.send(b('abcdefghij'))
+            output_buffer = bytearray(5)
+            self.assertEquals(client.recv_into(output_buffer, 50), 5)
+            self.assertEquals(output_buffer, bytearray(b('abcde')))
+            rest = client.recv(5)
+            self.assertEquals(rest, b('fghij'))
+
+
+    try:
+        memoryview
+    except NameError:
+        "cannot test recv_into memoryview without memoryview"
+    else:
+        def test_memoryview_no_length(self):
+            """
+            :py:obj:`Connection.recv_into` can be passed a :py:obj:`memoryview`
+            instance and data in the receive buffer is written to it.
+            """
+            server, client = self._loopback()
+            server.send(b('xy'))
+            output_buffer = bytearray(5)
+            view = memoryview(output_buffer)[1:]
+            self.assertEquals(client.recv_into(view), 2)
+            self.assertEquals(output_buffer, bytearray(b('\x00xy\x00\x00')))
+
+
+
+class ConnectionNonBlockingTests(TestCase, _LoopbackMixin):
+    """
+    Tests for the methods of :py:obj:`Connection` which return
+    :py:obj:`WANT_READ` or :py:obj:`WANT_WRITE` instead of raising
+    :py:obj:`WantReadError` or :py:obj:`WantWriteError`.
+    """
+    def _handshake(self):
+        """
+        Make a connected pair of :py:obj:`Connection` objects on non-blocking
+        sockets and complete their handshake with
+        :py:obj:`Connection.do_handshake_nb`.
+        """
+        server, client = socket_pair()
+        server = self._loopbackServerFactory(server)
+        client = self._loopbackClientFactory(client)
+        self.assertEqual(client.do_handshake_nb(), WANT_READ)
+        pending = [client, server]
+        while pending:
+            for conn in pending[:]:
+                status = conn.do_handshake_nb()
+                if status is None:
+                    pending.remove(conn)
+                else:
+                    self.assertTrue(status in (WANT_READ, WANT_WRITE))
+        return server, client
+
+
+    def test_constants(self):
+        """
+        :py:obj:`WANT_READ` and :py:obj:`WANT_WRITE` are different negative
+        integers.
+        """
+        self.assertTrue(WANT_READ < 0)
+        self.assertTrue(WANT_WRITE < 0)
+        self.assertNotEqual(WANT_READ, WANT_WRITE)
+
+
+    def test_wrong_args(self):
+        """
+        The non-blocking methods raise :py:obj:`TypeError` if called with the
+        wrong number or types of arguments.
+        """
+        connection = Connection(Context(TLSv1_METHOD), None)
+        self.assertRaises(TypeError, connection.recv_nb)
+        self.assertRaises(TypeError, connection.recv_nb, None)
+        self.assertRaises(TypeError, connection.send_nb)
+        self.assertRaises(TypeError, connection.send_nb, object())
+        self.assertRaises(TypeError, connection.do_handshake_nb, None)
+
+
+    def test_recv_nb(self):
+        """
+        :py:obj:`Connection.recv_nb` returns :py:obj:`WANT_READ` if there is
+        nothing to receive, and the data otherwise.
+        """
+        server, client = self._handshake()
+        self.assertEqual(client.recv_nb(1024), WANT_READ)
+        server.send(b("xy"))
+        select([client], [], [], 5)
+        self.assertEqual(client.recv_nb(1024), b("xy"))
+
+
+    def test_recv_nb_closed(self):
+        """
+        :py:obj:`Connection.recv_nb` returns an empty string once the peer has
+        closed the connection cleanly.
+        """
+        server, client = self._handshake()
+        if version_info >= (2, 7, 0, 'alpha', 1):
+            server.shutdown(SHUT_RDWR)
+        else:
+            server.shutdown()
+        select([client], [], [], 5)
+        self.assertEqual(client.recv_nb(1024), b(""))
+
+
+    def test_recv_nb_error(self):
+        """
+        :py:obj:`Connection.recv_nb` raises :py:obj:`Error` for real errors.
+        """
+        server, client = self._handshake()
+        server.sock_shutdown(2)
+        select([client], [], [], 5)
+        self.assertRaises(Error, client.recv_nb, 1024)
+
+
+    def test_send_nb(self):
+        """
+        :py:obj:`Connection.send_nb` returns the number of bytes sent, or
+        :py:obj:`WANT_WRITE` once the socket can take no more.
+        """
+        server, client = self._handshake()
+        self.assertEqual(client.send_nb(b("xy")), 2)
+        select([server], [], [], 5)
+        self.assertEqual(server.recv(1024), b("xy"))
+        # The kernel may grow the socket buffers as they fill, so there is no
+        # telling how much it takes; keep sending until it can take no more.
+        while True:
+            sent = client.send_nb(b("x") * 1024)
+            if sent == WANT_WRITE:
+                break
+            self.assertEqual(sent, 1024)
+
+
+    if getattr(Connection, "recv_into_nb", None) is not None:
+        def test_recv_into_nb(self):
+            """
+            :py:obj:`Connection.recv_into_nb` returns :py:obj:`WANT_READ` if
+            there is nothing to receive, the number of bytes received
+            otherwise, and 0 once the peer has closed the connection cleanly.
+            """
+            server, client = self._handshake()
+            buf = bytearray(8)
+            self.assertEqual(client.recv_into_nb(buf), WANT_READ)
+            server.send(b("xy"))
+            select([client], [], [], 5)
+            self.assertEqual(client.recv_into_nb(buf), 2)
+            self.assertEqual(buf[:2], bytearray(b("xy")))
+            if version_info >= (2, 7, 0, 'alpha', 1):
+                server.shutdown(SHUT_RDWR)
+            else:
+                server.shutdown()
+            select([client], [], [], 5)
+            self.assertEqual(client.recv_into_nb(buf), 0)
+
+
+
+class ConnectionWritevTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`Connection.writev`.
+    """
+    def _receive(self, client, count):
+        """
+        Read exactly :py:obj:`count` bytes from :py:obj:`client`.
+        """
+        accum = []
+        received = 0
+        while received < count:
+            data = client.recv(count - received)
+            accum.append(data)
+            received += len(data)
+        return b('').join(accum)
+
+
+    def test_wrong_args(self):
+        """
+        When called with arguments other than a single sequence of strings,
+        :py:obj:`Connection.writev` raises :py:obj:`TypeError`.
+        """
+        connection = Connection(Context(TLSv1_METHOD), None)
+        self.assertRaises(TypeError, connection.writev)
+        self.assertRaises(TypeError, connection.writev, object())
+        self.assertRaises(TypeError, connection.writev, [object()])
+        self.assertRaises(TypeError, connection.writev, [b("foo")], "bar")
+
+
+    def test_empty(self):
+        """
+        :py:obj:`Connection.writev` returns 0 when passed an empty sequence
+        or a sequence of empty strings.
+        """
+        server, client = self._loopback()
+        self.assertEquals(server.writev([]), 0)
+        self.assertEquals(server.writev([b(''), b('')]), 0)
+
+
+    def test_short(self):
+        """
+        :py:obj:`Connection.writev` transmits the concatenation of the strings
+        passed to it and returns the total number of bytes sent.
+        """
+        server, client = self._loopback()
+        count = server.writev([b('HTTP/1.1 200 OK\r\n'), b('\r\n'), b('x')])
+        self.assertEquals(count, 20)
+        self.assertEquals(
+            self._receive(client, 20), b('HTTP/1.1 200 OK\r\n\r\nx'))
+
 
-        def makeClient(socket):
-            # Intentionally use a different, incompatible method here.
-            client = Connection(Context(SSLv3_METHOD), socket)
-            client.set_connect_state()
-            client.set_session(originalSession)
-            return client
+    try:
+        memoryview
+    except NameError:
+        "cannot test sending memoryview without memoryview"
+    else:
+        def test_mixed_buffers(self):
+            """
+            :py:obj:`Connection.writev` accepts any objects supporting the
+            buffer protocol.
+            """
+            server, client = self._loopback()
+            count = server.writev(
+                (memoryview(b('abc')), bytearray(b('def')), b('ghi')))
+            self.assertEquals(count, 9)
+            self.assertEquals(self._receive(client, 9), b('abcdefghi'))
 
-        self.assertRaises(
-            Error,
-            self._loopback, clientFactory=makeClient, serverFactory=makeServer)
+
+    def test_long(self):
+        """
+        :py:obj:`Connection.writev` transmits all of the bytes even when they
+        span several records, and when some of the strings are longer than a
+        single record.
+        """
+        server, client = self._loopback()
+        pieces = [b('a') * 100, b('b') * (1024 * 17), b('c') * 3,
+                  b('d') * (1024 * 8)]
+        message = b('').join(pieces)
+        count = server.writev(pieces)
+        self.assertEquals(count, len(message))
+        self.assertEquals(self._receive(client, len(message)), message)
 
 
 
-class ConnectionGetCipherListTests(TestCase):
+class ConnectionSendfileTests(TestCase, _LoopbackMixin):
     """
-    Tests for :py:obj:`Connection.get_cipher_list`.
+    Tests for :py:obj:`Connection.sendfile`.
     """
+    def _file(self, contents):
+        """
+        Create a temporary file holding :py:obj:`contents` and return it,
+        opened for reading.
+        """
+        path = self.mktemp()
+        fObj = open(path, 'wb')
+        fObj.write(contents)
+        fObj.close()
+        return open(path, 'rb')
+
+
+    def _receive(self, client, count):
+        accum = []
+        received = 0
+        while received < count:
+            data = client.recv(count - received)
+            accum.append(data)
+            received += len(data)
+        return b('').join(accum)
+
+
     def test_wrong_args(self):
         """
-        :py:obj:`Connection.get_cipher_list` raises :py:obj:`TypeError` if called with any
-        arguments.
+        :py:obj:`Connection.sendfile` raises :py:obj:`TypeError` when called
+        with something other than a file and optional integers, and
+        :py:obj:`ValueError` when the offset or count is negative.
         """
         connection = Connection(Context(TLSv1_METHOD), None)
-        self.assertRaises(TypeError, connection.get_cipher_list, None)
+        fObj = self._file(b('x'))
+        self.assertRaises(TypeError, connection.sendfile)
+        self.assertRaises(TypeError, connection.sendfile, object())
+        self.assertRaises(TypeError, connection.sendfile, fObj, "foo")
+        self.assertRaises(TypeError, connection.sendfile, fObj, 0, "foo")
+        self.assertRaises(ValueError, connection.sendfile, fObj, -1)
+        self.assertRaises(ValueError, connection.sendfile, fObj, 0, -1)
 
 
-    def test_result(self):
+    def test_whole_file(self):
         """
-        :py:obj:`Connection.get_cipher_list` returns a :py:obj:`list` of :py:obj:`str` giving the
-        names of the ciphers which might be used.
+        :py:obj:`Connection.sendfile` sends the entire contents of the file
+        and returns the number of bytes sent.
         """
-        connection = Connection(Context(TLSv1_METHOD), None)
-        ciphers = connection.get_cipher_list()
-        self.assertTrue(isinstance(ciphers, list))
-        for cipher in ciphers:
-            self.assertTrue(isinstance(cipher, str))
+        server, client = self._loopback()
+        message = b('x') * (1024 * 20) + b('y')
+        fObj = self._file(message)
+        self.assertEquals(server.sendfile(fObj), len(message))
+        self.assertEquals(self._receive(client, len(message)), message)
 
 
+    def test_file_descriptor(self):
+        """
+        :py:obj:`Connection.sendfile` accepts a file descriptor as well as a
+        file object.
+        """
+        server, client = self._loopback()
+        fObj = self._file(b('hello, world'))
+        self.assertEquals(server.sendfile(fObj.fileno()), 12)
+        self.assertEquals(self._receive(client, 12), b('hello, world'))
 
-class ConnectionSendTests(TestCase, _LoopbackMixin):
-    """
-    Tests for :py:obj:`Connection.send`
-    """
-    def test_wrong_args(self):
+
+    def test_offset_and_count(self):
         """
-        When called with arguments other than a single string,
-        :py:obj:`Connection.send` raises :py:obj:`TypeError`.
+        :py:obj:`Connection.sendfile` sends only :py:obj:`count` bytes starting
+        at :py:obj:`offset`, without regard to the file's own position.
         """
-        connection = Connection(Context(TLSv1_METHOD), None)
-        self.assertRaises(TypeError, connection.send)
-        self.assertRaises(TypeError, connection.send, object())
-        self.assertRaises(TypeError, connection.send, "foo", "bar")
+        server, client = self._loopback()
+        fObj = self._file(b('0123456789'))
+        fObj.read(8)
+        self.assertEquals(server.sendfile(fObj, offset=2, count=5), 5)
+        self.assertEquals(self._receive(client, 5), b('23456'))
+        self.assertEquals(fObj.read(), b('89'))
 
 
-    def test_short_bytes(self):
+    def test_count_past_end(self):
         """
-        When passed a short byte string, :py:obj:`Connection.send` transmits all of it
-        and returns the number of bytes sent.
+        If :py:obj:`count` extends past the end of the file,
+        :py:obj:`Connection.sendfile` stops at the end of the file and returns
+        the number of bytes actually sent.
         """
         server, client = self._loopback()
-        count = server.send(b('xy'))
-        self.assertEquals(count, 2)
-        self.assertEquals(client.recv(2), b('xy'))
+        fObj = self._file(b('0123456789'))
+        self.assertEquals(server.sendfile(fObj, 7, 100), 3)
+        self.assertEquals(self._receive(client, 3), b('789'))
+        self.assertEquals(server.sendfile(fObj, 10), 0)
 
-    try:
-        memoryview
-    except NameError:
-        "cannot test sending memoryview without memoryview"
-    else:
-        def test_short_memoryview(self):
-            """
-            When passed a memoryview onto a small number of bytes,
-            :py:obj:`Connection.send` transmits all of them and returns the number of
-            bytes sent.
-            """
-            server, client = self._loopback()
-            count = server.send(memoryview(b('xy')))
-            self.assertEquals(count, 2)
-            self.assertEquals(client.recv(2), b('xy'))
+
+    def test_closed(self):
+        """
+        If the underlying socket is closed, :py:obj:`Connection.sendfile`
+        raises :py:obj:`SysCallError` with a :py:obj:`bytes_sent` attribute.
+        """
+        server, client = self._loopback()
+        server.sock_shutdown(2)
+        fObj = self._file(b('hello, world'))
+        exc = self.assertRaises(SysCallError, server.sendfile, fObj)
+        self.assertEquals(exc.bytes_sent, 0)
 
 
 
@@ -1729,6 +3627,125 @@ class ConnectionSendallTests(TestCase, _LoopbackMixin):
         self.assertRaises(SysCallError, server.sendall, "hello, world")
 
 
+    def test_closed_bytes_sent(self):
+        """
+        The exception raised by :py:obj:`Connection.sendall` when the write
+        fails has a :py:obj:`bytes_sent` attribute giving the number of bytes
+        accepted before the failure.
+        """
+        server, client = self._loopback()
+        server.sock_shutdown(2)
+        exc = self.assertRaises(SysCallError, server.sendall, b("hello"))
+        self.assertEquals(exc.bytes_sent, 0)
+
+
+    def test_timeout_wrong_args(self):
+        """
+        :py:obj:`Connection.sendall` raises :py:obj:`TypeError` if the timeout
+        is not a number and :py:obj:`ValueError` if it is negative.
+        """
+        server, client = self._loopback()
+        self.assertRaises(TypeError, server.sendall, b("x"), 0, "bar")
+        self.assertRaises(ValueError, server.sendall, b("x"), 0, -1)
+        self.assertRaises(ValueError, server.sendall, b("x"), timeout=-0.5)
+
+
+    def _stalled(self):
+        """
+        Create a connected pair where the server's socket is non-blocking and
+        both sides have small socket buffers, so that the server quickly
+        cannot write any more until the client reads.
+        """
+        server, client = self._loopback()
+        server.setsockopt(SOL_SOCKET, SO_SNDBUF, 4096)
+        client.setsockopt(SOL_SOCKET, SO_RCVBUF, 4096)
+        server.setblocking(False)
+        return server, client
+
+
+    def _fill(self, server):
+        """
+        Write to the server with :py:obj:`Connection.send_nb` until the socket
+        can take no more, however large its buffers are.
+
+        :return: The number of bytes the server accepted.
+        """
+        chunk = b('x') * 1024
+        filled = 0
+        while True:
+            sent = server.send_nb(chunk)
+            if sent == WANT_WRITE:
+                return filled
+            filled += sent
+
+
+    def _receive(self, client, count):
+        accum = []
+        received = 0
+        while received < count:
+            data = client.recv(min(count - received, 2 ** 14))
+            accum.append(data)
+            received += len(data)
+        return b('').join(accum)
+
+
+    def test_timeout(self):
+        """
+        If a non-blocking socket does not become writable before the timeout
+        passed to :py:obj:`Connection.sendall` expires, :py:obj:`WantWriteError`
+        is raised with a :py:obj:`bytes_sent` attribute giving exactly how much
+        of the data was accepted; the peer receives exactly that much.
+        """
+        server, client = self._stalled()
+        # The kernel may take more once the socket buffers grow, so keep
+        # writing until the socket stays full for longer than the timeout.
+        message = b('x') * (1024 * 1024)
+        total = 0
+        for i in range(64):
+            try:
+                server.sendall(message, timeout=0.1)
+            except WantWriteError:
+                exc = exc_info()[1]
+                break
+            total += len(message)
+        else:
+            self.fail("The socket never filled up")
+        self.assertTrue(0 <= exc.bytes_sent < len(message))
+        total += exc.bytes_sent
+        self.assertEquals(self._receive(client, total), b('x') * total)
+
+
+    def test_nonblocking_waits(self):
+        """
+        On a non-blocking socket, :py:obj:`Connection.sendall` waits for the
+        socket to become writable again and eventually sends everything.
+        """
+        server, client = self._stalled()
+        message = b('y') * (1024 * 1024)
+        received = []
+        reader = Thread(
+            target=lambda: received.append(self._receive(client, len(message))))
+        reader.start()
+        try:
+            self.assertIdentical(server.sendall(message), None)
+        finally:
+            reader.join()
+        self.assertEquals(received, [message])
+
+
+    def test_memory_bio_does_not_spin(self):
+        """
+        When :py:obj:`Connection.sendall` is used on a memory BIO connection
+        which cannot proceed until more bytes are written into it, the
+        :py:obj:`WantReadError` is raised immediately rather than retrying
+        forever.
+        """
+        client = Connection(Context(TLSv1_METHOD), None)
+        client.set_connect_state()
+        exc = self.assertRaises(WantReadError, client.sendall, b("hello"))
+        self.assertEquals(exc.bytes_sent, 0)
+
+
 
 class ConnectionRenegotiateTests(TestCase, _LoopbackMixin):
     """
@@ -1783,6 +3800,154 @@ class ConnectionRenegotiateTests(TestCase, _LoopbackMixin):
 
 
 
+class ThreadSafeConnectionTests(TestCase, _LoopbackMixin):
+    """
+    Tests for :py:obj:`Connection` objects created with *thread_safe* true.
+    """
+    def _loopbackClientFactory(self, socket):
+        client = Connection(Context(TLSv1_METHOD), socket, thread_safe=True)
+        client.set_connect_state()
+        return client
+
+
+    def _start(self, target, *args):
+        thread = Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+    def test_memory_bio(self):
+        """
+        :py:obj:`Connection` raises :py:obj:`ValueError` if asked for a thread
+        safe connection without a socket.
+        """
+        self.assertRaises(
+            ValueError, Connection, Context(TLSv1_METHOD), None, True)
+
+
+    def test_tsafe(self):
+        """
+        :py:obj:`OpenSSL.tsafe.Connection` is a subclass of
+        :py:obj:`Connection` which makes thread safe connections, and can
+        itself be subclassed.  Without a socket it makes an ordinary memory
+        BIO connection.
+        """
+        from OpenSSL import tsafe
+        class Subclass(tsafe.Connection):
+            pass
+        server, client = self._loopback()
+        for cls in [tsafe.Connection, Subclass]:
+            connection = cls(Context(TLSv1_METHOD), client.dup())
+            self.assertTrue(isinstance(connection, Connection))
+            self.assertTrue(isinstance(connection, cls))
+
+        server = tsafe.Connection(Context(TLSv1_METHOD), None)
+        self.assertTrue(isinstance(server, tsafe.Connection))
+        server.bio_write(b("x"))
+
+
+    def test_full_duplex(self):
+        """
+        A thread can send on a thread safe connection while another is
+        waiting to receive on it.
+        """
+        server, client = self._loopback()
+        received = []
+        reader = self._start(lambda: received.append(client.recv(1024)))
+        # Give the reader time to start waiting.
+        sleep(0.1)
+        sent = []
+        writer = self._start(
+            lambda: sent.append(client.sendall(b("ping"))))
+        writer.join(10)
+        self.assertEqual(sent, [None])
+        self.assertEqual(server.recv(1024), b("ping"))
+        server.send(b("pong"))
+        reader.join(10)
+        self.assertEqual(received, [b("pong")])
+
+
+    def test_concurrent_sendall(self):
+        """
+        The data of calls to :py:obj:`Connection.sendall` on a thread safe
+        connection by several threads at once is not interleaved.
+        """
+        server, client = self._loopback()
+        size = 2 ** 16
+        senders = [
+            self._start(client.sendall, b(letter) * size)
+            for letter in "abcd"]
+        data = bytes()
+        while len(data) < size * len(senders):
+            data += server.recv(size)
+        for sender in senders:
+            sender.join(10)
+        blocks = [data[i:i + size] for i in range(0, len(data), size)]
+        self.assertEqual(
+            sorted(blocks), [b(letter) * size for letter in "abcd"])
+
+
+    def test_timeout(self):
+        """
+        A thread safe connection waits for as long as the timeout of its
+        socket and then raises :py:obj:`WantReadError` if there is still
+        nothing to receive.
+        """
+        server, client = self._loopback()
+        client.settimeout(0.2)
+        start = time()
+        self.assertRaises(WantReadError, client.recv, 1024)
+        self.assertTrue(time() - start >= 0.15)
+        server.send(b("x"))
+        self.assertEqual(client.recv(1024), b("x"))
+
+
+    def test_timeout_deadline(self):
+        """
+        The timeout of a thread safe connection is not started over each time
+        the socket becomes readable without a whole record to receive.
+        """
+        raw = []
+        def serverFactory(socket):
+            raw.append(socket)
+            return self._loopbackServerFactory(socket)
+        server, client = self._loopback(serverFactory=serverFactory)
+        client.settimeout(0.3)
+        # The header of an application data record which never arrives.
+        header = b("\x17\x03\x01\x40\x00")
+        stop = []
+        def trickle():
+            raw[0].send(header)
+            while not stop:
+                raw[0].send(b("x"))
+                sleep(0.05)
+        self._start(trickle)
+        start = time()
+        try:
+            self.assertRaises(WantReadError, client.recv, 1024)
+            self.assertTrue(time() - start < 2)
+        finally:
+            stop.append(None)
+
+
+    if platform != "win32":
+        def test_blocking_restored(self):
+            """
+            A thread safe connection puts its socket back in blocking mode
+            after each operation, so that it can still be used directly.
+            """
+            from fcntl import fcntl, F_GETFL
+            server, client = self._loopback()
+            server.send(b("x"))
+            self.assertEqual(client.recv(1024), b("x"))
+            client.send(b("y"))
+            self.assertEqual(server.recv(1024), b("y"))
+            self.assertEqual(client.gettimeout(), None)
+            self.assertFalse(fcntl(client.fileno(), F_GETFL) & os.O_NONBLOCK)
+
+
+
 class ErrorTests(TestCase):
     """
     Unit tests for :py:obj:`OpenSSL.SSL.Error`.
@@ -2041,6 +4206,197 @@ class MemoryBIOTests(TestCase, _LoopbackMixin):
         self.assertRaises( TypeError, clientSSL.bio_read, 100)
         self.assertRaises( TypeError, clientSSL.bio_write, "foo")
         self.assertRaises( TypeError, clientSSL.bio_shutdown )
+        try:
+            bytearray
+        except NameError:
+            pass
+        else:
+            self.assertRaises(
+                TypeError, clientSSL.bio_read_into, bytearray(100))
+
+
+    try:
+        bytearray
+    except NameError:
+        "cannot test buffer-protocol memory BIO APIs without bytearray"
+    else:
+        def test_bio_read_into_wrong_args(self):
+            """
+            :py:obj:`Connection.bio_read_into` raises :py:obj:`TypeError` if
+            called without a writable buffer, and :py:obj:`ValueError` if
+            called with a negative number of bytes.
+            """
+            conn = Connection(Context(TLSv1_METHOD), None)
+            self.assertRaises(TypeError, conn.bio_read_into)
+            self.assertRaises(TypeError, conn.bio_read_into, object())
+            self.assertRaises(TypeError, conn.bio_read_into, b("foo"))
+            self.assertRaises(ValueError, conn.bio_read_into, bytearray(3), -1)
+
+
+        def test_bio_read_into_empty(self):
+            """
+            :py:obj:`Connection.bio_read_into` raises
+            :py:obj:`WantReadError` if there is nothing to read, just like
+            :py:obj:`Connection.bio_read`.
+            """
+            conn = Connection(Context(TLSv1_METHOD), None)
+            self.assertRaises(WantReadError, conn.bio_read_into, bytearray(10))
+
+
+        def test_bio_read_into(self):
+            """
+            :py:obj:`Connection.bio_read_into` copies the bytes waiting in the
+            outgoing memory BIO into the given buffer, respecting
+            :py:obj:`nbytes`, and returns the number of bytes copied.
+            """
+            client = self._client(None)
+            self.assertRaises(WantReadError, client.do_handshake)
+            output_buffer = bytearray(5)
+            self.assertEquals(client.bio_read_into(output_buffer, 3), 3)
+            self.assertEquals(output_buffer[3:], bytearray(2))
+            # The rest of the client hello is still there for bio_read.
+            rest = client.bio_read(2 ** 16)
+            self.assertTrue(len(rest) > 0)
+
+
+        def test_bio_write_buffers(self):
+            """
+            :py:obj:`Connection.bio_write` accepts any object supporting the
+            buffer protocol, so two :py:obj:`Connection`s can be connected by
+            copying bytes between them through a reused :py:obj:`bytearray`.
+            """
+            server = self._server(None)
+            client = self._client(None)
+            scratch = bytearray(4096)
+            wrote = True
+            while wrote:
+                wrote = False
+                for (read, write) in [(client, server), (server, client)]:
+                    try:
+                        read.do_handshake()
+                    except WantReadError:
+                        pass
+                    while True:
+                        try:
+                            count = read.bio_read_into(scratch)
+                        except WantReadError:
+                            break
+                        wrote = True
+                        write.bio_write(scratch[:count])
+
+            important_message = b('One if by land, two if by sea.')
+            client.send(important_message)
+            count = client.bio_read_into(scratch)
+            server.bio_write(memoryview(scratch)[:count])
+            self.assertEquals(server.recv(1024), important_message)
+
+
+    def _feedHandshake(self, client, server):
+        """
+        Drive the handshake between two memory BIO :py:obj:`Connection`s using
+        only :py:obj:`Connection.feed`.
+        """
+        plaintext, outgoing = client.feed()
+        self.assertEquals(plaintext, b(''))
+        while outgoing:
+            plaintext, outgoing = server.feed(outgoing)
+            self.assertEquals(plaintext, b(''))
+            client, server = server, client
+
+
+    def test_feed_socket(self):
+        """
+        :py:obj:`Connection.feed` raises :py:obj:`TypeError` on a
+        :py:obj:`Connection` which uses a socket.
+        """
+        clientSSL = Connection(Context(TLSv1_METHOD), socket())
+        self.assertRaises(TypeError, clientSSL.feed, b("foo"))
+
+
+    def test_feed_wrong_args(self):
+        """
+        :py:obj:`Connection.feed` raises :py:obj:`TypeError` if called with
+        something other than one string.
+        """
+        conn = Connection(Context(TLSv1_METHOD), None)
+        self.assertRaises(TypeError, conn.feed, object())
+        self.assertRaises(TypeError, conn.feed, b("foo"), b("bar"))
+
+
+    def test_feed(self):
+        """
+        Two :py:obj:`Connection`s which use memory BIOs can complete a
+        handshake and exchange application data using nothing but
+        :py:obj:`Connection.feed` to move bytes between them.
+        """
+        server = self._server(None)
+        client = self._client(None)
+        self._feedHandshake(client, server)
+
+        important_message = b('One if by land, two if by sea.')
+        client.send(important_message)
+        plaintext, outgoing = client.feed()
+        self.assertEquals(plaintext, b(''))
+        self.assertEquals(server.feed(outgoing), (important_message, b('')))
+
+
+    def test_feed_many_records(self):
+        """
+        :py:obj:`Connection.feed` returns the application data from all of
+        the records in the ciphertext passed to it, even when that is more
+        than fits in a single record.
+        """
+        server = self._server(None)
+        client = self._client(None)
+        self._feedHandshake(client, server)
+
+        message = b('').join([b(c) * 10000 for c in 'abcdefg'])
+        remaining = message
+        while remaining:
+            remaining = remaining[client.send(remaining):]
+        plaintext, outgoing = server.feed(client.feed()[1])
+        self.assertEquals(plaintext, message)
+        self.assertEquals(outgoing, b(''))
+
+
+    def test_feed_zero_return(self):
+        """
+        Application data which arrives together with a closure alert is
+        returned by :py:obj:`Connection.feed`; the following call raises
+        :py:obj:`ZeroReturnError`.
+        """
+        server = self._server(None)
+        client = self._client(None)
+        self._feedHandshake(client, server)
+
+        client.send(b('goodbye'))
+        if version_info >= (2, 7, 0, 'alpha', 1):
+            client.shutdown(SHUT_RDWR)
+        else:
+            client.shutdown()
+        plaintext, outgoing = server.feed(client.feed()[1])
+        self.assertEquals(plaintext, b('goodbye'))
+        self.assertRaises(ZeroReturnError, server.feed)
+
+
+    def test_feed_error_plaintext(self):
+        """
+        If :py:obj:`Connection.feed` fails after reading application data,
+        the data is the ``plaintext`` attribute of the exception.
+        """
+        server = self._server(None)
+        client = self._client(None)
+        self._feedHandshake(client, server)
+
+        client.send(b('before'))
+        # An application data record which does not decrypt.
+        forged = b('\x17\x03\x01\x00\x20') + b('\x00') * 32
+        try:
+            server.feed(client.feed()[1] + forged)
+        except Error:
+            self.assertEquals(exc_info()[1].plaintext, b('before'))
+        else:
+            self.fail("feed did not fail")
 
 
     def test_outgoingOverflow(self):
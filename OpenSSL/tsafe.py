@@ -1,28 +1,23 @@
-from OpenSSL import SSL
-_ssl = SSL
-del SSL
+"""
+Thread safe connections.
 
-import threading
-_RLock = threading.RLock
-del threading
+This module is kept for compatibility.  :py:class:`OpenSSL.SSL.Connection`
+objects created with *thread_safe* true can be used by several threads at
+once, and one thread receiving does not stop another from sending.
+"""
 
-class Connection:
-    def __init__(self, *args):
-        self._ssl_conn = apply(_ssl.Connection, args)
-        self._lock = _RLock()
+from OpenSSL.SSL import Connection as _Connection
 
-    for f in ('get_context', 'pending', 'send', 'write', 'recv', 'read',
-              'renegotiate', 'bind', 'listen', 'connect', 'accept',
-              'setblocking', 'fileno', 'shutdown', 'close', 'get_cipher_list',
-              'getpeername', 'getsockname', 'getsockopt', 'setsockopt',
-              'makefile', 'get_app_data', 'set_app_data', 'state_string',
-              'sock_shutdown', 'get_peer_certificate', 'get_peer_cert_chain', 'want_read',
-              'want_write', 'set_connect_state', 'set_accept_state',
-              'connect_ex', 'sendall'):
-        exec("""def %s(self, *args):
-            self._lock.acquire()
-            try:
-                return self._ssl_conn.%s(*args)
-            finally:
-                self._lock.release()\n""" % (f, f))
 
+class Connection(_Connection):
+    """
+    A thread safe :py:class:`OpenSSL.SSL.Connection`.  Connections without a
+    socket, which use a memory BIO, cannot be made thread safe and are
+    created as ordinary connections, as they were before.
+
+    :param context: The :py:class:`OpenSSL.SSL.Context` to use.
+    :param socket: The socket to use for the transport layer, or
+        :py:obj:`None`.
+    """
+    def __new__(cls, context, socket):
+        return _Connection.__new__(cls, context, socket, socket is not None)
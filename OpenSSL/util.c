@@ -14,35 +14,321 @@
 #include "util.h"
 
 /*
- * Flush OpenSSL's error queue and return a list of errors (a (library,
- * function, reason) string tuple)
+ * Exception instances from Python 2.5 on are new-style objects, so the strings
+ * describing the errors can be looked up when the exception is first looked
+ * at instead of when it is raised.  Errors which are caught and dropped then
+ * cost little more than popping them off the error queue.
+ */
+#if PY_VERSION_HEX >= 0x02050000
+#define LAZY_ERRORS
+#endif
+
+/*
+ * Flush OpenSSL's error queue and return the packed error codes it held.
  *
  * Arguments: None
- * Returns:   A list of errors (new reference)
+ * Returns:   A tuple of integers (new reference)
  */
-PyObject *
-error_queue_to_list(void) {
+static PyObject *
+error_queue_to_codes(void) {
+    PyObject *codes, *code, *tuple;
+    unsigned long err;
+
+    codes = PyList_New(0);
+    if (codes == NULL) {
+        ERR_clear_error();
+        return NULL;
+    }
+
+    while ((err = ERR_get_error()) != 0) {
+        code = PyLong_FromUnsignedLong(err);
+        if (code == NULL || PyList_Append(codes, code) < 0) {
+            Py_XDECREF(code);
+            Py_DECREF(codes);
+            ERR_clear_error();
+            return NULL;
+        }
+        Py_DECREF(code);
+    }
+
+    tuple = PyList_AsTuple(codes);
+    Py_DECREF(codes);
+    return tuple;
+}
+
+/*
+ * Describe packed error codes.
+ *
+ * Arguments: codes - A sequence of packed error codes
+ * Returns:   A list of errors (a (library, function, reason) string tuple)
+ *            (new reference)
+ */
+static PyObject *
+error_codes_to_list(PyObject *codes) {
     PyObject *errlist, *tuple;
-    long err;
+    unsigned long err;
+    Py_ssize_t i;
 
     errlist = PyList_New(0);
+    if (errlist == NULL) {
+        return NULL;
+    }
 
-    while ((err = ERR_get_error()) != 0) {
-	tuple = Py_BuildValue("(sss)", ERR_lib_error_string(err),
-		                       ERR_func_error_string(err),
-				       ERR_reason_error_string(err));
-        PyList_Append(errlist, tuple);
+    for (i = 0; i < PySequence_Size(codes); i++) {
+        tuple = PySequence_GetItem(codes, i);
+        if (tuple == NULL) {
+            Py_DECREF(errlist);
+            return NULL;
+        }
+        err = PyLong_AsUnsignedLong(tuple);
+        Py_DECREF(tuple);
+        if (PyErr_Occurred()) {
+            Py_DECREF(errlist);
+            return NULL;
+        }
+        tuple = Py_BuildValue("(sss)", ERR_lib_error_string(err),
+                                       ERR_func_error_string(err),
+                                       ERR_reason_error_string(err));
+        if (tuple == NULL || PyList_Append(errlist, tuple) < 0) {
+            Py_XDECREF(tuple);
+            Py_DECREF(errlist);
+            return NULL;
+        }
         Py_DECREF(tuple);
     }
 
     return errlist;
 }
 
-void exception_from_error_queue(PyObject *the_Error) { 
-    PyObject *errlist = error_queue_to_list();
-    PyErr_SetObject(the_Error, errlist);
+/*
+ * Flush OpenSSL's error queue and return a list of errors (a (library,
+ * function, reason) string tuple)
+ *
+ * Arguments: None
+ * Returns:   A list of errors (new reference)
+ */
+PyObject *
+error_queue_to_list(void) {
+    PyObject *codes, *errlist;
+
+    codes = error_queue_to_codes();
+    if (codes == NULL) {
+        return NULL;
+    }
+    errlist = error_codes_to_list(codes);
+    Py_DECREF(codes);
+    return errlist;
+}
+
+#ifdef LAZY_ERRORS
+/*
+ * If the strings describing the errors of an exception raised by
+ * exception_from_error_queue have not been looked up yet, look them up and
+ * make them the arguments of the exception.
+ *
+ * Arguments: self - The exception
+ * Returns:   0 for success, -1 otherwise
+ */
+static int
+error_resolve(PyObject *self) {
+    PyBaseExceptionObject *exc = (PyBaseExceptionObject *)self;
+    PyObject *codes, *errlist, *args, *old;
+
+    if (exc->dict == NULL) {
+        return 0;
+    }
+    codes = PyDict_GetItemString(exc->dict, "_unresolved_codes");
+    if (codes == NULL) {
+        return 0;
+    }
+
+    errlist = error_codes_to_list(codes);
+    if (errlist == NULL) {
+        return -1;
+    }
+    args = PyTuple_Pack(1, errlist);
     Py_DECREF(errlist);
-} 
+    if (args == NULL) {
+        return -1;
+    }
+
+    old = exc->args;
+    exc->args = args;
+    Py_XDECREF(old);
+    return PyDict_DelItemString(exc->dict, "_unresolved_codes");
+}
+
+static PyObject *
+error_get_args(PyObject *self, void *closure) {
+    if (error_resolve(self) < 0) {
+        return NULL;
+    }
+    Py_INCREF(((PyBaseExceptionObject *)self)->args);
+    return ((PyBaseExceptionObject *)self)->args;
+}
+
+static int
+error_set_args(PyObject *self, PyObject *value, void *closure) {
+    PyBaseExceptionObject *exc = (PyBaseExceptionObject *)self;
+    PyObject *args, *old;
+
+    if (value == NULL) {
+        PyErr_SetString(PyExc_TypeError, "args may not be deleted");
+        return -1;
+    }
+    args = PySequence_Tuple(value);
+    if (args == NULL) {
+        return -1;
+    }
+    if (exc->dict != NULL &&
+        PyDict_GetItemString(exc->dict, "_unresolved_codes") != NULL &&
+        PyDict_DelItemString(exc->dict, "_unresolved_codes") < 0) {
+        Py_DECREF(args);
+        return -1;
+    }
+
+    old = exc->args;
+    exc->args = args;
+    Py_XDECREF(old);
+    return 0;
+}
+
+static PyObject *
+error_str(PyObject *self, PyObject *unused) {
+    if (error_resolve(self) < 0) {
+        return NULL;
+    }
+    return ((PyTypeObject *)PyExc_Exception)->tp_str(self);
+}
+
+static PyObject *
+error_repr(PyObject *self, PyObject *unused) {
+    if (error_resolve(self) < 0) {
+        return NULL;
+    }
+    return ((PyTypeObject *)PyExc_Exception)->tp_repr(self);
+}
+
+static PyObject *
+error_reduce(PyObject *self, PyObject *unused) {
+    if (error_resolve(self) < 0) {
+        return NULL;
+    }
+    return PyObject_CallMethod(PyExc_Exception, "__reduce__", "O", self);
+}
+
+static PyGetSetDef error_getset[] = {
+    { "args", (getter)error_get_args, (setter)error_set_args, NULL, NULL },
+    { NULL }
+};
+
+static PyMethodDef error_methods[] = {
+    { "__str__", (PyCFunction)error_str, METH_NOARGS, NULL },
+    { "__repr__", (PyCFunction)error_repr, METH_NOARGS, NULL },
+    { "__reduce__", (PyCFunction)error_reduce, METH_NOARGS, NULL },
+    { NULL, NULL }
+};
+#endif
+
+/*
+ * Create the exception class for the errors of a module.  Instances raised by
+ * exception_from_error_queue have a codes attribute, the packed error codes
+ * from OpenSSL's error queue, and (where Python allows) only look up the
+ * strings describing those errors for their args when they are first used.
+ *
+ * Arguments: name - The qualified name of the class
+ * Returns:   The class (new reference), or NULL
+ */
+PyObject *
+error_type_new(char *name) {
+    PyObject *type, *descr, *codes;
+#ifdef LAZY_ERRORS
+    PyGetSetDef *getset;
+    PyMethodDef *method;
+#endif
+
+    type = PyErr_NewException(name, NULL, NULL);
+    if (type == NULL) {
+        return NULL;
+    }
+
+    /*
+     * For instances which were not raised by exception_from_error_queue.
+     */
+    codes = PyTuple_New(0);
+    if (codes == NULL || PyObject_SetAttrString(type, "codes", codes) < 0) {
+        Py_XDECREF(codes);
+        Py_DECREF(type);
+        return NULL;
+    }
+    Py_DECREF(codes);
+
+#ifdef LAZY_ERRORS
+    for (getset = error_getset; getset->name != NULL; getset++) {
+        descr = PyDescr_NewGetSet((PyTypeObject *)type, getset);
+        if (descr == NULL || PyObject_SetAttrString(type, getset->name, descr) < 0) {
+            Py_XDECREF(descr);
+            Py_DECREF(type);
+            return NULL;
+        }
+        Py_DECREF(descr);
+    }
+    for (method = error_methods; method->ml_name != NULL; method++) {
+        descr = PyDescr_NewMethod((PyTypeObject *)type, method);
+        if (descr == NULL || PyObject_SetAttrString(type, method->ml_name, descr) < 0) {
+            Py_XDECREF(descr);
+            Py_DECREF(type);
+            return NULL;
+        }
+        Py_DECREF(descr);
+    }
+#else
+    (void)descr;
+#endif
+
+    return type;
+}
+
+/*
+ * Raise an exception of the_Error, a class made by error_type_new, for the
+ * errors in OpenSSL's error queue, flushing it.
+ *
+ * Arguments: the_Error - The exception class
+ * Returns:   None
+ */
+void
+exception_from_error_queue(PyObject *the_Error) {
+    PyObject *codes, *exc;
+
+    codes = error_queue_to_codes();
+    if (codes == NULL) {
+        return;
+    }
+
+#ifdef LAZY_ERRORS
+    exc = PyObject_CallObject(the_Error, NULL);
+    if (exc == NULL) {
+        Py_DECREF(codes);
+        return;
+    }
+    if (PyObject_SetAttrString(exc, "codes", codes) < 0 ||
+        PyObject_SetAttrString(exc, "_unresolved_codes", codes) < 0) {
+        Py_DECREF(exc);
+        Py_DECREF(codes);
+        return;
+    }
+    PyErr_SetObject(the_Error, exc);
+#else
+    exc = error_codes_to_list(codes);
+    if (exc == NULL) {
+        Py_DECREF(codes);
+        return;
+    }
+    PyErr_SetObject(the_Error, exc);
+#endif
+    Py_DECREF(exc);
+    Py_DECREF(codes);
+}
 
 /*
  * Flush OpenSSL's error queue and ignore the result
@@ -52,13 +338,7 @@ void exception_from_error_queue(PyObject *the_Error) {
  */
 void
 flush_error_queue(void) {
-    /*
-     * Make sure to save the errors to a local.  Py_DECREF might expand such
-     * that it evaluates its argument more than once, which would lead to
-     * very nasty things if we just invoked it with error_queue_to_list().
-     */
-    PyObject *list = error_queue_to_list();
-    Py_DECREF(list);
+    ERR_clear_error();
 }
 
 #if (PY_VERSION_HEX < 0x02600000)
@@ -29,6 +29,7 @@
 
 
 extern  PyObject *error_queue_to_list(void);
+extern  PyObject *error_type_new(char *name);
 extern void exception_from_error_queue(PyObject *the_Error);
 extern  void      flush_error_queue(void);
 
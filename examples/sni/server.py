@@ -6,26 +6,18 @@ if __name__ == '__main__':
     raise SystemExit(server.main())
 
 from sys import stdout
+from os.path import dirname
 from socket import SOL_SOCKET, SO_REUSEADDR, socket
 
-from OpenSSL.crypto import FILETYPE_PEM, load_privatekey, load_certificate
 from OpenSSL.SSL import TLSv1_METHOD, Context, Connection
-
-def load(domain):
-    crt = open(domain + ".crt")
-    key = open(domain + ".key")
-    result = (
-        load_privatekey(FILETYPE_PEM, key.read()),
-        load_certificate(FILETYPE_PEM, crt.read()))
-    crt.close()
-    key.close()
-    return result
+from OpenSSL.sni import ContextCache, DirectoryLoader
 
 
 def main():
     """
-    Run an SNI-enabled server which selects between a few certificates in a
-    C{dict} based on the handshake request it receives from a client.
+    Run an SNI-enabled server which selects between a few certificates, loaded
+    from this directory the first time a client asks for them, based on the
+    handshake request it receives from a client.
     """
     port = socket()
     port.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
@@ -38,7 +30,7 @@ def main():
     print 'accepted', addr
 
     server_context = Context(TLSv1_METHOD)
-    server_context.set_tlsext_servername_callback(pick_certificate)
+    contexts.install(server_context)
 
     server_ssl = Connection(server_context, server)
     server_ssl.set_accept_state()
@@ -46,19 +38,5 @@ def main():
     server.close()
 
 
-certificates = {
-    "example.invalid": load("example.invalid"),
-    "another.invalid": load("another.invalid"),
-    }
-
-
-def pick_certificate(connection):
-    try:
-        key, cert = certificates[connection.get_servername()]
-    except KeyError:
-        pass
-    else:
-        new_context = Context(TLSv1_METHOD)
-        new_context.use_privatekey(key)
-        new_context.use_certificate(cert)
-        connection.set_context(new_context)
+contexts = ContextCache(
+    DirectoryLoader(dirname(__file__) or '.', TLSv1_METHOD), max_contexts=100)
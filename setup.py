@@ -34,9 +34,9 @@ crypto_dep = ['OpenSSL/crypto/crypto.h', 'OpenSSL/crypto/x509.h',
 rand_src = ['OpenSSL/rand/rand.c', 'OpenSSL/util.c']
 rand_dep = ['OpenSSL/util.h']
 ssl_src = ['OpenSSL/ssl/connection.c', 'OpenSSL/ssl/context.c', 'OpenSSL/ssl/ssl.c',
-           'OpenSSL/ssl/session.c', 'OpenSSL/util.c']
+           'OpenSSL/ssl/session.c', 'OpenSSL/ssl/sessioncache.c', 'OpenSSL/util.c']
 ssl_dep = ['OpenSSL/ssl/connection.h', 'OpenSSL/ssl/context.h', 'OpenSSL/ssl/ssl.h',
-           'OpenSSL/ssl/session.h', 'OpenSSL/util.h']
+           'OpenSSL/ssl/session.h', 'OpenSSL/ssl/sessioncache.h', 'OpenSSL/util.h']
 
 IncludeDirs = None
 LibraryDirs = None
@@ -198,11 +198,19 @@ setup(name='pyOpenSSL', version=__version__,
       ext_modules = [mkExtension('crypto'), mkExtension('rand'),
                      mkExtension('SSL')],
       py_modules  = ['OpenSSL.__init__', 'OpenSSL.tsafe',
-                     'OpenSSL.version', 'OpenSSL.test.__init__',
+                     'OpenSSL.version', 'OpenSSL.aio', 'OpenSSL.server',
+                     'OpenSSL.pool',
+                     'OpenSSL.sni', 'OpenSSL.reloader',
+                     'OpenSSL.test.__init__',
                      'OpenSSL.test.util',
                      'OpenSSL.test.test_crypto',
                      'OpenSSL.test.test_rand',
-                     'OpenSSL.test.test_ssl'],
+                     'OpenSSL.test.test_ssl',
+                     'OpenSSL.test.test_aio',
+                     'OpenSSL.test.test_server',
+                     'OpenSSL.test.test_pool',
+                     'OpenSSL.test.test_sni',
+                     'OpenSSL.test.test_reloader'],
       zip_safe = False,
       cmdclass = {"build_ext": BuildExtension},
       description = 'Python wrapper module around the OpenSSL library',